@@ -0,0 +1,338 @@
+"""Token-budgeted conversation history with rolling summaries.
+
+Each turn sends the model the most recent messages that fit within
+``chat_history_token_budget`` plus a rolling summary of everything older.
+The summary lives on the ``conversations`` row (``summary`` text and
+``summary_through`` timestamp columns) and is refreshed in the background
+after a response has been sent.  Both columns are nullable additions::
+
+    ALTER TABLE conversations
+      ADD COLUMN summary text,
+      ADD COLUMN summary_through timestamptz;
+
+The assembled window is cached per conversation in process memory.  A
+cached conversation only fetches messages newer than the last one it has
+seen, so a turn never re-reads the whole thread.  Each worker has its own
+cache, so a cache hit also re-reads the conversation's ``summary_through``
+(alongside the new messages, not after them): a missing row means another
+worker deleted the conversation, and a different value means it
+re-summarised it, and either way the window is reloaded.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from app.core.config import get_settings
+from app.core.deadline import no_deadline
+from app.core.supabase import get_supabase_client
+
+logger = logging.getLogger(__name__)
+
+# Messages fetched when a conversation is first loaded into the cache.
+HISTORY_FETCH_LIMIT = 50
+
+# Conversations kept in the in-memory cache (least recently used evicted).
+MAX_CACHED_CONVERSATIONS = 1024
+
+# Overflow messages (older than the window, not yet summarised) needed
+# before a background summary refresh is worth an LLM call.
+SUMMARY_MIN_MESSAGES = 4
+
+# Per-message overhead for role/formatting tokens.
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+# Results of the cache version check besides a ``summary_through`` value.
+_GONE = object()
+_UNKNOWN = object()
+
+
+def _same_instant(a: str | None, b: str | None) -> bool:
+    """Whether two timestamps are equal, however PostgREST formatted them."""
+    if a is None or b is None:
+        return a is b
+    try:
+        return datetime.fromisoformat(a) == datetime.fromisoformat(b)
+    except ValueError:
+        return a == b
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate for budgeting (≈4 characters per token)."""
+    return len(text) // 4 + _MESSAGE_OVERHEAD_TOKENS
+
+
+@dataclass
+class _ConversationWindow:
+    """Cached history state for one conversation."""
+
+    summary: str | None = None
+    summary_through: str | None = None
+    # Unsummarised messages, oldest first: dicts with id/role/content/created_at.
+    messages: list[dict] = field(default_factory=list)
+    last_seen: str | None = None
+
+
+class HistoryManager:
+    """Builds token-budgeted history windows and maintains rolling summaries."""
+
+    def __init__(self, max_conversations: int = MAX_CACHED_CONVERSATIONS) -> None:
+        self._max_conversations = max_conversations
+        self._windows: OrderedDict[str, _ConversationWindow] = OrderedDict()
+        self._summarizing: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    async def get_window(self, conversation_id: str) -> list[dict]:
+        """Return ``[{"role", "content"}, ...]`` history for the next turn.
+
+        The rolling summary (if any) comes first as a system message,
+        followed by the most recent messages that fit the token budget.
+        """
+        entry = self._windows.get(conversation_id)
+        if entry is None:
+            entry = await self._load(conversation_id)
+            self._store(conversation_id, entry)
+        else:
+            self._windows.move_to_end(conversation_id)
+            current, newer = await asyncio.gather(
+                self._current_summary(conversation_id),
+                self._fetch_since(conversation_id, entry.last_seen),
+            )
+            if current is not _UNKNOWN and (
+                current is _GONE or not _same_instant(current, entry.summary_through)
+            ):
+                # Deleted or re-summarised by another worker.
+                entry = await self._load(conversation_id)
+                self._store(conversation_id, entry)
+            else:
+                self._append(entry, newer)
+
+        recent, _ = self._split(entry)
+        window: list[dict] = []
+        if entry.summary:
+            window.append(
+                {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{entry.summary}",
+                }
+            )
+        window.extend({"role": m["role"], "content": m["content"]} for m in recent)
+        return window
+
+    def record_turn(self, conversation_id: str, records: list[dict]) -> None:
+        """Add freshly persisted message rows to the cached window.
+
+        Schedules a background summary refresh when enough messages have
+        fallen out of the token budget.
+        """
+        entry = self._windows.get(conversation_id)
+        if entry is None:
+            return
+        self._append(entry, records)
+
+        _, overflow = self._split(entry)
+        if (
+            len(overflow) >= SUMMARY_MIN_MESSAGES
+            and conversation_id not in self._summarizing
+        ):
+            self._summarizing.add(conversation_id)
+            with no_deadline():
+                task = asyncio.create_task(self._refresh_summary(conversation_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def invalidate(self, conversation_id: str) -> None:
+        """Drop a conversation from the cache (e.g. after deletion)."""
+        self._windows.pop(conversation_id, None)
+
+    # ------------------------------------------------------------------
+    # Window bookkeeping
+    # ------------------------------------------------------------------
+
+    def _store(self, conversation_id: str, entry: _ConversationWindow) -> None:
+        self._windows[conversation_id] = entry
+        self._windows.move_to_end(conversation_id)
+        while len(self._windows) > self._max_conversations:
+            self._windows.popitem(last=False)
+
+    @staticmethod
+    def _append(entry: _ConversationWindow, records: list[dict]) -> None:
+        known = {m.get("id") for m in entry.messages}
+        for r in records:
+            if r.get("id") is not None and r["id"] in known:
+                continue
+            entry.messages.append(
+                {
+                    "id": r.get("id"),
+                    "role": r["role"],
+                    "content": r.get("content") or "",
+                    "created_at": r.get("created_at"),
+                }
+            )
+            if r.get("created_at") and (
+                entry.last_seen is None or r["created_at"] > entry.last_seen
+            ):
+                entry.last_seen = r["created_at"]
+        # Keep the cache bounded even if summarisation is lagging behind.
+        if len(entry.messages) > HISTORY_FETCH_LIMIT * 2:
+            del entry.messages[: len(entry.messages) - HISTORY_FETCH_LIMIT * 2]
+
+    @staticmethod
+    def _split(entry: _ConversationWindow) -> tuple[list[dict], list[dict]]:
+        """Split cached messages into ``(recent_within_budget, older_overflow)``."""
+        budget = get_settings().chat_history_token_budget
+        if entry.summary:
+            budget -= estimate_tokens(entry.summary)
+
+        used = 0
+        cut = len(entry.messages)
+        for i in range(len(entry.messages) - 1, -1, -1):
+            cost = estimate_tokens(entry.messages[i]["content"])
+            if used + cost > budget:
+                break
+            used += cost
+            cut = i
+        return entry.messages[cut:], entry.messages[:cut]
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    async def _load(self, conversation_id: str) -> _ConversationWindow:
+        """Load the summary and the most recent unsummarised messages."""
+        supabase = get_supabase_client()
+        entry = _ConversationWindow()
+        try:
+            conv_res = await asyncio.to_thread(
+                supabase.table("conversations")
+                .select("summary, summary_through")
+                .eq("id", conversation_id)
+                .execute
+            )
+            if conv_res.data:
+                entry.summary = conv_res.data[0].get("summary")
+                entry.summary_through = conv_res.data[0].get("summary_through")
+        except Exception as e:
+            logger.warning(
+                "history summary unavailable conversation_id=%s: %s", conversation_id, e
+            )
+
+        query = (
+            supabase.table("messages")
+            .select("id, role, content, created_at")
+            .eq("conversation_id", conversation_id)
+        )
+        if entry.summary_through:
+            query = query.gt("created_at", entry.summary_through)
+        res = await asyncio.to_thread(
+            query.order("created_at", desc=True).limit(HISTORY_FETCH_LIMIT).execute
+        )
+        # Newest-first fetch keeps the *latest* messages; restore chronological order.
+        self._append(entry, list(reversed(res.data or [])))
+        return entry
+
+    async def _current_summary(self, conversation_id: str) -> object:
+        """The stored ``summary_through``; ``_GONE`` / ``_UNKNOWN`` if unreadable."""
+        supabase = get_supabase_client()
+        try:
+            res = await asyncio.to_thread(
+                supabase.table("conversations")
+                .select("summary_through")
+                .eq("id", conversation_id)
+                .execute
+            )
+        except Exception as e:
+            logger.warning(
+                "history version check failed conversation_id=%s: %s",
+                conversation_id,
+                e,
+            )
+            return _UNKNOWN
+        if not res.data:
+            return _GONE
+        return res.data[0].get("summary_through")
+
+    async def _fetch_since(self, conversation_id: str, since: str | None) -> list[dict]:
+        """Fetch messages created after *since* (only the new tail of the thread)."""
+        supabase = get_supabase_client()
+        query = (
+            supabase.table("messages")
+            .select("id, role, content, created_at")
+            .eq("conversation_id", conversation_id)
+        )
+        if since:
+            query = query.gt("created_at", since)
+        res = await asyncio.to_thread(
+            query.order("created_at").limit(HISTORY_FETCH_LIMIT).execute
+        )
+        return res.data or []
+
+    async def _refresh_summary(self, conversation_id: str) -> None:
+        """Fold overflow messages into the rolling summary and persist it."""
+        from app.inference.client import get_llm_client
+        from app.inference.gateway import Priority
+        from app.inference.prompts import HISTORY_SUMMARY_SYSTEM_PROMPT
+        from app.inference.usage import usage_scope
+
+        try:
+            entry = self._windows.get(conversation_id)
+            if entry is None:
+                return
+            _, overflow = self._split(entry)
+            if not overflow:
+                return
+
+            transcript = "\n".join(f"{m['role']}: {m['content']}" for m in overflow)
+            user_prompt = (
+                f"Existing summary:\n{entry.summary or '(none)'}\n\n"
+                f"New messages:\n{transcript}"
+            )
+            # The task inherits the chat's usage scope; only the feature differs.
+            with usage_scope(feature="chat_summary"):
+                summary = await get_llm_client().complete(
+                    system_prompt=HISTORY_SUMMARY_SYSTEM_PROMPT,
+                    user_prompt=user_prompt,
+                    max_tokens=400,
+                    temperature=0.2,
+                    priority=Priority.BATCH,
+                )
+            if not summary:
+                return
+
+            through = overflow[-1]["created_at"]
+            folded = {id(m) for m in overflow}
+            entry.messages = [m for m in entry.messages if id(m) not in folded]
+            entry.summary = summary
+            entry.summary_through = through
+
+            supabase = get_supabase_client()
+            await asyncio.to_thread(
+                supabase.table("conversations")
+                .update({"summary": summary, "summary_through": through})
+                .eq("id", conversation_id)
+                .execute
+            )
+            logger.info(
+                "history summary refreshed conversation_id=%s folded=%d",
+                conversation_id, len(overflow),
+            )
+        except Exception as e:
+            logger.warning(
+                "history summary refresh failed conversation_id=%s: %s",
+                conversation_id,
+                e,
+            )
+        finally:
+            self._summarizing.discard(conversation_id)
+
+
+# Singleton instance
+history_manager = HistoryManager()
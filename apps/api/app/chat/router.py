@@ -1,14 +1,19 @@
 import logging
 from typing import List
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
 
 from app.core.config import get_settings
-from app.core.dependencies import CurrentUser, DbSession
+from app.core.deadline import request_deadline
+from app.core.dependencies import CurrentUser
+from app.core.quotas import token_quotas
 from app.core.rate_limiter import rate_limiter
+from app.core.sse import encode_sse
 from app.core.token_budget import token_budget
+from app.inference.gateway import llm_gateway
 from app.core.supabase import get_supabase_client
+from .history import history_manager
 from .schemas import ChatRequest, ChatResponse, ConversationResponse, ConversationUpdate, MessageResponse, SaveConversationRequest
 from .service import ChatService
 
@@ -17,49 +22,64 @@ router = APIRouter(prefix="/chat", tags=["chat"])
 chat_service = ChatService()
 
 
-def _check_chat_limits(user_id: str) -> None:
-    """Enforce rate limit and token budget for chat endpoints."""
+async def _check_chat_limits(user_id: str) -> None:
+    """Enforce rate limit, token budget and user quota for chat endpoints."""
     settings = get_settings()
-    if not rate_limiter.is_allowed(
+    decision = await rate_limiter.check(
         user_id, "chat", settings.rate_limit_chat_max, settings.rate_limit_chat_window
-    ):
+    )
+    if not decision.allowed:
         raise HTTPException(
             status_code=429,
             detail="Rate limit exceeded. Please wait before sending more messages.",
+            headers={"Retry-After": decision.retry_after_header},
         )
     if not token_budget.check():
         raise HTTPException(
             status_code=503,
             detail="Daily AI usage limit reached. Please try again tomorrow.",
         )
+    await token_quotas.admit(user_id, "chat")
+    llm_gateway.ensure_capacity()
 
 
-@router.post("/", response_model=ChatResponse)
+@router.post("/", response_model=ChatResponse, dependencies=[Depends(request_deadline)])
 async def chat(request: ChatRequest, user: CurrentUser):
     """Endpoint to send a message and get an AI response (non-streaming)."""
     user_id = str(user.user_id)
-    _check_chat_limits(user_id)
+    await _check_chat_limits(user_id)
     logger.debug("chat request user_id=%s conversation_id=%s", user_id, request.conversation_id)
     try:
         response = await chat_service.process_chat(user_id, request)
         return response
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("chat failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/stream")
-async def chat_stream(request: ChatRequest, user: CurrentUser, db: DbSession):
+@router.post("/stream", dependencies=[Depends(request_deadline)])
+async def chat_stream(request: ChatRequest, user: CurrentUser, http_request: Request):
     """Streaming endpoint that sends tokens via Server-Sent Events.
 
     The model can call the ``search_my_documents`` RAG tool (via Together AI
-    function calling) when the user asks about their uploaded files.
+    function calling) when the user asks about their uploaded files.  If the
+    client disconnects mid-answer the upstream completion is cancelled.
+    Token deltas are coalesced into fewer SSE frames (see ``app.core.sse``).
+
+    Deliberately takes no ``DbSession``: a request-scoped session would keep
+    a pooled connection checked out for the whole stream.
     """
     user_id = str(user.user_id)
-    _check_chat_limits(user_id)
+    await _check_chat_limits(user_id)
     logger.info("chat stream started user_id=%s conversation_id=%s", user_id, request.conversation_id)
     return StreamingResponse(
-        chat_service.process_chat_stream(user_id, request, db=db),
+        encode_sse(
+            chat_service.process_chat_stream(
+                user_id, request, is_disconnected=http_request.is_disconnected
+            )
+        ),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -158,5 +178,6 @@ async def delete_conversation(conversation_id: str, user: CurrentUser):
 
     # Delete the conversation
     supabase.table("conversations").delete().eq("id", conversation_id).execute()
+    history_manager.invalidate(conversation_id)
 
     return {"status": "ok"}
\ No newline at end of file
@@ -28,6 +28,7 @@ class MessageResponse(BaseModel):
     content: str
     created_at: datetime
     sources: Optional[List[Any]] = None
+    interrupted: Optional[bool] = None
 
 
 class ConversationResponse(BaseModel):
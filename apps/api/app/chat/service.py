@@ -1,32 +1,105 @@
-"""Chat service: conversation management and LLM streaming via Together AI SDK."""
+"""Chat service: conversation management and LLM streaming via Together AI SDK.
+
+An answer cut short by a client disconnect is stored with
+``messages.interrupted`` set.  Existing rows default to false::
+
+    ALTER TABLE messages
+      ADD COLUMN interrupted boolean NOT NULL DEFAULT false;
+
+Until it exists, the partial answer is stored without the flag.
+"""
 
 from __future__ import annotations
 
 import asyncio
 import json
 import logging
-from collections.abc import AsyncGenerator
+import time
+from collections.abc import AsyncGenerator, Awaitable, Callable
 from datetime import datetime
 from uuid import UUID
 
 from fastapi import HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
+from postgrest.exceptions import APIError
 from together import AsyncTogether
 
+from app.chat.history import history_manager
 from app.chat.schemas import DEFAULT_MODEL, ChatRequest, ChatResponse, MessageResponse
 from app.chat.tools import (
     SEARCH_TOOL_SCHEMA,
     SYSTEM_PROMPT,
+    TextToolCallScanner,
+    accumulate_tool_call_deltas,
     execute_search,
-    parse_text_tool_call,
 )
 from app.core.config import get_settings
+from app.core.deadline import timeout_for
+from app.core.quotas import QuotaExceeded
 from app.core.supabase import get_supabase_client
 from app.core.token_budget import token_budget
+from app.inference.client import LLM_CALL_TIMEOUT
+from app.inference.gateway import LLMOverloaded, Priority, llm_gateway
+from app.inference.usage import STREAM_USAGE_OPTIONS, StreamUsage, usage_scope
 
 logger = logging.getLogger(__name__)
 
-MAX_HISTORY_MESSAGES = 20
+# How often (seconds) the upstream read loop asks whether the SSE client is
+# still connected.  Checking every delta would add an ASGI receive per token.
+DISCONNECT_POLL_INTERVAL = 0.25
+
+# Strong references to fire-and-forget cleanup tasks so they are not GC'd.
+_background_tasks: set[asyncio.Task] = set()
+
+# PostgREST / Postgres codes for a column the table does not have.
+_UNKNOWN_COLUMN_CODES = {"PGRST204", "42703"}
+
+
+class ClientDisconnectedError(Exception):
+    """The SSE client went away while a completion was still streaming."""
+
+
+class _UpstreamWatch:
+    """Tracks the active provider stream and polls for client disconnects."""
+
+    def __init__(self, is_disconnected: Callable[[], Awaitable[bool]] | None) -> None:
+        self._is_disconnected = is_disconnected
+        self._last_poll = time.monotonic()
+        self.stream = None
+        self.usage: StreamUsage | None = None
+
+    def track(self, usage: StreamUsage) -> StreamUsage:
+        """Make *usage* the accounting record for the current provider stream."""
+        self.usage = usage
+        return usage
+
+    def finish_usage(self, status: str) -> None:
+        """Record the current stream's usage if it was not recorded yet."""
+        if self.usage is not None:
+            self.usage.finish(status)
+
+    async def check(self) -> None:
+        """Raise :class:`ClientDisconnectedError` if the client has gone away."""
+        if self._is_disconnected is None:
+            return
+        now = time.monotonic()
+        if now - self._last_poll < DISCONNECT_POLL_INTERVAL:
+            return
+        self._last_poll = now
+        if await self._is_disconnected():
+            raise ClientDisconnectedError
+
+    async def close_upstream(self) -> None:
+        """Close the provider stream so it stops generating (and billing) tokens."""
+        stream, self.stream = self.stream, None
+        if stream is None:
+            return
+        close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+        if close is None:
+            return
+        try:
+            await close()
+        except Exception as e:
+            logger.debug("upstream stream close failed: %s", e)
 
 
 class ChatService:
@@ -67,19 +140,6 @@ class ChatService:
         )
         return res.data
 
-    async def _build_history(self, conversation_id: str) -> list[dict]:
-        """Fetch recent messages as plain dicts (role + content)."""
-        supabase = get_supabase_client()
-        res = await asyncio.to_thread(
-            supabase.table("messages")
-            .select("role, content")
-            .eq("conversation_id", conversation_id)
-            .order("created_at")
-            .limit(MAX_HISTORY_MESSAGES)
-            .execute
-        )
-        return [{"role": m["role"], "content": m["content"]} for m in res.data]
-
     def _resolve_model(self, request: ChatRequest) -> str:
         settings = get_settings()
         return request.model or settings.together_model or DEFAULT_MODEL
@@ -92,11 +152,14 @@ class ChatService:
         """Non-streaming chat — single-turn LLM call without tool calling."""
         conversation_id = request.conversation_id
 
+        history: list[dict] = []
         if not conversation_id:
             new_conv = await self.create_conversation(
                 user_id, title=request.message[:50]
             )
             conversation_id = new_conv["id"]
+        else:
+            history = await history_manager.get_window(conversation_id)
 
         user_msg_data = {
             "conversation_id": conversation_id,
@@ -104,24 +167,24 @@ class ChatService:
             "content": request.message,
         }
         supabase = get_supabase_client()
-        await asyncio.to_thread(
+        user_res = await asyncio.to_thread(
             supabase.table("messages").insert(user_msg_data).execute
         )
 
-        history = await self._build_history(conversation_id)
-        history_without_latest = history[:-1] if history else []
-
         from app.inference.client import get_llm_client
 
         llm = get_llm_client()
         chunks: list[str] = []
         try:
-            async for token in llm.chat(
-                user_message=request.message,
-                conversation_history=history_without_latest,
-            ):
-                chunks.append(token)
+            with usage_scope(user_id=user_id, feature="chat"):
+                async for token in llm.chat(
+                    user_message=request.message,
+                    conversation_history=history,
+                ):
+                    chunks.append(token)
             ai_response_text = "".join(chunks)
+        except (LLMOverloaded, QuotaExceeded):
+            raise
         except Exception as e:
             logger.exception("LLM Error: %s", e)
             ai_response_text = "Sorry, I'm having trouble generating a response right now. Please try again."
@@ -136,6 +199,7 @@ class ChatService:
             supabase.table("messages").insert(ai_msg_data).execute
         )
         ai_msg_record = ai_res.data[0]
+        history_manager.record_turn(conversation_id, [user_res.data[0], ai_msg_record])
 
         await asyncio.to_thread(
             supabase.table("conversations")
@@ -159,27 +223,132 @@ class ChatService:
     # Streaming chat with Together SDK tool calling
     # ------------------------------------------------------------------
 
+    async def _stream_answer(
+        self,
+        client: AsyncTogether,
+        model_name: str,
+        messages: list[dict],
+        watch: _UpstreamWatch,
+        user_id: str,
+    ) -> AsyncGenerator[str, None]:
+        """Stream the tool-free follow-up completion, yielding content deltas."""
+        settings = get_settings()
+        async with llm_gateway.slot(model_name, Priority.INTERACTIVE):
+            usage = StreamUsage(
+                "chat", model_name, list(messages), user_id=user_id, feature="chat",
+                max_tokens=settings.together_max_tokens,
+            )
+            stream = await usage.open(client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                max_tokens=settings.together_max_tokens,
+                temperature=settings.together_temperature,
+                stream=True,
+                timeout=timeout_for(LLM_CALL_TIMEOUT),
+                extra_body=STREAM_USAGE_OPTIONS,
+            ))
+            watch.stream = stream
+            watch.track(usage)
+            async for chunk in stream:
+                usage.observe(chunk)
+                await watch.check()
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta and getattr(delta, "content", None):
+                    yield delta.content
+        usage.finish()
+
+    async def _finish_interrupted(
+        self,
+        watch: _UpstreamWatch,
+        conversation_id: str | None,
+        messages: list[dict],
+        partial_text: str,
+        sources: list[dict],
+        user_msg_record: dict | None,
+        supabase,
+    ) -> None:
+        """Stop the provider stream and store what was generated before a disconnect."""
+        await watch.close_upstream()
+        # No final usage chunk arrives for a closed stream: counted locally.
+        watch.finish_usage("interrupted")
+        logger.info(
+            "chat stream interrupted by client conversation_id=%s response_len=%d",
+            conversation_id, len(partial_text),
+        )
+        if supabase is None or not conversation_id:
+            return
+        row = {
+            "conversation_id": conversation_id,
+            "role": "assistant",
+            "content": partial_text,
+            "sources": sources,
+            "interrupted": True,
+        }
+        try:
+            try:
+                ai_res = await asyncio.to_thread(
+                    supabase.table("messages").insert(row).execute
+                )
+            except APIError as e:
+                if e.code not in _UNKNOWN_COLUMN_CODES:
+                    raise
+                # messages.interrupted not migrated yet: keep the answer anyway.
+                logger.warning(
+                    "messages.interrupted missing, storing without it "
+                    "conversation_id=%s",
+                    conversation_id,
+                )
+                row = {k: v for k, v in row.items() if k != "interrupted"}
+                ai_res = await asyncio.to_thread(
+                    supabase.table("messages").insert(row).execute
+                )
+            if user_msg_record is not None:
+                history_manager.record_turn(
+                    conversation_id, [user_msg_record, ai_res.data[0]]
+                )
+        except Exception as e:
+            logger.warning(
+                "failed to store interrupted message conversation_id=%s: %s",
+                conversation_id, e,
+            )
+
     async def process_chat_stream(
         self,
         user_id: str,
         request: ChatRequest,
-        db: AsyncSession,
-    ) -> AsyncGenerator[str, None]:
+        is_disconnected: Callable[[], Awaitable[bool]] | None = None,
+    ) -> AsyncGenerator[tuple[str, str], None]:
         """Streaming chat using the Together AI SDK directly.
 
         Flow:
-        1. Non-streaming first call with ``tools`` so the model can decide
-           whether to call ``search_my_documents``.
-        2. If the model returns ``tool_calls``, execute the RAG search and
+        1. Streaming first call with ``tools`` so the model can decide
+           whether to call ``search_my_documents``.  Content deltas are
+           forwarded as they arrive; structured ``tool_calls`` deltas are
+           merged and text-based tool calls are detected incrementally
+           (content is only held back once a tool-call marker shows up).
+        2. If the model requested a tool call, execute the RAG search and
            append the results to the message list.
         3. Streaming second call to produce the final text response (with
            document context already in the conversation).
-        4. If the first call returned text directly (no tool call), stream
-           that content to the client.
-
-        Yields SSE-formatted events:
-          - ``event: token\\ndata: <chunk>\\n\\n``  for each text token
-          - ``event: done\\ndata: {json}\\n\\n``     once with final metadata
+        4. If the first call answered directly, its streamed content is the
+           whole response — no second call.
+
+        No database session is held for the lifetime of the stream: the RAG
+        search opens a short-lived one only around its queries (chat data
+        itself is persisted through Supabase).
+
+        If the client disconnects mid-answer (detected by polling
+        ``is_disconnected`` or by the server cancelling the response), the
+        provider stream is closed, only the generated tokens are charged to
+        the token budget, and the truncated answer is stored flagged as
+        ``interrupted``.
+
+        Yields ``(event, data)`` pairs, encoded for the wire by
+        :func:`app.core.sse.encode_sse`:
+          - ``("token", <chunk>)``  for each text delta
+          - ``("done", <json>)``    once with final metadata
         """
         model_name = self._resolve_model(request)
         conversation_id = request.conversation_id
@@ -187,16 +356,22 @@ class ChatService:
 
         # 1. Create conversation if needed (skip for ephemeral chats)
         _supabase = None
+        user_msg_record: dict | None = None
+        history: list[dict] = []
         if not ephemeral:
             if not conversation_id:
                 new_conv = await self.create_conversation(
                     user_id, title=request.message[:50]
                 )
                 conversation_id = new_conv["id"]
+            else:
+                # Token-budgeted window (rolling summary + recent turns),
+                # read before the new user message is stored.
+                history = await history_manager.get_window(conversation_id)
 
             # 2. Save user message
             _supabase = get_supabase_client()
-            await asyncio.to_thread(
+            user_res = await asyncio.to_thread(
                 _supabase.table("messages")
                 .insert(
                     {
@@ -207,16 +382,11 @@ class ChatService:
                 )
                 .execute
             )
+            user_msg_record = user_res.data[0]
 
         # 3. Build messages array: system + history + user
-        if not ephemeral and conversation_id:
-            raw_history = await self._build_history(conversation_id)
-            history_without_latest = raw_history[:-1] if raw_history else []
-        else:
-            history_without_latest = []
-
         messages: list[dict] = [{"role": "system", "content": SYSTEM_PROMPT}]
-        messages.extend(history_without_latest)
+        messages.extend(history)
         messages.append({"role": "user", "content": request.message})
 
         settings = get_settings()
@@ -229,27 +399,62 @@ class ChatService:
 
         sources: list[dict] = []
         accumulated_text = ""
+        watch = _UpstreamWatch(is_disconnected)
+        interrupted = False
 
         try:
-            # 4. First call: non-streaming, with tools
-            first_response = await client.chat.completions.create(
-                model=model_name,
-                messages=messages,
-                max_tokens=settings.together_max_tokens,
-                temperature=settings.together_temperature,
-                tools=[SEARCH_TOOL_SCHEMA],
-                tool_choice="auto",
-                stream=False,
-            )
+            # Some models emit tool calls as XML/text in content instead of
+            # using the structured tool_calls field.  The scanner forwards
+            # plain text immediately and captures anything that looks like one.
+            scanner = TextToolCallScanner()
+            tool_call_acc: dict[int, dict] = {}
+            first_text = ""
+
+            # 4. First call: streaming, with tools.  The gateway slot is held
+            # only while the provider stream is open, not during tool calls.
+            async with llm_gateway.slot(model_name, Priority.INTERACTIVE):
+                first_usage = StreamUsage(
+                    "chat", model_name, list(messages), user_id=user_id, feature="chat",
+                    max_tokens=settings.together_max_tokens,
+                )
+                first_stream = await first_usage.open(client.chat.completions.create(
+                    model=model_name,
+                    messages=messages,
+                    max_tokens=settings.together_max_tokens,
+                    temperature=settings.together_temperature,
+                    tools=[SEARCH_TOOL_SCHEMA],
+                    tool_choice="auto",
+                    stream=True,
+                    timeout=timeout_for(LLM_CALL_TIMEOUT),
+                    extra_body=STREAM_USAGE_OPTIONS,
+                ))
+                watch.stream = first_stream
+                watch.track(first_usage)
+                async for chunk in first_stream:
+                    first_usage.observe(chunk)
+                    await watch.check()
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if not delta:
+                        continue
+                    if getattr(delta, "tool_calls", None):
+                        accumulate_tool_call_deltas(tool_call_acc, delta.tool_calls)
+                    if getattr(delta, "content", None):
+                        first_text += delta.content
+                        emit = scanner.feed(delta.content)
+                        if emit:
+                            accumulated_text += emit
+                            yield ("token", emit)
 
-            choice = first_response.choices[0]
-            tool_calls = getattr(choice.message, "tool_calls", None)
+            first_usage.finish()
 
-            # Some models emit tool calls as XML/text in content instead of
-            # using the structured tool_calls field.  Detect and normalise.
-            text_tool: dict | None = None
-            if not tool_calls:
-                text_tool = parse_text_tool_call(choice.message.content or "")
+            remaining, text_tool = scanner.finish()
+            if remaining:
+                accumulated_text += remaining
+                yield ("token", remaining)
+
+            tool_calls = [tool_call_acc[i] for i in sorted(tool_call_acc)]
 
             if tool_calls:
                 # 5a. Model used structured tool_calls — execute them
@@ -261,18 +466,21 @@ class ChatService:
                 messages.append(
                     {
                         "role": "assistant",
-                        "content": choice.message.content or "",
-                        "tool_calls": [tc.model_dump() for tc in tool_calls],
+                        "content": first_text,
+                        "tool_calls": tool_calls,
                     }
                 )
 
                 for tc in tool_calls:
-                    fn_name = tc.function.name
-                    fn_args = json.loads(tc.function.arguments)
+                    fn_name = tc["function"]["name"]
+                    try:
+                        fn_args = json.loads(tc["function"]["arguments"] or "{}")
+                    except json.JSONDecodeError:
+                        fn_args = {}
 
                     if fn_name == "search_my_documents":
                         context_text, call_sources = await execute_search(
-                            db=db,
+                            db=None,
                             user_id=UUID(user_id),
                             query=fn_args.get("query", request.message),
                         )
@@ -283,27 +491,18 @@ class ChatService:
 
                     messages.append(
                         {
-                            "tool_call_id": tc.id,
+                            "tool_call_id": tc["id"],
                             "role": "tool",
                             "name": fn_name,
                             "content": context_text,
                         }
                     )
 
-                stream = await client.chat.completions.create(
-                    model=model_name,
-                    messages=messages,
-                    max_tokens=settings.together_max_tokens,
-                    temperature=settings.together_temperature,
-                    stream=True,
-                )
-                async for chunk in stream:
-                    if not chunk.choices:
-                        continue
-                    delta = chunk.choices[0].delta
-                    if delta and hasattr(delta, "content") and delta.content:
-                        accumulated_text += delta.content
-                        yield f"event: token\ndata: {delta.content}\n\n"
+                async for token in self._stream_answer(
+                    client, model_name, messages, watch, user_id
+                ):
+                    accumulated_text += token
+                    yield ("token", token)
 
             elif text_tool:
                 # 5b. Model emitted a tool call as text — execute it
@@ -313,7 +512,7 @@ class ChatService:
                 )
 
                 context_text, call_sources = await execute_search(
-                    db=db,
+                    db=None,
                     user_id=UUID(user_id),
                     query=text_tool["arguments"].get("query", request.message),
                 )
@@ -339,37 +538,52 @@ class ChatService:
                     }
                 )
 
-                stream = await client.chat.completions.create(
-                    model=model_name,
-                    messages=messages,
-                    max_tokens=settings.together_max_tokens,
-                    temperature=settings.together_temperature,
-                    stream=True,
+                async for token in self._stream_answer(
+                    client, model_name, messages, watch, user_id
+                ):
+                    accumulated_text += token
+                    yield ("token", token)
+
+            # 5c. No tool call at all — the streamed first response is the answer.
+
+        except ClientDisconnectedError:
+            interrupted = True
+        except (asyncio.CancelledError, GeneratorExit):
+            # The server tore the response down (client went away).  Nothing
+            # more can be awaited here, so finish the bookkeeping in the
+            # background and let the cancellation propagate.
+            task = asyncio.create_task(
+                self._finish_interrupted(
+                    watch, conversation_id, messages, accumulated_text,
+                    sources, user_msg_record, _supabase,
                 )
-                async for chunk in stream:
-                    if not chunk.choices:
-                        continue
-                    delta = chunk.choices[0].delta
-                    if delta and hasattr(delta, "content") and delta.content:
-                        accumulated_text += delta.content
-                        yield f"event: token\ndata: {delta.content}\n\n"
-
-            else:
-                # 5c. No tool call at all — model responded with text directly.
-                text = choice.message.content or ""
-                accumulated_text = text
-                yield f"event: token\ndata: {text}\n\n"
-
+            )
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+            raise
+        except (LLMOverloaded, QuotaExceeded) as e:
+            watch.finish_usage("error")
+            # Headers are already sent, so the 503/429 is surfaced as the answer.
+            logger.warning(
+                "chat stream rejected conversation_id=%s status=%d",
+                conversation_id,
+                e.status_code,
+            )
+            accumulated_text = e.detail
+            yield ("token", e.detail)
         except Exception as e:
+            watch.finish_usage("error")
             logger.exception("Chat stream error: %s", e)
             fallback = "Sorry, I'm having trouble generating a response right now. Please try again."
             accumulated_text = fallback
-            yield f"event: token\ndata: {fallback}\n\n"
+            yield ("token", fallback)
 
-        # Track token usage: estimate input from messages + output from response
-        estimated_input = sum(len(m.get("content", "")) // 4 for m in messages)
-        estimated_output = len(accumulated_text) // 4
-        token_budget.record(estimated_input + estimated_output)
+        if interrupted:
+            await self._finish_interrupted(
+                watch, conversation_id, messages, accumulated_text,
+                sources, user_msg_record, _supabase,
+            )
+            return
 
         logger.info(
             "chat stream completed conversation_id=%s ephemeral=%s response_len=%d sources=%d budget_remaining=%d",
@@ -390,7 +604,7 @@ class ChatService:
                     },
                 }
             )
-            yield f"event: done\ndata: {done_payload}\n\n"
+            yield ("done", done_payload)
             return
 
         # 7. Save complete AI message
@@ -404,6 +618,7 @@ class ChatService:
             _supabase.table("messages").insert(ai_msg_data).execute
         )
         ai_msg_record = ai_res.data[0]
+        history_manager.record_turn(conversation_id, [user_msg_record, ai_msg_record])
 
         # 8. Update conversation timestamp
         await asyncio.to_thread(
@@ -426,4 +641,4 @@ class ChatService:
                 },
             }
         )
-        yield f"event: done\ndata: {done_payload}\n\n"
+        yield ("done", done_payload)
@@ -15,8 +15,10 @@ from uuid import UUID
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.database import session_scope
+from app.core.deadline import within_deadline
 from app.documents.models import Document
-from app.processing.service import ProcessingService
+from app.processing.service import PARTIAL_NOTE, ProcessingService
 
 logger = logging.getLogger(__name__)
 
@@ -83,6 +85,108 @@ def parse_text_tool_call(text: str) -> dict | None:
 
     return None
 
+
+# Literal prefixes that open one of the text tool-call patterns above.  While
+# streaming, content is held back only once one of these (or a partial prefix
+# of one at the very end of the text) shows up.
+_TEXT_TOOL_MARKERS = ("<tool_call>", "[TOOL_CALL]", "<function=search_my_documents>")
+
+# Upper bound for one RAG search (embedding + vector query); shortened to
+# whatever is left of the request deadline.
+SEARCH_TIMEOUT = 15.0
+
+
+def _partial_marker_len(text: str) -> int:
+    """Length of the longest suffix of *text* that is a proper prefix of a marker."""
+    longest = 0
+    for marker in _TEXT_TOOL_MARKERS:
+        for size in range(min(len(marker) - 1, len(text)), longest, -1):
+            if text.endswith(marker[:size]):
+                longest = size
+                break
+    return longest
+
+
+class TextToolCallScanner:
+    """Incrementally detect text-based tool calls in streamed model content.
+
+    ``feed()`` returns the part of each delta that is safe to forward to the
+    client right away.  Text is only held back when it starts (or might start)
+    one of the tool-call markers; from the first full marker onwards the rest
+    of the stream is captured and handed to ``parse_text_tool_call`` by
+    ``finish()``.
+    """
+
+    def __init__(self) -> None:
+        self._pending = ""
+        self._captured: list[str] | None = None
+
+    @property
+    def capturing(self) -> bool:
+        """True once a tool-call marker has been seen."""
+        return self._captured is not None
+
+    def feed(self, text: str) -> str:
+        """Consume a content delta and return the text that can be emitted now."""
+        if self._captured is not None:
+            self._captured.append(text)
+            return ""
+
+        buf = self._pending + text
+        positions = [p for p in (buf.find(m) for m in _TEXT_TOOL_MARKERS) if p != -1]
+        if positions:
+            start = min(positions)
+            self._captured = [buf[start:]]
+            self._pending = ""
+            return buf[:start]
+
+        hold = _partial_marker_len(buf)
+        self._pending = buf[len(buf) - hold:] if hold else ""
+        return buf[: len(buf) - hold]
+
+    def finish(self) -> tuple[str, dict | None]:
+        """Flush the scanner at end of stream.
+
+        Returns ``(remaining_text, tool_call)``.  When the captured text does
+        not parse as a tool call it is returned as ordinary content instead.
+        """
+        if self._captured is None:
+            remaining, self._pending = self._pending, ""
+            return remaining, None
+
+        captured = "".join(self._captured)
+        self._captured = None
+        tool_call = parse_text_tool_call(captured)
+        if tool_call:
+            return "", tool_call
+        return captured, None
+
+
+def accumulate_tool_call_deltas(acc: dict[int, dict], deltas: list) -> None:
+    """Merge streamed ``tool_calls`` deltas into *acc*, keyed by call index.
+
+    Providers send the call id and function name once and the JSON arguments
+    in pieces; the merged entries have the same shape as a non-streamed
+    ``tool_calls`` item (``{"id", "type", "function": {"name", "arguments"}}``).
+    """
+    for delta in deltas:
+        index = getattr(delta, "index", None)
+        if index is None:
+            index = len(acc)
+        entry = acc.setdefault(
+            index,
+            {"id": "", "type": "function", "function": {"name": "", "arguments": ""}},
+        )
+        if getattr(delta, "id", None):
+            entry["id"] = delta.id
+        fn = getattr(delta, "function", None)
+        if fn is not None:
+            if getattr(fn, "name", None):
+                entry["function"]["name"] += fn.name
+            if getattr(fn, "arguments", None):
+                entry["function"]["arguments"] += fn.arguments
+
+
 SYSTEM_PROMPT = """You are StudyBudd, a friendly and knowledgeable AI study assistant.
 
 Your role:
@@ -135,7 +239,7 @@ SEARCH_TOOL_SCHEMA: dict = {
 
 
 async def execute_search(
-    db: AsyncSession,
+    db: AsyncSession | None,
     user_id: UUID,
     query: str,
     folder_ids: list[UUID] | None = None,
@@ -148,17 +252,28 @@ async def execute_search(
     names (e.g. "[Doc: filename.pdf | Chunk 0]") so the model cites names.
 
     *sources* is a list of dicts with ``document_id``, ``document_name``,
-    ``chunk_index``, and ``preview``.
+    ``chunk_index``, ``preview``, and ``partial`` (the document is still
+    being indexed, so the answer may miss parts of it).
+
+    When *db* is ``None`` a short-lived session is opened just for the
+    retrieval queries, so streaming callers don't pin a pooled connection.
     """
+    if db is None:
+        async with session_scope() as session:
+            return await execute_search(
+                session, user_id, query, folder_ids=folder_ids, top_k=top_k
+            )
+
     logger.info("RAG search user_id=%s query=%r", user_id, query)
 
-    retrieve = await ProcessingService.rag_retrieve_multi(
-        db=db,
-        user_id=user_id,
-        question=query,
-        top_k=top_k,
-        folder_ids=folder_ids,
-    )
+    async with within_deadline(SEARCH_TIMEOUT):
+        retrieve = await ProcessingService.rag_retrieve_multi(
+            db=db,
+            user_id=user_id,
+            question=query,
+            top_k=top_k,
+            folder_ids=folder_ids,
+        )
 
     if not retrieve.context_chunks:
         logger.info("RAG search returned 0 chunks for query=%r", query)
@@ -183,6 +298,8 @@ async def execute_search(
     context_parts = []
     for c in retrieve.context_chunks:
         name = doc_id_to_name.get(c.document_id) or "Untitled"
+        if c.partial:
+            name += PARTIAL_NOTE
         context_parts.append(f"[Doc: {name} | Chunk {c.chunk_index}]\n{c.content}")
     context_text = "\n\n---\n\n".join(context_parts)
 
@@ -197,6 +314,7 @@ async def execute_search(
                     "document_name": doc_id_to_name.get(chunk.document_id) or "Untitled",
                     "chunk_index": chunk.chunk_index,
                     "preview": chunk.content[:120],
+                    "partial": chunk.partial,
                 }
             )
             seen_doc_ids.add(doc_id_str)
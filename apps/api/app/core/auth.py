@@ -0,0 +1,170 @@
+"""JWT verification support: JWKS key store and verified-token cache.
+
+Supabase signs access tokens with a key published at the project's JWKS
+endpoint.  :class:`JWKSStore` fetches that key set at startup and refreshes
+it in the background with an async client, so verifying a token never
+waits on a blocking HTTP fetch; a token signed with an unknown ``kid``
+(key rotation) triggers one immediate, rate-limited refresh.
+
+Verifying an ES256 signature costs real CPU, and clients send the same
+bearer token on every request until it expires.  :class:`VerifiedTokenCache`
+remembers tokens that already passed verification — keyed by a SHA-256
+digest, never the raw token — until their ``exp``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any
+
+import httpx
+import jwt
+
+from app.core.config import get_settings
+
+if TYPE_CHECKING:
+    from app.core.dependencies import AuthenticatedUser
+
+logger = logging.getLogger(__name__)
+
+JWKS_REFRESH_INTERVAL = 600.0
+# Minimum gap between refreshes forced by an unknown key id.
+JWKS_MIN_FORCED_REFRESH = 30.0
+JWKS_FETCH_TIMEOUT = 5.0
+
+
+class JWKSStore:
+    """Signing keys from a JWKS endpoint, refreshed in the background."""
+
+    def __init__(
+        self,
+        url: str | None,
+        refresh_interval: float = JWKS_REFRESH_INTERVAL,
+    ) -> None:
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self._keys: dict[str, jwt.PyJWK] = {}
+        self._last_forced = -JWKS_MIN_FORCED_REFRESH
+        self._refreshing: asyncio.Task | None = None
+        self._background: asyncio.Task | None = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.url)
+
+    async def start(self) -> None:
+        """Load the key set and start the background refresh loop."""
+        if not self.configured or self._background is not None:
+            return
+        try:
+            await self.refresh()
+        except Exception as e:
+            # Not fatal: the first token with a kid triggers another fetch.
+            logger.warning("JWKS initial fetch failed url=%s: %s", self.url, e)
+        self._background = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._background is not None:
+            self._background.cancel()
+            self._background = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning("JWKS refresh failed url=%s: %s", self.url, e)
+
+    async def refresh(self) -> None:
+        """Fetch the key set now; concurrent callers share one request."""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._fetch())
+        await asyncio.shield(self._refreshing)
+
+    async def _fetch(self) -> None:
+        async with httpx.AsyncClient(timeout=JWKS_FETCH_TIMEOUT) as client:
+            r = await client.get(self.url)
+            r.raise_for_status()
+            data = r.json()
+        self.load(data)
+        logger.info("JWKS refreshed keys=%d", len(self._keys))
+
+    def load(self, data: dict[str, Any]) -> None:
+        """Replace the key set from a parsed JWKS document."""
+        key_set = jwt.PyJWKSet.from_dict(data)
+        self._keys = {k.key_id: k for k in key_set.keys if k.key_id}
+
+    async def signing_key(self, kid: str | None) -> jwt.PyJWK | None:
+        """Key for *kid*, refreshing once if it is not known yet."""
+        key = self._keys.get(kid) if kid else None
+        if key is not None or not kid:
+            return key
+        now = time.monotonic()
+        if now - self._last_forced >= JWKS_MIN_FORCED_REFRESH:
+            # Stamped before fetching so a failing endpoint is not hammered.
+            self._last_forced = now
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning("JWKS refresh for kid=%s failed: %s", kid, e)
+        return self._keys.get(kid)
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of verified token digests -> user, honouring ``exp``."""
+
+    def __init__(self, max_entries: int = 10_000) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[bytes, tuple[AuthenticatedUser, float]] = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> AuthenticatedUser | None:
+        digest = self._digest(token)
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[digest]
+            return None
+        self._entries.move_to_end(digest)
+        return user
+
+    def put(
+        self, token: str, user: AuthenticatedUser, expires_at: float | None
+    ) -> None:
+        """Cache a verified token; tokens without ``exp`` are not cached."""
+        if expires_at is None:
+            return
+        digest = self._digest(token)
+        self._entries[digest] = (user, float(expires_at))
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+def _jwks_url() -> str | None:
+    # e.g., https://xyz.supabase.co -> https://xyz.supabase.co/auth/v1/.well-known/jwks.json
+    base_url = get_settings().supabase_url.rstrip("/")
+    return f"{base_url}/auth/v1/.well-known/jwks.json" if base_url else None
+
+
+# Singletons; main starts the JWKS refresh in its lifespan.
+jwks_store = JWKSStore(_jwks_url())
+token_cache = VerifiedTokenCache()
@@ -164,11 +164,118 @@ class Settings(BaseSettings):
         validation_alias=AliasChoices("RATE_LIMIT_GENERATE_WINDOW", "rate_limit_generate_window"),
     )
 
+    # Where rate-limit state lives: "memory" (per process) or "postgres"
+    # (shared by all workers; needs the rate_limits table).
+    rate_limit_backend: str = Field(
+        default="memory",
+        validation_alias=AliasChoices("RATE_LIMIT_BACKEND", "rate_limit_backend"),
+    )
+
+    # How ingestion progress reaches SSE subscribers on other workers:
+    # "postgres" (NOTIFY/LISTEN; needs a session-mode connection, not a
+    # transaction pooler) or "memory" (subscribers on the same process only).
+    progress_backend: str = Field(
+        default="postgres",
+        validation_alias=AliasChoices("PROGRESS_BACKEND", "progress_backend"),
+    )
+
+    # Ingestion runs that have stored nothing for this many seconds are
+    # taken to have died with their worker and are resumed by another.
+    ingestion_resume_after: float = Field(
+        default=600.0,
+        validation_alias=AliasChoices(
+            "INGESTION_RESUME_AFTER", "ingestion_resume_after"
+        ),
+    )
+
+    # Embedding migrations (see app.processing.reembed): default pace, in
+    # chunks re-embedded per second, and documents re-embedded at once.
+    reembed_rate_limit: float = Field(
+        default=50.0,
+        validation_alias=AliasChoices("REEMBED_RATE_LIMIT", "reembed_rate_limit"),
+    )
+    reembed_concurrency: int = Field(
+        default=2,
+        validation_alias=AliasChoices("REEMBED_CONCURRENCY", "reembed_concurrency"),
+    )
+
+    # Users allowed to call admin endpoints (JSON list of user ids).
+    admin_user_ids: list[str] = Field(
+        default=[],
+        validation_alias=AliasChoices("ADMIN_USER_IDS", "admin_user_ids"),
+    )
+
+    # Chat history window: recent turns are sent verbatim up to this many
+    # (estimated) tokens; older turns are folded into a rolling summary.
+    chat_history_token_budget: int = Field(
+        default=2000,
+        validation_alias=AliasChoices(
+            "CHAT_HISTORY_TOKEN_BUDGET", "chat_history_token_budget"
+        ),
+    )
+
+    # LLM gateway: upstream concurrency limits and the wait queue in front
+    # of them.  Requests still queued after the timeout are shed with 503.
+    llm_max_concurrency: int = Field(
+        default=32,
+        validation_alias=AliasChoices("LLM_MAX_CONCURRENCY", "llm_max_concurrency"),
+    )
+    llm_model_max_concurrency: int = Field(
+        default=16,
+        validation_alias=AliasChoices(
+            "LLM_MODEL_MAX_CONCURRENCY", "llm_model_max_concurrency"
+        ),
+    )
+    llm_max_queue: int = Field(
+        default=200,
+        validation_alias=AliasChoices("LLM_MAX_QUEUE", "llm_max_queue"),
+    )
+    llm_queue_timeout: float = Field(
+        default=10.0,
+        validation_alias=AliasChoices("LLM_QUEUE_TIMEOUT", "llm_queue_timeout"),
+    )
+    llm_batch_queue_timeout: float = Field(
+        default=60.0,
+        validation_alias=AliasChoices(
+            "LLM_BATCH_QUEUE_TIMEOUT", "llm_batch_queue_timeout"
+        ),
+    )
+
+    # Overall time budget for chat, RAG query and generation requests;
+    # provider and retrieval timeouts are drawn from what is left of it.
+    request_deadline_seconds: float = Field(
+        default=90.0,
+        validation_alias=AliasChoices(
+            "REQUEST_DEADLINE_SECONDS", "request_deadline_seconds"
+        ),
+    )
+
     # Daily token budget (total across all users)
     daily_token_budget: int = Field(
         default=200_000,
         validation_alias=AliasChoices("DAILY_TOKEN_BUDGET", "daily_token_budget"),
     )
+    # Per-user daily token quotas (0 disables).  Feature quotas are keyed by
+    # the usage feature name, e.g. {"flashcards": 30000}.
+    user_daily_token_quota: int = Field(
+        default=50_000,
+        validation_alias=AliasChoices(
+            "USER_DAILY_TOKEN_QUOTA", "user_daily_token_quota"
+        ),
+    )
+    feature_daily_token_quotas: dict[str, int] = Field(
+        default={"flashcards": 30_000, "quizzes": 30_000},
+        validation_alias=AliasChoices(
+            "FEATURE_DAILY_TOKEN_QUOTAS", "feature_daily_token_quotas"
+        ),
+    )
+
+    # Tokens each worker reserves from the shared daily budget at a time.
+    # Larger leases mean fewer DB round trips but a looser global cap.
+    token_budget_lease: int = Field(
+        default=5_000,
+        validation_alias=AliasChoices("TOKEN_BUDGET_LEASE", "token_budget_lease"),
+    )
 
 
 @lru_cache
@@ -1,8 +1,9 @@
 """Database configuration and session management."""
 
 from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
 
-from sqlalchemy import text
+from sqlalchemy import event, text
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app.core.config import get_settings
@@ -30,10 +31,60 @@ async_session_maker = async_sessionmaker(
 )
 
 
+async def _prepare_session(session: AsyncSession) -> None:
+    """Per-session setup shared by the request dependency and short-lived scopes."""
+    # Supabase: include extensions so unqualified "vector" resolves (pgvector may
+    # be in public or extensions).
+    if "supabase" in settings.database_url or "supabase" in settings.db_host:
+        await session.execute(text("SET search_path TO public, extensions, vector_db"))
+
+
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """Dependency for getting database sessions."""
     async with async_session_maker() as session:
-        # Supabase: include extensions so unqualified "vector" resolves (pgvector may be in public or extensions)
-        if "supabase" in settings.database_url or "supabase" in settings.db_host:
-            await session.execute(text("SET search_path TO public, extensions, vector_db"))
+        await _prepare_session(session)
+        yield session
+
+
+@asynccontextmanager
+async def session_scope() -> AsyncGenerator[AsyncSession, None]:
+    """Short-lived session for code that must not hold a pooled connection.
+
+    Long-lived requests (e.g. SSE chat streams) open one of these only around
+    the queries they run, so the connection goes back to the pool while the
+    request waits on the LLM.
+    """
+    async with async_session_maker() as session:
+        await _prepare_session(session)
         yield session
+
+
+# =============================================================================
+# Pool occupancy metrics
+# =============================================================================
+
+_pool_peak_checked_out = 0
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    global _pool_peak_checked_out
+    checked_out = engine.sync_engine.pool.checkedout()
+    if checked_out > _pool_peak_checked_out:
+        _pool_peak_checked_out = checked_out
+
+
+def pool_status() -> dict[str, int]:
+    """Snapshot of connection-pool occupancy (exposed on ``/health``)."""
+    pool = engine.sync_engine.pool
+    status = {"peak_checked_out": _pool_peak_checked_out}
+    for key, name in (
+        ("size", "size"),
+        ("checked_out", "checkedout"),
+        ("checked_in", "checkedin"),
+        ("overflow", "overflow"),
+    ):
+        metric = getattr(pool, name, None)
+        if callable(metric):
+            status[key] = metric()
+    return status
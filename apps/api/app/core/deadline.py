@@ -0,0 +1,116 @@
+"""Per-request deadline budgets.
+
+Latency-sensitive endpoints (chat, RAG query, generation) get an overall
+time budget (``REQUEST_DEADLINE_SECONDS``) from the :func:`request_deadline`
+dependency, held in a context variable.  Retrieval, embedding and LLM calls
+draw their timeouts from what is left of it via :func:`timeout_for` /
+:func:`within_deadline`, so a slow first step leaves less time for later ones
+instead of each step waiting its own full timeout.
+
+Context variables are copied into tasks spawned by the request, so the
+deadline also applies inside streaming responses and hedged calls.  Work that
+must outlive the request (ingestion, summaries, background generation and
+migrations) is started under :func:`no_deadline` and only uses the per-call
+caps.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from fastapi import HTTPException
+
+from app.core.config import get_settings
+
+_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(HTTPException):
+    """The request ran out of its time budget."""
+
+    def __init__(self) -> None:
+        super().__init__(
+            status_code=504, detail="The request took too long. Please try again."
+        )
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[float]:
+    """Run the block with at most *seconds* left (never extends an outer deadline)."""
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def no_deadline() -> Iterator[None]:
+    """Run the block, and tasks started in it, without any deadline."""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+async def request_deadline() -> None:
+    """FastAPI dependency giving the rest of the request its time budget.
+
+    The value is set without a reset: it lives in the request's own context,
+    so it also covers a streaming body sent after the endpoint returns.
+    """
+    deadline = time.monotonic() + get_settings().request_deadline_seconds
+    outer = _deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    _deadline.set(deadline)
+
+
+def time_remaining() -> float | None:
+    """Seconds left in the current deadline, or ``None`` if there is none."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def timeout_for(cap: float) -> float:
+    """Timeout for one call: *cap*, shortened to the remaining budget.
+
+    Raises:
+        DeadlineExceeded: If the budget is already spent.
+    """
+    left = time_remaining()
+    if left is None:
+        return cap
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(cap, left)
+
+
+@asynccontextmanager
+async def within_deadline(cap: float | None = None) -> AsyncIterator[None]:
+    """Cancel the block when the deadline (or *cap* seconds) runs out."""
+    left = time_remaining()
+    if left is None and cap is None:
+        yield
+        return
+    limit = min(x for x in (left, cap) if x is not None)
+    if limit <= 0:
+        raise DeadlineExceeded()
+    try:
+        async with asyncio.timeout(limit) as cm:
+            yield
+    except TimeoutError:
+        if cm.expired():
+            raise DeadlineExceeded() from None
+        raise
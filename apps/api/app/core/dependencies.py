@@ -2,17 +2,15 @@
 
 import logging
 from collections.abc import AsyncGenerator
-from functools import lru_cache
 from typing import Annotated
-from urllib.parse import urlparse
 from uuid import UUID
 
 import jwt
-from jwt import PyJWKClient
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.auth import jwks_store, token_cache
 from app.core.config import get_settings
 from app.core.database import async_session_maker
 
@@ -21,29 +19,6 @@ settings = get_settings()
 security = HTTPBearer()
 
 
-# =============================================================================
-# JWKS Client (cached)
-# =============================================================================
-
-
-@lru_cache(maxsize=1)
-def get_jwks_client() -> PyJWKClient | None:
-    """Get cached JWKS client for Supabase.
-    
-    Returns:
-        PyJWKClient instance or None if Supabase URL not configured.
-    """
-    if not settings.supabase_url:
-        return None
-    
-    # Build JWKS URL from Supabase project URL
-    # e.g., https://xyz.supabase.co -> https://xyz.supabase.co/auth/v1/.well-known/jwks.json
-    base_url = settings.supabase_url.rstrip("/")
-    jwks_url = f"{base_url}/auth/v1/.well-known/jwks.json"
-    
-    return PyJWKClient(jwks_url, cache_keys=True)
-
-
 # =============================================================================
 # Authentication
 # =============================================================================
@@ -63,7 +38,7 @@ class AuthenticatedUser:
         self.email = email
 
 
-def get_current_user(
+async def get_current_user(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)],
 ) -> AuthenticatedUser:
     """Verify Supabase JWT token and extract user information.
@@ -72,6 +47,9 @@ def get_current_user(
     - ES256 (ECC P-256) - Supabase's new default
     - HS256 (Legacy shared secret) - for backwards compatibility
 
+    Tokens that already passed verification are served from
+    ``token_cache`` until they expire, skipping signature checks.
+
     Args:
         credentials: HTTP Bearer token from Authorization header.
 
@@ -91,6 +69,10 @@ def get_current_user(
             email="dev@localhost",
         )
 
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
+
     # Try to decode the token header to determine algorithm
     try:
         unverified_header = jwt.get_unverified_header(token)
@@ -105,16 +87,20 @@ def get_current_user(
     try:
         # Use JWKS for ES256/RS256 (asymmetric algorithms)
         if alg in ("ES256", "RS256", "ES384", "RS384", "ES512", "RS512"):
-            jwks_client = get_jwks_client()
-            if not jwks_client:
+            if not jwks_store.configured:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail="JWKS not configured. Set SUPABASE_URL in environment.",
                 )
-            
-            # Get the signing key from JWKS
-            signing_key = jwks_client.get_signing_key_from_jwt(token)
-            
+
+            # Get the signing key from the prefetched JWKS
+            signing_key = await jwks_store.signing_key(unverified_header.get("kid"))
+            if signing_key is None:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid token: unknown signing key",
+                )
+
             payload = jwt.decode(
                 token,
                 signing_key.key,
@@ -153,7 +139,9 @@ def get_current_user(
         user_id = UUID(user_id_str)
         email = payload.get("email")
 
-        return AuthenticatedUser(user_id=user_id, email=email)
+        user = AuthenticatedUser(user_id=user_id, email=email)
+        token_cache.put(token, user, payload.get("exp"))
+        return user
 
     except jwt.ExpiredSignatureError:
         logger.warning("auth failed token expired")
@@ -169,6 +157,22 @@ def get_current_user(
         )
 
 
+async def get_admin_user(
+    user: Annotated[AuthenticatedUser, Depends(get_current_user)],
+) -> AuthenticatedUser:
+    """Require an authenticated user listed in ``ADMIN_USER_IDS``.
+
+    Raises:
+        HTTPException: 403 if the user is not an admin.
+    """
+    if str(user.user_id) not in settings.admin_user_ids:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required.",
+        )
+    return user
+
+
 # =============================================================================
 # Database
 # =============================================================================
@@ -189,4 +193,5 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
 # =============================================================================
 
 CurrentUser = Annotated[AuthenticatedUser, Depends(get_current_user)]
+AdminUser = Annotated[AuthenticatedUser, Depends(get_admin_user)]
 DbSession = Annotated[AsyncSession, Depends(get_db)]
@@ -1,11 +1,11 @@
-"""Shared SQLAlchemy base class and mixins for all modules."""
+"""Shared SQLAlchemy base class and mixins, and the core service tables."""
 
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import date, datetime
 from uuid import UUID, uuid4
 
-from sqlalchemy import func
+from sqlalchemy import BigInteger, Date, Float, Integer, String, func
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 
@@ -36,3 +36,27 @@ class TimestampMixin:
         server_default=func.now(),
         onupdate=func.now(),
     )
+
+
+class TokenBudgetDay(Base):
+    """Shared per-day counter of tokens reserved by all workers."""
+
+    __tablename__ = "token_budget_days"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    tokens_reserved: Mapped[int] = mapped_column(
+        BigInteger, default=0, server_default="0"
+    )
+
+
+class RateLimitState(Base):
+    """One GCRA key for the shared rate limiter (table created ``UNLOGGED``)."""
+
+    __tablename__ = "rate_limits"
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    # Theoretical arrival time, seconds since the epoch (database clock).
+    tat: Mapped[float] = mapped_column(Float)
+    # Cells handed out by the last lease, reported back by the upsert.
+    granted: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
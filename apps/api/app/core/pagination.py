@@ -0,0 +1,72 @@
+"""Keyset (cursor) pagination for list endpoints.
+
+Lists are ordered newest first by ``(created_at, id)``; ``id`` breaks ties
+between rows created in the same instant.  The cursor is an opaque token
+encoding the last row of a page, and the next page is the rows strictly
+before it, so each page costs an index range scan of *limit* rows no
+matter how deep the client pages (unlike ``OFFSET``).
+"""
+
+from __future__ import annotations
+
+import base64
+from datetime import datetime
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import Select, tuple_
+from sqlalchemy.orm import InstrumentedAttribute
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    """Opaque cursor pointing at the row ``(created_at, row_id)``."""
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """Inverse of :func:`encode_cursor`.
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.") from e
+
+
+def keyset_page(
+    stmt: Select,
+    created_at: InstrumentedAttribute,
+    row_id: InstrumentedAttribute,
+    *,
+    cursor: str | None,
+    limit: int,
+) -> Select:
+    """Order *stmt* newest first and restrict it to the page after *cursor*.
+
+    One extra row is fetched so :func:`split_page` can tell whether another
+    page follows.
+    """
+    if cursor is not None:
+        after_created, after_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(created_at, row_id) < tuple_(after_created, after_id))
+    return stmt.order_by(created_at.desc(), row_id.desc()).limit(limit + 1)
+
+
+def split_page(rows: list, limit: int) -> tuple[list, str | None]:
+    """Trim the extra row from :func:`keyset_page`; return rows and next cursor.
+
+    Rows must have ``created_at`` and ``id`` attributes.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
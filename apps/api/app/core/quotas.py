@@ -0,0 +1,237 @@
+"""Per-user and per-feature daily token quotas.
+
+Admission is *reserve-then-reconcile*: before each LLM call the client
+reserves an estimate (prompt tokens + ``max_tokens``) against the user's
+daily quota and, if the call is attributed to one, the feature's quota.
+When the call's real usage is known the reservation is settled to it and
+the unused remainder is released.  Concurrent requests therefore see each
+other's in-flight cost instead of all passing a check before any of them
+records usage.
+
+All reservation bookkeeping is in memory and O(1).  Usage is persisted by
+the usage ledger (``llm_usage``); a user's counters are loaded from it the
+first time they are seen each day and refreshed periodically, so quotas
+survive restarts and pick up usage from other workers.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Seconds in a day
+_DAY = 86400
+
+# Loads ``{feature: tokens_used}`` for one user since the given UTC datetime.
+UsageLoader = Callable[[str, datetime], Awaitable[dict[str | None, int]]]
+
+
+class QuotaExceeded(HTTPException):
+    """The user has used up a daily token quota (429 until UTC midnight)."""
+
+    def __init__(self, scope: str) -> None:
+        now = time.time()
+        retry_after = int(_DAY - now % _DAY) + 1
+        super().__init__(
+            status_code=429,
+            detail=f"Daily {scope} usage limit reached. Please try again tomorrow.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+@dataclass
+class _Counter:
+    used: int = 0
+    reserved: int = 0
+
+    def headroom(self, limit: int) -> int:
+        return limit - self.used - self.reserved
+
+
+@dataclass
+class _UserState:
+    total: _Counter = field(default_factory=_Counter)
+    features: dict[str, _Counter] = field(default_factory=dict)
+    loaded_at: float = 0.0
+
+    def feature(self, name: str) -> _Counter:
+        counter = self.features.get(name)
+        if counter is None:
+            counter = self.features[name] = _Counter()
+        return counter
+
+
+class Reservation:
+    """Tokens held for one call until :meth:`settle` or :meth:`release`."""
+
+    __slots__ = ("_counters", "tokens", "_open")
+
+    def __init__(self, counters: tuple[_Counter, ...], tokens: int) -> None:
+        self._counters = counters
+        self.tokens = tokens
+        self._open = True
+        for counter in counters:
+            counter.reserved += tokens
+
+    def settle(self, actual: int) -> None:
+        """Replace the estimate with *actual* usage (idempotent)."""
+        if not self._open:
+            return
+        self._open = False
+        for counter in self._counters:
+            counter.reserved -= self.tokens
+            counter.used += actual
+
+    def release(self) -> None:
+        """Drop the reservation without charging anything (call never ran)."""
+        if not self._open:
+            return
+        self._open = False
+        for counter in self._counters:
+            counter.reserved -= self.tokens
+
+
+class TokenQuotas:
+    """Daily token quotas keyed by user and (user, feature).
+
+    A limit of 0 disables that quota.  Calls without a user id (background
+    jobs, scripts) are not subject to quotas.
+    """
+
+    def __init__(
+        self,
+        user_daily_limit: int = 0,
+        feature_daily_limits: dict[str, int] | None = None,
+        refresh_interval: float = 60.0,
+        loader: UsageLoader | None = None,
+    ) -> None:
+        self.user_daily_limit = user_daily_limit
+        self.feature_daily_limits = dict(feature_daily_limits or {})
+        self.refresh_interval = refresh_interval
+        self.loader = loader
+        self._users: dict[str, _UserState] = {}
+        self._day_start = self._current_day_start()
+
+    @staticmethod
+    def _current_day_start() -> float:
+        now = time.time()
+        return now - (now % _DAY)
+
+    def _maybe_reset(self) -> None:
+        current_day = self._current_day_start()
+        if current_day > self._day_start:
+            self._users.clear()
+            self._day_start = current_day
+
+    def _state(self, user_id: str) -> _UserState:
+        self._maybe_reset()
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState()
+        return state
+
+    async def admit(self, user_id: str, feature: str | None = None) -> None:
+        """Refresh the user's persisted usage if stale and reject if exhausted.
+
+        Raises:
+            QuotaExceeded: If the user (or feature) quota has no headroom.
+        """
+        user_id = str(user_id)
+        state = self._state(user_id)
+        if (
+            self.loader is not None
+            and time.monotonic() - state.loaded_at >= self.refresh_interval
+        ):
+            await self._refresh(user_id, state)
+        self._ensure_headroom(state, feature, 1)
+
+    async def _refresh(self, user_id: str, state: _UserState) -> None:
+        since = datetime.fromtimestamp(self._day_start, tz=UTC)
+        # Stamp first so concurrent requests for the same user load once.
+        state.loaded_at = time.monotonic()
+        try:
+            persisted = await self.loader(user_id, since)
+        except Exception as e:
+            logger.warning("quota usage load failed user_id=%s: %s", user_id, e)
+            return
+        # Local counts include usage the ledger may not have flushed yet, so
+        # never move backwards; other workers' usage shows up as an increase.
+        state.total.used = max(state.total.used, sum(persisted.values()))
+        for name, tokens in persisted.items():
+            if name is not None:
+                counter = state.feature(name)
+                counter.used = max(counter.used, tokens)
+
+    def _ensure_headroom(
+        self, state: _UserState, feature: str | None, tokens: int
+    ) -> None:
+        if (
+            self.user_daily_limit
+            and state.total.headroom(self.user_daily_limit) < tokens
+        ):
+            raise QuotaExceeded("AI")
+        limit = self.feature_daily_limits.get(feature or "", 0)
+        if limit and state.feature(feature).headroom(limit) < tokens:
+            raise QuotaExceeded(feature)
+
+    @staticmethod
+    def _counters(state: _UserState, feature: str | None) -> tuple[_Counter, ...]:
+        return (state.total, state.feature(feature)) if feature else (state.total,)
+
+    def reserve(
+        self, user_id: str | None, feature: str | None, tokens: int
+    ) -> Reservation:
+        """Hold *tokens* against the user's quotas.
+
+        Raises:
+            QuotaExceeded: If the estimate does not fit in a quota.
+        """
+        if user_id is None:
+            return Reservation((), tokens)
+        state = self._state(str(user_id))
+        self._ensure_headroom(state, feature, tokens)
+        return Reservation(self._counters(state, feature), tokens)
+
+    def charge(self, user_id: str | None, feature: str | None, tokens: int) -> None:
+        """Record usage that was not reserved up front."""
+        if user_id is None:
+            return
+        for counter in self._counters(self._state(str(user_id)), feature):
+            counter.used += tokens
+
+    def usage(self, user_id: str) -> dict[str, int]:
+        """Tokens used and reserved today by *user_id* (for diagnostics)."""
+        state = self._state(str(user_id))
+        return {"used": state.total.used, "reserved": state.total.reserved}
+
+
+async def load_usage_from_ledger(
+    user_id: str, since: datetime
+) -> dict[str | None, int]:
+    """Sum today's ``llm_usage`` rows for *user_id* by feature."""
+    from uuid import UUID
+
+    from sqlalchemy import func, select
+
+    from app.core.database import session_scope
+    from app.inference.models import LLMUsageRecord
+
+    async with session_scope() as session:
+        rows = await session.execute(
+            select(LLMUsageRecord.feature, func.sum(LLMUsageRecord.total_tokens))
+            .where(LLMUsageRecord.user_id == UUID(user_id))
+            .where(LLMUsageRecord.created_at >= since)
+            .group_by(LLMUsageRecord.feature)
+        )
+        return {feature: int(total or 0) for feature, total in rows.all()}
+
+
+# Global singleton — limits and the loader are set from settings in main
+token_quotas = TokenQuotas()
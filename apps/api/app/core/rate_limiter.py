@@ -1,72 +1,383 @@
-"""In-memory per-user rate limiter for AI endpoints."""
+"""Per-user rate limiter for AI endpoints.
 
-import time
+Implements GCRA (the generic cell rate algorithm, equivalent to a token
+bucket): each (user, action) key stores a single float, its *theoretical
+arrival time* (TAT).  A limit of ``max_requests`` per ``window_seconds``
+spaces requests ``window / max`` apart while allowing a burst of up to
+``max_requests``.  A check is O(1) and needs no per-request history.
+
+The TATs live in a pluggable backend:
+
+- :class:`MemoryRateLimitBackend` keeps them in process.  A key whose TAT
+  is in the past is indistinguishable from a new key, so idle keys are
+  swept in LRU order and ``max_keys`` caps memory.
+- :class:`PostgresRateLimitBackend` keeps them in a small unlogged table
+  (:class:`~app.core.models.RateLimitState`) and leases a few requests'
+  worth of allowance per key in one atomic upsert, so limits hold across
+  workers and replicas while most allowed requests stay in process.
+
+:class:`RateLimiter` fronts the backend with a local cache of denials: a
+key that was refused is refused in process until its retry time without
+asking the backend again, so a client hammering a limit costs no
+database round trips.  If the backend fails, decisions fall back to the
+in-process backend rather than failing requests, and a circuit breaker
+keeps them there for a few seconds while the failures continue.
+"""
+
+import asyncio
 import logging
-from collections import defaultdict
-from dataclasses import dataclass, field
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from contextlib import AbstractAsyncContextManager
+from typing import NamedTuple, Protocol
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.inference.resilience import CircuitBreaker, ProviderUnavailable
 
 logger = logging.getLogger(__name__)
 
+# Idle keys removed per check; > 1 so the sweep outpaces new keys.
+_SWEEP_PER_CHECK = 2
+# How often the Postgres backend deletes idle rows.
+_PRUNE_INTERVAL = 300.0
+# Seconds the limiter uses local limits only after the backend keeps failing.
+_BREAKER_RESET = 5.0
 
-@dataclass
-class _Bucket:
-    """Sliding-window token bucket."""
-    timestamps: list[float] = field(default_factory=list)
 
-    def prune(self, window_seconds: float) -> None:
-        cutoff = time.monotonic() - window_seconds
-        self.timestamps = [t for t in self.timestamps if t > cutoff]
+class RateLimitDecision(NamedTuple):
+    allowed: bool
+    # Seconds until the request would be allowed (0 when allowed).
+    retry_after: float
 
-    def count(self) -> int:
-        return len(self.timestamps)
+    @property
+    def retry_after_header(self) -> str:
+        """``Retry-After`` value: whole seconds, rounded up."""
+        return str(max(1, int(-(-self.retry_after // 1))))
 
-    def add(self) -> None:
-        self.timestamps.append(time.monotonic())
 
+class RateLimitBackend(Protocol):
+    async def hit(
+        self, key: str, max_requests: int, window_seconds: float
+    ) -> RateLimitDecision:
+        """Apply one request to *key* and return the decision."""
+        ...
 
-class RateLimiter:
-    """Simple in-memory rate limiter keyed by (user_id, action).
 
-    Not shared across processes — fine for single-instance deployments
-    (Railway / Render / Fly.io with 1 worker).
+class MemoryRateLimitBackend:
+    """In-process GCRA state.
+
+    Not shared across processes — used on its own for single-worker
+    deployments and tests, and as the fallback for the shared backend.
+    """
+
+    def __init__(self, max_keys: int = 1_000_000) -> None:
+        self.max_keys = max_keys
+        # "action:user_id" -> theoretical arrival time (monotonic seconds)
+        self._tat: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    async def hit(
+        self, key: str, max_requests: int, window_seconds: float
+    ) -> RateLimitDecision:
+        return self.hit_now(key, max_requests, window_seconds)
+
+    def hit_now(
+        self, key: str, max_requests: int, window_seconds: float
+    ) -> RateLimitDecision:
+        """Synchronous :meth:`hit`."""
+        now = time.monotonic()
+        interval = window_seconds / max_requests
+        # How far ahead of now the TAT may run: a full window minus one slot.
+        tolerance = window_seconds - interval
+
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        allow_at = tat - tolerance
+        if allow_at > now:
+            return RateLimitDecision(False, allow_at - now)
+
+        self._tat[key] = tat + interval
+        self._tat.move_to_end(key)
+        self._sweep(now)
+        return RateLimitDecision(True, 0.0)
+
+    def _sweep(self, now: float) -> None:
+        """Drop idle keys from the LRU end, and the oldest keys past ``max_keys``."""
+        tats = self._tat
+        for _ in range(_SWEEP_PER_CHECK):
+            if not tats:
+                return
+            key, tat = next(iter(tats.items()))
+            if tat > now:
+                break
+            del tats[key]
+        while len(tats) > self.max_keys:
+            # Forgets an active key: that user briefly gets a fresh burst.
+            tats.popitem(last=False)
+
+
+# GCRA for a lease of up to :cells requests in one statement, on the database
+# clock so replicas agree on "now".  A new key takes all :cells, so the
+# inserted TAT is now + :span and EXCLUDED.tat - :span is now.  An existing
+# key takes as many cells as fit under the tolerance (at least one, given
+# the WHERE), and ``granted`` reports that count back.  The WHERE leaves the
+# row untouched (and returns nothing) when not even one cell fits.
+_NOW = "(EXCLUDED.tat - CAST(:span AS float8))"
+_FIT = (
+    f"LEAST(EXCLUDED.granted, floor(({_NOW} + CAST(:tolerance AS float8) - r.tat)"
+    " / CAST(:interval AS float8))::integer + 1)"
+)
+_LEASE_SQL = text(
+    f"""
+    INSERT INTO rate_limits AS r (key, tat, granted)
+    VALUES (
+        :key,
+        extract(epoch FROM clock_timestamp())::float8 + CAST(:span AS float8),
+        :cells
+    )
+    ON CONFLICT (key) DO UPDATE
+    SET tat = GREATEST(r.tat, {_NOW}) + CAST(:interval AS float8) * {_FIT},
+        granted = {_FIT}
+    WHERE r.tat - CAST(:tolerance AS float8) <= {_NOW}
+    RETURNING r.granted
     """
+)
+_RETRY_AFTER_SQL = text(
+    "SELECT tat - CAST(:tolerance AS float8)"
+    " - extract(epoch FROM clock_timestamp())::float8"
+    " FROM rate_limits WHERE key = :key"
+)
+# Hands unspent cells back: GCRA state is additive, so this undoes them.
+_RELEASE_SQL = text(
+    "UPDATE rate_limits SET tat = tat - CAST(:span AS float8) WHERE key = :key"
+)
+_PRUNE_SQL = text(
+    "DELETE FROM rate_limits WHERE tat < extract(epoch FROM clock_timestamp())::float8"
+)
+
+SessionFactory = Callable[[], AbstractAsyncContextManager[AsyncSession]]
+
+
+class _Lease:
+    """Cells a worker took from the shared table and has not spent yet."""
+
+    __slots__ = ("cells", "expires", "interval")
 
-    def __init__(self) -> None:
-        # key: (user_id, action) -> _Bucket
-        self._buckets: dict[tuple[str, str], _Bucket] = defaultdict(_Bucket)
+    def __init__(self, cells: int, expires: float, interval: float) -> None:
+        self.cells = cells
+        self.expires = expires
+        self.interval = interval
 
-    def is_allowed(
+
+class PostgresRateLimitBackend:
+    """GCRA state shared by all workers through the ``rate_limits`` table.
+
+    Rather than one upsert per request, a worker leases a few cells of a
+    key's allowance at once (a quarter of the burst, at most
+    ``lease_cells``) and spends them locally, so a busy user costs one
+    round trip per lease.  A lease is charged to the shared TAT up front,
+    so the limit still holds across workers; cells left when the lease
+    expires after ``lease_ttl`` seconds are handed back.  A denied request
+    costs a second small read for the retry time.  Rows for idle keys are
+    deleted every few minutes.
+
+    Requires the ``granted`` column on ``rate_limits``::
+
+        ALTER TABLE rate_limits ADD COLUMN granted integer NOT NULL DEFAULT 0;
+    """
+
+    def __init__(
+        self,
+        session_factory: SessionFactory | None = None,
+        lease_cells: int = 5,
+        lease_ttl: float = 10.0,
+    ) -> None:
+        self._session_factory = session_factory
+        self.lease_cells = lease_cells
+        self.lease_ttl = lease_ttl
+        # key -> unspent lease, oldest first
+        self._leases: OrderedDict[str, _Lease] = OrderedDict()
+        self._last_prune = time.monotonic()
+        self._pruning: asyncio.Task | None = None
+        self._releasing: set[asyncio.Task] = set()
+
+    def _session(self) -> AbstractAsyncContextManager[AsyncSession]:
+        if self._session_factory is not None:
+            return self._session_factory()
+        from app.core.database import session_scope
+
+        return session_scope()
+
+    async def hit(
+        self, key: str, max_requests: int, window_seconds: float
+    ) -> RateLimitDecision:
+        now = time.monotonic()
+        self._expire_leases(now)
+        lease = self._leases.get(key)
+        if lease is not None:
+            lease.cells -= 1
+            if not lease.cells:
+                del self._leases[key]
+            return RateLimitDecision(True, 0.0)
+
+        interval = window_seconds / max_requests
+        cells = max(1, min(self.lease_cells, max_requests // 4))
+        params = {
+            "key": key,
+            "cells": cells,
+            "span": cells * interval,
+            "interval": interval,
+            "tolerance": window_seconds - interval,
+        }
+        async with self._session() as session:
+            granted = (await session.execute(_LEASE_SQL, params)).scalar_one_or_none()
+            retry_after = 0.0
+            if granted is None:
+                retry_after = (
+                    await session.execute(_RETRY_AFTER_SQL, params)
+                ).scalar_one_or_none() or 0.0
+            await session.commit()
+        self._maybe_prune()
+        if granted is None:
+            return RateLimitDecision(False, max(0.0, float(retry_after)))
+
+        if granted > 1:
+            # A concurrent miss on the same key may have leased too; pool them.
+            lease = self._leases.pop(key, None)
+            spare = granted - 1 + (lease.cells if lease else 0)
+            expires = time.monotonic() + self.lease_ttl
+            self._leases[key] = _Lease(spare, expires, interval)
+        return RateLimitDecision(True, 0.0)
+
+    async def close(self) -> None:
+        """Hand every unspent lease back, e.g. on shutdown."""
+        self._expire_leases(float("inf"))
+        if self._releasing:
+            await asyncio.gather(*self._releasing)
+
+    def _expire_leases(self, now: float) -> None:
+        """Release leases past their TTL, oldest first."""
+        expired = []
+        while self._leases:
+            key, lease = next(iter(self._leases.items()))
+            if lease.expires > now:
+                break
+            del self._leases[key]
+            expired.append((key, lease.cells * lease.interval))
+        if expired:
+            task = asyncio.get_running_loop().create_task(self._release(expired))
+            self._releasing.add(task)
+            task.add_done_callback(self._releasing.discard)
+
+    async def _release(self, expired: list[tuple[str, float]]) -> None:
+        try:
+            async with self._session() as session:
+                for key, span in expired:
+                    await session.execute(_RELEASE_SQL, {"key": key, "span": span})
+                await session.commit()
+        except Exception as e:
+            # The cells just stay charged until the window rolls past them.
+            logger.warning("rate limit lease release failed: %s", e)
+
+    def _maybe_prune(self) -> None:
+        now = time.monotonic()
+        if now - self._last_prune < _PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        self._pruning = asyncio.get_running_loop().create_task(self._prune())
+
+    async def _prune(self) -> None:
+        try:
+            async with self._session() as session:
+                await session.execute(_PRUNE_SQL)
+                await session.commit()
+        except Exception as e:
+            logger.warning("rate limit prune failed: %s", e)
+
+
+class RateLimiter:
+    """Rate limiter keyed by (user_id, action) over a :class:`RateLimitBackend`."""
+
+    def __init__(
+        self, backend: RateLimitBackend | None = None, max_denied: int = 100_000
+    ) -> None:
+        self.fallback = MemoryRateLimitBackend()
+        self.backend: RateLimitBackend = backend or self.fallback
+        # While the backend keeps failing, skip it for a few seconds instead
+        # of paying a connection timeout on every request.
+        self.breaker = CircuitBreaker(
+            "rate_limits", failure_threshold=3, reset_timeout=_BREAKER_RESET
+        )
+        self.max_denied = max_denied
+        # key -> monotonic time until which the key is known to be limited
+        self._denied: OrderedDict[str, float] = OrderedDict()
+
+    async def check(
         self,
         user_id: str,
         action: str,
         max_requests: int,
         window_seconds: float,
-    ) -> bool:
+    ) -> RateLimitDecision:
         """Check if a request is allowed and record it if so.
 
         Args:
             user_id: The authenticated user's ID.
-            action: Action category (e.g. "chat", "generate_flashcards").
-            max_requests: Max requests allowed in the window.
-            window_seconds: Sliding window size in seconds.
+            action: Action category (e.g. "chat", "generate").
+            max_requests: Max requests allowed in the window (the burst size).
+            window_seconds: Window size in seconds.
 
         Returns:
-            True if the request is allowed, False if rate-limited.
+            The decision, with the wait until the next allowed request.
         """
-        key = (user_id, action)
-        bucket = self._buckets[key]
-        bucket.prune(window_seconds)
+        key = f"{action}:{user_id}"
+        now = time.monotonic()
+        denied_until = self._denied.get(key)
+        if denied_until is not None:
+            if denied_until > now:
+                return RateLimitDecision(False, denied_until - now)
+            del self._denied[key]
+
+        decision = await self._hit(key, max_requests, window_seconds)
 
-        if bucket.count() >= max_requests:
+        if not decision.allowed:
             logger.warning(
-                "rate limit hit user_id=%s action=%s count=%d limit=%d window=%ds",
-                user_id, action, bucket.count(), max_requests, window_seconds,
+                "rate limit hit user_id=%s action=%s limit=%d window=%ds",
+                user_id, action, max_requests, window_seconds,
             )
-            return False
+            self._denied[key] = now + decision.retry_after
+            while len(self._denied) > self.max_denied:
+                self._denied.popitem(last=False)
+        return decision
 
-        bucket.add()
-        return True
+    async def _hit(
+        self, key: str, max_requests: int, window_seconds: float
+    ) -> RateLimitDecision:
+        """Ask the backend, or the local fallback while the backend is failing."""
+        if self.backend is self.fallback:
+            return self.fallback.hit_now(key, max_requests, window_seconds)
+        try:
+            self.breaker.before_call()
+        except ProviderUnavailable:
+            return self.fallback.hit_now(key, max_requests, window_seconds)
+        try:
+            decision = await self.backend.hit(key, max_requests, window_seconds)
+        except Exception as e:
+            self.breaker.record_failure()
+            logger.warning("rate limit backend failed, using local limits: %s", e)
+            return self.fallback.hit_now(key, max_requests, window_seconds)
+        except BaseException:
+            self.breaker.record_abandoned()
+            raise
+        self.breaker.record_success()
+        return decision
 
 
-# Singleton instance
+# Singleton instance; main switches it to the shared backend.
 rate_limiter = RateLimiter()
@@ -0,0 +1,147 @@
+"""Server-Sent Events encoding with adaptive frame coalescing.
+
+Services yield ``(event, data)`` pairs; :func:`encode_sse` turns them into
+wire frames for a ``StreamingResponse``:
+
+- multi-line ``data`` is split into one ``data:`` line per line, so payloads
+  containing newlines survive SSE framing;
+- consecutive ``token`` events are merged into a single frame, flushed after
+  a short time window or once a byte threshold is reached.  The first delta
+  after an idle gap is sent immediately, so time-to-first-token is
+  unaffected;
+- a comment heartbeat is sent when nothing has been written for a while,
+  which keeps proxies from closing quiet streams (e.g. during RAG search).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import re
+from collections.abc import AsyncIterator, Iterable
+
+# Defaults tuned for chat: ~20 ms is below what readers perceive as jitter
+# while cutting frames per answer by an order of magnitude.
+DEFAULT_FLUSH_INTERVAL = 0.02
+DEFAULT_MAX_FRAME_BYTES = 1024
+DEFAULT_HEARTBEAT_INTERVAL = 15.0
+
+HEARTBEAT_FRAME = ": ping\n\n"
+
+_LINE_BREAK_RE = re.compile(r"\r\n|\r|\n")
+
+
+def format_sse(event: str | None, data: str) -> str:
+    """Encode one SSE frame, emitting a ``data:`` line per line of *data*."""
+    head = f"event: {event}\n" if event else ""
+    body = "".join(f"data: {line}\n" for line in _LINE_BREAK_RE.split(data))
+    return f"{head}{body}\n"
+
+
+class _PumpFailed:
+    """Carries an exception from the producer task to the encoder."""
+
+    def __init__(self, exc: BaseException) -> None:
+        self.exc = exc
+
+
+_END = object()
+
+
+async def encode_sse(
+    events: AsyncIterator[tuple[str, str]],
+    *,
+    coalesce: Iterable[str] = ("token",),
+    flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    max_frame_bytes: int = DEFAULT_MAX_FRAME_BYTES,
+    heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+) -> AsyncIterator[str]:
+    """Encode ``(event, data)`` pairs into SSE frames, coalescing deltas.
+
+    The source is consumed in its own task so time-based flushes and
+    heartbeats happen even while the source is waiting on the provider.
+    If the encoder is closed or cancelled (client disconnect), the source
+    task is cancelled too.
+    """
+    coalesced = frozenset(coalesce)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+
+    async def pump() -> None:
+        try:
+            async for item in events:
+                await queue.put(item)
+        except asyncio.CancelledError:
+            # Cancelled while blocked on a full queue: close the source so
+            # its own cleanup (e.g. cancelling the upstream call) runs now.
+            aclose = getattr(events, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            raise
+        except Exception as e:
+            await queue.put(_PumpFailed(e))
+            return
+        await queue.put(_END)
+
+    loop = asyncio.get_running_loop()
+    pump_task = asyncio.create_task(pump())
+
+    pending_event: str | None = None
+    pending: list[str] = []
+    pending_bytes = 0
+    flush_at = 0.0
+    # Start "idle" so the first delta goes out without waiting a window.
+    last_write = loop.time() - flush_interval
+
+    def take_pending() -> str:
+        nonlocal pending_event, pending, pending_bytes
+        frame = format_sse(pending_event, "".join(pending))
+        pending_event, pending, pending_bytes = None, [], 0
+        return frame
+
+    try:
+        while True:
+            now = loop.time()
+            if pending:
+                timeout = max(0.0, flush_at - now)
+            else:
+                timeout = max(0.0, heartbeat_interval - (now - last_write))
+
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except TimeoutError:
+                yield take_pending() if pending else HEARTBEAT_FRAME
+                last_write = loop.time()
+                continue
+
+            if item is _END or isinstance(item, _PumpFailed):
+                if pending:
+                    yield take_pending()
+                if isinstance(item, _PumpFailed):
+                    raise item.exc
+                return
+
+            event, data = item
+            now = loop.time()
+            if event in coalesced:
+                if pending and pending_event != event:
+                    yield take_pending()
+                    last_write = now
+                if not pending and now - last_write >= flush_interval:
+                    # Idle stream: send right away instead of waiting a window.
+                    yield format_sse(event, data)
+                    last_write = loop.time()
+                    continue
+                if not pending:
+                    pending_event = event
+                    flush_at = now + flush_interval
+                pending.append(data)
+                pending_bytes += len(data.encode())
+                if pending_bytes >= max_frame_bytes:
+                    yield take_pending()
+                    last_write = loop.time()
+            else:
+                if pending:
+                    yield take_pending()
+                yield format_sse(event, data)
+                last_write = loop.time()
+    finally:
+        pump_task.cancel()
@@ -1,26 +1,127 @@
-"""Daily global token budget tracker to prevent runaway API costs."""
+"""Daily global token budget tracker to prevent runaway API costs.
 
-import time
+The budget is shared by every worker and replica through one counter row
+per UTC day in Postgres (``token_budget_days``, see
+:class:`~app.core.models.TokenBudgetDay`).  Workers do not touch the row on
+every call: each holds a *lease* of tokens reserved up front with a single
+``UPDATE ... RETURNING`` and spends it locally, topping it up in the
+background when it runs low.  Tokens used past the lease (a call can
+overshoot it) are carried as debt and charged on the next top-up.
+
+The shared counter therefore runs ahead of real usage by at most one
+lease per process, and unused lease is handed back on shutdown.  Without
+a store (tests, local scripts) the budget is process-local.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
 import logging
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
+from datetime import UTC, date, datetime
+from typing import Protocol
+
+from sqlalchemy import text
 
 logger = logging.getLogger(__name__)
 
 # Seconds in a day
 _DAY = 86400
+# Pause between top-ups after the store failed or had nothing left to grant.
+_REFILL_BACKOFF = 1.0
+
+
+class BudgetStore(Protocol):
+    async def reserve(
+        self, day: date, spent: int, want: int, limit: int
+    ) -> tuple[int, int]:
+        """Charge *spent* and reserve up to *want* more tokens under *limit*.
+
+        Returns ``(granted, total_reserved)``.
+        """
+        ...
+
+    async def release(self, day: date, tokens: int) -> None:
+        """Hand *tokens* of unused lease back to the shared counter."""
+        ...
+
+
+# The CTE locks the row and exposes the value before the update, so the
+# caller learns how much was actually granted in one round trip.
+_RESERVE_SQL = text(
+    """
+    WITH current AS (
+        SELECT tokens_reserved FROM token_budget_days WHERE day = :day FOR UPDATE
+    )
+    UPDATE token_budget_days AS t
+    SET tokens_reserved = current.tokens_reserved + :spent
+        + LEAST(:want, GREATEST(:limit - current.tokens_reserved - :spent, 0))
+    FROM current
+    WHERE t.day = :day
+    RETURNING t.tokens_reserved, current.tokens_reserved
+    """
+)
+_ENSURE_DAY_SQL = text(
+    "INSERT INTO token_budget_days (day, tokens_reserved) VALUES (:day, 0) "
+    "ON CONFLICT (day) DO NOTHING"
+)
+_RELEASE_SQL = text(
+    "UPDATE token_budget_days "
+    "SET tokens_reserved = GREATEST(tokens_reserved - :tokens, 0) "
+    "WHERE day = :day"
+)
+
+
+class PostgresBudgetStore:
+    """:class:`BudgetStore` backed by the ``token_budget_days`` table."""
+
+    async def reserve(
+        self, day: date, spent: int, want: int, limit: int
+    ) -> tuple[int, int]:
+        from app.core.database import session_scope
+
+        async with session_scope() as session:
+            await session.execute(_ENSURE_DAY_SQL, {"day": day})
+            row = (
+                await session.execute(
+                    _RESERVE_SQL,
+                    {"day": day, "spent": spent, "want": want, "limit": limit},
+                )
+            ).one()
+            await session.commit()
+        total, before = int(row[0]), int(row[1])
+        return total - before - spent, total
+
+    async def release(self, day: date, tokens: int) -> None:
+        from app.core.database import session_scope
+
+        async with session_scope() as session:
+            await session.execute(_RELEASE_SQL, {"day": day, "tokens": tokens})
+            await session.commit()
 
 
 @dataclass
 class TokenBudget:
     """Tracks total token usage across all users per calendar day.
 
-    Resets automatically when a new day starts (based on UTC).
-    Not persisted across restarts — that's fine for a demo deployment.
+    Resets automatically when a new day starts (based on UTC).  ``check``
+    and ``record`` never wait on the store; lease top-ups run as
+    background tasks.
     """
 
     daily_limit: int
+    store: BudgetStore | None = None
+    # Tokens reserved per top-up, and the level that triggers one.
+    lease_size: int = 5_000
     _tokens_used: int = 0
     _day_start: float = 0.0
+    _lease: int = 0
+    _debt: int = 0
+    _shared_reserved: int = 0
+    _retry_at: float = 0.0
+    _refill: asyncio.Task | None = field(default=None, repr=False)
 
     def __post_init__(self) -> None:
         self._day_start = self._current_day_start()
@@ -31,6 +132,10 @@ class TokenBudget:
         now = time.time()
         return now - (now % _DAY)
 
+    @property
+    def _day(self) -> date:
+        return datetime.fromtimestamp(self._day_start, tz=UTC).date()
+
     def _maybe_reset(self) -> None:
         """Reset counter if a new day has started."""
         current_day = self._current_day_start()
@@ -41,30 +146,103 @@ class TokenBudget:
             )
             self._tokens_used = 0
             self._day_start = current_day
+            # Yesterday's lease and debt belong to yesterday's row.
+            self._lease = 0
+            self._debt = 0
+            self._shared_reserved = 0
 
     def check(self) -> bool:
         """Return True if there is budget remaining."""
         self._maybe_reset()
-        return self._tokens_used < self.daily_limit
+        if self.store is None:
+            return self._tokens_used < self.daily_limit
+        self._maybe_refill()
+        return self._lease > 0 or self._shared_reserved + self._debt < self.daily_limit
 
     def record(self, tokens: int) -> None:
         """Record token usage."""
         self._maybe_reset()
         self._tokens_used += tokens
+        if self.store is not None:
+            from_lease = min(tokens, self._lease)
+            self._lease -= from_lease
+            self._debt += tokens - from_lease
+            self._maybe_refill()
         logger.debug(
             "token budget updated used=%d limit=%d remaining=%d",
             self._tokens_used, self.daily_limit, self.remaining,
         )
 
+    def _maybe_refill(self) -> None:
+        if self._lease >= self.lease_size // 2 and not self._debt:
+            return
+        if self._refill is not None and not self._refill.done():
+            return
+        if time.monotonic() < self._retry_at:
+            return
+        # No running loop: the next call from async code refills.
+        with contextlib.suppress(RuntimeError):
+            self._refill = asyncio.get_running_loop().create_task(self.sync())
+
+    async def sync(self) -> None:
+        """Charge outstanding debt and top the lease up to ``lease_size``."""
+        if self.store is None:
+            return
+        self._maybe_reset()
+        day, spent = self._day, self._debt
+        want = max(0, self.lease_size - self._lease)
+        try:
+            granted, total = await self.store.reserve(
+                day, spent, want, self.daily_limit
+            )
+        except Exception as e:
+            # Keep counting locally; the debt is charged once the store is back.
+            logger.warning("token budget sync failed debt=%d: %s", spent, e)
+            self._retry_at = time.monotonic() + _REFILL_BACKOFF
+            return
+        if day != self._day:
+            return  # the day rolled over while we waited
+        self._debt -= spent
+        self._lease += granted
+        self._shared_reserved = total
+        if not granted:
+            self._retry_at = time.monotonic() + _REFILL_BACKOFF
+        logger.debug(
+            "token budget lease granted=%d lease=%d shared_reserved=%d",
+            granted, self._lease, total,
+        )
+
+    async def release(self) -> None:
+        """Return the unused lease to the shared counter (on shutdown)."""
+        if self.store is None:
+            return
+        if self._debt:
+            await self.sync()
+        lease, self._lease = self._lease, 0
+        if not lease:
+            return
+        try:
+            await self.store.release(self._day, lease)
+        except Exception as e:
+            logger.warning("token budget release failed lease=%d: %s", lease, e)
+
+    @property
+    def lease(self) -> int:
+        """Tokens this process may still spend without asking the store."""
+        return self._lease
+
     @property
     def used(self) -> int:
         self._maybe_reset()
-        return self._tokens_used
+        if self.store is None:
+            return self._tokens_used
+        # Other workers' unspent leases are counted as used.
+        return max(0, self._shared_reserved - self._lease + self._debt)
 
     @property
     def remaining(self) -> int:
         self._maybe_reset()
-        return max(0, self.daily_limit - self._tokens_used)
+        return max(0, self.daily_limit - self.used)
 
 
 # Global singleton — 200K tokens/day default (configurable via settings)
@@ -44,6 +44,8 @@ class Folder(Base, UUIDMixin, TimestampMixin):
         "Document",
         back_populates="folder",
         foreign_keys="[Document.folder_id]",
+        lazy="raise",
+        passive_deletes=True,
     )
 
     def __repr__(self) -> str:
@@ -94,11 +96,13 @@ class Document(Base, UUIDMixin, TimestampMixin):
         "Folder",
         back_populates="documents",
         foreign_keys=[folder_id],
+        lazy="raise",
     )
     shares: Mapped[list["DocumentShare"]] = relationship(
         back_populates="document",
         cascade="all, delete-orphan",
-        lazy="selectin",
+        lazy="raise",
+        passive_deletes=True,
     )
 
     def __repr__(self) -> str:
@@ -124,11 +128,12 @@ class DocumentShare(Base, UUIDMixin, TimestampMixin):
         server_default=text("false"),
     )
 
-    document: Mapped[Document] = relationship(back_populates="shares", lazy="joined")
+    document: Mapped[Document] = relationship(back_populates="shares", lazy="raise")
     recipients: Mapped[list["DocumentShareRecipient"]] = relationship(
         back_populates="share",
         cascade="all, delete-orphan",
-        lazy="selectin",
+        lazy="raise",
+        passive_deletes=True,
     )
 
 
@@ -152,5 +157,5 @@ class DocumentShareRecipient(Base, UUIDMixin):
 
     share: Mapped[DocumentShare] = relationship(
         back_populates="recipients",
-        lazy="joined",
+        lazy="raise",
     )
@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import logging
+from functools import partial
 from typing import Annotated
 from uuid import UUID
 
@@ -20,9 +21,11 @@ from app.documents.schemas import (
     ShareLinkResponse,
 )
 from app.documents.service import DocumentService
-from app.documents.text_extraction import extract_text_from_document
+from app.documents.text_extraction import iter_document_pages
 from app.folders.schemas import AssignFolderRequest
 from app.folders.service import FolderService
+from app.inference.usage import usage_scope
+from app.processing.progress import ProgressReporter
 from app.processing.service import ProcessingService
 
 logger = logging.getLogger(__name__)
@@ -78,20 +81,26 @@ async def upload_document(
     processing_error: str | None = None
 
     if document.file_type in ("text", "csv", "pdf"):
+        progress = ProgressReporter(current_user.user_id, document.id)
         try:
-            text = extract_text_from_document(document)
-            result = await ProcessingService.process_document(
-                db=db,
-                document_id=document.id,
-                title=document.original_filename or "untitled",
-                text=text,
-            )
+            pages = partial(iter_document_pages, document, progress)
+            with usage_scope(
+                user_id=current_user.user_id, feature="document_processing"
+            ):
+                result = await ProcessingService.process_document(
+                    db=db,
+                    document_id=document.id,
+                    title=document.original_filename or "untitled",
+                    text=pages,
+                    progress=progress,
+                )
             processing_status = result.status
             chunks_count = result.chunks_count
             processing_error = result.error
         except ValueError as e:
             processing_status = "error"
             processing_error = str(e)
+            progress("error", error=processing_error)
         except HTTPException as e:
             processing_status = "error"
             processing_error = e.detail or "Embedding failed."
@@ -265,20 +274,26 @@ async def import_shared_document(
     processing_error: str | None = None
 
     if new_doc.file_type in ("text", "csv", "pdf"):
+        progress = ProgressReporter(current_user.user_id, new_doc.id)
         try:
-            text = extract_text_from_document(new_doc)
-            result = await ProcessingService.process_document(
-                db=db,
-                document_id=new_doc.id,
-                title=new_doc.original_filename or "untitled",
-                text=text,
-            )
+            pages = partial(iter_document_pages, new_doc, progress)
+            with usage_scope(
+                user_id=current_user.user_id, feature="document_processing"
+            ):
+                result = await ProcessingService.process_document(
+                    db=db,
+                    document_id=new_doc.id,
+                    title=new_doc.original_filename or "untitled",
+                    text=pages,
+                    progress=progress,
+                )
             processing_status = result.status
             chunks_count = result.chunks_count
             processing_error = result.error
         except ValueError as e:
             processing_status = "error"
             processing_error = str(e)
+            progress("error", error=processing_error)
         except HTTPException as e:
             processing_status = "error"
             processing_error = e.detail or "Embedding failed."
@@ -2,21 +2,33 @@
 
 import csv
 import io
+import math
+from collections.abc import Iterator
 from typing import TYPE_CHECKING
 import pdfplumber
 
 from app.core.supabase import download_file
 from app.documents.models import Document
+from app.processing.pipeline import Page
 
 if TYPE_CHECKING:
-    pass
+    from app.processing.progress import ProgressReporter
 
 
-def extract_text_from_document(document: Document) -> str:
+# CSV rows handed to the pipeline per "page".
+CSV_ROWS_PER_PAGE = 200
+
+
+def extract_text_from_document(
+    document: Document,
+    progress: "ProgressReporter | None" = None,
+) -> str:
     """Extract text from a document (text, CSV, or PDF file).
 
     Args:
         document: Document entity with storage_path, file_type, mime_type.
+        progress: Optional reporter told when the file is downloaded and
+            as pages are extracted.
 
     Returns:
         Extracted text as a string.
@@ -24,59 +36,118 @@ def extract_text_from_document(document: Document) -> str:
     Raises:
         ValueError: If file_type is not supported for text extraction.
     """
+    separator = "\n" if document.file_type == "csv" else "\n\n"
+    return separator.join(
+        page.text for page in iter_document_pages(document, progress)
+    ).strip()
+
+
+def iter_document_pages(
+    document: Document,
+    progress: "ProgressReporter | None" = None,
+    start_page: int = 1,
+) -> Iterator[Page]:
+    """Extract a document's text lazily, one page at a time.
+
+    PDF pages, groups of CSV rows, or the whole of a text file, each with
+    its page number and the page count.  The file is downloaded on the
+    first ``next()``, so the ingestion pipeline can start embedding early
+    pages while later ones are still parsed.  Pages before *start_page*
+    (already checkpointed by an earlier run) are not extracted.
+
+    Raises:
+        ValueError: If file_type is not supported for text extraction
+            (immediately, not on iteration).
+    """
     if document.file_type not in ("text", "csv", "pdf"):
         raise ValueError(
             f"Only text and CSV documents can be processed for RAG; got file_type={document.file_type!r}"
         )
-
     if document.file_type == "pdf":
-        content = download_file(document.storage_path)
-        with pdfplumber.open(io.BytesIO(content)) as pdf:
+        return _iter_pdf_pages(document, progress, start_page)
+    return _iter_text_pages(document, progress, start_page)
 
 
+def _iter_pdf_pages(
+    document: Document,
+    progress: "ProgressReporter | None",
+    start_page: int,
+) -> Iterator[Page]:
+    content = download_file(document.storage_path)
+    if progress:
+        progress("downloaded")
+    with pdfplumber.open(io.BytesIO(content)) as pdf:
+        total_pages = len(pdf.pages)
+        for page_number, page in enumerate(pdf.pages, start=1):
+            if page_number < start_page:
+                continue
             pages: list[str] = []
-            for page in pdf.pages:
-                tables = page.extract_tables()
-
-                if tables:
-                    for table in tables:
-                        headers = table[0]
-                        for i, row in enumerate(table[1:], start = 1):
-                            pairs = [f"{h} = {v}" for h, v in zip(headers, row) if v and v.strip()]
-                            pages.append(f"Row {i}: {','.join(pairs)}")
-                else:
-                    text = page.extract_text()
-                    if text:
-                        pages.append(text.strip())
-
-            return "\n\n".join(pages).strip()
-
+            tables = page.extract_tables()
+
+            if tables:
+                for table in tables:
+                    headers = table[0]
+                    for i, row in enumerate(table[1:], start = 1):
+                        pairs = [
+                            f"{h} = {v}"
+                            for h, v in zip(headers, row, strict=False)
+                            if v and v.strip()
+                        ]
+                        pages.append(f"Row {i}: {','.join(pairs)}")
+            else:
+                text = page.extract_text()
+                if text:
+                    pages.append(text.strip())
+            if progress:
+                progress("extracted", page_number, total_pages)
+            if pages:
+                yield Page("\n\n".join(pages), page_number, total_pages)
+
+
+def _iter_text_pages(
+    document: Document,
+    progress: "ProgressReporter | None",
+    start_page: int,
+) -> Iterator[Page]:
     content = download_file(document.storage_path)
+    if progress:
+        progress("downloaded")
     raw = content.decode("utf-8-sig")
 
     if document.file_type == "text":
-        return raw.strip()
-
-    if document.file_type == "csv":
-        reader = csv.reader(io.StringIO(raw))
-        firstHeader = next(reader)
-        parts: list[str] = []
-
-        if not firstHeader:
-            return ""
-
-        for (row_number, row) in enumerate(reader, start = 1):
-            result = []
-            newReadList = zip(firstHeader, row)
-
-            for header, value in newReadList:
-                newEntry = header + "=" + value
-                if value.strip():
-                    result.append(newEntry)
-            
-            joined_string = ", ".join(result)
-            parts.append(f"Row {row_number}: {joined_string}")
-            
-        return "\n".join(parts)
-
-    return ""
+        text = raw.strip()
+        if text and start_page <= 1:
+            yield Page(text, 1, 1)
+        return
+
+    reader = csv.reader(io.StringIO(raw))
+    firstHeader = next(reader, None)
+    parts: list[str] = []
+
+    if not firstHeader:
+        return
+
+    rows = list(reader)
+    page_count = math.ceil(len(rows) / CSV_ROWS_PER_PAGE)
+    page_number = start_page - 1
+
+    for (row_number, row) in enumerate(rows, start = 1):
+        if row_number <= page_number * CSV_ROWS_PER_PAGE:
+            continue
+        result = []
+        newReadList = zip(firstHeader, row, strict=False)
+
+        for header, value in newReadList:
+            newEntry = header + "=" + value
+            if value.strip():
+                result.append(newEntry)
+
+        joined_string = ", ".join(result)
+        parts.append(f"Row {row_number}: {joined_string}")
+        if len(parts) == CSV_ROWS_PER_PAGE:
+            page_number += 1
+            yield Page("\n".join(parts), page_number, page_count)
+            parts = []
+
+    if parts:
+        yield Page("\n".join(parts), page_number + 1, page_count)
@@ -4,7 +4,7 @@ from __future__ import annotations
 
 from uuid import UUID
 
-from sqlalchemy import ForeignKey, Integer, String, Text
+from sqlalchemy import ForeignKey, Index, Integer, String, Text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -16,6 +16,10 @@ class FlashcardSet(Base, UUIDMixin, TimestampMixin):
     """A named collection of flashcards generated from user documents."""
 
     __tablename__ = "flashcard_sets"
+    # Serves the newest-first keyset pagination of a user's sets.
+    __table_args__ = (
+        Index("ix_flashcard_sets_user_created", "user_id", "created_at", "id"),
+    )
 
     user_id: Mapped[UUID] = mapped_column(
         PG_UUID(as_uuid=True), index=True, nullable=False
@@ -29,13 +33,18 @@ class FlashcardSet(Base, UUIDMixin, TimestampMixin):
     )
     document_ids: Mapped[list] = mapped_column(JSONB, default=list)
     source_chunks: Mapped[list] = mapped_column(JSONB, default=list, nullable=False)
+    # Maintained on insert so listing sets never touches flashcards.
+    card_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0", nullable=False
+    )
 
     cards: Mapped[list[Flashcard]] = relationship(
         "Flashcard",
         back_populates="flashcard_set",
         cascade="all, delete-orphan",
         order_by="Flashcard.position",
-        lazy="selectin",
+        lazy="raise",
+        passive_deletes=True,
     )
 
     def __repr__(self) -> str:
@@ -58,7 +67,7 @@ class Flashcard(Base, UUIDMixin):
     position: Mapped[int] = mapped_column(Integer, default=0)
 
     flashcard_set: Mapped[FlashcardSet] = relationship(
-        "FlashcardSet", back_populates="cards"
+        "FlashcardSet", back_populates="cards", lazy="raise"
     )
 
     def __repr__(self) -> str:
@@ -4,61 +4,119 @@ from __future__ import annotations
 
 from uuid import UUID
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
 from app.core.config import get_settings
+from app.core.deadline import request_deadline
 from app.core.dependencies import CurrentUser, DbSession
+from app.core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.core.quotas import token_quotas
 from app.core.rate_limiter import rate_limiter
+from app.core.sse import encode_sse
 from app.core.token_budget import token_budget
 from app.flashcards.schemas import (
     FlashcardGenerateRequest,
+    FlashcardSetPage,
     FlashcardSetResponse,
-    FlashcardSetSummary,
 )
 from app.flashcards.service import FlashcardService
+from app.inference.usage import usage_scope
 
 router = APIRouter(prefix="/flashcards", tags=["flashcards"])
 
 
-@router.post("/generate", response_model=FlashcardSetResponse)
-async def generate_flashcards(
-    req: FlashcardGenerateRequest,
-    current_user: CurrentUser,
-    db: DbSession,
-) -> FlashcardSetResponse:
-    """Generate a new flashcard set from user documents."""
-    user_id = str(current_user.user_id)
+async def _check_generate_limits(user_id: str) -> None:
+    """Enforce rate limit, token budget and user quota for generation."""
     settings = get_settings()
-    if not rate_limiter.is_allowed(
+    decision = await rate_limiter.check(
         user_id, "generate", settings.rate_limit_generate_max, settings.rate_limit_generate_window
-    ):
+    )
+    if not decision.allowed:
         raise HTTPException(
             status_code=429,
             detail="Generation rate limit exceeded. Please wait before generating more flashcards.",
+            headers={"Retry-After": decision.retry_after_header},
         )
     if not token_budget.check():
         raise HTTPException(
             status_code=503,
             detail="Daily AI usage limit reached. Please try again tomorrow.",
         )
-    return await FlashcardService.generate(
-        db=db,
-        user_id=current_user.user_id,
-        folder_id=req.folder_id,
-        document_ids=req.document_ids,
-        topic=req.topic,
-        title=req.title,
-        num_cards=req.num_cards,
+    await token_quotas.admit(user_id, "flashcards")
+
+
+@router.post(
+    "/generate",
+    response_model=FlashcardSetResponse,
+    dependencies=[Depends(request_deadline)],
+)
+async def generate_flashcards(
+    req: FlashcardGenerateRequest,
+    current_user: CurrentUser,
+    db: DbSession,
+) -> FlashcardSetResponse:
+    """Generate a new flashcard set from user documents."""
+    user_id = str(current_user.user_id)
+    await _check_generate_limits(user_id)
+    with usage_scope(user_id=current_user.user_id, feature="flashcards"):
+        return await FlashcardService.generate(
+            db=db,
+            user_id=current_user.user_id,
+            folder_id=req.folder_id,
+            document_ids=req.document_ids,
+            topic=req.topic,
+            title=req.title,
+            num_cards=req.num_cards,
+        )
+
+
+@router.post("/generate/stream", dependencies=[Depends(request_deadline)])
+async def generate_flashcards_stream(
+    req: FlashcardGenerateRequest,
+    current_user: CurrentUser,
+) -> StreamingResponse:
+    """Generate a new flashcard set, streaming each card via Server-Sent Events.
+
+    Events: ``set``, one ``card`` per card as the model completes it, then
+    ``done`` or ``error``.  Cards are saved as they arrive, and the set is
+    completed even if the client disconnects.
+    """
+    user_id = str(current_user.user_id)
+    await _check_generate_limits(user_id)
+    with usage_scope(user_id=current_user.user_id, feature="flashcards"):
+        events = await FlashcardService.generate_stream(
+            user_id=current_user.user_id,
+            folder_id=req.folder_id,
+            document_ids=req.document_ids,
+            topic=req.topic,
+            title=req.title,
+            num_cards=req.num_cards,
+        )
+    return StreamingResponse(
+        encode_sse(events),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
     )
 
 
-@router.get("/sets", response_model=list[FlashcardSetSummary])
+@router.get("/sets", response_model=FlashcardSetPage)
 async def list_flashcard_sets(
     current_user: CurrentUser,
     db: DbSession,
-) -> list[FlashcardSetSummary]:
-    """List all flashcard sets for the current user."""
-    return await FlashcardService.list_sets(db, current_user.user_id)
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+) -> FlashcardSetPage:
+    """List the current user's flashcard sets, newest first.
+
+    Pass the returned ``next_cursor`` as ``cursor`` to get the next page.
+    """
+    return await FlashcardService.list_sets(
+        db, current_user.user_id, cursor=cursor, limit=limit
+    )
 
 
 @router.get("/sets/{set_id}", response_model=FlashcardSetResponse)
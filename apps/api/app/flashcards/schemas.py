@@ -73,3 +73,11 @@ class FlashcardSetSummary(BaseModel):
     folder_id: UUID | None
     card_count: int
     created_at: datetime
+
+
+class FlashcardSetPage(BaseModel):
+    """One page of flashcard sets, newest first."""
+
+    items: list[FlashcardSetSummary]
+    # Pass as ``cursor`` to get the next page; ``None`` on the last page.
+    next_cursor: str | None = None
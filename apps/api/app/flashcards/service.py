@@ -3,22 +3,35 @@
 from __future__ import annotations
 
 import logging
+from collections.abc import AsyncIterator, Callable
 from uuid import UUID
 
 from fastapi import HTTPException
-from sqlalchemy import delete, func, select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
+from app.core.database import session_scope
+from app.core.pagination import DEFAULT_PAGE_SIZE, keyset_page, split_page
 from app.documents.models import Document
 from app.flashcards.models import Flashcard, FlashcardSet
 from app.flashcards.schemas import (
+    FlashcardSetPage,
     FlashcardSetResponse,
     FlashcardSetSummary,
     SourceChunkSummary,
     SourceDocumentSummary,
 )
 from app.inference.client import get_llm_client
+from app.inference.generation import (
+    ItemWriter,
+    context_top_k,
+    generate_items,
+    relay_generation,
+    stream_items,
+)
 from app.inference.prompts import FLASHCARD_SYSTEM_PROMPT
+from app.processing.schemas import ChunkResponse, RetrieveResult
 from app.processing.service import ProcessingService
 
 logger = logging.getLogger(__name__)
@@ -59,35 +72,50 @@ def _enrich_set_response(
     )
 
 
+def _build_prompt(topic: str | None) -> Callable[[int, str], str]:
+    topic_hint = f"Focus on: {topic}" if topic else ""
+
+    def build_prompt(count: int, context_text: str) -> str:
+        return (
+            f"Generate exactly {count} flashcards "
+            f"from the following study material.\n\n"
+            f"{topic_hint}\n\n"
+            f"Study material:\n{context_text}"
+        )
+
+    return build_prompt
+
+
+def _card_row(position: int, card: dict) -> dict:
+    """Column values for one generated card."""
+    return {
+        "front": card.get("front", ""),
+        "back": card.get("back", ""),
+        "position": position,
+    }
+
+
 class FlashcardService:
     """Service for generating, listing, and managing flashcard sets."""
 
     @staticmethod
-    async def generate(
+    async def _retrieve(
         db: AsyncSession,
         user_id: UUID,
         *,
-        folder_id: UUID | None = None,
-        document_ids: list[UUID] | None = None,
-        topic: str | None = None,
-        title: str | None = None,
-        num_cards: int = 10,
-    ) -> FlashcardSetResponse:
-        """Generate a flashcard set from user documents via RAG + LLM.
-
-        1. Retrieve relevant chunks using the existing RAG pipeline.
-        2. Prompt the LLM for structured flashcard JSON.
-        3. Persist the set and individual cards.
-        """
-        folder_ids = [folder_id] if folder_id else None
-
+        folder_id: UUID | None,
+        document_ids: list[UUID] | None,
+        topic: str | None,
+        num_cards: int,
+    ) -> RetrieveResult:
+        """Retrieve generation context; 400 if no indexed chunks match."""
         retrieve = await ProcessingService.rag_retrieve_multi(
             db=db,
             user_id=user_id,
             question=topic or "key concepts and important information",
-            top_k=6,
+            top_k=context_top_k(num_cards),
             document_ids=document_ids,
-            folder_ids=folder_ids,
+            folder_ids=[folder_id] if folder_id else None,
         )
 
         if not retrieve.context_chunks:
@@ -98,30 +126,19 @@ class FlashcardService:
                     "Upload and process documents first."
                 ),
             )
+        return retrieve
 
-        topic_hint = f"Focus on: {topic}" if topic else ""
-        user_prompt = (
-            f"Generate exactly {num_cards} flashcards "
-            f"from the following study material.\n\n"
-            f"{topic_hint}\n\n"
-            f"Study material:\n{retrieve.context_text}"
-        )
-
-        llm = get_llm_client()
-        raw = await llm.generate_json(
-            system_prompt=FLASHCARD_SYSTEM_PROMPT,
-            user_prompt=user_prompt,
-            temperature=0.3,
-        )
-
-        cards_data = raw.get("flashcards", [])
-        if not cards_data:
-            raise HTTPException(
-                status_code=502,
-                detail="LLM did not return any flashcards.",
-            )
-
-        source_doc_ids = list({str(c.document_id) for c in retrieve.context_chunks})
+    @staticmethod
+    def _new_set(
+        user_id: UUID,
+        *,
+        title: str | None,
+        topic: str | None,
+        folder_id: UUID | None,
+        chunks: list[ChunkResponse],
+    ) -> FlashcardSet:
+        """Build (not persist) a set with source attribution for *chunks*."""
+        source_doc_ids = list({str(c.document_id) for c in chunks})
         set_title = (title or topic or "Flashcard Set").strip() or "Flashcard Set"
 
         source_chunks_payload = [
@@ -130,10 +147,10 @@ class FlashcardService:
                 "chunk_index": c.chunk_index,
                 "content_preview": (c.content or "")[:PREVIEW_MAX_LEN],
             }
-            for c in retrieve.context_chunks
+            for c in chunks
         ]
 
-        flashcard_set = FlashcardSet(
+        return FlashcardSet(
             user_id=user_id,
             title=set_title,
             description=f"Generated from {len(source_doc_ids)} document(s)",
@@ -141,21 +158,65 @@ class FlashcardService:
             document_ids=source_doc_ids,
             source_chunks=source_chunks_payload,
         )
+
+    @staticmethod
+    async def generate(
+        db: AsyncSession,
+        user_id: UUID,
+        *,
+        folder_id: UUID | None = None,
+        document_ids: list[UUID] | None = None,
+        topic: str | None = None,
+        title: str | None = None,
+        num_cards: int = 10,
+    ) -> FlashcardSetResponse:
+        """Generate a flashcard set from user documents via RAG + LLM.
+
+        1. Retrieve relevant chunks using the existing RAG pipeline.
+        2. Prompt the LLM for structured flashcard JSON (map-reduce over
+           groups of chunks for large sets).
+        3. Persist the set and individual cards.
+        """
+        retrieve = await FlashcardService._retrieve(
+            db,
+            user_id,
+            folder_id=folder_id,
+            document_ids=document_ids,
+            topic=topic,
+            num_cards=num_cards,
+        )
+
+        cards_data = await generate_items(
+            get_llm_client(),
+            system_prompt=FLASHCARD_SYSTEM_PROMPT,
+            key="flashcards",
+            chunks=retrieve.context_chunks,
+            num_items=num_cards,
+            build_prompt=_build_prompt(topic),
+            text_of=lambda card: card.get("front", ""),
+        )
+        if not cards_data:
+            raise HTTPException(
+                status_code=502,
+                detail="LLM did not return any flashcards.",
+            )
+
+        flashcard_set = FlashcardService._new_set(
+            user_id,
+            title=title,
+            topic=topic,
+            folder_id=folder_id,
+            chunks=retrieve.context_chunks,
+        )
+        flashcard_set.card_count = len(cards_data)
         db.add(flashcard_set)
         await db.flush()
 
         for idx, card in enumerate(cards_data):
-            db.add(
-                Flashcard(
-                    set_id=flashcard_set.id,
-                    front=card.get("front", ""),
-                    back=card.get("back", ""),
-                    position=idx,
-                )
-            )
+            db.add(Flashcard(set_id=flashcard_set.id, **_card_row(idx, card)))
 
         await db.commit()
-        await db.refresh(flashcard_set)
+        await db.refresh(flashcard_set, ["created_at", "updated_at", "cards"])
 
         logger.info(
             "flashcard set generated user_id=%s set_id=%s cards=%d",
@@ -172,31 +233,114 @@ class FlashcardService:
         return _enrich_set_response(base, source_documents, chunks)
 
     @staticmethod
-    async def list_sets(db: AsyncSession, user_id: UUID) -> list[FlashcardSetSummary]:
-        """Return all flashcard sets for a user (lightweight, no cards)."""
-        stmt = (
-            select(
-                FlashcardSet,
-                func.count(Flashcard.id).label("card_count"),
+    async def generate_stream(
+        user_id: UUID,
+        *,
+        folder_id: UUID | None = None,
+        document_ids: list[UUID] | None = None,
+        topic: str | None = None,
+        title: str | None = None,
+        num_cards: int = 10,
+    ) -> AsyncIterator[tuple[str, str]]:
+        """Start generating a flashcard set and return its SSE events.
+
+        Retrieval and creating the (empty) set happen before this returns,
+        so a request without usable context still fails with a plain 400.
+        Events: ``set`` (id and title), one ``card`` per card as the model
+        completes it, then ``done`` (set id and card count) or ``error``.
+        Cards are inserted in batches while the completion streams, and the
+        generation finishes even if the client disconnects.
+
+        Uses short-lived sessions rather than a request session, which
+        would hold a pooled connection for the whole stream.
+        """
+        async with session_scope() as db:
+            retrieve = await FlashcardService._retrieve(
+                db,
+                user_id,
+                folder_id=folder_id,
+                document_ids=document_ids,
+                topic=topic,
+                num_cards=num_cards,
             )
-            .outerjoin(Flashcard, Flashcard.set_id == FlashcardSet.id)
-            .where(FlashcardSet.user_id == user_id)
-            .group_by(FlashcardSet.id)
-            .order_by(FlashcardSet.created_at.desc())
-        )
-        rows = (await db.execute(stmt)).all()
-
-        return [
-            FlashcardSetSummary(
-                id=fset.id,
-                title=fset.title,
-                description=fset.description,
-                folder_id=fset.folder_id,
-                card_count=count,
-                created_at=fset.created_at,
+            flashcard_set = FlashcardService._new_set(
+                user_id,
+                title=title,
+                topic=topic,
+                folder_id=folder_id,
+                chunks=retrieve.context_chunks,
             )
-            for fset, count in rows
-        ]
+            db.add(flashcard_set)
+            await db.commit()
+        set_id = flashcard_set.id
+
+        cards = stream_items(
+            get_llm_client(),
+            system_prompt=FLASHCARD_SYSTEM_PROMPT,
+            key="flashcards",
+            chunks=retrieve.context_chunks,
+            num_items=num_cards,
+            build_prompt=_build_prompt(topic),
+            text_of=lambda card: card.get("front", ""),
+        )
+
+        async def finish(count: int) -> dict:
+            if not count:
+                async with session_scope() as db:
+                    await db.execute(
+                        delete(FlashcardSet).where(FlashcardSet.id == set_id)
+                    )
+                    await db.commit()
+                raise HTTPException(
+                    status_code=502,
+                    detail="LLM did not return any flashcards.",
+                )
+            logger.info(
+                "flashcard set streamed user_id=%s set_id=%s cards=%d",
+                user_id, set_id, count,
+            )
+            return {"set_id": set_id, "card_count": count}
+
+        return relay_generation(
+            cards,
+            ItemWriter(Flashcard, set_id, _card_row, counter=FlashcardSet.card_count),
+            created={"id": set_id, "title": flashcard_set.title},
+            event="card",
+            finish=finish,
+        )
+
+    @staticmethod
+    async def list_sets(
+        db: AsyncSession,
+        user_id: UUID,
+        *,
+        cursor: str | None = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+    ) -> FlashcardSetPage:
+        """Return one page of a user's flashcard sets, newest first.
+
+        Projects summary columns only (the cards relationship is never
+        loaded) and reads the maintained ``card_count``.
+        """
+        stmt = keyset_page(
+            select(
+                FlashcardSet.id,
+                FlashcardSet.title,
+                FlashcardSet.description,
+                FlashcardSet.folder_id,
+                FlashcardSet.card_count,
+                FlashcardSet.created_at,
+            ).where(FlashcardSet.user_id == user_id),
+            FlashcardSet.created_at,
+            FlashcardSet.id,
+            cursor=cursor,
+            limit=limit,
+        )
+        rows, next_cursor = split_page((await db.execute(stmt)).all(), limit)
+        return FlashcardSetPage(
+            items=[FlashcardSetSummary.model_validate(row) for row in rows],
+            next_cursor=next_cursor,
+        )
 
     @staticmethod
     async def get_set(
@@ -204,10 +348,12 @@ class FlashcardService:
     ) -> FlashcardSetResponse:
         """Get a single flashcard set with all cards and source attribution."""
         fset = await db.scalar(
-            select(FlashcardSet).where(
+            select(FlashcardSet)
+            .where(
                 FlashcardSet.id == set_id,
                 FlashcardSet.user_id == user_id,
             )
+            .options(selectinload(FlashcardSet.cards))
         )
         if fset is None:
             raise HTTPException(status_code=404, detail="Flashcard set not found.")
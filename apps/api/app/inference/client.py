@@ -1,21 +1,34 @@
 """Together AI LLM client for chat inference and structured generation."""
 
+import asyncio
 import json
 import logging
+import time
 from collections.abc import AsyncGenerator
 from typing import Any
 
 from together import AsyncTogether
 
 from app.core.config import get_settings
+from app.core.deadline import timeout_for
 from app.core.token_budget import token_budget
 
-from .prompts import SYSTEM_PROMPT
+from .gateway import Priority, llm_gateway
+from .json_stream import JSONItemParser, parse_prefix
+from .prompts import JSON_CONTINUATION_PROMPT, SYSTEM_PROMPT
+from .resilience import LatencyTracker, hedged
+from .usage import STREAM_USAGE_OPTIONS, StreamUsage, record_response, reserved_tokens
 
 logger = logging.getLogger(__name__)
 
 _JSON_GENERATION_MIN_TOKENS = 4096
 
+# Upper bound for one provider request; shortened to the request deadline.
+LLM_CALL_TIMEOUT = 60.0
+
+# Latency history for hedging JSON generation (idempotent, non-streaming).
+_json_latency = LatencyTracker(default_delay=20.0, min_delay=2.0)
+
 
 class LLMClient:
     """Client for Together AI chat completions API."""
@@ -40,6 +53,7 @@ class LLMClient:
         user_message: str,
         conversation_history: list[dict] | None = None,
         system_prompt: str | None = None,
+        priority: Priority = Priority.INTERACTIVE,
     ) -> AsyncGenerator[str, None]:
         """Stream chat completion tokens.
 
@@ -48,6 +62,7 @@ class LLMClient:
             conversation_history: Previous messages as
                 ``[{"role": ..., "content": ...}]``.
             system_prompt: Optional override for the default system prompt.
+            priority: Gateway queue priority.
 
         Yields:
             Individual text tokens from the model.
@@ -60,29 +75,111 @@ class LLMClient:
         messages.append({"role": "user", "content": user_message})
 
         logger.debug("LLM request started messages_count=%d", len(messages))
-        stream = await self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            max_tokens=self.max_tokens,
-            temperature=self.temperature,
-            stream=True,
+        # Reserve against the user's quota before queueing for a slot.
+        pending = StreamUsage(
+            kind="chat", model=self.model, messages=messages, max_tokens=self.max_tokens
+        )
+        usage: StreamUsage | None = None
+        status = "ok"
+        try:
+            async with llm_gateway.slot(self.model, priority):
+                stream = await pending.open(self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature,
+                    stream=True,
+                    timeout=timeout_for(LLM_CALL_TIMEOUT),
+                    extra_body=STREAM_USAGE_OPTIONS,
+                ))
+                # Only calls that reached the provider are accounted for.
+                usage = pending
+
+                async for chunk in stream:
+                    usage.observe(chunk)
+                    if not chunk.choices or len(chunk.choices) == 0:
+                        continue
+
+                    delta_obj = chunk.choices[0].delta
+                    if (
+                        delta_obj
+                        and hasattr(delta_obj, "content")
+                        and delta_obj.content
+                    ):
+                        yield delta_obj.content
+        except (GeneratorExit, asyncio.CancelledError):
+            status = "interrupted"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            if usage is not None:
+                total = usage.finish(status)
+            else:
+                pending.abandon()
+                total = 0
+        logger.debug(
+            "LLM stream completed tokens=%d budget_remaining=%d",
+            total,
+            token_budget.remaining,
         )
 
-        token_count = 0
-        async for chunk in stream:
-            if not chunk.choices or len(chunk.choices) == 0:
-                continue
+    async def complete(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        *,
+        max_tokens: int | None = None,
+        temperature: float | None = None,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> str:
+        """Non-streaming call that returns the plain text completion.
 
-            delta_obj = chunk.choices[0].delta
-            if delta_obj and hasattr(delta_obj, "content") and delta_obj.content:
-                token_count += 1
-                yield delta_obj.content
+        Args:
+            system_prompt: System-level instruction.
+            user_prompt: User-level content.
+            max_tokens: Override default max_tokens for this call.
+            temperature: Override default temperature for this call.
+            priority: Gateway queue priority.
+
+        Returns:
+            The stripped completion text (empty string if the model returned none).
+        """
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        max_tokens = max_tokens or self.max_tokens
+        with reserved_tokens(messages, max_tokens) as reservation:
+            started = time.monotonic()
+            async with llm_gateway.slot(self.model, priority):
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=(
+                        temperature if temperature is not None else self.temperature
+                    ),
+                    stream=False,
+                    timeout=timeout_for(LLM_CALL_TIMEOUT),
+                )
+            content = response.choices[0].message.content or ""
 
-        # Estimate total tokens (input ~= len(messages)*100 + output tokens)
-        estimated_input = sum(len(m.get("content", "")) // 4 for m in messages)
-        total_estimated = estimated_input + token_count
-        token_budget.record(total_estimated)
-        logger.debug("LLM stream completed tokens=%d budget_remaining=%d", token_count, token_budget.remaining)
+            record_response(
+                kind="completion",
+                model=self.model,
+                usage=getattr(response, "usage", None),
+                started=started,
+                prompt_text=messages,
+                completion_text=content,
+                reservation=reservation,
+            )
+        logger.debug(
+            "LLM completion finished length=%d budget_remaining=%d",
+            len(content), token_budget.remaining,
+        )
+        return content.strip()
 
     async def generate_json(
         self,
@@ -92,123 +189,247 @@ class LLMClient:
         max_tokens: int | None = None,
         temperature: float | None = None,
         max_retries: int = 2,
+        priority: Priority = Priority.BATCH,
     ) -> dict[str, Any]:
         """Non-streaming call that returns parsed JSON.
 
         Uses ``response_format={"type": "json_object"}`` so the model is
         constrained to produce valid JSON.  If the response is truncated
-        (finish_reason == "length"), it retries with more tokens before
-        attempting a best-effort JSON repair.
+        (finish_reason == "length"), the complete elements of its item
+        array are kept and the model is asked to continue after the last
+        one; the continuations are spliced onto the kept items, so no item
+        is generated (and paid for) twice.  Each call is hedged: a
+        duplicate request is started if the first is slower than the
+        recent p95, and whichever finishes first is used.
 
         Args:
             system_prompt: System-level instruction (should mention JSON output).
             user_prompt: User-level content (context, topic, etc.).
-            max_tokens: Override default max_tokens for this call.
+            max_tokens: Token limit for each attempt (default: the client's
+                ``max_tokens``, at least 4096).  It is also what the call
+                reserves against the user's quotas.
             temperature: Override default temperature for this call.
-            max_retries: How many times to retry on truncation.
+            max_retries: How many continuation calls to make on truncation.
+            priority: Gateway queue priority (generation is batch by default).
 
         Returns:
-            Parsed JSON dict from the model response.
+            Parsed JSON dict from the model response.  If the output is
+            still truncated after *max_retries* continuations, the items
+            completed so far.
 
         Raises:
-            ValueError: If the model response is not valid JSON after retries.
+            ValueError: If the model response is not valid JSON and no
+                complete item could be recovered.
         """
-        messages = [
+        base_messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ]
+        messages = base_messages
 
-        tokens = max(max_tokens or self.max_tokens, _JSON_GENERATION_MIN_TOKENS)
+        tokens = max_tokens or max(self.max_tokens, _JSON_GENERATION_MIN_TOKENS)
         temp = temperature if temperature is not None else self.temperature
         last_raw: str | None = None
+        # Items kept from truncated responses, and the key of their array.
+        kept: dict[str, Any] | None = None
+        key: str | None = None
 
         for attempt in range(1, max_retries + 2):
             logger.debug(
                 "LLM JSON generation attempt=%d model=%s max_tokens=%d",
                 attempt, self.model, tokens,
             )
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=tokens,
-                temperature=temp,
-                response_format={"type": "json_object"},
-                stream=False,
+            async def attempt_call(messages: list[dict] = messages) -> Any:
+                with reserved_tokens(messages, tokens) as reservation:
+                    started = time.monotonic()
+                    async with llm_gateway.slot(self.model, priority):
+                        response = await self.client.chat.completions.create(
+                            model=self.model,
+                            messages=messages,
+                            max_tokens=tokens,
+                            temperature=temp,
+                            response_format={"type": "json_object"},
+                            stream=False,
+                            timeout=timeout_for(LLM_CALL_TIMEOUT),
+                        )
+                    # Each completed request is billed, including a hedge that
+                    # finished alongside the winner.
+                    record_response(
+                        kind="json",
+                        model=self.model,
+                        usage=getattr(response, "usage", None),
+                        started=started,
+                        prompt_text=messages,
+                        completion_text=response.choices[0].message.content or "",
+                        reservation=reservation,
+                    )
+                return response
+
+            # Only hedge when the gateway has spare capacity for a duplicate.
+            response = await hedged(
+                attempt_call,
+                tracker=_json_latency,
+                allow_hedge=lambda: llm_gateway.queue_depth == 0,
             )
 
             last_raw = response.choices[0].message.content
             finish_reason = response.choices[0].finish_reason
 
-            # Track token usage from response metadata
-            usage = getattr(response, "usage", None)
-            if usage:
-                total_tokens = getattr(usage, "total_tokens", 0) or 0
-                token_budget.record(total_tokens)
-                logger.debug(
-                    "LLM JSON generation completed length=%d finish_reason=%s tokens=%d budget_remaining=%d",
-                    len(last_raw or ""), finish_reason, total_tokens, token_budget.remaining,
-                )
-            else:
-                # Fallback estimate
-                estimated = len(last_raw or "") // 4 + len(user_prompt) // 4
-                token_budget.record(estimated)
-                logger.debug(
-                    "LLM JSON generation completed length=%d finish_reason=%s estimated_tokens=%d",
-                    len(last_raw or ""), finish_reason, estimated,
-                )
+            logger.debug(
+                "LLM JSON generation completed length=%d finish_reason=%s "
+                "budget_remaining=%d",
+                len(last_raw or ""),
+                finish_reason,
+                token_budget.remaining,
+            )
 
             try:
-                return json.loads(last_raw)
+                parsed = json.loads(last_raw)
             except (json.JSONDecodeError, TypeError):
-                pass
-
-            if finish_reason == "length" and attempt <= max_retries:
-                tokens = int(tokens * 1.5)
-                logger.warning(
-                    "LLM JSON truncated (finish_reason=length), retrying with max_tokens=%d",
-                    tokens,
-                )
-                continue
-
-            repaired = _try_repair_json(last_raw)
-            if repaired is not None:
-                logger.warning("LLM JSON repaired after truncation")
-                return repaired
-
-            break
+                parsed = None
+            if isinstance(parsed, dict):
+                return _splice(kept, parsed, key)
+
+            if finish_reason != "length":
+                break
+
+            prefix, parser = parse_prefix(last_raw or "", key)
+            if prefix is None:
+                break
+            key = parser.key
+            kept = _splice(kept, prefix, key)
+            if attempt > max_retries:
+                break
+
+            logger.warning(
+                "LLM JSON truncated (finish_reason=length), continuing after item=%d",
+                len(kept[key]),
+            )
+            messages = base_messages + [
+                {"role": "assistant", "content": json.dumps(kept)},
+                {"role": "user", "content": JSON_CONTINUATION_PROMPT.format(key=key)},
+            ]
+
+        if kept is not None:
+            logger.warning(
+                "LLM JSON still truncated after %d continuations, keeping items=%d",
+                max_retries, len(kept[key]),
+            )
+            return kept
 
         logger.error("LLM returned invalid JSON: %s", last_raw[:300] if last_raw else None)
         raise ValueError(
-            f"Model did not return valid JSON after {max_retries + 1} attempts. "
-            f"Last response ({len(last_raw or '')} chars) was truncated."
+            f"Model did not return valid JSON ({len(last_raw or '')} chars, "
+            f"no complete item to continue from)."
         )
 
+    async def stream_json(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        *,
+        key: str,
+        max_tokens: int | None = None,
+        temperature: float | None = None,
+        priority: Priority = Priority.BATCH,
+    ) -> AsyncGenerator[dict[str, Any], None]:
+        """Stream a JSON completion, yielding the elements of its *key* array.
+
+        Same request as :meth:`generate_json`, but streamed: each element is
+        yielded as soon as its closing brace arrives (see
+        :class:`~app.inference.json_stream.JSONItemParser`).  Streams are not
+        hedged or retried; a truncated completion ends after its last
+        complete element.
 
-def _try_repair_json(raw: str | None) -> dict[str, Any] | None:
-    """Best-effort repair of truncated JSON from the LLM.
+        Args:
+            system_prompt: System-level instruction (should mention JSON output).
+            user_prompt: User-level content (context, topic, etc.).
+            key: Top-level key of the item array.
+            max_tokens: Token limit (default as for :meth:`generate_json`).
+            temperature: Override default temperature for this call.
+            priority: Gateway queue priority (generation is batch by default).
 
-    Handles the common case where the model output is cut off mid-array:
-    closes any open brackets/braces so the outermost object can be parsed,
-    then trims the last incomplete array element.
-    """
-    if not raw:
-        return None
+        Yields:
+            Parsed array elements, in order.
+        """
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        tokens = max_tokens or max(self.max_tokens, _JSON_GENERATION_MIN_TOKENS)
+        parser = JSONItemParser(key)
+        finish_reason = None
 
-    text = raw.rstrip()
-    open_braces = text.count("{") - text.count("}")
-    open_brackets = text.count("[") - text.count("]")
+        pending = StreamUsage(
+            kind="json", model=self.model, messages=messages, max_tokens=tokens
+        )
+        usage: StreamUsage | None = None
+        status = "ok"
+        try:
+            async with llm_gateway.slot(self.model, priority):
+                stream = await pending.open(
+                    self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        max_tokens=tokens,
+                        temperature=(
+                            temperature
+                            if temperature is not None
+                            else self.temperature
+                        ),
+                        response_format={"type": "json_object"},
+                        stream=True,
+                        timeout=timeout_for(LLM_CALL_TIMEOUT),
+                        extra_body=STREAM_USAGE_OPTIONS,
+                    )
+                )
+                usage = pending
+
+                async for chunk in stream:
+                    usage.observe(chunk)
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    finish_reason = (
+                        getattr(choice, "finish_reason", None) or finish_reason
+                    )
+                    delta = choice.delta
+                    if delta and getattr(delta, "content", None):
+                        for item in parser.feed(delta.content):
+                            yield item
+        except (GeneratorExit, asyncio.CancelledError):
+            status = "interrupted"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            if usage is not None:
+                usage.finish(status)
+            else:
+                pending.abandon()
 
-    last_comma = text.rfind(",")
-    if last_comma > 0:
-        text = text[:last_comma]
+        if not parser.done:
+            logger.warning(
+                "LLM JSON stream ended early finish_reason=%s items=%d",
+                finish_reason, len(parser.items),
+            )
+        logger.debug(
+            "LLM JSON stream completed items=%d budget_remaining=%d",
+            len(parser.items), token_budget.remaining,
+        )
 
-    text += "]" * max(open_brackets, 0)
-    text += "}" * max(open_braces, 0)
 
-    try:
-        return json.loads(text)
-    except (json.JSONDecodeError, TypeError):
-        return None
+def _splice(
+    kept: dict[str, Any] | None, continuation: dict[str, Any], key: str | None
+) -> dict[str, Any]:
+    """Append the *key* items of *continuation* to those *kept* so far."""
+    if kept is None or key is None:
+        return continuation
+    items = continuation.get(key)
+    if not isinstance(items, list):
+        return kept
+    return {**kept, key: kept[key] + items}
 
 
 _llm_client: LLMClient | None = None
@@ -0,0 +1,289 @@
+"""Admission control for every upstream LLM call.
+
+All chat, JSON-generation and RAG-answer calls acquire a slot from
+:data:`llm_gateway` before talking to the provider.  The gateway bounds the
+number of in-flight calls globally and per model, queues the overflow by
+priority (interactive chat ahead of batch generation) and sheds requests
+with a 503 once they have waited longer than the queue deadline or the
+queue is full — a traffic spike degrades into fast rejections instead of
+provider 429s and unbounded tail latency.  A circuit breaker in front of
+the queue fast-fails calls while the provider is degraded.
+
+Not shared across processes: limits apply per worker.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import defaultdict, deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+
+from fastapi import HTTPException
+
+from app.core.config import get_settings
+
+from .resilience import CircuitBreaker, llm_breaker
+
+logger = logging.getLogger(__name__)
+
+# Wait-time samples kept for the percentile metrics.
+_WAIT_SAMPLES = 1024
+
+
+class Priority(IntEnum):
+    """Queue priority; lower values are admitted first."""
+
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class LLMOverloaded(HTTPException):
+    """Raised when an LLM call is shed by the gateway."""
+
+    def __init__(
+        self, detail: str = "AI service is busy. Please try again shortly."
+    ) -> None:
+        super().__init__(status_code=503, detail=detail, headers={"Retry-After": "5"})
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    model: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class LLMGateway:
+    """Global + per-model concurrency limits with a bounded priority queue."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        per_model_concurrency: int = 16,
+        max_queue: int = 200,
+        queue_timeout: float = 10.0,
+        batch_queue_timeout: float = 60.0,
+        breaker: CircuitBreaker | None = None,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.per_model_concurrency = per_model_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.batch_queue_timeout = batch_queue_timeout
+        self.breaker = breaker
+
+        self._in_flight = 0
+        self._model_in_flight: dict[str, int] = defaultdict(int)
+        self._waiters: list[_Waiter] = []
+        self._seq = itertools.count()
+
+        self._admitted = 0
+        self._shed = 0
+        self._waits_ms: deque[float] = deque(maxlen=_WAIT_SAMPLES)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        model: str,
+        priority: Priority = Priority.INTERACTIVE,
+        timeout: float | None = None,
+    ) -> AsyncIterator[None]:
+        """Hold an upstream slot for *model* for the duration of the block.
+
+        For streaming calls, keep the block open until the stream has been
+        fully consumed or closed.
+
+        Raises:
+            ProviderUnavailable: If the circuit breaker is open.
+            LLMOverloaded: If the queue is full or the wait exceeds *timeout*
+                (defaults to the queue deadline for *priority*).
+        """
+        if self.breaker is None:
+            await self._acquire(model, priority, timeout)
+            try:
+                yield
+            finally:
+                self._release(model)
+            return
+
+        async with self.breaker.guard():
+            await self._acquire(model, priority, timeout)
+            try:
+                yield
+            finally:
+                self._release(model)
+
+    def ensure_capacity(self) -> None:
+        """Fail fast with 503 when the queue is already full.
+
+        Used before starting an SSE response, whose status code cannot be
+        changed once streaming has begun.
+        """
+        if len(self._waiters) >= self.max_queue:
+            self._shed += 1
+            raise LLMOverloaded()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def stats(self) -> dict:
+        """Snapshot of gateway occupancy and wait times (exposed on ``/health``)."""
+        waits = sorted(self._waits_ms)
+
+        def pct(q: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))], 1)
+
+        return {
+            "in_flight": self._in_flight,
+            "in_flight_by_model": {m: n for m, n in self._model_in_flight.items() if n},
+            "queue_depth": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "per_model_concurrency": self.per_model_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self._admitted,
+            "shed": self._shed,
+            "wait_ms": {
+                "p50": pct(0.5),
+                "p95": pct(0.95),
+                "max": round(waits[-1], 1) if waits else 0.0,
+            },
+            "breaker": self.breaker.stats() if self.breaker else None,
+        }
+
+    # ------------------------------------------------------------------
+    # Admission
+    # ------------------------------------------------------------------
+
+    def _has_capacity(self, model: str) -> bool:
+        return (
+            self._in_flight < self.max_concurrency
+            and self._model_in_flight[model] < self.per_model_concurrency
+        )
+
+    def _take(self, model: str, started: float) -> None:
+        self._in_flight += 1
+        self._model_in_flight[model] += 1
+        self._admitted += 1
+        self._waits_ms.append((time.monotonic() - started) * 1000)
+
+    def _release(self, model: str) -> None:
+        self._in_flight -= 1
+        self._model_in_flight[model] -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Admit queued waiters in priority order while capacity allows.
+
+        A waiter whose model is at its per-model limit is skipped (not
+        blocking the queue) so other models can still be served.
+        """
+        blocked: list[_Waiter] = []
+        while self._waiters and self._in_flight < self.max_concurrency:
+            waiter = heapq.heappop(self._waiters)
+            if waiter.future.done():
+                continue
+            if self._model_in_flight[waiter.model] >= self.per_model_concurrency:
+                blocked.append(waiter)
+                continue
+            waiter.future.set_result(None)
+            # Count the slot now so later waiters see it as taken.
+            self._in_flight += 1
+            self._model_in_flight[waiter.model] += 1
+        for waiter in blocked:
+            heapq.heappush(self._waiters, waiter)
+
+    def _remove(self, waiter: _Waiter) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            return
+        heapq.heapify(self._waiters)
+
+    async def _acquire(
+        self, model: str, priority: Priority, timeout: float | None
+    ) -> None:
+        started = time.monotonic()
+        if not self._waiters and self._has_capacity(model):
+            self._take(model, started)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self._shed += 1
+            logger.warning(
+                "llm gateway shed (queue full) model=%s priority=%s depth=%d",
+                model, priority.name, len(self._waiters),
+            )
+            raise LLMOverloaded()
+
+        if timeout is None:
+            timeout = (
+                self.queue_timeout
+                if priority == Priority.INTERACTIVE
+                else self.batch_queue_timeout
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(int(priority), next(self._seq), model, future)
+        heapq.heappush(self._waiters, waiter)
+        self._dispatch()
+
+        try:
+            done, _ = await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            if future.done():
+                # Admitted just as the caller was cancelled — hand the slot back.
+                self._release(model)
+            else:
+                future.cancel()
+                self._remove(waiter)
+            raise
+
+        if not done:
+            future.cancel()
+            self._remove(waiter)
+            self._shed += 1
+            logger.warning(
+                "llm gateway shed (deadline) model=%s priority=%s waited=%.1fs "
+                "depth=%d",
+                model,
+                priority.name,
+                timeout,
+                len(self._waiters),
+            )
+            raise LLMOverloaded()
+
+        # _dispatch already counted the slot; record the admission metrics.
+        self._admitted += 1
+        self._waits_ms.append((time.monotonic() - started) * 1000)
+
+
+_settings = get_settings()
+
+# Singleton instance
+llm_gateway = LLMGateway(
+    max_concurrency=_settings.llm_max_concurrency,
+    per_model_concurrency=_settings.llm_model_max_concurrency,
+    max_queue=_settings.llm_max_queue,
+    queue_timeout=_settings.llm_queue_timeout,
+    batch_queue_timeout=_settings.llm_batch_queue_timeout,
+    breaker=llm_breaker,
+)
@@ -0,0 +1,522 @@
+"""Map-reduce generation of study items (flashcards, quiz questions).
+
+One completion asked for a large set is long, and runs into ``max_tokens``
+and sequential continuation calls in :meth:`LLMClient.generate_json`, so
+latency grows with the set size.  For larger sets the retrieved context is partitioned
+into groups and each group gets its own, smaller ``generate_json`` call
+for a share of the items; the calls run concurrently (bounded by the LLM
+gateway) and their results are merged.
+
+Items generated from different groups can overlap, so the merge drops
+duplicates by normalized text and then by embedding similarity.
+
+:func:`stream_items` is the streamed variant: items are yielded as the
+model closes each one, and :func:`relay_generation` runs a stream to
+completion in the background while an :class:`ItemWriter` batch-inserts
+the items, relaying them to the client as SSE events.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import re
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from contextlib import AbstractAsyncContextManager
+from typing import Any
+from uuid import UUID, uuid4
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+
+from app.core.deadline import no_deadline
+from app.core.quotas import QuotaExceeded
+from app.processing.schemas import ChunkResponse
+
+logger = logging.getLogger(__name__)
+
+# Sets up to this size are generated with a single call.
+MAP_REDUCE_MIN_ITEMS = 12
+# Items requested from each map call.
+ITEMS_PER_CALL = 6
+# Extra items requested per call to make up for duplicates dropped in merge.
+OVERGENERATE = 1.25
+# Completion budget per call: the JSON envelope plus this much per item.  Each
+# call reserves its budget against the user's quota, so it follows the count.
+RESPONSE_OVERHEAD_TOKENS = 200
+TOKENS_PER_ITEM = 160
+# Retrieval depth: chunks per map call, and the overall cap.
+CHUNKS_PER_CALL = 3
+MAX_CONTEXT_CHUNKS = 24
+# Cosine similarity above which two items count as the same concept.
+DUPLICATE_SIMILARITY = 0.92
+# Streamed generation writes items in batches of this size, or whatever is
+# pending once the oldest item has waited this long.
+WRITE_BATCH_SIZE = 5
+WRITE_INTERVAL = 0.5
+# A failed batch insert is retried once, after this many seconds.
+WRITE_RETRY_DELAY = 0.5
+
+SessionFactory = Callable[[], AbstractAsyncContextManager[AsyncSession]]
+
+# Streamed generations outlive their request; keep references until done.
+_background_tasks: set[asyncio.Task] = set()
+
+_NON_WORD_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def context_top_k(num_items: int, default: int = 6) -> int:
+    """How many chunks to retrieve for a set of *num_items*."""
+    if num_items <= MAP_REDUCE_MIN_ITEMS:
+        return default
+    groups = math.ceil(num_items / ITEMS_PER_CALL)
+    return max(default, min(MAX_CONTEXT_CHUNKS, groups * CHUNKS_PER_CALL))
+
+
+def max_tokens_for(count: int) -> int:
+    """Completion token limit for a call asked for *count* items."""
+    return RESPONSE_OVERHEAD_TOKENS + count * TOKENS_PER_ITEM
+
+
+def format_context(chunks: Sequence[ChunkResponse]) -> str:
+    """Context block in the same format as ``rag_retrieve_multi``."""
+    return "\n\n---\n\n".join(
+        f"[Doc {c.document_id} | Chunk {c.chunk_index}]\n{c.content}" for c in chunks
+    )
+
+
+def partition(
+    chunks: Sequence[ChunkResponse], groups: int
+) -> list[list[ChunkResponse]]:
+    """Split *chunks* into *groups* round-robin (ranks are spread evenly).
+
+    With fewer chunks than groups, chunks are reused so every group has
+    context; the merge removes the overlapping items this produces.
+    """
+    if len(chunks) >= groups:
+        return [list(chunks[i::groups]) for i in range(groups)]
+    return [[chunks[i % len(chunks)]] for i in range(groups)]
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return _SPACE_RE.sub(" ", _NON_WORD_RE.sub(" ", text.lower())).strip()
+
+
+def _distinct(vectors: list[list[float]], limit: int | None) -> list[int]:
+    """Indices of vectors not too similar to an earlier kept one, up to *limit*."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Normalize once so one matrix product gives every pairwise cosine;
+    # zero vectors stay zero and so match nothing.
+    matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+    sims = matrix @ matrix.T
+
+    kept: list[int] = []
+    for i in range(len(vectors)):
+        if kept and sims[i, kept].max() >= DUPLICATE_SIMILARITY:
+            continue
+        kept.append(i)
+        if limit is not None and len(kept) >= limit:
+            break
+    return kept
+
+
+async def dedupe(
+    items: list[dict[str, Any]],
+    text_of: Callable[[dict[str, Any]], str],
+    *,
+    limit: int | None = None,
+) -> list[dict[str, Any]]:
+    """Drop duplicate items, keeping the first occurrence, up to *limit*.
+
+    Exact duplicates are found by normalized text; near-duplicates by
+    embedding similarity of the same text.  If embedding fails only the
+    exact pass is applied.
+    """
+    seen: set[str] = set()
+    unique: list[dict[str, Any]] = []
+    for item in items:
+        key = normalize(text_of(item))
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(item)
+    if len(unique) < 2:
+        return unique[:limit]
+
+    from app.processing.service import embed
+
+    try:
+        vectors = await embed([text_of(item) for item in unique], prefix="query: ")
+    except Exception as e:
+        logger.warning("generation dedupe embedding failed, exact matches only: %s", e)
+        return unique[:limit]
+
+    return [unique[i] for i in _distinct(vectors, limit)]
+
+
+async def generate_items(
+    llm: Any,
+    *,
+    system_prompt: str,
+    key: str,
+    chunks: Sequence[ChunkResponse],
+    num_items: int,
+    build_prompt: Callable[[int, str], str],
+    text_of: Callable[[dict[str, Any]], str],
+) -> list[dict[str, Any]]:
+    """Generate *num_items* items, map-reducing over *chunks* for large sets.
+
+    Args:
+        llm: The LLM client.
+        system_prompt: Generation system prompt (JSON output).
+        key: Key of the item array in the JSON response.
+        chunks: Retrieved context chunks.
+        num_items: Number of items wanted.
+        build_prompt: ``(count, context_text) -> user_prompt``.
+        text_of: The text used to detect duplicate items.
+
+    Returns:
+        Up to *num_items* deduplicated items (may be fewer if the model
+        returned fewer).
+
+    Raises:
+        QuotaExceeded: If the user's quota stopped calls and the set came
+            out short.
+    """
+    if num_items <= MAP_REDUCE_MIN_ITEMS:
+        raw = await llm.generate_json(
+            system_prompt=system_prompt,
+            user_prompt=build_prompt(num_items, format_context(chunks)),
+            max_tokens=max_tokens_for(num_items),
+            temperature=0.3,
+        )
+        return raw.get(key, [])
+
+    groups = partition(chunks, math.ceil(num_items / ITEMS_PER_CALL))
+    per_call = math.ceil(num_items / len(groups) * OVERGENERATE)
+    logger.info(
+        "map-reduce generation items=%d calls=%d per_call=%d chunks=%d",
+        num_items, len(groups), per_call, len(chunks),
+    )
+    results = await asyncio.gather(
+        *(
+            llm.generate_json(
+                system_prompt=system_prompt,
+                user_prompt=build_prompt(per_call, format_context(group)),
+                max_tokens=max_tokens_for(per_call),
+                temperature=0.3,
+            )
+            for group in groups
+        ),
+        return_exceptions=True,
+    )
+
+    items: list[dict[str, Any]] = []
+    failures: list[BaseException] = []
+    for result in results:
+        if isinstance(result, BaseException):
+            failures.append(result)
+        else:
+            items.extend(result.get(key, []))
+    if failures:
+        logger.warning(
+            "map-reduce generation calls failed=%d of %d", len(failures), len(groups)
+        )
+        if not items:
+            raise failures[0]
+
+    merged = await dedupe(items, text_of, limit=num_items)
+    if len(merged) < num_items:
+        _raise_quota(failures)
+    return merged
+
+
+def _raise_quota(failures: Sequence[BaseException]) -> None:
+    """Re-raise the first quota failure among *failures*, if there is one."""
+    for failure in failures:
+        if isinstance(failure, QuotaExceeded):
+            raise failure
+
+
+class _CallEnded:
+    """Queued by a map call when its stream ends (with the error, if any)."""
+
+    def __init__(self, error: Exception | None = None) -> None:
+        self.error = error
+
+
+async def stream_items(
+    llm: Any,
+    *,
+    system_prompt: str,
+    key: str,
+    chunks: Sequence[ChunkResponse],
+    num_items: int,
+    build_prompt: Callable[[int, str], str],
+    text_of: Callable[[dict[str, Any]], str],
+) -> AsyncIterator[dict[str, Any]]:
+    """Streamed :func:`generate_items`: yield items as the model completes them.
+
+    Large sets stream their map calls concurrently and interleave the
+    items.  An item is sent before later ones exist, so only exact
+    (normalized text) duplicates are dropped.  Calls still running once
+    *num_items* items have been yielded are cancelled.  If the user's quota
+    stopped calls and fewer items were sent, :class:`QuotaExceeded` is
+    raised once the stream ends.
+    """
+    if num_items <= MAP_REDUCE_MIN_ITEMS:
+        calls = [(num_items, list(chunks))]
+    else:
+        groups = partition(chunks, math.ceil(num_items / ITEMS_PER_CALL))
+        per_call = math.ceil(num_items / len(groups) * OVERGENERATE)
+        calls = [(per_call, group) for group in groups]
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run(count: int, group: list[ChunkResponse]) -> None:
+        try:
+            async for item in llm.stream_json(
+                system_prompt=system_prompt,
+                user_prompt=build_prompt(count, format_context(group)),
+                key=key,
+                max_tokens=max_tokens_for(count),
+                temperature=0.3,
+            ):
+                queue.put_nowait(item)
+        except Exception as e:
+            queue.put_nowait(_CallEnded(e))
+        else:
+            queue.put_nowait(_CallEnded())
+
+    tasks = [asyncio.create_task(run(count, group)) for count, group in calls]
+    seen: set[str] = set()
+    sent = 0
+    running = len(tasks)
+    failures: list[Exception] = []
+    try:
+        while running and sent < num_items:
+            message = await queue.get()
+            if isinstance(message, _CallEnded):
+                running -= 1
+                if message.error is not None:
+                    failures.append(message.error)
+                continue
+            if not isinstance(message, dict):
+                continue
+            text_key = normalize(text_of(message))
+            if not text_key or text_key in seen:
+                continue
+            seen.add(text_key)
+            sent += 1
+            yield message
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if failures:
+        logger.warning(
+            "streamed generation calls failed=%d of %d", len(failures), len(tasks)
+        )
+        if not sent:
+            raise failures[0]
+        if sent < num_items:
+            _raise_quota(failures)
+
+
+class ItemWriter:
+    """Inserts generated items for one set in batches from a background task.
+
+    :meth:`add` never waits on the database.  Rows go out in batches of
+    *batch_size*, or whatever is pending once the oldest row has waited
+    *interval* seconds; :meth:`close` writes the rest.  A batch that fails
+    to insert is retried once; if it fails again the writer stops, and
+    :meth:`add` and :meth:`close` raise a 500 instead of dropping rows.
+
+    Args:
+        model: ORM class of the item rows.
+        set_id: Parent set, stored in each row's ``set_id``.
+        row_of: ``(position, item) -> column values`` for one item.
+        counter: The parent's item-count column, incremented in the same
+            transaction as each batch.
+    """
+
+    def __init__(
+        self,
+        model: type,
+        set_id: UUID,
+        row_of: Callable[[int, dict[str, Any]], dict[str, Any]],
+        *,
+        counter: InstrumentedAttribute | None = None,
+        batch_size: int = WRITE_BATCH_SIZE,
+        interval: float = WRITE_INTERVAL,
+        session_factory: SessionFactory | None = None,
+    ) -> None:
+        self.model = model
+        self.set_id = set_id
+        self.row_of = row_of
+        self.counter = counter
+        self.batch_size = batch_size
+        self.interval = interval
+        self._session_factory = session_factory
+        self.added = 0
+        self.written = 0
+        self._pending: list[dict[str, Any]] = []
+        self._first_at = 0.0
+        self._wake = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.create_task(self._run())
+
+    def _session(self) -> AbstractAsyncContextManager[AsyncSession]:
+        if self._session_factory is not None:
+            return self._session_factory()
+        from app.core.database import session_scope
+
+        return session_scope()
+
+    def add(self, item: dict[str, Any]) -> dict[str, Any]:
+        """Queue *item* at the next position; returns its row values.
+
+        Raises:
+            HTTPException: If an earlier batch could not be saved.
+        """
+        if self._task.done():
+            self._task.result()
+        row = {"id": uuid4(), **self.row_of(self.added, item)}
+        self.added += 1
+        self._pending.append({**row, "set_id": self.set_id})
+        if len(self._pending) == 1:
+            self._first_at = asyncio.get_running_loop().time()
+            self._wake.set()
+        elif len(self._pending) >= self.batch_size:
+            self._wake.set()
+        return row
+
+    async def close(self) -> int:
+        """Write everything still pending; returns the number of rows written.
+
+        Raises:
+            HTTPException: If a batch could not be saved.
+        """
+        self._closed = True
+        self._wake.set()
+        await self._task
+        return self.written
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                if self._closed:
+                    return
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            wait = self._first_at + self.interval - loop.time()
+            if len(self._pending) < self.batch_size and not self._closed and wait > 0:
+                self._wake.clear()
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                continue
+            batch = self._pending[: self.batch_size]
+            del self._pending[: self.batch_size]
+            self._first_at = loop.time()
+            await self._write(batch)
+
+    async def _write(self, batch: list[dict[str, Any]]) -> None:
+        try:
+            await self._insert(batch)
+        except Exception as e:
+            logger.warning(
+                "generated item insert failed, retrying set_id=%s rows=%d: %s",
+                self.set_id, len(batch), e,
+            )
+            await asyncio.sleep(WRITE_RETRY_DELAY)
+            try:
+                await self._insert(batch)
+            except Exception as e:
+                logger.error(
+                    "generated item insert failed set_id=%s rows=%d: %s",
+                    self.set_id, len(batch), e,
+                )
+                raise HTTPException(
+                    status_code=500,
+                    detail="Generated items could not be saved. Please try again.",
+                ) from e
+        self.written += len(batch)
+
+    async def _insert(self, batch: list[dict[str, Any]]) -> None:
+        async with self._session() as session:
+            await session.execute(insert(self.model), batch)
+            if self.counter is not None:
+                parent = self.counter.class_
+                await session.execute(
+                    update(parent)
+                    .where(parent.id == self.set_id)
+                    .values({self.counter.key: self.counter + len(batch)})
+                )
+            await session.commit()
+
+
+def relay_generation(
+    items: AsyncIterator[dict[str, Any]],
+    writer: ItemWriter,
+    *,
+    created: dict[str, Any],
+    event: str,
+    finish: Callable[[int], Awaitable[dict[str, Any]]],
+) -> AsyncIterator[tuple[str, str]]:
+    """Run a streamed generation in the background and relay it as SSE events.
+
+    The first event is ``set``, carrying *created* (the new set).  Each
+    item is handed to *writer* and sent as an *event* event carrying its row
+    values.  Once the stream ends and the writer has drained,
+    ``finish(count)`` builds the ``done`` payload; an ``HTTPException`` from
+    the stream, the writer or *finish* becomes an ``error`` event.
+
+    The generation runs in its own task, started here: a client that
+    disconnects stops receiving events, but the set is still completed and
+    saved.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    queue.put_nowait(("set", json.dumps(created, default=str)))
+
+    async def run() -> None:
+        try:
+            try:
+                async for item in items:
+                    row = writer.add(item)
+                    queue.put_nowait((event, json.dumps(row, default=str)))
+            finally:
+                await writer.close()
+            payload = await finish(writer.written)
+        except HTTPException as e:
+            queue.put_nowait(("error", json.dumps({"detail": e.detail})))
+        except Exception as e:
+            logger.exception("streamed generation failed: %s", e)
+            detail = "Generation failed. Please try again."
+            queue.put_nowait(("error", json.dumps({"detail": detail})))
+        else:
+            queue.put_nowait(("done", json.dumps(payload, default=str)))
+
+    # Outlives the request, so it runs on the per-call caps, not its deadline.
+    with no_deadline():
+        task = asyncio.create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+    async def events() -> AsyncIterator[tuple[str, str]]:
+        while True:
+            name, data = await queue.get()
+            yield name, data
+            if name in ("done", "error"):
+                return
+
+    return events()
@@ -0,0 +1,142 @@
+"""Incremental parsing of streamed JSON completions.
+
+Generation prompts ask for ``{"<key>": [{...}, {...}, ...]}``.
+:class:`JSONItemParser` is fed the completion text as it streams and
+returns each element of the item array as soon as its closing brace
+arrives, so a caller can use the first item long before the completion
+ends.
+
+The parser only tracks nesting and string state; the text of a complete
+element is handed to :func:`json.loads`.  A completion cut off mid-way
+still leaves every element that closed before the cut in :attr:`items`,
+and :func:`parse_prefix` turns such a completion into a valid object
+ending after its last complete element.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class JSONItemParser:
+    """Yields the elements of one array in a streamed JSON object.
+
+    Args:
+        key: Top-level key of the item array; ``None`` accepts the first
+            array-valued key.
+    """
+
+    def __init__(self, key: str | None = None) -> None:
+        self.key = key
+        self.items: list[Any] = []
+        # True once the top-level value has closed.
+        self.done = False
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        # Text of the string being read at depth 1 (a candidate key).
+        self._string: list[str] | None = None
+        self._last_key: str | None = None
+        self._array_key: str | None = None
+        # Text of the item being read, from its opening brace.
+        self._item: list[str] | None = None
+        # Characters consumed, and the offset just past the last complete item.
+        self._pos = 0
+        self.item_end = 0
+
+    def feed(self, text: str) -> list[Any]:
+        """Consume more completion text; return the items it completed."""
+        completed: list[Any] = []
+        for ch in text:
+            if self.done:
+                break
+            self._pos += 1
+            if self._item is not None:
+                self._item.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._string is not None:
+                        self._last_key = _decode_string(self._string)
+                        self._string = None
+                    continue
+                if self._string is not None:
+                    self._string.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._stack == ["{"]:
+                    self._string = []
+            elif ch in "{[":
+                if ch == "[" and self._stack == ["{"]:
+                    self._array_key = self._last_key
+                    if self.key is None:
+                        self.key = self._array_key
+                elif (
+                    ch == "{"
+                    and self._stack == ["{", "["]
+                    and self._array_key == self.key
+                ):
+                    self._item = ["{"]
+                self._stack.append(ch)
+            elif ch in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if self._item is not None and self._stack == ["{", "["]:
+                    item = self._close_item()
+                    if item is not None:
+                        self.items.append(item)
+                        self.item_end = self._pos
+                        completed.append(item)
+                elif not self._stack:
+                    self.done = True
+        return completed
+
+    def _close_item(self) -> Any | None:
+        raw = "".join(self._item)
+        self._item = None
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            logger.warning("skipping unparseable streamed JSON item len=%d", len(raw))
+            return None
+
+
+def parse_prefix(
+    raw: str, key: str | None = None
+) -> tuple[dict[str, Any] | None, JSONItemParser]:
+    """Parse the valid prefix of a truncated JSON object.
+
+    Returns the object cut after the last complete element of its item
+    array and closed (``None`` if no element completed), together with the
+    parser, whose :attr:`~JSONItemParser.key` names the array.
+    """
+    parser = JSONItemParser(key)
+    parser.feed(raw)
+    if not parser.items:
+        return None, parser
+    try:
+        prefix = json.loads(raw[: parser.item_end] + "]}")
+    except json.JSONDecodeError:
+        # The item was valid; something before it was not.
+        return None, parser
+    return prefix, parser
+
+
+def _decode_string(chars: list[str]) -> str:
+    raw = "".join(chars)
+    try:
+        return json.loads(f'"{raw}"')
+    except json.JSONDecodeError:
+        return raw
@@ -0,0 +1,40 @@
+"""SQLAlchemy models for LLM usage accounting."""
+
+from __future__ import annotations
+
+from datetime import datetime
+from uuid import UUID
+
+from sqlalchemy import DateTime, Integer, String, func
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.core.models import Base, UUIDMixin
+
+
+class LLMUsageRecord(Base, UUIDMixin):
+    """One upstream LLM or embedding call (the usage ledger).
+
+    ``usage_source`` is ``"provider"`` when the token counts come from the
+    provider's ``usage`` payload and ``"estimate"`` when they were counted
+    locally (e.g. a stream closed before its final usage chunk).
+    """
+
+    __tablename__ = "llm_usage"
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), index=True
+    )
+    user_id: Mapped[UUID | None] = mapped_column(
+        PG_UUID(as_uuid=True), index=True, nullable=True
+    )
+    feature: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    kind: Mapped[str] = mapped_column(String(32))
+    model: Mapped[str] = mapped_column(String(255))
+    prompt_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    completion_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    total_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    usage_source: Mapped[str] = mapped_column(String(16), default="provider")
+    latency_ms: Mapped[int] = mapped_column(Integer, default=0)
+    ttft_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    status: Mapped[str] = mapped_column(String(16), default="ok")
@@ -60,3 +60,25 @@ QUIZ_SYSTEM_PROMPT = (
     '- "explanation": why the correct answer is right\n'
     "No other text."
 )
+
+HISTORY_SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a student "
+    "and StudyBudd, an AI study assistant.\n\n"
+    "Rules:\n"
+    "- Merge the existing summary with the new messages into one updated "
+    "summary.\n"
+    "- Keep topics discussed, questions asked, key facts and explanations "
+    "given, and any preferences or goals the student mentioned.\n"
+    "- Drop greetings, filler, and repeated content.\n"
+    "- Write in the third person, at most 200 words.\n"
+    "Respond with the summary text only."
+)
+
+# Follow-up turn after a JSON generation was cut off; the assistant turn
+# before it holds the items kept so far.  Formatted with the array key.
+JSON_CONTINUATION_PROMPT = (
+    "Your previous response was cut off; the complete items from it are "
+    "above. Continue the list from where it stopped: respond with a JSON "
+    'object {{"{key}": [...]}} containing only the remaining items. '
+    "Do not repeat any item above. No other text."
+)
@@ -0,0 +1,221 @@
+"""Tail-latency and failure handling for provider calls.
+
+- :func:`hedged` runs an idempotent call and, if it has not finished after
+  roughly the observed p95 latency, starts a duplicate; the first success
+  wins and the other is cancelled.
+- :class:`CircuitBreaker` fast-fails calls with a 503 after repeated
+  provider failures, then lets a single trial call through after a cool-off.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+
+import httpx
+from fastapi import HTTPException
+from together import APIConnectionError, APIStatusError
+
+from app.core.deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+
+# =============================================================================
+# Hedged requests
+# =============================================================================
+
+
+class LatencyTracker:
+    """Rolling window of call latencies used to pick the hedge delay."""
+
+    def __init__(
+        self,
+        default_delay: float,
+        *,
+        min_delay: float = 0.05,
+        window: int = 256,
+        min_samples: int = 20,
+    ) -> None:
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self) -> float:
+        """p95 latency once enough samples exist, else the configured default."""
+        p95 = self.percentile(0.95)
+        return max(self.min_delay, p95 if p95 is not None else self.default_delay)
+
+
+async def hedged[T](
+    call: Callable[[], Awaitable[T]],
+    *,
+    tracker: LatencyTracker,
+    allow_hedge: Callable[[], bool] | None = None,
+) -> T:
+    """Await ``call()``, hedging with a second ``call()`` if the first is slow.
+
+    Only use for idempotent calls.  A fast failure is not hedged — it is
+    raised as-is.  If every attempt fails, the first error is raised.
+
+    Args:
+        call: Factory for the awaitable; invoked once per attempt.
+        tracker: Latency history; the winner's latency is recorded here.
+        allow_hedge: Optional check evaluated at hedge time (e.g. skip the
+            duplicate when the gateway has no spare capacity).
+    """
+    started: dict[asyncio.Task, float] = {}
+
+    def launch() -> asyncio.Task:
+        task = asyncio.ensure_future(call())
+        started[task] = time.monotonic()
+        return task
+
+    pending = {launch()}
+    errors: list[BaseException] = []
+    try:
+        done, pending = await asyncio.wait(pending, timeout=tracker.hedge_delay())
+        if not done and (allow_hedge is None or allow_hedge()):
+            logger.debug("hedging slow call after %.2fs", tracker.hedge_delay())
+            pending.add(launch())
+
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    tracker.observe(time.monotonic() - started[task])
+                    return task.result()
+                errors.append(task.exception())
+            if not pending:
+                raise errors[0]
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+# =============================================================================
+# Circuit breaker
+# =============================================================================
+
+
+class ProviderUnavailable(HTTPException):
+    """Raised while a circuit breaker is open."""
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(
+            status_code=503,
+            detail=(
+                "The AI provider is temporarily unavailable. "
+                "Please try again shortly."
+            ),
+            headers={"Retry-After": str(max(1, int(retry_after)))},
+        )
+        self.name = name
+
+
+def is_provider_failure(exc: BaseException) -> bool:
+    """Whether *exc* indicates a degraded provider (not a caller error)."""
+    if isinstance(exc, (DeadlineExceeded, ProviderUnavailable)):
+        return False
+    if isinstance(exc, (TimeoutError, httpx.TransportError, APIConnectionError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code >= 500 or exc.status_code == 429
+    if isinstance(exc, HTTPException):
+        # Our own wrappers turn provider 5xx responses into 502s.
+        return exc.status_code == 502
+    return False
+
+
+class CircuitBreaker:
+    """Closed → open after consecutive failures → half-open trial → closed."""
+
+    def __init__(
+        self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0
+    ) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        """Raise :class:`ProviderUnavailable` unless a call may go through."""
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return
+        retry_after = self.reset_timeout - (time.monotonic() - (self._opened_at or 0.0))
+        raise ProviderUnavailable(self.name, retry_after)
+
+    def record_success(self) -> None:
+        if self._opened_at is not None:
+            logger.info("circuit breaker closed name=%s", self.name)
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._trial_in_flight or self._failures >= self.failure_threshold:
+            if self._opened_at is None or self._trial_in_flight:
+                logger.warning(
+                    "circuit breaker opened name=%s failures=%d",
+                    self.name,
+                    self._failures,
+                )
+            self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def record_abandoned(self) -> None:
+        """The call ended without a verdict (e.g. cancelled); free the trial."""
+        self._trial_in_flight = False
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """Check the breaker, then record the block's outcome."""
+        self.before_call()
+        try:
+            yield
+        except BaseException as exc:
+            if is_provider_failure(exc):
+                self.record_failure()
+            else:
+                self.record_abandoned()
+            raise
+        self.record_success()
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self._failures}
+
+
+# One breaker per upstream endpoint.
+llm_breaker = CircuitBreaker("together.chat")
+embedding_breaker = CircuitBreaker("together.embeddings")
@@ -0,0 +1,458 @@
+"""Token accounting for LLM and embedding calls.
+
+Every upstream call reports its usage through :func:`record_call`, which
+charges the daily token budget, settles the call's quota reservation (see
+:mod:`app.core.quotas`) and appends a row to the usage ledger
+(``llm_usage``: model, prompt/completion tokens, latency, time to first
+token, user and feature).
+
+Token counts come from the provider's ``usage`` payload whenever there is
+one — streaming calls ask for it in the final chunk.  When it is missing
+(older models, a stream closed early) the counts are estimated with a
+local tokenizer: ``tiktoken``'s ``cl100k_base`` if it can be loaded, else
+a word/punctuation heuristic.  tiktoken downloads the encoding's BPE file
+on first use and caches it (``TIKTOKEN_CACHE_DIR``), so loading it needs
+network access or a pre-populated cache.
+
+Ledger rows are buffered in memory and written in batches in the
+background so accounting never adds a DB round trip to a request.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import re
+import time
+from collections import deque
+from collections.abc import Awaitable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, TypeVar
+from uuid import UUID
+
+from sqlalchemy import insert
+
+from app.core.quotas import Reservation, token_quotas
+from app.core.token_budget import token_budget
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Ask streaming completions to append a final chunk with token usage.
+STREAM_USAGE_OPTIONS = {"stream_options": {"include_usage": True}}
+
+# Ledger batching: flush once this many rows are pending, or when the
+# oldest pending row is this many seconds old.
+LEDGER_BATCH_SIZE = 100
+LEDGER_FLUSH_INTERVAL = 5.0
+# Rows kept in memory if the database is unreachable (oldest dropped).
+LEDGER_MAX_PENDING = 10_000
+
+# Role/formatting overhead per chat message.
+_MESSAGE_OVERHEAD_TOKENS = 4
+_HEURISTIC_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+# Characters per token assumed for quota reservations.  Deliberately low
+# (over-reserves) and cheap: the reservation is settled to real usage.
+_RESERVE_CHARS_PER_TOKEN = 3
+
+
+# =============================================================================
+# Token estimation
+# =============================================================================
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Any | None:
+    """Load the tiktoken encoding once; ``None`` if offline or not installed."""
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.info("tiktoken unavailable, using heuristic token counts: %s", e)
+        return None
+
+
+def warm_tokenizer() -> None:
+    """Load the tokenizer ahead of the first call.
+
+    Reads the BPE ranks from tiktoken's cache, fetching them over the network
+    when the cache is empty.  Offline without a cached file, counts fall back
+    to the heuristic.
+    """
+    _encoding()
+
+
+def count_tokens(text: str) -> int:
+    """Estimate the token count of *text*."""
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    # BPE vocabularies split long words; ~1 token per 4 chars of a word.
+    return sum(max(1, len(t) // 4) for t in _HEURISTIC_TOKEN_RE.findall(text))
+
+
+def count_message_tokens(messages: list[dict]) -> int:
+    """Estimate prompt tokens for a chat ``messages`` array."""
+    total = 0
+    for m in messages:
+        total += _MESSAGE_OVERHEAD_TOKENS + count_tokens(m.get("content") or "")
+        for tc in m.get("tool_calls") or []:
+            total += count_tokens(tc.get("function", {}).get("arguments") or "")
+    return total
+
+
+def usage_counts(usage: Any) -> tuple[int, int] | None:
+    """``(prompt_tokens, completion_tokens)`` from an SDK object or JSON dict."""
+    if not usage:
+        return None
+    get = usage.get if isinstance(usage, dict) else lambda k: getattr(usage, k, None)
+    prompt = get("prompt_tokens")
+    completion = get("completion_tokens")
+    total = get("total_tokens")
+    if prompt is None and completion is None and total is None:
+        return None
+    prompt = prompt or 0
+    completion = completion if completion is not None else max(0, (total or 0) - prompt)
+    return int(prompt), int(completion)
+
+
+# =============================================================================
+# Call attribution
+# =============================================================================
+
+
+@dataclass(frozen=True)
+class UsageContext:
+    user_id: UUID | str | None = None
+    feature: str | None = None
+
+
+_context: ContextVar[UsageContext | None] = ContextVar(
+    "llm_usage_context", default=None
+)
+
+
+def _current() -> UsageContext:
+    return _context.get() or UsageContext()
+
+
+@contextmanager
+def usage_scope(
+    user_id: UUID | str | None = None, feature: str | None = None
+) -> Iterator[None]:
+    """Attribute LLM calls made inside the block to *user_id* / *feature*."""
+    outer = _current()
+    token = _context.set(
+        UsageContext(user_id=user_id or outer.user_id, feature=feature or outer.feature)
+    )
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def reserve_tokens(
+    messages: list[dict],
+    max_tokens: int,
+    *,
+    user_id: UUID | str | None = None,
+    feature: str | None = None,
+) -> Reservation:
+    """Reserve the worst-case cost of a call against the caller's quotas.
+
+    *user_id* / *feature* default to the enclosing :func:`usage_scope`.
+
+    Raises:
+        QuotaExceeded: If the estimate does not fit in the user's quota.
+    """
+    ctx = _current()
+    chars = sum(len(m.get("content") or "") for m in messages)
+    estimate = (
+        chars // _RESERVE_CHARS_PER_TOKEN
+        + len(messages) * _MESSAGE_OVERHEAD_TOKENS
+        + max_tokens
+    )
+    return token_quotas.reserve(
+        user_id or ctx.user_id, feature or ctx.feature, estimate
+    )
+
+
+@contextmanager
+def reserved_tokens(messages: list[dict], max_tokens: int) -> Iterator[Reservation]:
+    """:func:`reserve_tokens` for the block; whatever was not settled is released."""
+    reservation = reserve_tokens(messages, max_tokens)
+    try:
+        yield reservation
+    finally:
+        reservation.release()
+
+
+# =============================================================================
+# Ledger
+# =============================================================================
+
+
+def _as_uuid(value: UUID | str | None) -> UUID | None:
+    if value is None or isinstance(value, UUID):
+        return value
+    try:
+        return UUID(str(value))
+    except ValueError:
+        return None
+
+
+class UsageLedger:
+    """Buffers usage rows and writes them to ``llm_usage`` in batches."""
+
+    def __init__(self) -> None:
+        self._pending: deque[dict] = deque(maxlen=LEDGER_MAX_PENDING)
+        self._oldest_pending: float | None = None
+        self._flushing: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add(self, row: dict) -> None:
+        if len(self._pending) == self._pending.maxlen:
+            logger.warning("usage ledger full, dropping oldest row")
+        self._pending.append(row)
+        now = time.monotonic()
+        if self._oldest_pending is None:
+            self._oldest_pending = now
+        if (
+            len(self._pending) >= LEDGER_BATCH_SIZE
+            or now - self._oldest_pending >= LEDGER_FLUSH_INTERVAL
+        ):
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flushing is not None and not self._flushing.done():
+            return
+        # No running loop (sync caller): the next async call flushes.
+        with contextlib.suppress(RuntimeError):
+            self._flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self) -> None:
+        """Write all pending rows.  Rows are re-queued if the insert fails."""
+        from app.core.database import session_scope
+
+        from .models import LLMUsageRecord
+
+        while self._pending:
+            batch = [
+                self._pending.popleft()
+                for _ in range(min(LEDGER_BATCH_SIZE, len(self._pending)))
+            ]
+            try:
+                async with session_scope() as session:
+                    await session.execute(insert(LLMUsageRecord), batch)
+                    await session.commit()
+            except Exception as e:
+                logger.warning("usage ledger flush failed rows=%d: %s", len(batch), e)
+                self._pending.extendleft(reversed(batch))
+                break
+        self._oldest_pending = time.monotonic() if self._pending else None
+
+
+usage_ledger = UsageLedger()
+
+
+def record_call(
+    *,
+    kind: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    usage_source: str,
+    latency_ms: float,
+    ttft_ms: float | None = None,
+    status: str = "ok",
+    charge_budget: bool = True,
+    user_id: UUID | str | None = None,
+    feature: str | None = None,
+    reservation: Reservation | None = None,
+) -> int:
+    """Charge the token budget and quotas and append one call to the ledger.
+
+    *user_id* / *feature* default to the enclosing :func:`usage_scope`.
+    A *reservation* taken before the call is settled to the real total.
+    Returns the total tokens recorded.
+    """
+    ctx = _current()
+    user_id = user_id or ctx.user_id
+    feature = feature or ctx.feature
+    total = prompt_tokens + completion_tokens
+    if charge_budget:
+        token_budget.record(total)
+        if reservation is not None:
+            reservation.settle(total)
+        else:
+            token_quotas.charge(user_id, feature, total)
+    usage_ledger.add(
+        {
+            "user_id": _as_uuid(user_id),
+            "feature": feature,
+            "kind": kind,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total,
+            "usage_source": usage_source,
+            "latency_ms": int(latency_ms),
+            "ttft_ms": int(ttft_ms) if ttft_ms is not None else None,
+            "status": status,
+        }
+    )
+    logger.debug(
+        "llm usage kind=%s model=%s prompt=%d completion=%d source=%s "
+        "latency_ms=%d budget_remaining=%d",
+        kind,
+        model,
+        prompt_tokens,
+        completion_tokens,
+        usage_source,
+        latency_ms,
+        token_budget.remaining,
+    )
+    return total
+
+
+def record_response(
+    *,
+    kind: str,
+    model: str,
+    usage: Any,
+    started: float,
+    prompt_text: str | list[dict],
+    completion_text: str,
+    charge_budget: bool = True,
+    reservation: Reservation | None = None,
+) -> int:
+    """Record a non-streaming call from its ``usage`` payload (or an estimate)."""
+    counts = usage_counts(usage)
+    if counts is not None:
+        prompt_tokens, completion_tokens = counts
+        source = "provider"
+    else:
+        prompt_tokens = (
+            count_message_tokens(prompt_text)
+            if isinstance(prompt_text, list)
+            else count_tokens(prompt_text)
+        )
+        completion_tokens = count_tokens(completion_text)
+        source = "estimate"
+    return record_call(
+        kind=kind,
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        usage_source=source,
+        latency_ms=(time.monotonic() - started) * 1000,
+        charge_budget=charge_budget,
+        reservation=reservation,
+    )
+
+
+@dataclass
+class StreamUsage:
+    """Collects usage for one streaming completion.
+
+    Creating one reserves the call's worst-case cost (prompt plus
+    *max_tokens*) against the caller's quotas.  Await the provider call
+    through :meth:`open`, feed every chunk to :meth:`observe` and call
+    :meth:`finish` once the stream ends (or is abandoned).  The final usage
+    chunk is used when the provider sends one, otherwise prompt and
+    streamed output are counted locally.
+    """
+
+    kind: str
+    model: str
+    messages: list[dict]
+    user_id: UUID | str | None = None
+    feature: str | None = None
+    max_tokens: int = 0
+    started: float = field(default_factory=time.monotonic)
+    first_token_at: float | None = None
+    text: list[str] = field(default_factory=list)
+    usage: Any = None
+    finished: bool = False
+    reservation: Reservation | None = None
+
+    def __post_init__(self) -> None:
+        self.reservation = reserve_tokens(
+            self.messages, self.max_tokens, user_id=self.user_id, feature=self.feature
+        )
+
+    async def open(self, create: Awaitable[T]) -> T:
+        """Await the provider's ``create`` call; release the reservation on failure."""
+        try:
+            return await create
+        except BaseException:
+            self.abandon()
+            raise
+
+    def abandon(self) -> None:
+        """Drop the reservation for a call that never reached the provider."""
+        self.finished = True
+        self.reservation.release()
+
+    def observe(self, chunk: Any) -> None:
+        chunk_usage = getattr(chunk, "usage", None)
+        if chunk_usage:
+            self.usage = chunk_usage
+        for choice in getattr(chunk, "choices", None) or []:
+            delta = getattr(choice, "delta", None)
+            if delta is None:
+                continue
+            content = getattr(delta, "content", None)
+            if content:
+                if self.first_token_at is None:
+                    self.first_token_at = time.monotonic()
+                self.text.append(content)
+            for tc in getattr(delta, "tool_calls", None) or []:
+                fn = getattr(tc, "function", None)
+                if fn is not None and getattr(fn, "arguments", None):
+                    if self.first_token_at is None:
+                        self.first_token_at = time.monotonic()
+                    self.text.append(fn.arguments)
+
+    def finish(self, status: str = "ok") -> int:
+        """Record the call (idempotent).  Returns the total tokens recorded."""
+        if self.finished:
+            return 0
+        self.finished = True
+        counts = usage_counts(self.usage)
+        if counts is not None:
+            prompt_tokens, completion_tokens = counts
+            source = "provider"
+        else:
+            prompt_tokens = count_message_tokens(self.messages)
+            completion_tokens = count_tokens("".join(self.text))
+            source = "estimate"
+        now = time.monotonic()
+        return record_call(
+            kind=self.kind,
+            model=self.model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            usage_source=source,
+            latency_ms=(now - self.started) * 1000,
+            ttft_ms=(
+                (self.first_token_at - self.started) * 1000
+                if self.first_token_at
+                else None
+            ),
+            status=status,
+            user_id=self.user_id,
+            feature=self.feature,
+            reservation=self.reservation,
+        )
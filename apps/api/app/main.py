@@ -1,8 +1,10 @@
 """Main FastAPI application entry point."""
 
+import asyncio
 import logging
 import os
 import time
+from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
@@ -11,8 +13,18 @@ from fastapi.requests import Request
 from pydantic import BaseModel
 from supabase import create_client, Client
 
+from app.core.auth import jwks_store
 from app.core.config import get_settings
-from app.core.token_budget import token_budget
+from app.core.database import pool_status
+from app.core.quotas import load_usage_from_ledger, token_quotas
+from app.core.rate_limiter import PostgresRateLimitBackend, rate_limiter
+from app.core.token_budget import PostgresBudgetStore, token_budget
+from app.inference.gateway import llm_gateway
+from app.inference.resilience import embedding_breaker
+from app.inference.usage import usage_ledger, warm_tokenizer
+from app.processing.progress import PostgresProgressBackend, progress_hub
+from app.processing.recovery import ingestion_recovery
+from app.processing.reembed import reembed_jobs
 from app.documents.router import router as documents_router
 from app.chat.router import router as chat_router
 from app.processing.router import router as processing_router
@@ -60,16 +72,51 @@ else:
         bool(SUPABASE_KEY),
     )
 
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Load the tokenizer off the event loop so the first estimate is cheap.
+    await asyncio.to_thread(warm_tokenizer)
+    await token_budget.sync()
+    await jwks_store.start()
+    await progress_hub.start()
+    await ingestion_recovery.start()
+    yield
+    await reembed_jobs.stop()
+    await ingestion_recovery.stop()
+    await progress_hub.stop()
+    await jwks_store.stop()
+    # Write out buffered usage rows and hand back unused budget lease.
+    await usage_ledger.flush()
+    await token_budget.release()
+    if isinstance(rate_limiter.backend, PostgresRateLimitBackend):
+        # Hand back rate-limit cells this worker leased but never spent.
+        await rate_limiter.backend.close()
+
+
 # Initialize FastAPI App
 app = FastAPI(
     title="StudyBudd API",
     description="Backend API for StudyBudd application",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # --- 2b. Initialize token budget from settings ---
 token_budget.daily_limit = get_settings().daily_token_budget
+token_budget.lease_size = get_settings().token_budget_lease
+token_budget.store = PostgresBudgetStore()
 logger.info("Token budget initialized: %d tokens/day", token_budget.daily_limit)
+token_quotas.user_daily_limit = get_settings().user_daily_token_quota
+token_quotas.feature_daily_limits = dict(get_settings().feature_daily_token_quotas)
+token_quotas.loader = load_usage_from_ledger
+if get_settings().rate_limit_backend == "postgres":
+    rate_limiter.backend = PostgresRateLimitBackend()
+logger.info("Rate limit backend: %s", get_settings().rate_limit_backend)
+if get_settings().progress_backend == "postgres":
+    progress_hub.backend = PostgresProgressBackend()
+logger.info("Progress backend: %s", get_settings().progress_backend)
+ingestion_recovery.stale_after = get_settings().ingestion_resume_after
 
 # --- 3. Middleware ---
 
@@ -97,6 +144,7 @@ async def log_requests(request: Request, call_next):
     )
     return response
 
+
 # --- 4. Register Routers ---
 
 # Existing documents router
@@ -133,14 +181,19 @@ async def root() -> dict[str, str]:
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint with DB status and token budget."""
+    """Health check endpoint with DB status, LLM gateway load and token budget."""
     return {
         "status": "healthy",
         "database_connected": supabase is not None,
+        "db_pool": pool_status(),
+        "llm_gateway": llm_gateway.stats(),
+        "embedding_breaker": embedding_breaker.stats(),
+        "usage_ledger_pending": usage_ledger.pending,
         "token_budget": {
             "used": token_budget.used,
             "remaining": token_budget.remaining,
             "daily_limit": token_budget.daily_limit,
+            "lease": token_budget.lease,
         },
     }
 
@@ -7,7 +7,7 @@ from typing import Any
 from uuid import UUID
 
 from pgvector.sqlalchemy import Vector
-from sqlalchemy import DateTime, ForeignKey, Integer, String, Text, func
+from sqlalchemy import DateTime, Float, ForeignKey, Index, Integer, String, Text, func
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -24,6 +24,40 @@ class ProcessingDocument(Base, UUIDMixin):
     status: Mapped[str] = mapped_column(String(32), default="pending")
     error: Mapped[str | None] = mapped_column(Text, nullable=True)
 
+    # Written by the ingestion pipeline so status reads never touch chunks.
+    chunks_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    embed_model: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    # Percent of the document indexed so far; chunks of a "partial"
+    # document are already searchable.
+    coverage: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # Blue/green chunk sets: retrieval reads active_version while
+    # ingestion builds index_version; finishing a build switches the
+    # pointer and retires the old version's chunks for background deletion.
+    active_version: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    index_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    retired_version: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # Embedding model of the active version's chunks; queries against the
+    # document are embedded with it.
+    active_model: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    # Version an embedding migration is building for staged_model, and how
+    # many of the active version's chunks it has re-embedded so far.
+    staged_version: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    staged_model: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    staged_chunks: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # Ingestion checkpoint for index_version: pages up to pages_extracted
+    # are saved in processing_pages, and chunks_count chunks are stored.
+    pages_extracted: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    page_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # Stage work time; the stages overlap, so they sum to more than total_ms.
+    extract_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    chunk_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    embed_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    store_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    total_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    processed_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
@@ -35,7 +69,8 @@ class ProcessingDocument(Base, UUIDMixin):
         "DocumentChunk",
         back_populates="document",
         cascade="all, delete-orphan",
-        lazy="selectin",
+        lazy="raise",
+        passive_deletes=True,
     )
 
 
@@ -43,6 +78,9 @@ class DocumentChunk(Base, UUIDMixin):
     """A single text chunk with its embedding vector, belonging to a ProcessingDocument."""
 
     __tablename__ = "document_chunks"
+    __table_args__ = (
+        Index("ix_document_chunks_document_version", "document_id", "index_version"),
+    )
 
     document_id: Mapped[UUID] = mapped_column(
         PG_UUID(as_uuid=True),
@@ -50,6 +88,7 @@ class DocumentChunk(Base, UUIDMixin):
         index=True,
     )
 
+    index_version: Mapped[int] = mapped_column(Integer, default=1, server_default="1")
     chunk_index: Mapped[int] = mapped_column(Integer, index=True)
     content: Mapped[str] = mapped_column(Text)
     chunk_metadata: Mapped[dict[str, Any]] = mapped_column(
@@ -57,8 +96,63 @@ class DocumentChunk(Base, UUIDMixin):
     )
 
     embedding: Mapped[list[float]] = mapped_column(Vector(1024))
+    embed_model: Mapped[str | None] = mapped_column(String(255), nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
-    document: Mapped[ProcessingDocument] = relationship("ProcessingDocument", back_populates="chunks")
+    document: Mapped[ProcessingDocument] = relationship(
+        "ProcessingDocument", back_populates="chunks", lazy="raise"
+    )
+
+
+class ProcessingPage(Base):
+    """Extracted text of one page, kept so an ingestion run can resume from it."""
+
+    __tablename__ = "processing_pages"
+
+    document_id: Mapped[UUID] = mapped_column(
+        PG_UUID(as_uuid=True),
+        ForeignKey("processing_documents.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    page_number: Mapped[int] = mapped_column(Integer, primary_key=True)
+    content: Mapped[str] = mapped_column(Text)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
+
+class EmbeddingMigration(Base, UUIDMixin):
+    """Re-embedding of every document's chunks with a new embedding model.
+
+    See :mod:`app.processing.reembed`.  ``switched_at`` is set when the
+    target became the model retrieval and ingestion use.
+    """
+
+    __tablename__ = "embedding_migrations"
 
+    target_model: Mapped[str] = mapped_column(String(255))
+    status: Mapped[str] = mapped_column(String(32), default="pending")
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Chunks re-embedded per second, and documents re-embedded at once.
+    rate_limit: Mapped[float] = mapped_column(Float)
+    concurrency: Mapped[int] = mapped_column(Integer)
+    # Last document id the current pass has finished.
+    cursor: Mapped[UUID | None] = mapped_column(PG_UUID(as_uuid=True), nullable=True)
+    chunks_done: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    switched_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+    completed_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
@@ -0,0 +1,268 @@
+"""Staged, pipelined document ingestion.
+
+:func:`run_ingestion` runs four stages as concurrent tasks connected by
+bounded :class:`asyncio.Queue`\\s::
+
+    extract pages -> chunk -> embed batches -> bulk insert
+
+Pages are pulled from the extractor in a worker thread, so parsing later
+pages overlaps embedding, and embedding batch *N* overlaps inserting
+batch *N-1*.  A full queue blocks its producer, so however large the
+document, at most ``queue_size`` pages or batches wait between two
+stages.
+
+Each stage adds the time it spends working — not waiting on a queue —
+to :class:`StageTimings`.  Because stages overlap, the stage times add
+up to more than the wall time.
+
+Every stored batch is passed the fraction of the document it brings the
+index to, so callers can make a document searchable before the last
+page is embedded.  Until the chunk count is known that fraction is
+estimated from :class:`Page` numbers.
+
+Each batch also carries the pages chunked since the previous one, so the
+caller can checkpoint page text together with the chunks made from it.
+Chunking is deterministic, so replaying those pages with ``skip`` set to
+the number of chunks already stored resumes an interrupted run without
+embedding anything twice.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+from collections.abc import Awaitable, Callable, Coroutine, Iterable
+from dataclasses import dataclass, field
+from typing import Any, NamedTuple
+
+from app.processing.progress import ProgressReporter
+
+# Chunks per embedding request / insert.
+EMBED_BATCH_SIZE = 32
+# Items allowed to wait between two stages.
+STAGE_QUEUE_SIZE = 2
+
+_END = object()
+
+EmbedFn = Callable[[list[str]], Awaitable[list[list[float]]]]
+
+
+class Page(NamedTuple):
+    """A page of extracted text and its place in the document.
+
+    ``count`` is None when the number of pages is not known up front.
+    """
+
+    text: str
+    number: int = 1
+    count: int | None = 1
+
+
+# Extracts a document's pages from the given page number on.
+PageSource = Callable[[int], Iterable[Page]]
+
+
+@dataclass
+class Batch:
+    """Embedded chunks ready to store."""
+
+    first_index: int
+    texts: list[str]
+    vectors: list[list[float]]
+    # Fraction of the document indexed once this batch is stored; None
+    # if that cannot be estimated yet.
+    coverage: float | None
+    # Pages chunked since the previous batch (replayed ones included).
+    pages: list[Page]
+
+
+StoreFn = Callable[[Batch], Awaitable[None]]
+
+
+class TextChunker:
+    """Fixed-size overlapping chunks of a text fed one piece at a time.
+
+    Pieces are whitespace-normalized and joined with a single space, and
+    a chunk is emitted as soon as it can no longer change, so feeding a
+    document page by page yields exactly the chunks
+    :func:`~app.processing.service.chunk_text` gives for the whole text.
+    """
+
+    def __init__(self, max_chars: int = 900, overlap: int = 150) -> None:
+        self.max_chars = max_chars
+        self.overlap = overlap
+        self._buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        """Add *text*; return the chunks it completed."""
+        # PostgreSQL UTF-8 text cannot contain null bytes (0x00); PDF extraction
+        # can produce them.
+        text = re.sub(r"\s+", " ", text.replace("\x00", " ")).strip()
+        if not text:
+            return []
+        self._buffer = f"{self._buffer} {text}" if self._buffer else text
+
+        chunks: list[str] = []
+        while len(self._buffer) > self.max_chars:
+            chunk = self._buffer[: self.max_chars].strip()
+            if chunk:
+                chunks.append(chunk)
+            self._buffer = self._buffer[max(1, self.max_chars - self.overlap) :]
+        return chunks
+
+    def finish(self) -> list[str]:
+        """Return the final chunk, if any text is left."""
+        chunk, self._buffer = self._buffer.strip(), ""
+        return [chunk] if chunk else []
+
+
+@dataclass
+class StageTimings:
+    """Seconds each stage spent working, plus wall time."""
+
+    extract: float = 0.0
+    chunk: float = 0.0
+    embed: float = 0.0
+    store: float = 0.0
+    total: float = 0.0
+    _started: float = field(default_factory=time.perf_counter, repr=False)
+
+    def stop(self) -> None:
+        self.total = time.perf_counter() - self._started
+
+    def as_ms(self) -> dict[str, int]:
+        """Column values for ``processing_documents``."""
+        return {
+            "extract_ms": int(self.extract * 1000),
+            "chunk_ms": int(self.chunk * 1000),
+            "embed_ms": int(self.embed * 1000),
+            "store_ms": int(self.store * 1000),
+            "total_ms": int(self.total * 1000),
+        }
+
+
+async def run_ingestion(
+    pages: Iterable[str | Page],
+    *,
+    embed: EmbedFn,
+    store: StoreFn,
+    timings: StageTimings,
+    progress: ProgressReporter | None = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    queue_size: int = STAGE_QUEUE_SIZE,
+    skip: int = 0,
+) -> int:
+    """Chunk, embed and store *pages*; return the document's number of chunks.
+
+    *pages* may be a lazy iterator (e.g. a PDF being parsed); it is
+    advanced in a worker thread.  Plain strings carry no position, so
+    batches stored before chunking ends get no coverage estimate.  The
+    first *skip* chunks are taken as already stored and are neither
+    embedded nor stored again.  The first failing stage cancels the
+    others and its exception propagates; *timings* holds the work done
+    up to that point.
+    """
+    report = progress or (lambda *args, **kwargs: None)
+    page_queue: asyncio.Queue[Any] = asyncio.Queue(maxsize=queue_size)
+    batch_queue: asyncio.Queue[Any] = asyncio.Queue(maxsize=queue_size)
+    store_queue: asyncio.Queue[Any] = asyncio.Queue(maxsize=queue_size)
+    total: int | None = None
+
+    async def extract() -> None:
+        if isinstance(pages, (list, tuple)):
+            for page in pages:
+                await page_queue.put(page)
+        else:
+            iterator = iter(pages)
+            while True:
+                started = time.perf_counter()
+                page = await asyncio.to_thread(next, iterator, _END)
+                timings.extract += time.perf_counter() - started
+                if page is _END:
+                    break
+                await page_queue.put(page)
+        await page_queue.put(_END)
+
+    async def chunk() -> None:
+        nonlocal total
+        chunker = TextChunker()
+        batch: list[str] = []
+        fed: list[Page] = []
+        index = 0
+        while True:
+            page = await page_queue.get()
+            started = time.perf_counter()
+            if page is _END:
+                pieces = chunker.finish()
+            elif isinstance(page, Page):
+                pieces = chunker.feed(page.text)
+                fed.append(page)
+            else:
+                pieces = chunker.feed(page)
+            timings.chunk += time.perf_counter() - started
+            for n, piece in enumerate(pieces, start=1):
+                index += 1
+                if index <= skip:
+                    continue
+                batch.append(piece)
+                if len(batch) == batch_size:
+                    position = _position(page, n, len(pieces))
+                    await batch_queue.put((index - len(batch), batch, position, fed))
+                    batch, fed = [], []
+            if page is _END:
+                break
+        total = index
+        report("chunked", total=total)
+        if batch:
+            await batch_queue.put((index - len(batch), batch, 1.0, fed))
+        await batch_queue.put(_END)
+
+    async def embed_batches() -> None:
+        embedded = skip
+        while (item := await batch_queue.get()) is not _END:
+            first_index, texts, position, fed = item
+            started = time.perf_counter()
+            vectors = await embed(texts)
+            timings.embed += time.perf_counter() - started
+            embedded += len(texts)
+            report("embedding", embedded, total)
+            await store_queue.put(Batch(first_index, texts, vectors, position, fed))
+        await store_queue.put(_END)
+
+    async def store_batches() -> None:
+        while (batch := await store_queue.get()) is not _END:
+            if total:
+                batch.coverage = (batch.first_index + len(batch.texts)) / total
+            started = time.perf_counter()
+            await store(batch)
+            timings.store += time.perf_counter() - started
+
+    try:
+        await _run_stages(extract(), chunk(), embed_batches(), store_batches())
+    finally:
+        timings.stop()
+    return total or 0
+
+
+def _position(page: Any, n: int, pieces: int) -> float | None:
+    """Estimated fraction of the document read at chunk *n* of *page*'s *pieces*."""
+    if page is _END:
+        return 1.0
+    if not isinstance(page, Page) or not page.count:
+        return None
+    return min(1.0, (page.number - 1 + n / pieces) / page.count)
+
+
+async def _run_stages(*stages: Coroutine[Any, Any, None]) -> None:
+    """Run *stages* concurrently; on the first failure cancel the rest and raise it."""
+    tasks = [asyncio.create_task(stage) for stage in stages]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
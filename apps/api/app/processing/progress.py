@@ -0,0 +1,332 @@
+"""Ingestion progress pub/sub.
+
+The ingestion pipeline reports each step through a :class:`ProgressReporter`,
+which publishes a :class:`ProgressEvent` to :data:`progress_hub`.  SSE
+endpoints subscribe per user, optionally narrowed to a set of documents,
+so clients are pushed progress instead of polling the status endpoint.
+
+Delivery to subscribers on the same process is direct.  With
+:class:`PostgresProgressBackend` every event is also sent with
+``pg_notify`` and each worker ``LISTEN``\\s on the channel, so a client
+connected to one worker sees ingestion running on another.  Each worker
+ignores the notifications it sent itself.
+
+Progress is lossy by design: every event carries the full state of its
+stage, so a slow subscriber's oldest queued events are dropped rather
+than blocking the pipeline.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from collections.abc import Callable
+from contextlib import AbstractAsyncContextManager
+from dataclasses import dataclass
+from uuid import UUID, uuid4
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_CHANNEL = "ingestion_progress"
+# Stages after which a document sends no more events.
+TERMINAL_STAGES = frozenset({"ready", "error"})
+SUBSCRIBER_QUEUE_SIZE = 64
+OUTBOX_SIZE = 1024
+LISTEN_RETRY_DELAY = 5.0
+
+SessionFactory = Callable[[], AbstractAsyncContextManager[AsyncSession]]
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    """One step of a document's ingestion.
+
+    Stages, in order: ``downloaded``, ``extracted`` (``done``/``total``
+    pages), ``chunked`` (``total`` chunks), ``embedding`` (``done``/``total``
+    chunks), ``partial`` (``done`` chunks committed and searchable), then
+    ``ready`` or ``error``.
+    """
+
+    user_id: UUID
+    document_id: UUID
+    stage: str
+    done: int | None = None
+    total: int | None = None
+    error: str | None = None
+
+    @property
+    def terminal(self) -> bool:
+        return self.stage in TERMINAL_STAGES
+
+    def to_json(self) -> str:
+        """Client-facing payload (without the owner)."""
+        return json.dumps(
+            {
+                "document_id": str(self.document_id),
+                "stage": self.stage,
+                "done": self.done,
+                "total": self.total,
+                "error": self.error,
+            }
+        )
+
+    def to_payload(self, origin: str) -> str:
+        return json.dumps(
+            {
+                "origin": origin,
+                "user_id": str(self.user_id),
+                "document_id": str(self.document_id),
+                "stage": self.stage,
+                "done": self.done,
+                "total": self.total,
+                "error": self.error,
+            }
+        )
+
+    @classmethod
+    def from_payload(cls, payload: str) -> tuple[str, ProgressEvent]:
+        """Inverse of :meth:`to_payload`; returns ``(origin, event)``."""
+        data = json.loads(payload)
+        event = cls(
+            user_id=UUID(data["user_id"]),
+            document_id=UUID(data["document_id"]),
+            stage=data["stage"],
+            done=data.get("done"),
+            total=data.get("total"),
+            error=data.get("error"),
+        )
+        return data.get("origin", ""), event
+
+
+class Subscription:
+    """A subscriber's queue of events for one user's documents."""
+
+    def __init__(
+        self,
+        hub: ProgressHub,
+        user_id: UUID,
+        document_ids: set[UUID] | None,
+    ) -> None:
+        self._hub = hub
+        self.user_id = user_id
+        # None means every document of the user.
+        self.document_ids = document_ids
+        self.queue: asyncio.Queue[ProgressEvent] = asyncio.Queue(
+            maxsize=SUBSCRIBER_QUEUE_SIZE
+        )
+
+    def offer(self, event: ProgressEvent) -> None:
+        if self.document_ids is not None and event.document_id not in self.document_ids:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self) -> ProgressEvent:
+        return await self.queue.get()
+
+    def close(self) -> None:
+        self._hub._unsubscribe(self)
+
+
+class ProgressHub:
+    """In-process fan-out of progress events, optionally bridged across workers."""
+
+    def __init__(self, backend: PostgresProgressBackend | None = None) -> None:
+        self.backend = backend
+        self._origin = uuid4().hex
+        self._subscriptions: dict[UUID, set[Subscription]] = {}
+
+    def subscribe(
+        self, user_id: UUID, document_ids: set[UUID] | None = None
+    ) -> Subscription:
+        """Start receiving *user_id*'s events.
+
+        Call :meth:`Subscription.close` when done.
+        """
+        subscription = Subscription(self, user_id, document_ids)
+        self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.user_id]
+
+    def publish(self, event: ProgressEvent) -> None:
+        """Deliver *event* to local subscribers and, if bridged, to other workers.
+
+        Never blocks, so the pipeline can report from anywhere.
+        """
+        self._deliver(event)
+        if self.backend is not None:
+            self.backend.send(event.to_payload(self._origin))
+
+    def _deliver(self, event: ProgressEvent) -> None:
+        for subscription in tuple(self._subscriptions.get(event.user_id, ())):
+            subscription.offer(event)
+
+    def _on_notification(self, payload: str) -> None:
+        try:
+            origin, event = ProgressEvent.from_payload(payload)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("ignoring malformed progress notification: %s", e)
+            return
+        if origin != self._origin:
+            self._deliver(event)
+
+    async def start(self) -> None:
+        if self.backend is not None:
+            await self.backend.start(self._on_notification)
+
+    async def stop(self) -> None:
+        if self.backend is not None:
+            await self.backend.stop()
+
+
+class PostgresProgressBackend:
+    """Bridges :class:`ProgressHub`\\s on all workers with ``NOTIFY``/``LISTEN``.
+
+    Notifications are sent in order by one background task, so publishing
+    never waits on the database; the listener holds one dedicated
+    connection and reconnects if it drops.
+    """
+
+    def __init__(
+        self,
+        channel: str = PROGRESS_CHANNEL,
+        session_factory: SessionFactory | None = None,
+    ) -> None:
+        self.channel = channel
+        self._session_factory = session_factory
+        self._outbox: asyncio.Queue[str] | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    def _session(self) -> AbstractAsyncContextManager[AsyncSession]:
+        if self._session_factory is not None:
+            return self._session_factory()
+        from app.core.database import session_scope
+
+        return session_scope()
+
+    def send(self, payload: str) -> None:
+        if self._outbox is None:
+            return
+        try:
+            self._outbox.put_nowait(payload)
+        except asyncio.QueueFull:
+            logger.warning("progress outbox full; dropping notification")
+
+    async def start(self, on_message: Callable[[str], None]) -> None:
+        if self._tasks:
+            return
+        self._outbox = asyncio.Queue(maxsize=OUTBOX_SIZE)
+        self._tasks = [
+            asyncio.create_task(self._send_loop(self._outbox)),
+            asyncio.create_task(self._listen_loop(on_message)),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._outbox = None
+
+    async def _send_loop(self, outbox: asyncio.Queue[str]) -> None:
+        while True:
+            payload = await outbox.get()
+            try:
+                async with self._session() as session:
+                    await session.execute(
+                        text("SELECT pg_notify(:channel, :payload)"),
+                        {"channel": self.channel, "payload": payload},
+                    )
+                    await session.commit()
+            except Exception as e:
+                logger.warning("progress notify failed: %s", e)
+
+    async def _listen_loop(self, on_message: Callable[[str], None]) -> None:
+        from app.core.database import engine
+
+        def callback(_connection, _pid, _channel, payload: str) -> None:
+            on_message(payload)
+
+        while True:
+            try:
+                async with engine.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    driver = raw.driver_connection
+                    await driver.add_listener(self.channel, callback)
+                    logger.info(
+                        "listening for progress notifications channel=%s", self.channel
+                    )
+                    try:
+                        while not driver.is_closed():
+                            await asyncio.sleep(LISTEN_RETRY_DELAY)
+                    finally:
+                        if not driver.is_closed():
+                            await driver.remove_listener(self.channel, callback)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    "progress listener failed channel=%s: %s", self.channel, e
+                )
+            await asyncio.sleep(LISTEN_RETRY_DELAY)
+
+
+class ProgressReporter:
+    """Publishes the progress of one document's ingestion.
+
+    May be called from worker threads (e.g. page extraction); events are
+    then handed to the event loop the reporter was created on.  A reporter
+    without a ``user_id`` (ingestion nobody can watch) does nothing.
+    """
+
+    def __init__(
+        self,
+        user_id: UUID | None,
+        document_id: UUID,
+        hub: ProgressHub | None = None,
+    ) -> None:
+        self.user_id = user_id
+        self.document_id = document_id
+        self._hub = hub
+        try:
+            self._loop: asyncio.AbstractEventLoop | None = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+
+    def __call__(
+        self,
+        stage: str,
+        done: int | None = None,
+        total: int | None = None,
+        error: str | None = None,
+    ) -> None:
+        if self.user_id is None:
+            return
+        hub = self._hub or progress_hub
+        event = ProgressEvent(
+            self.user_id, self.document_id, stage, done=done, total=total, error=error
+        )
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is not None and running is not self._loop:
+            self._loop.call_soon_threadsafe(hub.publish, event)
+        else:
+            hub.publish(event)
+
+
+# Singleton; main picks the backend and starts it in its lifespan.
+progress_hub = ProgressHub()
@@ -0,0 +1,179 @@
+"""Background upkeep of ingestion: resume stopped runs, delete retired chunks.
+
+A run that dies with its worker (deploy, crash) leaves its document in
+``processing`` or ``partial``, with its checkpoint saved (see
+:meth:`~app.processing.service.ProcessingService.process_document`).
+Every worker periodically claims such runs once they have made no
+progress for ``stale_after`` seconds — each stored batch touches
+``updated_at`` — and resumes them one at a time.  Claiming bumps
+``updated_at`` under ``FOR UPDATE SKIP LOCKED``, so two workers never
+take the same document.
+
+The same sweep deletes the chunks of versions a finished re-index
+retired (see :meth:`~app.processing.service.ProcessingService.delete_retired_chunks`),
+so the swap itself never waits on a large delete.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Callable
+from contextlib import AbstractAsyncContextManager
+from datetime import timedelta
+from functools import partial
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.documents.models import Document
+from app.documents.text_extraction import iter_document_pages
+from app.inference.usage import usage_scope
+from app.processing.models import ProcessingDocument
+from app.processing.progress import ProgressReporter
+from app.processing.service import ProcessingService
+
+logger = logging.getLogger(__name__)
+
+# Statuses a run has while it is going; anything else is finished.
+RUNNING_STATUSES = ("processing", "partial")
+DEFAULT_STALE_AFTER = 600.0
+SWEEP_INTERVAL = 120.0
+INTERRUPTED_ERROR = "Processing was interrupted."
+# Documents whose retired chunks are deleted per sweep.
+RETIRED_BATCH = 100
+
+SessionFactory = Callable[[], AbstractAsyncContextManager[AsyncSession]]
+
+
+class IngestionRecovery:
+    """Background sweep that resumes interrupted ingestion and drops retired chunks."""
+
+    def __init__(
+        self,
+        stale_after: float = DEFAULT_STALE_AFTER,
+        interval: float = SWEEP_INTERVAL,
+        session_factory: SessionFactory | None = None,
+    ) -> None:
+        self.stale_after = stale_after
+        self.interval = interval
+        self._session_factory = session_factory
+        self._background: asyncio.Task | None = None
+
+    def _session(self) -> AbstractAsyncContextManager[AsyncSession]:
+        if self._session_factory is not None:
+            return self._session_factory()
+        from app.core.database import session_scope
+
+        return session_scope()
+
+    async def start(self) -> None:
+        if self._background is None:
+            self._background = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        if self._background is not None:
+            self._background.cancel()
+            await asyncio.gather(self._background, return_exceptions=True)
+            self._background = None
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            try:
+                await self.collect_retired()
+                await self.sweep()
+            except Exception as e:
+                logger.warning("ingestion recovery sweep failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def collect_retired(self) -> int:
+        """Delete chunks of retired index versions; return the documents cleaned."""
+        async with self._session() as db:
+            document_ids = (
+                await db.scalars(
+                    select(ProcessingDocument.id)
+                    .where(ProcessingDocument.retired_version.is_not(None))
+                    .limit(RETIRED_BATCH)
+                )
+            ).all()
+        cleaned = 0
+        for document_id in document_ids:
+            async with self._session() as db:
+                cleaned += await ProcessingService.delete_retired_chunks(
+                    db, document_id
+                )
+        if cleaned:
+            logger.info("deleted retired chunk versions documents=%d", cleaned)
+        return cleaned
+
+    async def sweep(self) -> int:
+        """Resume stale runs until none are left; return how many were resumed."""
+        resumed = 0
+        while (document_id := await self._claim()) is not None:
+            await self._resume(document_id)
+            resumed += 1
+        return resumed
+
+    async def _claim(self) -> UUID | None:
+        stale = (
+            select(ProcessingDocument.id)
+            .where(
+                ProcessingDocument.status.in_(RUNNING_STATUSES),
+                ProcessingDocument.updated_at
+                < func.now() - timedelta(seconds=self.stale_after),
+            )
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        async with self._session() as db:
+            document_id = await db.scalar(
+                update(ProcessingDocument)
+                .where(ProcessingDocument.id == stale)
+                .values(updated_at=func.now())
+                .returning(ProcessingDocument.id)
+            )
+            await db.commit()
+        return document_id
+
+    async def _resume(self, document_id: UUID) -> None:
+        async with self._session() as db:
+            document = await db.scalar(
+                select(Document).where(Document.id == document_id)
+            )
+            if document is None:
+                # Submitted as raw text, which is not kept; nothing to resume from.
+                await db.execute(
+                    update(ProcessingDocument)
+                    .where(ProcessingDocument.id == document_id)
+                    .values(
+                        status="error", error=INTERRUPTED_ERROR, processed_at=func.now()
+                    )
+                )
+                await db.commit()
+                return
+
+            logger.info("resuming interrupted ingestion document_id=%s", document_id)
+            progress = ProgressReporter(document.user_id, document.id)
+            try:
+                with usage_scope(
+                    user_id=document.user_id, feature="document_processing"
+                ):
+                    await ProcessingService.process_document(
+                        db=db,
+                        document_id=document.id,
+                        title=document.original_filename or "untitled",
+                        text=partial(iter_document_pages, document, progress),
+                        progress=progress,
+                    )
+            except (HTTPException, ValueError) as e:
+                # Recorded on the document; a later retry resumes from the checkpoint.
+                logger.warning(
+                    "resumed ingestion failed document_id=%s: %s", document_id, e
+                )
+
+
+# Singleton; main configures and starts it in its lifespan.
+ingestion_recovery = IngestionRecovery()
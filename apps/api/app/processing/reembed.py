@@ -0,0 +1,712 @@
+"""Re-embed every document's chunks with a new embedding model.
+
+An :class:`~app.processing.models.EmbeddingMigration` tracks one move to
+``target_model``.  :class:`Reembedder` walks ready documents in id order
+and gives each a *staged* chunk version: the chunks of its active
+version, re-embedded with the target model, under the next
+``index_version`` (the blue/green versions of
+:meth:`~app.processing.service.ProcessingService.process_document`).
+Retrieval keeps reading the active versions with query vectors from the
+old model, so the old index is served unchanged while the new one is
+built.
+
+Once every ready document is staged, one transaction switches them all:
+each active version becomes the staged one, the old versions are retired
+for background deletion, and the target becomes the model new ingestion
+embeds with.  Documents that were not staged at that moment — re-processed
+during the migration, or still indexing — are re-embedded and switched
+one at a time afterwards, and the migration completes once none are
+left and no ingestion run is still building with another model.
+Retrieval embeds the query with each model among the documents it reads,
+so those stay searchable in between.
+
+Work is paced to ``rate_limit`` chunks a second, with at most
+``concurrency`` documents in flight, to leave the embedding provider to
+live traffic.  Progress is checkpointed twice: the migration's ``cursor``
+is the last document of the current pass that is done, and each
+document's ``staged_chunks`` counts the chunks re-embedded so far, so an
+interrupted migration resumes without embedding anything twice.  Pausing
+takes effect at the next batch.
+
+Run it from ``apps/api``::
+
+    python -m app.processing.reembed --model <target model> --rate 50
+    python -m app.processing.reembed --resume <migration id>
+    python -m app.processing.reembed --status <migration id>
+
+(``--concurrency`` sets how many documents are re-embedded at once), or
+through the admin endpoints under ``/api/processing/embedding-migrations``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import AbstractAsyncContextManager
+from datetime import timedelta
+from uuid import UUID, uuid4
+
+from fastapi import HTTPException
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import get_settings
+from app.core.deadline import no_deadline
+from app.inference.usage import usage_ledger, usage_scope
+from app.processing.models import DocumentChunk, EmbeddingMigration, ProcessingDocument
+from app.processing.pipeline import EMBED_BATCH_SIZE
+from app.processing.schemas import EmbeddingMigrationResponse
+from app.processing.service import FALLBACK_EMBED_MODEL, embed, serving_embed_model
+
+logger = logging.getLogger(__name__)
+
+# A running migration that has checkpointed nothing for this long is
+# taken to have died with its process and may be resumed elsewhere.
+LEASE_TIMEOUT = 300.0
+# Pause between passes over the documents, which only repeat for
+# documents that changed during the previous one.
+PASS_DELAY = 5.0
+FINISHED_STATUSES = ("completed",)
+
+SessionFactory = Callable[[], AbstractAsyncContextManager[AsyncSession]]
+EmbedFn = Callable[..., Awaitable[list[list[float]]]]
+
+# The switch: a document's staged version becomes the one retrieval reads.
+_SWAP = {
+    "retired_version": ProcessingDocument.active_version,
+    "active_version": ProcessingDocument.staged_version,
+    "active_model": ProcessingDocument.staged_model,
+    "embed_model": ProcessingDocument.staged_model,
+    "staged_version": None,
+    "staged_model": None,
+    "staged_chunks": 0,
+}
+
+
+class _StoppedError(Exception):
+    """The migration stopped being ``running`` (it was paused) mid-batch."""
+
+
+class Pacer:
+    """Spaces work out to *rate* items a second across all callers."""
+
+    def __init__(
+        self, rate: float, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.rate = rate
+        self._clock = clock
+        self._next = 0.0
+
+    def delay(self, items: int) -> float:
+        """Book *items*; return how long the caller must wait before starting them."""
+        now = self._clock()
+        start = max(now, self._next)
+        self._next = start + items / self.rate
+        return start - now
+
+    async def wait(self, items: int) -> None:
+        delay = self.delay(items)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _staged(target: str):
+    """Documents whose staged version holds all their chunks under *target*."""
+    return and_(
+        ProcessingDocument.staged_model == target,
+        ProcessingDocument.staged_chunks >= ProcessingDocument.chunks_count,
+    )
+
+
+def _to_migrate(target: str, switched: bool):
+    """Ready documents the migration still has work on."""
+    pending = [
+        ProcessingDocument.status == "ready",
+        ProcessingDocument.active_model.is_distinct_from(target),
+    ]
+    if not switched:
+        # Staged ones wait for the switch; after it each is switched on its own.
+        pending.append(
+            or_(
+                ProcessingDocument.staged_model.is_distinct_from(target),
+                ProcessingDocument.staged_chunks < ProcessingDocument.chunks_count,
+            )
+        )
+    return and_(*pending)
+
+
+class Reembedder:
+    """Runs one :class:`EmbeddingMigration` from its checkpoint to completion.
+
+    Returns early if the migration is paused or fails.
+    """
+
+    def __init__(
+        self,
+        migration_id: UUID,
+        session_factory: SessionFactory | None = None,
+        embed_fn: EmbedFn | None = None,
+        lease_timeout: float = LEASE_TIMEOUT,
+        pass_delay: float = PASS_DELAY,
+    ) -> None:
+        self.migration_id = migration_id
+        self.lease_timeout = lease_timeout
+        self.pass_delay = pass_delay
+        self._session_factory = session_factory
+        self._embed = embed_fn or embed
+        self.target = ""
+        self._pacer = Pacer(1.0)
+
+    def _session(self) -> AbstractAsyncContextManager[AsyncSession]:
+        if self._session_factory is not None:
+            return self._session_factory()
+        from app.core.database import session_scope
+
+        return session_scope()
+
+    async def run(self) -> str | None:
+        """Migrate until done, paused or failed; return the final status.
+
+        Returns None without doing anything if the migration is finished
+        or another process is running it.
+        """
+        migration = await self._claim()
+        if migration is None:
+            return None
+        self.target = migration.target_model
+        self._pacer = Pacer(migration.rate_limit)
+        switched = migration.switched_at is not None
+        cursor = migration.cursor
+        # Whether the pass under way has found any work.
+        worked = cursor is not None
+        logger.info(
+            "embedding migration running id=%s target=%s cursor=%s",
+            self.migration_id, self.target, cursor,
+        )
+        try:
+            with usage_scope(feature="embedding_migration"):
+                while True:
+                    documents = await self._next_documents(
+                        cursor, switched, migration.concurrency
+                    )
+                    if documents:
+                        await self._migrate_all(documents, switched)
+                        cursor, worked = documents[-1].id, True
+                        await self._set_cursor(cursor)
+                        continue
+                    if (
+                        switched
+                        and not worked
+                        and not await self._building_old_versions()
+                    ):
+                        return await self._finish()
+                    if not switched and await self._switch():
+                        switched = True
+                    else:
+                        await asyncio.sleep(self.pass_delay)
+                    # Start another pass for documents that changed meanwhile.
+                    cursor, worked = None, False
+                    await self._set_cursor(None)
+        except _StoppedError:
+            logger.info("embedding migration stopped id=%s", self.migration_id)
+            return "paused"
+        except HTTPException as e:
+            error = str(e.detail)
+            await self._fail(error)
+            logger.warning(
+                "embedding migration failed id=%s: %s", self.migration_id, error
+            )
+            return "failed"
+
+    async def _claim(self) -> EmbeddingMigration | None:
+        async with self._session() as db:
+            migration = await db.scalar(
+                update(EmbeddingMigration)
+                .where(
+                    EmbeddingMigration.id == self.migration_id,
+                    or_(
+                        EmbeddingMigration.status.in_(("pending", "paused", "failed")),
+                        and_(
+                            EmbeddingMigration.status == "running",
+                            EmbeddingMigration.updated_at
+                            < func.now() - timedelta(seconds=self.lease_timeout),
+                        ),
+                    ),
+                )
+                .values(status="running", error=None, updated_at=func.now())
+                .returning(EmbeddingMigration)
+            )
+            await db.commit()
+        return migration
+
+    async def _next_documents(self, cursor: UUID | None, switched: bool, limit: int):
+        query = (
+            select(
+                ProcessingDocument.id,
+                ProcessingDocument.chunks_count,
+                ProcessingDocument.active_version,
+                ProcessingDocument.index_version,
+                ProcessingDocument.staged_version,
+                ProcessingDocument.staged_model,
+                ProcessingDocument.staged_chunks,
+            )
+            .where(_to_migrate(self.target, switched))
+            .order_by(ProcessingDocument.id)
+            .limit(limit)
+        )
+        if cursor is not None:
+            query = query.where(ProcessingDocument.id > cursor)
+        async with self._session() as db:
+            return (await db.execute(query)).all()
+
+    async def _migrate_all(self, documents, switched: bool) -> None:
+        """Migrate *documents* concurrently; the first failure stops the others."""
+        tasks = [
+            asyncio.create_task(self._migrate(document, switched))
+            for document in documents
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _migrate(self, document, switched: bool) -> None:
+        """Re-embed *document*'s active chunks into its staged version.
+
+        After the switch the staged version is switched to right away.
+        Gives up on the document if it is re-processed meanwhile; a later
+        pass picks it up again.
+        """
+        async with self._session() as db:
+            if (
+                document.staged_model == self.target
+                and document.staged_version is not None
+            ):
+                version, done = document.staged_version, document.staged_chunks
+            else:
+                version, done = document.index_version + 1, 0
+                claimed = await db.scalar(
+                    update(ProcessingDocument)
+                    .where(
+                        ProcessingDocument.id == document.id,
+                        ProcessingDocument.status == "ready",
+                        ProcessingDocument.index_version == document.index_version,
+                    )
+                    .values(
+                        index_version=version,
+                        staged_version=version,
+                        staged_model=self.target,
+                        staged_chunks=0,
+                    )
+                    .returning(ProcessingDocument.id)
+                )
+                if claimed is None:
+                    await db.rollback()
+                    return
+                await db.execute(
+                    delete(DocumentChunk).where(
+                        DocumentChunk.document_id == document.id,
+                        DocumentChunk.index_version == version,
+                    )
+                )
+                await db.commit()
+
+            while done < document.chunks_count:
+                rows = (
+                    await db.execute(
+                        select(
+                            DocumentChunk.chunk_index,
+                            DocumentChunk.content,
+                            DocumentChunk.chunk_metadata.label("chunk_metadata"),
+                        )
+                        .where(
+                            DocumentChunk.document_id == document.id,
+                            DocumentChunk.index_version == document.active_version,
+                            DocumentChunk.chunk_index >= done,
+                        )
+                        .order_by(DocumentChunk.chunk_index)
+                        .limit(EMBED_BATCH_SIZE)
+                    )
+                ).all()
+                if not rows:
+                    # The active version has fewer chunks than counted;
+                    # stage what it has.
+                    await db.execute(
+                        update(ProcessingDocument)
+                        .where(
+                            ProcessingDocument.id == document.id,
+                            ProcessingDocument.staged_version == version,
+                        )
+                        .values(staged_chunks=document.chunks_count)
+                    )
+                    await db.commit()
+                    break
+                await self._pacer.wait(len(rows))
+                vectors = await self._embed(
+                    [row.content for row in rows], prefix="passage: ", model=self.target
+                )
+                await db.execute(
+                    insert(DocumentChunk),
+                    [
+                        {
+                            "id": uuid4(),
+                            "document_id": document.id,
+                            "index_version": version,
+                            "chunk_index": row.chunk_index,
+                            "content": row.content,
+                            "embedding": vector,
+                            "embed_model": self.target,
+                            "chunk_metadata": row.chunk_metadata,
+                        }
+                        for row, vector in zip(rows, vectors, strict=True)
+                    ],
+                )
+                done = rows[-1].chunk_index + 1
+                # Both checkpoints commit with the chunks, or none of them do.
+                still_staged = await db.scalar(
+                    update(ProcessingDocument)
+                    .where(
+                        ProcessingDocument.id == document.id,
+                        ProcessingDocument.staged_version == version,
+                        ProcessingDocument.staged_model == self.target,
+                    )
+                    .values(staged_chunks=done)
+                    .returning(ProcessingDocument.id)
+                )
+                running = await db.scalar(
+                    update(EmbeddingMigration)
+                    .where(
+                        EmbeddingMigration.id == self.migration_id,
+                        EmbeddingMigration.status == "running",
+                    )
+                    .values(chunks_done=EmbeddingMigration.chunks_done + len(rows))
+                    .returning(EmbeddingMigration.id)
+                )
+                if running is None:
+                    await db.rollback()
+                    raise _StoppedError
+                if still_staged is None:
+                    await db.rollback()
+                    return
+                await db.commit()
+
+            if switched:
+                await db.execute(
+                    update(ProcessingDocument)
+                    .where(
+                        ProcessingDocument.id == document.id,
+                        ProcessingDocument.status == "ready",
+                        ProcessingDocument.staged_version == version,
+                        _staged(self.target),
+                    )
+                    .values(**_SWAP)
+                )
+                await db.commit()
+
+    async def _switch(self) -> bool:
+        """Serve the target model if every ready document is staged for it."""
+        async with self._session() as db:
+            unstaged = await db.scalar(
+                select(func.count())
+                .select_from(ProcessingDocument)
+                .where(_to_migrate(self.target, switched=False))
+            )
+            if unstaged:
+                return False
+            result = await db.execute(
+                update(ProcessingDocument)
+                .where(
+                    ProcessingDocument.status == "ready",
+                    ProcessingDocument.active_model.is_distinct_from(self.target),
+                    _staged(self.target),
+                )
+                .values(**_SWAP)
+            )
+            await db.execute(
+                update(EmbeddingMigration)
+                .where(EmbeddingMigration.id == self.migration_id)
+                .values(switched_at=func.now())
+            )
+            await db.commit()
+        logger.info(
+            "embedding migration switched id=%s target=%s documents=%d",
+            self.migration_id, self.target, result.rowcount,
+        )
+        return True
+
+    async def _building_old_versions(self) -> bool:
+        """Whether an ingestion run is embedding with a model other than the target."""
+        async with self._session() as db:
+            building = await db.scalar(
+                select(func.count())
+                .select_from(ProcessingDocument)
+                .where(
+                    ProcessingDocument.status.in_(("processing", "partial")),
+                    ProcessingDocument.embed_model.is_distinct_from(self.target),
+                )
+            )
+        return bool(building)
+
+    async def _set_cursor(self, cursor: UUID | None) -> None:
+        async with self._session() as db:
+            await db.execute(
+                update(EmbeddingMigration)
+                .where(EmbeddingMigration.id == self.migration_id)
+                .values(cursor=cursor)
+            )
+            await db.commit()
+
+    async def _finish(self) -> str:
+        async with self._session() as db:
+            await db.execute(
+                update(EmbeddingMigration)
+                .where(EmbeddingMigration.id == self.migration_id)
+                .values(status="completed", cursor=None, completed_at=func.now())
+            )
+            await db.commit()
+        logger.info("embedding migration completed id=%s", self.migration_id)
+        return "completed"
+
+    async def _fail(self, error: str) -> None:
+        async with self._session() as db:
+            await db.execute(
+                update(EmbeddingMigration)
+                .where(
+                    EmbeddingMigration.id == self.migration_id,
+                    EmbeddingMigration.status == "running",
+                )
+                .values(status="failed", error=error)
+            )
+            await db.commit()
+
+
+# ----------------------------
+# Starting and inspecting migrations
+# ----------------------------
+async def start_migration(
+    db: AsyncSession,
+    target_model: str,
+    rate_limit: float | None = None,
+    concurrency: int | None = None,
+) -> EmbeddingMigration:
+    """Create a migration to *target_model*, or return the unfinished one for it.
+
+    Raises:
+        HTTPException: 400 if embeddings come from the local fallback or
+            *target_model* is already served; 409 if a migration to another
+            model is unfinished.
+    """
+    settings = get_settings()
+    if not settings.together_api_key or target_model == FALLBACK_EMBED_MODEL:
+        raise HTTPException(status_code=400, detail="No embedding provider configured.")
+    unfinished = await db.scalar(
+        select(EmbeddingMigration)
+        .where(EmbeddingMigration.status.not_in(FINISHED_STATUSES))
+        .order_by(EmbeddingMigration.created_at.desc())
+        .limit(1)
+    )
+    if unfinished is not None:
+        if unfinished.target_model != target_model:
+            raise HTTPException(
+                status_code=409,
+                detail=f"A migration to '{unfinished.target_model}' is unfinished.",
+            )
+        return unfinished
+    if target_model == await serving_embed_model(db):
+        raise HTTPException(
+            status_code=400, detail=f"'{target_model}' is already the embedding model."
+        )
+
+    migration = EmbeddingMigration(
+        target_model=target_model,
+        status="pending",
+        rate_limit=rate_limit or settings.reembed_rate_limit,
+        concurrency=concurrency or settings.reembed_concurrency,
+        chunks_done=0,
+    )
+    db.add(migration)
+    await db.commit()
+    await db.refresh(migration)
+    return migration
+
+
+async def pause_migration(db: AsyncSession, migration_id: UUID) -> None:
+    """Stop a running migration at its next batch; it resumes from its checkpoint.
+
+    Raises:
+        HTTPException: 404 if there is no such migration, 409 if it is not running.
+    """
+    paused = await db.scalar(
+        update(EmbeddingMigration)
+        .where(
+            EmbeddingMigration.id == migration_id,
+            EmbeddingMigration.status == "running",
+        )
+        .values(status="paused")
+        .returning(EmbeddingMigration.id)
+    )
+    if paused is None:
+        status = await db.scalar(
+            select(EmbeddingMigration.status).where(
+                EmbeddingMigration.id == migration_id
+            )
+        )
+        if status is None:
+            raise HTTPException(status_code=404, detail="Migration not found.")
+        raise HTTPException(
+            status_code=409, detail=f"Migration is {status}, not running."
+        )
+    await db.commit()
+
+
+async def migration_status(
+    db: AsyncSession, migration_id: UUID
+) -> EmbeddingMigrationResponse:
+    """A migration's state and how much of the index its target covers.
+
+    Coverage counts the chunks of ready documents that are served by, or
+    staged for, the target model; the switch happens at 100.
+
+    Raises:
+        HTTPException: 404 if there is no such migration.
+    """
+    migration = await db.scalar(
+        select(EmbeddingMigration).where(EmbeddingMigration.id == migration_id)
+    )
+    if migration is None:
+        raise HTTPException(status_code=404, detail="Migration not found.")
+    target = migration.target_model
+    covered = or_(ProcessingDocument.active_model == target, _staged(target))
+    total, done = (
+        await db.execute(
+            select(
+                func.coalesce(func.sum(ProcessingDocument.chunks_count), 0),
+                func.coalesce(
+                    func.sum(ProcessingDocument.chunks_count).filter(covered), 0
+                ),
+            ).where(ProcessingDocument.status == "ready")
+        )
+    ).one()
+    return EmbeddingMigrationResponse(
+        id=migration.id,
+        target_model=target,
+        status=migration.status,
+        error=migration.error,
+        rate_limit=migration.rate_limit,
+        concurrency=migration.concurrency,
+        chunks_done=migration.chunks_done,
+        chunks_total=total,
+        coverage=100 if not total else int(done * 100 / total),
+        switched_at=migration.switched_at,
+        completed_at=migration.completed_at,
+        created_at=migration.created_at,
+    )
+
+
+class ReembedJobs:
+    """Migrations running in this process, started from the admin API."""
+
+    def __init__(self) -> None:
+        self._tasks: dict[UUID, asyncio.Task] = {}
+
+    def launch(self, migration_id: UUID) -> None:
+        """Run *migration_id* in the background unless it already runs here."""
+        if migration_id in self._tasks:
+            return
+        # Launched from a request: drop its deadline, or every embed() call
+        # would fail once the request's budget ran out.
+        with no_deadline():
+            task = asyncio.create_task(self._run(migration_id))
+        self._tasks[migration_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(migration_id, None))
+
+    async def _run(self, migration_id: UUID) -> None:
+        try:
+            await Reembedder(migration_id).run()
+        except Exception:
+            # Left "running"; resuming takes it over once its lease expires.
+            logger.exception("embedding migration crashed id=%s", migration_id)
+
+    async def stop(self) -> None:
+        """Cancel running migrations; they resume from their checkpoints."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Singleton; main stops it in its lifespan.
+reembed_jobs = ReembedJobs()
+
+
+# ----------------------------
+# Command line
+# ----------------------------
+async def _main(args: argparse.Namespace) -> int:
+    from app.core.database import session_scope
+
+    if args.status:
+        async with session_scope() as db:
+            print((await migration_status(db, args.status)).model_dump_json(indent=2))
+        return 0
+    if args.model:
+        async with session_scope() as db:
+            migration_id = (
+                await start_migration(
+                    db, args.model, rate_limit=args.rate, concurrency=args.concurrency
+                )
+            ).id
+    else:
+        migration_id = args.resume
+        if args.rate or args.concurrency:
+            async with session_scope() as db:
+                values = {"rate_limit": args.rate, "concurrency": args.concurrency}
+                await db.execute(
+                    update(EmbeddingMigration)
+                    .where(EmbeddingMigration.id == migration_id)
+                    .values({k: v for k, v in values.items() if v})
+                )
+                await db.commit()
+    print(f"migration {migration_id}")
+    try:
+        status = await Reembedder(migration_id).run()
+    finally:
+        await usage_ledger.flush()
+    if status is None:
+        print("migration is finished or running elsewhere", file=sys.stderr)
+        return 1
+    print(f"migration {status}")
+    return 0 if status in ("completed", "paused") else 1
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Re-embed all document chunks with a new model."
+    )
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument(
+        "--model", help="start (or resume) a migration to this embedding model"
+    )
+    action.add_argument("--resume", type=UUID, help="resume the migration with this id")
+    action.add_argument("--status", type=UUID, help="print the migration's progress")
+    parser.add_argument("--rate", type=float, help="chunks re-embedded per second")
+    parser.add_argument("--concurrency", type=int, help="documents re-embedded at once")
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s"
+    )
+    try:
+        return asyncio.run(_main(args))
+    except HTTPException as e:
+        print(e.detail, file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
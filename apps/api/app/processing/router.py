@@ -2,18 +2,35 @@
 
 from __future__ import annotations
 
+from collections.abc import AsyncIterator
+from functools import partial
 from uuid import UUID
 
-from fastapi import APIRouter, HTTPException
-from sqlalchemy import func, select
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.dependencies import CurrentUser, DbSession
+from app.core.deadline import request_deadline
+from app.core.dependencies import AdminUser, CurrentUser, DbSession
+from app.core.sse import encode_sse
 from app.documents.models import Document
-from app.documents.text_extraction import extract_text_from_document
-from app.processing.models import ProcessingDocument, DocumentChunk
+from app.documents.text_extraction import iter_document_pages
+from app.inference.usage import usage_scope
+from app.processing.models import DocumentChunk, ProcessingDocument
+from app.processing.progress import ProgressReporter
+from app.processing.reembed import (
+    migration_status,
+    pause_migration,
+    reembed_jobs,
+    start_migration,
+)
 from app.processing.schemas import (
     ChunkResponse,
+    EmbeddingMigrationRequest,
+    EmbeddingMigrationResponse,
+    ProcessingStatusBatchRequest,
+    ProcessingStatusBatchResponse,
     ProcessingStatusResponse,
     QueryRequest,
     QueryResponse,
@@ -62,18 +79,21 @@ async def process_document(
             detail=f"Only text and CSV documents can be processed; got file_type={doc.file_type!r}",
         )
 
+    progress = ProgressReporter(current_user.user_id, document_id)
     try:
-        text = extract_text_from_document(doc)
+        pages = partial(iter_document_pages, doc, progress)
+        with usage_scope(user_id=current_user.user_id, feature="document_processing"):
+            return await ProcessingService.process_document(
+                db=db,
+                document_id=document_id,
+                title=doc.original_filename or "untitled",
+                text=pages,
+                progress=progress,
+            )
     except ValueError as e:
+        progress("error", error=str(e))
         raise HTTPException(status_code=400, detail=str(e))
 
-    return await ProcessingService.process_document(
-        db=db,
-        document_id=document_id,
-        title=doc.original_filename or "untitled",
-        text=text,
-    )
-
 
 @router.get("/{document_id}/status")
 async def get_status(
@@ -81,44 +101,89 @@ async def get_status(
     current_user: CurrentUser,
     db: DbSession,
 ) -> ProcessingStatusResponse:
-    """Get processing status for a document."""
-    await _verify_document_ownership(document_id, current_user.user_id, db)
+    """Get processing status for a document.
 
-    proc_doc = await db.scalar(select(ProcessingDocument).where(ProcessingDocument.id == document_id))
-    if proc_doc is None:
-        return ProcessingStatusResponse(
-            document_id=document_id,
-            status="pending",
-            chunks_count=0,
-            error=None,
-        )
+    One query against columns the ingestion pipeline maintains, so it is
+    cheap to poll.
+    """
+    statuses = await ProcessingService.get_statuses(
+        db, current_user.user_id, [document_id]
+    )
+    if not statuses:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    return statuses[0]
 
-    chunks_count = await db.scalar(
-        select(func.count()).select_from(DocumentChunk).where(
-            DocumentChunk.document_id == document_id
-        )
+
+@router.post("/status")
+async def get_statuses(
+    req: ProcessingStatusBatchRequest,
+    current_user: CurrentUser,
+    db: DbSession,
+) -> ProcessingStatusBatchResponse:
+    """Get processing status for many documents in one query.
+
+    Ids that do not exist or belong to another user are omitted.
+    """
+    statuses = await ProcessingService.get_statuses(
+        db, current_user.user_id, req.document_ids
     )
+    return ProcessingStatusBatchResponse(statuses=statuses)
+
 
-    return ProcessingStatusResponse(
-        document_id=proc_doc.id,
-        status=proc_doc.status,
-        chunks_count=int(chunks_count or 0),
-        error=proc_doc.error,
+def _progress_response(events: AsyncIterator[tuple[str, str]]) -> StreamingResponse:
+    return StreamingResponse(
+        encode_sse(events),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
     )
 
 
+@router.get("/progress")
+async def stream_progress(
+    current_user: CurrentUser,
+    document_ids: list[UUID] | None = Query(default=None, max_length=100),
+) -> StreamingResponse:
+    """Stream ingestion progress via Server-Sent Events.
+
+    With ``document_ids``, sends each document's current state, then its
+    ``progress`` events until every one is ready or failed, then ``done``.
+    Without, streams progress of all the user's documents until the client
+    disconnects — open it before uploading a batch.
+    """
+    events = await ProcessingService.watch_progress(current_user.user_id, document_ids)
+    return _progress_response(events)
+
+
+@router.get("/{document_id}/progress")
+async def stream_document_progress(
+    document_id: UUID,
+    current_user: CurrentUser,
+) -> StreamingResponse:
+    """Stream one document's ingestion progress via Server-Sent Events."""
+    events = await ProcessingService.watch_progress(current_user.user_id, [document_id])
+    return _progress_response(events)
+
+
 @router.get("/{document_id}/chunks")
 async def get_chunks(
     document_id: UUID,
     current_user: CurrentUser,
     db: DbSession,
 ) -> list[ChunkResponse]:
-    """Get document chunks (requires document to be processed)."""
+    """Get the chunks retrieval reads: the active index version of a document."""
     await _verify_document_ownership(document_id, current_user.user_id, db)
 
     rows = (
         await db.execute(
             select(DocumentChunk)
+            .join(
+                ProcessingDocument,
+                (ProcessingDocument.id == DocumentChunk.document_id)
+                & (ProcessingDocument.active_version == DocumentChunk.index_version),
+            )
             .where(DocumentChunk.document_id == document_id)
             .order_by(DocumentChunk.chunk_index.asc())
         )
@@ -136,10 +201,72 @@ async def get_chunks(
     ]
 
 
+# ----------------------------
+# Embedding migrations (admin)
+# ----------------------------
+@router.post("/embedding-migrations", status_code=202)
+async def start_embedding_migration(
+    req: EmbeddingMigrationRequest,
+    _admin: AdminUser,
+    db: DbSession,
+) -> EmbeddingMigrationResponse:
+    """Re-embed every chunk with ``target_model`` in the background.
+
+    The current index is served until the new one covers every document.
+    Resumes the unfinished migration if one to the same model exists.
+    """
+    migration = await start_migration(
+        db, req.target_model, req.rate_limit, req.concurrency
+    )
+    reembed_jobs.launch(migration.id)
+    return await migration_status(db, migration.id)
+
+
+@router.get("/embedding-migrations/{migration_id}")
+async def get_embedding_migration(
+    migration_id: UUID,
+    _admin: AdminUser,
+    db: DbSession,
+) -> EmbeddingMigrationResponse:
+    """Progress and coverage of an embedding migration."""
+    return await migration_status(db, migration_id)
+
+
+@router.post("/embedding-migrations/{migration_id}/pause")
+async def pause_embedding_migration(
+    migration_id: UUID,
+    _admin: AdminUser,
+    db: DbSession,
+) -> EmbeddingMigrationResponse:
+    """Stop an embedding migration after its current batch."""
+    await pause_migration(db, migration_id)
+    return await migration_status(db, migration_id)
+
+
+@router.post("/embedding-migrations/{migration_id}/resume", status_code=202)
+async def resume_embedding_migration(
+    migration_id: UUID,
+    _admin: AdminUser,
+    db: DbSession,
+) -> EmbeddingMigrationResponse:
+    """Continue a paused or failed embedding migration from its checkpoint.
+
+    A migration left running by a process that died is taken over once
+    it has checkpointed nothing for a few minutes.
+    """
+    status = await migration_status(db, migration_id)
+    if status.status == "completed":
+        raise HTTPException(status_code=409, detail="Migration is completed.")
+    reembed_jobs.launch(migration_id)
+    return status
+
+
 # ----------------------------
 # RAG query endpoint
 # ----------------------------
-@router.post("/rag/query", response_model=QueryResponse)
+@router.post(
+    "/rag/query", response_model=QueryResponse, dependencies=[Depends(request_deadline)]
+)
 async def rag_query(
     req: QueryRequest,
     current_user: CurrentUser,
@@ -148,9 +275,10 @@ async def rag_query(
     """Run RAG query on a document."""
     await _verify_document_ownership(req.document_id, current_user.user_id, db)
 
-    return await ProcessingService.rag_query(
-        db=db,
-        document_id=req.document_id,
-        question=req.question,
-        top_k=req.top_k,
-    )
+    with usage_scope(user_id=current_user.user_id, feature="rag_query"):
+        return await ProcessingService.rag_query(
+            db=db,
+            document_id=req.document_id,
+            question=req.question,
+            top_k=req.top_k,
+        )
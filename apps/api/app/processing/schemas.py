@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+from datetime import datetime
 from typing import Any, Optional
 from uuid import UUID
 
@@ -21,6 +22,54 @@ class ProcessingStatusResponse(BaseModel):
     status: str
     chunks_count: int
     error: Optional[str] = None
+    # Percent of the document searchable; below 100 while status is "partial".
+    coverage: Optional[int] = None
+    # Retrieval can read the document; true throughout a re-index.
+    searchable: bool = False
+    embed_model: Optional[str] = None
+    processed_at: Optional[datetime] = None
+    # Time spent in each pipeline stage on the last run, in milliseconds.
+    # Stages overlap, so they can add up to more than total_ms.
+    extract_ms: Optional[int] = None
+    chunk_ms: Optional[int] = None
+    embed_ms: Optional[int] = None
+    store_ms: Optional[int] = None
+    total_ms: Optional[int] = None
+
+
+class ProcessingStatusBatchRequest(BaseModel):
+    """Document ids to report processing status for."""
+    document_ids: list[UUID] = Field(min_length=1, max_length=100)
+
+
+class ProcessingStatusBatchResponse(BaseModel):
+    """Processing status of each requested document the caller owns."""
+    statuses: list[ProcessingStatusResponse]
+
+
+class EmbeddingMigrationRequest(BaseModel):
+    """Start (or resume) re-embedding every chunk with ``target_model``."""
+    target_model: str = Field(min_length=1, max_length=255)
+    # Chunks per second and documents at once; default to the settings.
+    rate_limit: Optional[float] = Field(default=None, gt=0)
+    concurrency: Optional[int] = Field(default=None, ge=1, le=32)
+
+
+class EmbeddingMigrationResponse(BaseModel):
+    """Progress of an embedding migration."""
+    id: UUID
+    target_model: str
+    status: str
+    error: Optional[str] = None
+    rate_limit: float
+    concurrency: int
+    chunks_done: int
+    chunks_total: int
+    # Percent of ready documents' chunks served by or staged for the target.
+    coverage: int
+    switched_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
 
 
 class ChunkResponse(BaseModel):
@@ -30,6 +79,8 @@ class ChunkResponse(BaseModel):
     chunk_index: int
     content: str
     metadata: dict[str, Any]
+    # The chunk's document is still being indexed, so answers may miss parts of it.
+    partial: bool = False
 
 
 class QueryRequest(BaseModel):
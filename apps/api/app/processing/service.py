@@ -2,20 +2,50 @@
 
 from __future__ import annotations
 
+import asyncio
 import hashlib
+import itertools
+import json
 import math
 import re
+import time
+from collections.abc import AsyncIterator, Iterable
+from datetime import UTC, datetime
 from typing import Any
-from uuid import UUID
+from uuid import UUID, uuid4
 
 import httpx
 from fastapi import HTTPException
-from sqlalchemy import delete, func, select, text, update
+from sqlalchemy import and_, case, delete, func, insert, select, text, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import get_settings
+from app.core.database import session_scope
+from app.core.deadline import timeout_for
 from app.documents.models import Document as UserDocument
-from app.processing.models import ProcessingDocument, DocumentChunk
+from app.inference.gateway import Priority, llm_gateway
+from app.inference.resilience import LatencyTracker, embedding_breaker, hedged
+from app.inference.usage import record_response, reserved_tokens
+from app.processing.models import (
+    DocumentChunk,
+    EmbeddingMigration,
+    ProcessingDocument,
+    ProcessingPage,
+)
+from app.processing.pipeline import (
+    Batch,
+    Page,
+    PageSource,
+    StageTimings,
+    TextChunker,
+    run_ingestion,
+)
+from app.processing.progress import (
+    TERMINAL_STAGES,
+    ProgressReporter,
+    Subscription,
+    progress_hub,
+)
 from app.processing.schemas import (
     ChunkResponse,
     ProcessingStatusResponse,
@@ -26,35 +56,69 @@ from app.processing.schemas import (
 # intfloat/multilingual-e5-large-instruct outputs 1024. Must match Vector(dim) in models.py.
 EMBEDDING_DIM = 1024
 
+# Upper bounds for provider calls; shortened to the request deadline.
+EMBED_TIMEOUT = 30.0
+ANSWER_TIMEOUT = 45.0
+
+# Retrieval reads a document's active_version; while that is also the
+# version an unfinished run is building, answers may miss parts of it.
+READING_PARTIAL = and_(
+    ProcessingDocument.active_version == ProcessingDocument.index_version,
+    ProcessingDocument.status != "ready",
+)
+# Statuses of runs that did not finish and can resume from their checkpoint.
+RESUMABLE_STATUSES = ("processing", "partial", "error")
+# Appended to a partially indexed document's name in retrieval context.
+PARTIAL_NOTE = " (still indexing; may be incomplete)"
+
+# Query-embedding latency history, used to pick the hedge delay.
+_query_embed_latency = LatencyTracker(default_delay=1.0)
+
 
 # ----------------------------
 # Chunking
 # ----------------------------
 def chunk_text(text: str, max_chars: int = 900, overlap: int = 150) -> list[str]:
     """Split text into overlapping chunks for embedding."""
-    # PostgreSQL UTF-8 text cannot contain null bytes (0x00); PDF extraction can produce them
-    text = text.replace("\x00", " ")
-    text = re.sub(r"\s+", " ", text).strip()
-    if not text:
-        return []
-
-    chunks: list[str] = []
-    i = 0
-    n = len(text)
-    while i < n:
-        end = min(i + max_chars, n)
-        chunk = text[i:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        if end == n:
-            break
-        i = max(0, end - overlap)
-    return chunks
+    chunker = TextChunker(max_chars, overlap)
+    return chunker.feed(text) + chunker.finish()
 
 
 # ----------------------------
 # Embeddings
 # ----------------------------
+# Recorded as the embed model of documents embedded without an API key.
+FALLBACK_EMBED_MODEL = "hash-fallback"
+
+
+def embed_model_name() -> str:
+    """Name of the model :func:`embed` uses when not given one."""
+    settings = get_settings()
+    return (
+        settings.together_embed_model
+        if settings.together_api_key
+        else FALLBACK_EMBED_MODEL
+    )
+
+
+async def serving_embed_model(db: AsyncSession) -> str:
+    """Model new chunks are embedded with.
+
+    That is the target of the last embedding migration to switch over
+    (see :mod:`app.processing.reembed`), or else the configured model.
+    """
+    configured = embed_model_name()
+    if configured == FALLBACK_EMBED_MODEL:
+        return configured
+    switched = await db.scalar(
+        select(EmbeddingMigration.target_model)
+        .where(EmbeddingMigration.switched_at.is_not(None))
+        .order_by(EmbeddingMigration.switched_at.desc())
+        .limit(1)
+    )
+    return switched or configured
+
+
 def _hash_to_unit_vector(s: str, dim: int = EMBEDDING_DIM) -> list[float]:
     """
     Deterministic fallback embedding when no API key is configured.
@@ -73,25 +137,36 @@ def _hash_to_unit_vector(s: str, dim: int = EMBEDDING_DIM) -> list[float]:
     return [v / norm for v in vec]
 
 
-async def embed(texts: list[str], *, prefix: str | None = None) -> list[list[float]]:
+async def embed(
+    texts: list[str],
+    *,
+    prefix: str | None = None,
+    model: str | None = None,
+) -> list[list[float]]:
     """Generate embeddings via Together API or fallback to deterministic hash vectors.
 
     Args:
         texts: Raw text strings to embed.
         prefix: Optional instruction prefix for models that require it
                 (e.g. ``"query: "`` or ``"passage: "`` for E5-instruct).
+        model: Embedding model; defaults to ``TOGETHER_EMBED_MODEL``.
     """
     prefixed = [f"{prefix}{t}" for t in texts] if prefix else texts
 
     settings = get_settings()
-    if not settings.together_api_key:
+    if not settings.together_api_key or model == FALLBACK_EMBED_MODEL:
         return [_hash_to_unit_vector(t) for t in prefixed]
+    model = model or settings.together_embed_model
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
+    started = time.monotonic()
+    async with (
+        embedding_breaker.guard(),
+        httpx.AsyncClient(timeout=timeout_for(EMBED_TIMEOUT)) as client,
+    ):
         r = await client.post(
             "https://api.together.xyz/v1/embeddings",
             headers={"Authorization": f"Bearer {settings.together_api_key}"},
-            json={"model": settings.together_embed_model, "input": prefixed},
+            json={"model": model, "input": prefixed},
         )
         if r.status_code >= 400:
             raise HTTPException(status_code=502, detail=f"Embedding provider error: {r.text}")
@@ -99,6 +174,17 @@ async def embed(texts: list[str], *, prefix: str | None = None) -> list[list[flo
         data = r.json()
         vectors = [item["embedding"] for item in data["data"]]
 
+    # Embedding tokens go to the usage ledger but not the daily chat budget.
+    record_response(
+        kind="embedding",
+        model=model,
+        usage=data.get("usage"),
+        started=started,
+        prompt_text="\n".join(prefixed),
+        completion_text="",
+        charge_budget=False,
+    )
+
     if vectors and len(vectors[0]) != EMBEDDING_DIM:
         raise HTTPException(
             status_code=500,
@@ -110,6 +196,21 @@ async def embed(texts: list[str], *, prefix: str | None = None) -> list[list[flo
     return vectors
 
 
+async def embed_query(question: str, model: str | None = None) -> list[float]:
+    """Embed a search query, hedging slow provider calls.
+
+    Query embeddings are idempotent and on the interactive path, so a
+    duplicate request is sent if the first one is slower than the recent
+    p95 latency; the first response wins.  *model* must be the model of
+    the chunks searched (see ``ProcessingDocument.active_model``).
+    """
+    vectors = await hedged(
+        lambda: embed([question], prefix="query: ", model=model),
+        tracker=_query_embed_latency,
+    )
+    return vectors[0]
+
+
 # ----------------------------
 # Vector schema helper
 # ----------------------------
@@ -147,40 +248,150 @@ async def generate_answer(question: str, context: str) -> str:
             f"{context}"
         )
 
-    async with httpx.AsyncClient(timeout=45.0) as client:
-        r = await client.post(
-            "https://api.together.xyz/v1/chat/completions",
-            headers={"Authorization": f"Bearer {settings.together_api_key}"},
-            json={
-                "model": settings.together_model,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a helpful study assistant. The user is asking about a specific document. "
-                            "The 'Context' below is the actual content extracted from that document (shown in chunks). "
-                            "Answer the user's question using ONLY this context. "
-                            "When they ask 'about this file' or 'about the document', describe or summarize what the context contains. "
-                            "If the context is truly empty or irrelevant to the question, say you don't have enough information."
-                        ),
-                    },
-                    {
-                        "role": "user",
-                        "content": (
-                            f"The following context is the content of the document the user is asking about.\n\n"
-                            f"Question: {question}\n\nContext:\n{context}"
-                        ),
-                    },
-                ],
-                "temperature": 0.2,
-                "max_tokens": settings.together_max_tokens,
-            },
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                "You are a helpful study assistant. The user is asking about a "
+                "specific document. The 'Context' below is the actual content "
+                "extracted from that document (shown in chunks). "
+                "Answer the user's question using ONLY this context. "
+                "When they ask 'about this file' or 'about the document', describe "
+                "or summarize what the context contains. "
+                "If the context is truly empty or irrelevant to the question, say "
+                "you don't have enough information."
+            ),
+        },
+        {
+            "role": "user",
+            "content": (
+                "The following context is the content of the document the user is "
+                "asking about.\n\n"
+                f"Question: {question}\n\nContext:\n{context}"
+            ),
+        },
+    ]
+    with reserved_tokens(messages, settings.together_max_tokens) as reservation:
+        async with (
+            llm_gateway.slot(settings.together_model, Priority.INTERACTIVE),
+            httpx.AsyncClient(timeout=timeout_for(ANSWER_TIMEOUT)) as client,
+        ):
+            started = time.monotonic()
+            r = await client.post(
+                "https://api.together.xyz/v1/chat/completions",
+                headers={"Authorization": f"Bearer {settings.together_api_key}"},
+                json={
+                    "model": settings.together_model,
+                    "messages": messages,
+                    "temperature": 0.2,
+                    "max_tokens": settings.together_max_tokens,
+                },
+            )
+            if r.status_code >= 400:
+                raise HTTPException(
+                    status_code=502, detail=f"LLM provider error: {r.text}"
+                )
+
+            out = r.json()
+            answer = out["choices"][0]["message"]["content"].strip()
+
+        record_response(
+            kind="answer",
+            model=settings.together_model,
+            usage=out.get("usage"),
+            started=started,
+            prompt_text=messages,
+            completion_text=answer,
+            reservation=reservation,
         )
-        if r.status_code >= 400:
-            raise HTTPException(status_code=502, detail=f"LLM provider error: {r.text}")
+    return answer
+
+
+async def _record_failure(
+    db: AsyncSession,
+    document_id: UUID,
+    error: str,
+    timings: StageTimings,
+) -> None:
+    """Mark a processing run failed, keeping the stage timings it reached."""
+    await db.execute(
+        update(ProcessingDocument)
+        .where(ProcessingDocument.id == document_id)
+        .values(status="error", error=error, processed_at=func.now(), **timings.as_ms())
+    )
+    await db.commit()
 
-        out = r.json()
-        return out["choices"][0]["message"]["content"].strip()
+
+async def _load_pages(
+    db: AsyncSession, document_id: UUID, page_count: int | None
+) -> list[Page]:
+    """The document's checkpointed pages, in order."""
+    rows = await db.execute(
+        select(ProcessingPage.page_number, ProcessingPage.content)
+        .where(ProcessingPage.document_id == document_id)
+        .order_by(ProcessingPage.page_number)
+    )
+    return [Page(row.content, row.page_number, page_count) for row in rows.all()]
+
+
+def _resume_pages(
+    saved: list[Page],
+    source: Iterable[str | Page] | PageSource,
+    pages_extracted: int,
+    page_count: int | None,
+) -> Iterable[str | Page]:
+    """Saved pages, then whatever the source has after them."""
+    if page_count is not None and pages_extracted >= page_count:
+        return saved
+    if callable(source):
+        rest = source(pages_extracted + 1)
+    else:
+        rest = (
+            p for p in source if not isinstance(p, Page) or p.number > pages_extracted
+        )
+    return itertools.chain(saved, rest)
+
+
+# ----------------------------
+# Progress streaming
+# ----------------------------
+def _status_event(status: ProcessingStatusResponse) -> str:
+    """A stored status in the shape of a progress event."""
+    ready = status.status == "ready"
+    return json.dumps(
+        {
+            "document_id": str(status.document_id),
+            "stage": status.status,
+            "done": (
+                status.chunks_count if status.status in ("ready", "partial") else None
+            ),
+            "total": status.chunks_count if ready else None,
+            "error": status.error,
+        }
+    )
+
+
+async def _progress_events(
+    subscription: Subscription,
+    statuses: list[ProcessingStatusResponse],
+    *,
+    follow_all: bool,
+) -> AsyncIterator[tuple[str, str]]:
+    """Current statuses, then live events until the watched documents finish."""
+    try:
+        pending = set()
+        for status in statuses:
+            yield "progress", _status_event(status)
+            if status.status not in TERMINAL_STAGES:
+                pending.add(status.document_id)
+        while follow_all or pending:
+            event = await subscription.get()
+            yield "progress", event.to_json()
+            if event.terminal:
+                pending.discard(event.document_id)
+        yield "done", "{}"
+    finally:
+        subscription.close()
 
 
 # ----------------------------
@@ -194,78 +405,376 @@ class ProcessingService:
         db: AsyncSession,
         document_id: UUID,
         title: str,
-        text: str,
+        text: str | Iterable[str | Page] | PageSource,
         metadata: dict[str, Any] | None = None,
+        progress: ProgressReporter | None = None,
     ) -> ProcessingStatusResponse:
         """
         Full RAG pipeline: chunk text, embed, store in processing_documents and document_chunks.
+
+        *text* is the whole text, an iterator of its pages, or a
+        :data:`~app.processing.pipeline.PageSource` such as
+        ``partial(iter_document_pages, document)``; pages are chunked,
+        embedded and inserted as they are extracted (see
+        :mod:`app.processing.pipeline`).  Each step is reported to
+        *progress* (see :mod:`app.processing.progress`).
+
+        Every batch of chunks is committed as soon as it is stored, with
+        the document marked ``partial`` and its coverage updated, so a
+        large document can be searched while the rest of it is indexed.
+
+        Pages are checkpointed in ``processing_pages`` with those chunks.
+        A later run replays the saved pages and only extracts the rest
+        (nothing, once extraction has finished), and a run that did not
+        finish with the same embedding model resumes after its last
+        stored chunk instead of starting over.
+
+        Chunks are written under a new ``index_version`` while retrieval
+        keeps reading ``active_version``, so re-indexing a document never
+        hides it.  (A first index has nothing to hide, so it becomes the
+        active version with its first batch.)  The final UPDATE switches
+        the pointer and retires the previous version, whose chunks
+        :meth:`delete_retired_chunks` removes in the background.
         """
         meta = metadata or {}
+        report = progress or ProgressReporter(None, document_id)
+        timings = StageTimings()
+        embed_model = await serving_embed_model(db)
+
+        prior = (
+            await db.execute(
+                select(
+                    ProcessingDocument.status,
+                    ProcessingDocument.chunks_count,
+                    ProcessingDocument.embed_model,
+                    ProcessingDocument.pages_extracted,
+                    ProcessingDocument.page_count,
+                    ProcessingDocument.index_version,
+                ).where(ProcessingDocument.id == document_id)
+            )
+        ).one_or_none()
+        checkpoint_pages = not isinstance(text, str)
+        resumable = (
+            prior is not None
+            and checkpoint_pages
+            and prior.status in RESUMABLE_STATUSES
+            and prior.embed_model in (None, embed_model)
+        )
+        skip = prior.chunks_count if resumable else 0
+        # Resume the version being built, or build the next one.
+        if prior is None:
+            version = 1
+        else:
+            version = prior.index_version if resumable else prior.index_version + 1
 
         # Upsert processing_documents row
-        existing = await db.scalar(select(ProcessingDocument).where(ProcessingDocument.id == document_id))
-        if existing is None:
-            doc = ProcessingDocument(id=document_id, title=title, status="processing")
+        if prior is None:
+            doc = ProcessingDocument(
+                id=document_id,
+                title=title,
+                status="processing",
+                coverage=0,
+                index_version=version,
+            )
             db.add(doc)
             await db.flush()
         else:
+            restart = {} if skip else {"chunks_count": 0, "coverage": 0}
             await db.execute(
                 update(ProcessingDocument)
                 .where(ProcessingDocument.id == document_id)
-                .values(title=title, status="processing", error=None)
+                .values(
+                    title=title,
+                    status="partial" if skip else "processing",
+                    error=None,
+                    processed_at=None,
+                    index_version=version,
+                    # The document changes under any embedding migration
+                    # staging it, which has to start over.
+                    staged_version=None,
+                    staged_model=None,
+                    staged_chunks=0,
+                    **restart,
+                )
             )
 
-        # Clear old chunks
-        await db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document_id))
+        # Clear this version's chunks past the checkpoint; other versions
+        # are left to retrieval until the swap.
+        await db.execute(
+            delete(DocumentChunk).where(
+                DocumentChunk.document_id == document_id,
+                DocumentChunk.index_version == version,
+                DocumentChunk.chunk_index >= skip,
+            )
+        )
+        await db.commit()
 
-        chunks = chunk_text(text)
-        if not chunks:
+        pages_extracted = (
+            prior.pages_extracted if prior is not None and checkpoint_pages else 0
+        )
+        page_count = prior.page_count if pages_extracted else None
+
+        async def store(batch: Batch) -> None:
+            nonlocal pages_extracted, page_count
+            new_pages = (
+                [p for p in batch.pages if p.number > pages_extracted]
+                if checkpoint_pages
+                else []
+            )
+            if new_pages:
+                await db.execute(
+                    insert(ProcessingPage),
+                    [
+                        {
+                            "document_id": document_id,
+                            "page_number": p.number,
+                            "content": p.text,
+                        }
+                        for p in new_pages
+                    ],
+                )
+                pages_extracted, page_count = new_pages[-1].number, new_pages[-1].count
+            await db.execute(
+                insert(DocumentChunk),
+                [
+                    {
+                        "id": uuid4(),
+                        "document_id": document_id,
+                        "index_version": version,
+                        "chunk_index": idx,
+                        "content": content,
+                        "embedding": vec,
+                        "embed_model": embed_model,
+                        "chunk_metadata": {**meta, "chunk_index": idx},
+                    }
+                    for idx, (content, vec) in enumerate(
+                        zip(batch.texts, batch.vectors, strict=True),
+                        start=batch.first_index,
+                    )
+                ],
+            )
+            # Commit each batch so it is searchable now, not when the document
+            # is done, and so a later run can resume from here.
+            indexed = batch.first_index + len(batch.texts)
             await db.execute(
                 update(ProcessingDocument)
                 .where(ProcessingDocument.id == document_id)
-                .values(status="error", error="No text to process.")
+                .values(
+                    status="partial",
+                    chunks_count=indexed,
+                    coverage=(
+                        None if batch.coverage is None else int(batch.coverage * 100)
+                    ),
+                    embed_model=embed_model,
+                    pages_extracted=pages_extracted,
+                    page_count=page_count,
+                    # A first index is searchable from its first batch.
+                    active_version=func.coalesce(
+                        ProcessingDocument.active_version, version
+                    ),
+                    active_model=case(
+                        (ProcessingDocument.active_version.is_(None), embed_model),
+                        else_=ProcessingDocument.active_model,
+                    ),
+                )
             )
             await db.commit()
+            report("partial", indexed)
+
+        try:
+            if not checkpoint_pages:
+                pages: Iterable[str | Page] = [Page(text)]
+            elif pages_extracted:
+                saved = await _load_pages(db, document_id, page_count)
+                pages = _resume_pages(saved, text, pages_extracted, page_count)
+            else:
+                pages = text(1) if callable(text) else text
+            chunks_count = await run_ingestion(
+                pages,
+                embed=lambda batch: embed(batch, prefix="passage: ", model=embed_model),
+                store=store,
+                timings=timings,
+                progress=report,
+                skip=skip,
+            )
+        except HTTPException:
+            await _record_failure(db, document_id, "Embedding failed.", timings)
+            report("error", error="Embedding failed.")
+            raise
+        except ValueError as e:
+            # Text extraction failed part-way through the document.
+            await _record_failure(db, document_id, str(e), timings)
+            report("error", error=str(e))
+            raise
+
+        if not chunks_count:
+            await _record_failure(db, document_id, "No text to process.", timings)
+            report("error", error="No text to process.")
             return ProcessingStatusResponse(
                 document_id=document_id,
                 status="error",
                 chunks_count=0,
                 error="No text to process.",
+                **timings.as_ms(),
             )
 
-        try:
-            vectors = await embed(chunks, prefix="passage: ")
-        except HTTPException:
-            await db.execute(
-                update(ProcessingDocument)
-                .where(ProcessingDocument.id == document_id)
-                .values(status="error", error="Embedding failed.")
+        processed_at = datetime.now(UTC)
+        # The swap: retrieval moves to the new version in this one UPDATE,
+        # and the version it replaces is queued for deletion.
+        final = (
+            update(ProcessingDocument)
+            .where(ProcessingDocument.id == document_id)
+            .values(
+                retired_version=case(
+                    (
+                        ProcessingDocument.active_version != version,
+                        ProcessingDocument.active_version,
+                    ),
+                    else_=ProcessingDocument.retired_version,
+                ),
+                active_version=version,
+                active_model=embed_model,
+                status="ready",
+                error=None,
+                chunks_count=chunks_count,
+                coverage=100,
+                embed_model=embed_model,
+                processed_at=processed_at,
+                **timings.as_ms(),
             )
-            await db.commit()
-            raise
-
-        for idx, (content, vec) in enumerate(zip(chunks, vectors)):
-            db.add(
-                DocumentChunk(
-                    document_id=document_id,
-                    chunk_index=idx,
-                    content=content,
-                    embedding=vec,
-                    chunk_metadata={**meta, "chunk_index": idx},
-                )
-            )
-
-        await db.execute(
-            update(ProcessingDocument).where(ProcessingDocument.id == document_id).values(status="ready", error=None)
         )
+        if checkpoint_pages and page_count:
+            # Every page has been read, including any without text.
+            final = final.values(pages_extracted=page_count, page_count=page_count)
+        await db.execute(final)
         await db.commit()
+        report("ready", chunks_count, chunks_count)
 
         return ProcessingStatusResponse(
             document_id=document_id,
             status="ready",
-            chunks_count=len(chunks),
+            chunks_count=chunks_count,
             error=None,
+            coverage=100,
+            searchable=True,
+            embed_model=embed_model,
+            processed_at=processed_at,
+            **timings.as_ms(),
+        )
+
+    @staticmethod
+    async def delete_retired_chunks(db: AsyncSession, document_id: UUID) -> bool:
+        """Delete the chunks of versions the document no longer reads.
+
+        Clears the retirement mark and deletes everything below the active
+        version in one transaction; the UPDATE's row lock keeps a swap
+        from landing in between.  Returns False if nothing was retired.
+        """
+        active = await db.scalar(
+            update(ProcessingDocument)
+            .where(
+                ProcessingDocument.id == document_id,
+                ProcessingDocument.retired_version.is_not(None),
+            )
+            .values(retired_version=None)
+            .returning(ProcessingDocument.active_version)
+        )
+        if active is None:
+            return False
+        await db.execute(
+            delete(DocumentChunk).where(
+                DocumentChunk.document_id == document_id,
+                DocumentChunk.index_version < active,
+            )
         )
+        await db.commit()
+        return True
+
+    @staticmethod
+    async def get_statuses(
+        db: AsyncSession,
+        user_id: UUID,
+        document_ids: list[UUID],
+    ) -> list[ProcessingStatusResponse]:
+        """Processing status of the user's documents among *document_ids*.
+
+        One query: ``documents`` joined to ``processing_documents`` on their
+        shared primary key, reading only the columns the pipeline maintains.
+        Ids the user does not own are left out; owned documents that were
+        never processed are reported as pending.
+        """
+        rows = (
+            await db.execute(
+                select(
+                    UserDocument.id,
+                    ProcessingDocument.status,
+                    ProcessingDocument.chunks_count,
+                    ProcessingDocument.error,
+                    ProcessingDocument.coverage,
+                    ProcessingDocument.active_version,
+                    ProcessingDocument.embed_model,
+                    ProcessingDocument.processed_at,
+                    ProcessingDocument.extract_ms,
+                    ProcessingDocument.chunk_ms,
+                    ProcessingDocument.embed_ms,
+                    ProcessingDocument.store_ms,
+                    ProcessingDocument.total_ms,
+                )
+                .outerjoin(ProcessingDocument, ProcessingDocument.id == UserDocument.id)
+                .where(
+                    UserDocument.id.in_(document_ids), UserDocument.user_id == user_id
+                )
+            )
+        ).all()
+        return [
+            ProcessingStatusResponse(
+                document_id=row.id,
+                status=row.status or "pending",
+                chunks_count=row.chunks_count or 0,
+                error=row.error,
+                coverage=row.coverage,
+                searchable=row.active_version is not None,
+                embed_model=row.embed_model,
+                processed_at=row.processed_at,
+                extract_ms=row.extract_ms,
+                chunk_ms=row.chunk_ms,
+                embed_ms=row.embed_ms,
+                store_ms=row.store_ms,
+                total_ms=row.total_ms,
+            )
+            for row in rows
+        ]
+
+    @staticmethod
+    async def watch_progress(
+        user_id: UUID,
+        document_ids: list[UUID] | None = None,
+    ) -> AsyncIterator[tuple[str, str]]:
+        """Subscribe to ingestion progress; return the SSE event stream.
+
+        Subscribes before reading the current state so no event is missed
+        in between.  With *document_ids*, ids the user does not own are
+        dropped (404 if none are left), each document's stored status is
+        sent first, and the stream ends with ``done`` once all of them are
+        ready or failed.  Runs its queries in a short-lived session so the
+        stream holds no connection.
+        """
+        watched = set(document_ids) if document_ids else None
+        subscription = progress_hub.subscribe(user_id, watched)
+        try:
+            statuses: list[ProcessingStatusResponse] = []
+            if watched is not None:
+                async with session_scope() as db:
+                    statuses = await ProcessingService.get_statuses(
+                        db, user_id, list(watched)
+                    )
+                if not statuses:
+                    raise HTTPException(status_code=404, detail="Document not found.")
+                subscription.document_ids = {s.document_id for s in statuses}
+        except BaseException:
+            subscription.close()
+            raise
+        return _progress_events(subscription, statuses, follow_all=watched is None)
 
     @staticmethod
     async def rag_query(
@@ -280,13 +789,14 @@ class ProcessingService:
         doc = await db.scalar(select(ProcessingDocument).where(ProcessingDocument.id == document_id))
         if doc is None:
             raise HTTPException(status_code=404, detail="Document not found.")
-        if doc.status != "ready":
+        if doc.active_version is None:
             raise HTTPException(
                 status_code=400,
                 detail=f"Document status is '{doc.status}', not ready.",
             )
+        partial = doc.active_version == doc.index_version and doc.status != "ready"
 
-        qvec = (await embed([question], prefix="query: "))[0]
+        qvec = await embed_query(question, model=doc.active_model)
         vec_schema = await _resolve_vec_schema(db)
         qvec_str = "[" + ",".join(str(x) for x in qvec) + "]"
 
@@ -294,14 +804,19 @@ class ProcessingService:
             f"""
             SELECT id, document_id, chunk_index, content, metadata, embedding, created_at
             FROM document_chunks
-            WHERE document_id = :document_id
+            WHERE document_id = :document_id AND index_version = :version
             ORDER BY embedding <=> CAST(:qvec AS {vec_schema}.vector)
             LIMIT :limit
             """
         )
         result = await db.execute(
             stmt,
-            {"document_id": document_id, "qvec": qvec_str, "limit": top_k},
+            {
+                "document_id": document_id,
+                "version": doc.active_version,
+                "qvec": qvec_str,
+                "limit": top_k,
+            },
         )
         rows = result.mappings().all()
 
@@ -312,6 +827,7 @@ class ProcessingService:
                 chunk_index=row["chunk_index"],
                 content=row["content"],
                 metadata=row["metadata"] or {},
+                partial=partial,
             )
             for row in rows
         ]
@@ -345,63 +861,90 @@ class ProcessingService:
         2. ``document_ids`` provided → those specific docs (ownership verified, must be ready).
         3. Neither provided → all of the user's RAG-ready documents.
 
-        Returns context text and the matched chunks for source attribution.
+        Only each document's active chunk version is read, so documents
+        being re-indexed stay searchable.  Partially indexed documents
+        count as ready; their chunks are flagged ``partial``.  The query
+        is embedded with each model the documents' active chunks use, and
+        matches from several models are merged by distance.  Returns
+        context text and the matched chunks for source attribution.
         """
         # --- Resolve document ID set ---
         if folder_ids is not None and len(folder_ids) > 0:
             rows = await db.execute(
-                select(UserDocument.id)
+                select(
+                    UserDocument.id, READING_PARTIAL, ProcessingDocument.active_model
+                )
                 .join(ProcessingDocument, ProcessingDocument.id == UserDocument.id)
                 .where(
                     UserDocument.user_id == user_id,
                     UserDocument.folder_id.in_(folder_ids),
-                    ProcessingDocument.status == "ready",
+                    ProcessingDocument.active_version.is_not(None),
                 )
             )
-            resolved_ids = [r[0] for r in rows.all()]
+            resolved = rows.all()
         elif document_ids is not None and len(document_ids) > 0:
             rows = await db.execute(
-                select(UserDocument.id)
+                select(
+                    UserDocument.id, READING_PARTIAL, ProcessingDocument.active_model
+                )
                 .join(ProcessingDocument, ProcessingDocument.id == UserDocument.id)
                 .where(
                     UserDocument.id.in_(document_ids),
                     UserDocument.user_id == user_id,
-                    ProcessingDocument.status == "ready",
+                    ProcessingDocument.active_version.is_not(None),
                 )
             )
-            resolved_ids = [r[0] for r in rows.all()]
+            resolved = rows.all()
         else:
             rows = await db.execute(
-                select(UserDocument.id)
+                select(
+                    UserDocument.id, READING_PARTIAL, ProcessingDocument.active_model
+                )
                 .join(ProcessingDocument, ProcessingDocument.id == UserDocument.id)
                 .where(
                     UserDocument.user_id == user_id,
-                    ProcessingDocument.status == "ready",
+                    ProcessingDocument.active_version.is_not(None),
                 )
             )
-            resolved_ids = [r[0] for r in rows.all()]
+            resolved = rows.all()
 
-        if not resolved_ids:
+        if not resolved:
             return RetrieveResult(context_text="", context_chunks=[])
-
-        qvec = (await embed([question], prefix="query: "))[0]
+        partial_ids = {r[0] for r in resolved if r[1]}
+        # Documents by the model their active chunks were embedded with;
+        # one model except while an embedding migration is switching over.
+        by_model: dict[str | None, list[UUID]] = {}
+        for r in resolved:
+            by_model.setdefault(r[2], []).append(r[0])
+
+        qvecs = await asyncio.gather(
+            *(embed_query(question, model=m) for m in by_model)
+        )
         vec_schema = await _resolve_vec_schema(db)
-        qvec_str = "[" + ",".join(str(x) for x in qvec) + "]"
 
         stmt = text(
             f"""
-            SELECT id, document_id, chunk_index, content, metadata, embedding, created_at
-            FROM document_chunks
-            WHERE document_id = ANY(:doc_ids)
-            ORDER BY embedding <=> CAST(:qvec AS {vec_schema}.vector)
+            SELECT c.id, c.document_id, c.chunk_index, c.content, c.metadata,
+                   c.embedding, c.created_at,
+                   c.embedding <=> CAST(:qvec AS {vec_schema}.vector) AS distance
+            FROM document_chunks c
+            JOIN processing_documents d
+              ON d.id = c.document_id AND d.active_version = c.index_version
+            WHERE c.document_id = ANY(:doc_ids)
+            ORDER BY c.embedding <=> CAST(:qvec AS {vec_schema}.vector)
             LIMIT :limit
             """
         )
-        result = await db.execute(
-            stmt,
-            {"doc_ids": resolved_ids, "qvec": qvec_str, "limit": top_k},
-        )
-        rows_data = result.mappings().all()
+        rows_data = []
+        for doc_ids, qvec in zip(by_model.values(), qvecs, strict=True):
+            qvec_str = "[" + ",".join(str(x) for x in qvec) + "]"
+            result = await db.execute(
+                stmt,
+                {"doc_ids": doc_ids, "qvec": qvec_str, "limit": top_k},
+            )
+            rows_data.extend(result.mappings().all())
+        if len(by_model) > 1:
+            rows_data = sorted(rows_data, key=lambda row: row["distance"])[:top_k]
 
         context_chunks = [
             ChunkResponse(
@@ -410,12 +953,14 @@ class ProcessingService:
                 chunk_index=row["chunk_index"],
                 content=row["content"],
                 metadata=row["metadata"] or {},
+                partial=row["document_id"] in partial_ids,
             )
             for row in rows_data
         ]
 
         context_text = "\n\n---\n\n".join(
-            f"[Doc {c.document_id} | Chunk {c.chunk_index}]\n{c.content}"
+            f"[Doc {c.document_id}{PARTIAL_NOTE if c.partial else ''} "
+            f"| Chunk {c.chunk_index}]\n{c.content}"
             for c in context_chunks
         )
 
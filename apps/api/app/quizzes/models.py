@@ -4,7 +4,7 @@ from __future__ import annotations
 
 from uuid import UUID
 
-from sqlalchemy import ForeignKey, Integer, String, Text
+from sqlalchemy import ForeignKey, Index, Integer, String, Text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -16,6 +16,10 @@ class QuizSet(Base, UUIDMixin, TimestampMixin):
     """A named quiz generated from user documents."""
 
     __tablename__ = "quiz_sets"
+    # Serves the newest-first keyset pagination of a user's sets.
+    __table_args__ = (
+        Index("ix_quiz_sets_user_created", "user_id", "created_at", "id"),
+    )
 
     user_id: Mapped[UUID] = mapped_column(
         PG_UUID(as_uuid=True), index=True, nullable=False
@@ -28,13 +32,18 @@ class QuizSet(Base, UUIDMixin, TimestampMixin):
         nullable=True,
     )
     document_ids: Mapped[list] = mapped_column(JSONB, default=list)
+    # Maintained on insert so listing sets never touches quiz_questions.
+    question_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0", nullable=False
+    )
 
     questions: Mapped[list[QuizQuestion]] = relationship(
         "QuizQuestion",
         back_populates="quiz_set",
         cascade="all, delete-orphan",
         order_by="QuizQuestion.position",
-        lazy="selectin",
+        lazy="raise",
+        passive_deletes=True,
     )
 
     def __repr__(self) -> str:
@@ -58,7 +67,9 @@ class QuizQuestion(Base, UUIDMixin):
     explanation: Mapped[str | None] = mapped_column(Text, nullable=True)
     position: Mapped[int] = mapped_column(Integer, default=0)
 
-    quiz_set: Mapped[QuizSet] = relationship("QuizSet", back_populates="questions")
+    quiz_set: Mapped[QuizSet] = relationship(
+        "QuizSet", back_populates="questions", lazy="raise"
+    )
 
     def __repr__(self) -> str:
         return f"<QuizQuestion(id={self.id}, question={self.question[:30]!r})>"
@@ -4,61 +4,119 @@ from __future__ import annotations
 
 from uuid import UUID
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
 from app.core.config import get_settings
+from app.core.deadline import request_deadline
 from app.core.dependencies import CurrentUser, DbSession
+from app.core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.core.quotas import token_quotas
 from app.core.rate_limiter import rate_limiter
+from app.core.sse import encode_sse
 from app.core.token_budget import token_budget
+from app.inference.usage import usage_scope
 from app.quizzes.schemas import (
     QuizGenerateRequest,
+    QuizSetPage,
     QuizSetResponse,
-    QuizSetSummary,
 )
 from app.quizzes.service import QuizService
 
 router = APIRouter(prefix="/quizzes", tags=["quizzes"])
 
 
-@router.post("/generate", response_model=QuizSetResponse)
-async def generate_quiz(
-    req: QuizGenerateRequest,
-    current_user: CurrentUser,
-    db: DbSession,
-) -> QuizSetResponse:
-    """Generate a new quiz set from user documents."""
-    user_id = str(current_user.user_id)
+async def _check_generate_limits(user_id: str) -> None:
+    """Enforce rate limit, token budget and user quota for generation."""
     settings = get_settings()
-    if not rate_limiter.is_allowed(
+    decision = await rate_limiter.check(
         user_id, "generate", settings.rate_limit_generate_max, settings.rate_limit_generate_window
-    ):
+    )
+    if not decision.allowed:
         raise HTTPException(
             status_code=429,
             detail="Generation rate limit exceeded. Please wait before generating more quizzes.",
+            headers={"Retry-After": decision.retry_after_header},
         )
     if not token_budget.check():
         raise HTTPException(
             status_code=503,
             detail="Daily AI usage limit reached. Please try again tomorrow.",
         )
-    return await QuizService.generate(
-        db=db,
-        user_id=current_user.user_id,
-        title=req.title,
-        folder_id=req.folder_id,
-        document_ids=req.document_ids,
-        topic=req.topic,
-        num_questions=req.num_questions,
+    await token_quotas.admit(user_id, "quizzes")
+
+
+@router.post(
+    "/generate",
+    response_model=QuizSetResponse,
+    dependencies=[Depends(request_deadline)],
+)
+async def generate_quiz(
+    req: QuizGenerateRequest,
+    current_user: CurrentUser,
+    db: DbSession,
+) -> QuizSetResponse:
+    """Generate a new quiz set from user documents."""
+    user_id = str(current_user.user_id)
+    await _check_generate_limits(user_id)
+    with usage_scope(user_id=current_user.user_id, feature="quizzes"):
+        return await QuizService.generate(
+            db=db,
+            user_id=current_user.user_id,
+            title=req.title,
+            folder_id=req.folder_id,
+            document_ids=req.document_ids,
+            topic=req.topic,
+            num_questions=req.num_questions,
+        )
+
+
+@router.post("/generate/stream", dependencies=[Depends(request_deadline)])
+async def generate_quiz_stream(
+    req: QuizGenerateRequest,
+    current_user: CurrentUser,
+) -> StreamingResponse:
+    """Generate a new quiz set, streaming each question via Server-Sent Events.
+
+    Events: ``set``, one ``question`` per question as the model completes
+    it, then ``done`` or ``error``.  Questions are saved as they arrive, and
+    the set is completed even if the client disconnects.
+    """
+    user_id = str(current_user.user_id)
+    await _check_generate_limits(user_id)
+    with usage_scope(user_id=current_user.user_id, feature="quizzes"):
+        events = await QuizService.generate_stream(
+            user_id=current_user.user_id,
+            title=req.title,
+            folder_id=req.folder_id,
+            document_ids=req.document_ids,
+            topic=req.topic,
+            num_questions=req.num_questions,
+        )
+    return StreamingResponse(
+        encode_sse(events),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
     )
 
 
-@router.get("/sets", response_model=list[QuizSetSummary])
+@router.get("/sets", response_model=QuizSetPage)
 async def list_quiz_sets(
     current_user: CurrentUser,
     db: DbSession,
-) -> list[QuizSetSummary]:
-    """List all quiz sets for the current user."""
-    return await QuizService.list_sets(db, current_user.user_id)
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+) -> QuizSetPage:
+    """List the current user's quiz sets, newest first.
+
+    Pass the returned ``next_cursor`` as ``cursor`` to get the next page.
+    """
+    return await QuizService.list_sets(
+        db, current_user.user_id, cursor=cursor, limit=limit
+    )
 
 
 @router.get("/sets/{set_id}", response_model=QuizSetResponse)
@@ -64,3 +64,11 @@ class QuizSetSummary(BaseModel):
     folder_id: UUID | None
     question_count: int
     created_at: datetime
+
+
+class QuizSetPage(BaseModel):
+    """One page of quiz sets, newest first."""
+
+    items: list[QuizSetSummary]
+    # Pass as ``cursor`` to get the next page; ``None`` on the last page.
+    next_cursor: str | None = None
@@ -3,45 +3,79 @@
 from __future__ import annotations
 
 import logging
+from collections.abc import AsyncIterator, Callable
 from uuid import UUID
 
 from fastapi import HTTPException
-from sqlalchemy import delete, func, select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
+from app.core.database import session_scope
+from app.core.pagination import DEFAULT_PAGE_SIZE, keyset_page, split_page
 from app.inference.client import get_llm_client
+from app.inference.generation import (
+    ItemWriter,
+    context_top_k,
+    generate_items,
+    relay_generation,
+    stream_items,
+)
 from app.inference.prompts import QUIZ_SYSTEM_PROMPT
+from app.processing.schemas import ChunkResponse, RetrieveResult
 from app.processing.service import ProcessingService
 from app.quizzes.models import QuizQuestion, QuizSet
-from app.quizzes.schemas import QuizSetResponse, QuizSetSummary
+from app.quizzes.schemas import QuizSetPage, QuizSetResponse, QuizSetSummary
 
 logger = logging.getLogger(__name__)
 
 
+def _build_prompt(topic: str | None) -> Callable[[int, str], str]:
+    topic_hint = f"Focus on: {topic}" if topic else ""
+
+    def build_prompt(count: int, context_text: str) -> str:
+        return (
+            f"Generate exactly {count} multiple-choice "
+            f"questions from the following study material.\n\n"
+            f"{topic_hint}\n\n"
+            f"Study material:\n{context_text}"
+        )
+
+    return build_prompt
+
+
+def _question_row(position: int, q: dict) -> dict:
+    """Column values for one generated question."""
+    return {
+        "question": q.get("question", ""),
+        "options": q.get("options", []),
+        "correct_option": q.get("correct_option", "A"),
+        "explanation": q.get("explanation"),
+        "position": position,
+    }
+
+
 class QuizService:
     """Service for generating, listing, and managing quiz sets."""
 
     @staticmethod
-    async def generate(
+    async def _retrieve(
         db: AsyncSession,
         user_id: UUID,
         *,
-        title: str | None = None,
-        folder_id: UUID | None = None,
-        document_ids: list[UUID] | None = None,
-        topic: str | None = None,
-        num_questions: int = 10,
-    ) -> QuizSetResponse:
-        """Generate a quiz set from user documents via RAG + LLM."""
-        folder_ids = [folder_id] if folder_id else None
-
+        folder_id: UUID | None,
+        document_ids: list[UUID] | None,
+        topic: str | None,
+        num_questions: int,
+    ) -> RetrieveResult:
+        """Retrieve generation context; 400 if no indexed chunks match."""
         retrieve = await ProcessingService.rag_retrieve_multi(
             db=db,
             user_id=user_id,
             question=topic or "key concepts and important information",
-            top_k=6,
+            top_k=context_top_k(num_questions),
             document_ids=document_ids,
-            folder_ids=folder_ids,
+            folder_ids=[folder_id] if folder_id else None,
         )
 
         if not retrieve.context_chunks:
@@ -52,56 +86,82 @@ class QuizService:
                     "Upload and process documents first."
                 ),
             )
+        return retrieve
 
-        topic_hint = f"Focus on: {topic}" if topic else ""
-        user_prompt = (
-            f"Generate exactly {num_questions} multiple-choice "
-            f"questions from the following study material.\n\n"
-            f"{topic_hint}\n\n"
-            f"Study material:\n{retrieve.context_text}"
+    @staticmethod
+    def _new_set(
+        user_id: UUID,
+        *,
+        title: str | None,
+        topic: str | None,
+        folder_id: UUID | None,
+        chunks: list[ChunkResponse],
+    ) -> QuizSet:
+        """Build (not persist) a set generated from *chunks*."""
+        source_doc_ids = list({str(c.document_id) for c in chunks})
+        return QuizSet(
+            user_id=user_id,
+            title=title or topic or "Quiz",
+            description=f"Generated from {len(source_doc_ids)} document(s)",
+            folder_id=folder_id,
+            document_ids=source_doc_ids,
         )
 
-        llm = get_llm_client()
-        raw = await llm.generate_json(
-            system_prompt=QUIZ_SYSTEM_PROMPT,
-            user_prompt=user_prompt,
-            temperature=0.3,
+    @staticmethod
+    async def generate(
+        db: AsyncSession,
+        user_id: UUID,
+        *,
+        title: str | None = None,
+        folder_id: UUID | None = None,
+        document_ids: list[UUID] | None = None,
+        topic: str | None = None,
+        num_questions: int = 10,
+    ) -> QuizSetResponse:
+        """Generate a quiz set from user documents via RAG + LLM.
+
+        Large sets are generated map-reduce style over groups of chunks.
+        """
+        retrieve = await QuizService._retrieve(
+            db,
+            user_id,
+            folder_id=folder_id,
+            document_ids=document_ids,
+            topic=topic,
+            num_questions=num_questions,
         )
 
-        questions_data = raw.get("questions", [])
+        questions_data = await generate_items(
+            get_llm_client(),
+            system_prompt=QUIZ_SYSTEM_PROMPT,
+            key="questions",
+            chunks=retrieve.context_chunks,
+            num_items=num_questions,
+            build_prompt=_build_prompt(topic),
+            text_of=lambda q: q.get("question", ""),
+        )
         if not questions_data:
             raise HTTPException(
                 status_code=502,
                 detail="LLM did not return any quiz questions.",
             )
 
-        source_doc_ids = list({str(c.document_id) for c in retrieve.context_chunks})
-        set_title = title or topic or "Quiz"
-
-        quiz_set = QuizSet(
-            user_id=user_id,
-            title=set_title,
-            description=f"Generated from {len(source_doc_ids)} document(s)",
+        quiz_set = QuizService._new_set(
+            user_id,
+            title=title,
+            topic=topic,
             folder_id=folder_id,
-            document_ids=source_doc_ids,
+            chunks=retrieve.context_chunks,
         )
+        quiz_set.question_count = len(questions_data)
         db.add(quiz_set)
         await db.flush()
 
         for idx, q in enumerate(questions_data):
-            db.add(
-                QuizQuestion(
-                    set_id=quiz_set.id,
-                    question=q.get("question", ""),
-                    options=q.get("options", []),
-                    correct_option=q.get("correct_option", "A"),
-                    explanation=q.get("explanation"),
-                    position=idx,
-                )
-            )
+            db.add(QuizQuestion(set_id=quiz_set.id, **_question_row(idx, q)))
 
         await db.commit()
-        await db.refresh(quiz_set)
+        await db.refresh(quiz_set, ["created_at", "updated_at", "questions"])
 
         logger.info(
             "quiz set generated user_id=%s set_id=%s questions=%d",
@@ -110,40 +170,119 @@ class QuizService:
         return QuizSetResponse.model_validate(quiz_set)
 
     @staticmethod
-    async def list_sets(db: AsyncSession, user_id: UUID) -> list[QuizSetSummary]:
-        """Return all quiz sets for a user (lightweight, no questions)."""
-        stmt = (
-            select(
-                QuizSet,
-                func.count(QuizQuestion.id).label("question_count"),
+    async def generate_stream(
+        user_id: UUID,
+        *,
+        title: str | None = None,
+        folder_id: UUID | None = None,
+        document_ids: list[UUID] | None = None,
+        topic: str | None = None,
+        num_questions: int = 10,
+    ) -> AsyncIterator[tuple[str, str]]:
+        """Start generating a quiz set and return its SSE events.
+
+        Same flow as ``FlashcardService.generate_stream``: ``set``, one
+        ``question`` per question as it completes, then ``done`` (set id
+        and question count) or ``error``.
+        """
+        async with session_scope() as db:
+            retrieve = await QuizService._retrieve(
+                db,
+                user_id,
+                folder_id=folder_id,
+                document_ids=document_ids,
+                topic=topic,
+                num_questions=num_questions,
+            )
+            quiz_set = QuizService._new_set(
+                user_id,
+                title=title,
+                topic=topic,
+                folder_id=folder_id,
+                chunks=retrieve.context_chunks,
             )
-            .outerjoin(QuizQuestion, QuizQuestion.set_id == QuizSet.id)
-            .where(QuizSet.user_id == user_id)
-            .group_by(QuizSet.id)
-            .order_by(QuizSet.created_at.desc())
+            db.add(quiz_set)
+            await db.commit()
+        set_id = quiz_set.id
+
+        questions = stream_items(
+            get_llm_client(),
+            system_prompt=QUIZ_SYSTEM_PROMPT,
+            key="questions",
+            chunks=retrieve.context_chunks,
+            num_items=num_questions,
+            build_prompt=_build_prompt(topic),
+            text_of=lambda q: q.get("question", ""),
         )
-        rows = (await db.execute(stmt)).all()
-
-        return [
-            QuizSetSummary(
-                id=qset.id,
-                title=qset.title,
-                description=qset.description,
-                folder_id=qset.folder_id,
-                question_count=count,
-                created_at=qset.created_at,
+
+        async def finish(count: int) -> dict:
+            if not count:
+                async with session_scope() as db:
+                    await db.execute(delete(QuizSet).where(QuizSet.id == set_id))
+                    await db.commit()
+                raise HTTPException(
+                    status_code=502,
+                    detail="LLM did not return any quiz questions.",
+                )
+            logger.info(
+                "quiz set streamed user_id=%s set_id=%s questions=%d",
+                user_id, set_id, count,
             )
-            for qset, count in rows
-        ]
+            return {"set_id": set_id, "question_count": count}
+
+        return relay_generation(
+            questions,
+            ItemWriter(
+                QuizQuestion, set_id, _question_row, counter=QuizSet.question_count
+            ),
+            created={"id": set_id, "title": quiz_set.title},
+            event="question",
+            finish=finish,
+        )
+
+    @staticmethod
+    async def list_sets(
+        db: AsyncSession,
+        user_id: UUID,
+        *,
+        cursor: str | None = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+    ) -> QuizSetPage:
+        """Return one page of a user's quiz sets, newest first.
+
+        Projects summary columns only (the questions relationship is never
+        loaded) and reads the maintained ``question_count``.
+        """
+        stmt = keyset_page(
+            select(
+                QuizSet.id,
+                QuizSet.title,
+                QuizSet.description,
+                QuizSet.folder_id,
+                QuizSet.question_count,
+                QuizSet.created_at,
+            ).where(QuizSet.user_id == user_id),
+            QuizSet.created_at,
+            QuizSet.id,
+            cursor=cursor,
+            limit=limit,
+        )
+        rows, next_cursor = split_page((await db.execute(stmt)).all(), limit)
+        return QuizSetPage(
+            items=[QuizSetSummary.model_validate(row) for row in rows],
+            next_cursor=next_cursor,
+        )
 
     @staticmethod
     async def get_set(db: AsyncSession, user_id: UUID, set_id: UUID) -> QuizSetResponse:
         """Get a single quiz set with all questions."""
         qset = await db.scalar(
-            select(QuizSet).where(
+            select(QuizSet)
+            .where(
                 QuizSet.id == set_id,
                 QuizSet.user_id == user_id,
             )
+            .options(selectinload(QuizSet.questions))
         )
         if qset is None:
             raise HTTPException(status_code=404, detail="Quiz set not found.")
@@ -0,0 +1,70 @@
+"""Micro-benchmark: per-request auth overhead of ``get_current_user``.
+
+Signs an ES256 token with a throwaway key, loads the matching public key
+into the JWKS store, then times ``get_current_user`` with the verified
+token cache cleared before every call (full signature verification) and
+with it warm (a repeat request with the same bearer token).
+
+Usage::
+
+    python benchmarks/auth_bench.py --iterations 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from uuid import uuid4
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import jwt  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ec  # noqa: E402
+from fastapi.security import HTTPAuthorizationCredentials  # noqa: E402
+
+from app.core import dependencies  # noqa: E402
+from app.core.auth import JWKSStore  # noqa: E402
+
+
+async def _time(
+    iterations: int, creds: HTTPAuthorizationCredentials, clear: bool
+) -> float:
+    cache = dependencies.token_cache
+    start = time.perf_counter()
+    for _ in range(iterations):
+        if clear:
+            cache.clear()
+        await dependencies.get_current_user(creds)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    jwk = json.loads(jwt.algorithms.ECAlgorithm.to_jwk(private_key.public_key()))
+    store = JWKSStore("https://example.invalid/jwks.json")
+    store.load({"keys": [{**jwk, "kid": "bench", "alg": "ES256", "use": "sig"}]})
+    dependencies.jwks_store = store
+    dependencies.settings.debug = False
+
+    token = jwt.encode(
+        {"sub": str(uuid4()), "aud": "authenticated", "exp": int(time.time() + 3600)},
+        private_key, algorithm="ES256", headers={"kid": "bench"},
+    )
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    cold = await _time(args.iterations, creds, clear=True)
+    warm = await _time(args.iterations, creds, clear=False)
+    print(f"verify every request: {cold:8.1f} us/request")
+    print(f"cached token:         {warm:8.1f} us/request")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
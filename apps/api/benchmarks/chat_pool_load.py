@@ -0,0 +1,81 @@
+"""Load test: concurrent chat streams vs. document/flashcard endpoints.
+
+Opens ``--chats`` concurrent ``POST /api/chat/stream`` requests and, while
+they are streaming, hammers ``GET /api/documents`` and
+``GET /api/flashcards/sets``.  Reports latency percentiles for the
+non-chat endpoints and the DB pool occupancy from ``/health``; with chat
+streams holding no pooled connection, those latencies should stay flat as
+``--chats`` grows past the pool size.
+
+Usage (against a running API)::
+
+    python benchmarks/chat_pool_load.py --base-url http://localhost:8000 \\
+        --token "$ACCESS_TOKEN" --chats 20 --requests 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def _chat(client: httpx.AsyncClient, headers: dict[str, str]) -> None:
+    body = {"message": "Explain photosynthesis in detail.", "ephemeral": True}
+    async with client.stream(
+        "POST", "/api/chat/stream", json=body, headers=headers
+    ) as r:
+        async for _ in r.aiter_bytes():
+            pass
+
+
+async def _timed_get(
+    client: httpx.AsyncClient, path: str, headers: dict[str, str]
+) -> float:
+    start = time.perf_counter()
+    r = await client.get(path, headers=headers)
+    r.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+
+def _pct(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True, help="Supabase access token")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"}
+    limits = httpx.Limits(max_connections=args.chats + 50)
+    async with httpx.AsyncClient(
+        base_url=args.base_url, timeout=120, limits=limits
+    ) as client:
+        chats = [asyncio.create_task(_chat(client, headers)) for _ in range(args.chats)]
+        await asyncio.sleep(1.0)  # let the streams get going
+
+        paths = ["/api/documents", "/api/flashcards/sets"]
+        latencies = await asyncio.gather(
+            *(_timed_get(client, paths[i % 2], headers) for i in range(args.requests))
+        )
+        health = (await client.get("/health")).json()
+        await asyncio.gather(*chats, return_exceptions=True)
+
+    print(f"concurrent chat streams: {args.chats}")
+    print(
+        f"document/flashcard latency ms: p50={statistics.median(latencies):.1f} "
+        f"p95={_pct(latencies, 0.95):.1f} max={max(latencies):.1f}"
+    )
+    print(f"db pool during run: {health.get('db_pool')}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
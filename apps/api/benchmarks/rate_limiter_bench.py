@@ -0,0 +1,56 @@
+"""Micro-benchmark: GCRA rate limiter time and memory per key.
+
+Runs ``--users`` distinct users through the in-process GCRA backend in
+rounds and reports the mean cost of a check and the limiter's memory after
+each round.  Time per check should stay flat as the key count grows, and
+memory should stop growing once idle keys are swept or ``--max-keys`` is
+reached.
+
+Usage::
+
+    python benchmarks/rate_limiter_bench.py --users 1000000 --max-keys 200000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.core.rate_limiter import MemoryRateLimitBackend  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--max-keys", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    limiter = MemoryRateLimitBackend(max_keys=args.max_keys)
+    keys = [f"chat:user-{i:07d}" for i in range(args.users)]
+    per_round = max(1, args.users // args.rounds)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for r in range(args.rounds):
+        batch = keys[r * per_round:(r + 1) * per_round]
+        start = time.perf_counter()
+        for key in batch:
+            limiter.hit_now(key, 10, 60)
+        elapsed = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0] - baseline
+        print(
+            f"round={r + 1} keys={len(limiter):>9,} "
+            f"ns/check={elapsed / len(batch) * 1e9:8.0f} "
+            f"memory={memory / 2**20:7.1f} MiB"
+        )
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
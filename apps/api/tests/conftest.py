@@ -1,13 +1,17 @@
 """Shared fixtures for StudyBudd API tests."""
+import os
 import pytest
 from datetime import datetime, timezone
 from unittest.mock import AsyncMock, MagicMock
 from uuid import UUID, uuid4
 
 from httpx import AsyncClient, ASGITransport
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 
 from app.main import app
 from app.core.dependencies import get_current_user, get_db, AuthenticatedUser
+from app.core.models import Base
 
 TEST_USER_ID = UUID("00000000-0000-0000-0000-000000000001")
 TEST_DOC_ID = UUID("00000000-0000-0000-0000-000000000002")
@@ -15,6 +19,10 @@ TEST_FOLDER_ID = UUID("00000000-0000-0000-0000-000000000003")
 
 _NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
 
+# A Postgres URL (postgresql+asyncpg://...) with pgvector available, for the
+# tests that need a real database.  They are skipped when it is unset.
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
 
 @pytest.fixture
 def mock_user() -> AuthenticatedUser:
@@ -75,3 +83,97 @@ def make_mock_folder(
     folder.created_at = _NOW
     folder.updated_at = _NOW
     return folder
+
+
+# =============================================================================
+# Real database: query budgets
+# =============================================================================
+
+
+class QueryLog:
+    """Statements an engine sent, with the row count each one reported.
+
+    Recorded from the engine's cursor events, so it sees every round trip
+    a code path makes (lazy loads and flushes included), not just the
+    calls made on the session.
+    """
+
+    def __init__(self) -> None:
+        self.statements: list[str] = []
+        self.rowcounts: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+    @property
+    def rows(self) -> int:
+        """Rows fetched or changed over all statements."""
+        return sum(max(0, n) for n in self.rowcounts)
+
+    def clear(self) -> None:
+        self.statements.clear()
+        self.rowcounts.clear()
+
+    def before_cursor_execute(
+        self, conn, cursor, statement, params, context, many
+    ) -> None:
+        self.statements.append(statement)
+        # Stays -1 if the statement fails.
+        self.rowcounts.append(-1)
+
+    def after_cursor_execute(
+        self, conn, cursor, statement, params, context, many
+    ) -> None:
+        self.rowcounts[-1] = cursor.rowcount
+
+
+@pytest.fixture
+async def pg_engine() -> AsyncEngine:
+    """Engine on a throwaway schema of ``TEST_DATABASE_URL`` with every table."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL not set")
+    schema = f"test_{uuid4().hex}"
+    engine = create_async_engine(
+        TEST_DATABASE_URL,
+        connect_args={"server_settings": {"search_path": f"{schema},public"}},
+    )
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector SCHEMA public"))
+        await conn.execute(text(f"CREATE SCHEMA {schema}"))
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+    await engine.dispose()
+
+
+@pytest.fixture
+def query_log(pg_engine: AsyncEngine) -> QueryLog:
+    """Every statement *pg_engine* runs during the test."""
+    log = QueryLog()
+    for name in ("before_cursor_execute", "after_cursor_execute"):
+        event.listen(pg_engine.sync_engine, name, getattr(log, name))
+    yield log
+    for name in ("before_cursor_execute", "after_cursor_execute"):
+        event.remove(pg_engine.sync_engine, name, getattr(log, name))
+
+
+@pytest.fixture
+async def pg_client(
+    mock_user: AuthenticatedUser, pg_engine: AsyncEngine
+) -> AsyncClient:
+    """Like *client*, but requests run on a real session from *pg_engine*."""
+    async with async_sessionmaker(pg_engine)() as session:
+        app.dependency_overrides[get_current_user] = lambda: mock_user
+        app.dependency_overrides[get_db] = lambda: session
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as c:
+            yield c
+        app.dependency_overrides.clear()
+
+
+async def seed(engine: AsyncEngine, *rows) -> None:
+    """Insert ORM *rows* in their own session and commit."""
+    async with async_sessionmaker(engine)() as session:
+        session.add_all(rows)
+        await session.commit()
@@ -0,0 +1,147 @@
+"""Tests for JWT verification, the JWKS store and the verified-token cache."""
+from __future__ import annotations
+
+import json
+import time
+from unittest.mock import patch
+from uuid import uuid4
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from app.core import dependencies
+from app.core.auth import JWKSStore, VerifiedTokenCache
+from app.core.dependencies import get_current_user
+
+_SECRET = "test-secret-0123456789abcdef0123456789"
+
+
+def _creds(token: str) -> HTTPAuthorizationCredentials:
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+def _hs256(sub: str, exp_in: float = 3600) -> str:
+    claims = {"sub": sub, "aud": "authenticated", "exp": int(time.time() + exp_in)}
+    return jwt.encode(claims, _SECRET, algorithm="HS256")
+
+
+@pytest.fixture
+def auth_env():
+    """Fresh cache and JWKS store, with an HS256 secret configured."""
+    cache = VerifiedTokenCache()
+    store = JWKSStore("https://example.test/jwks.json")
+    with (
+        patch.object(dependencies, "token_cache", cache),
+        patch.object(dependencies, "jwks_store", store),
+        patch.object(dependencies.settings, "supabase_jwt_secret", _SECRET),
+        patch.object(dependencies.settings, "debug", False),
+    ):
+        yield cache, store
+
+
+# =============================================================================
+# Unit Tests: get_current_user
+# =============================================================================
+
+
+@pytest.mark.asyncio
+async def test_verified_token_is_cached(auth_env):
+    cache, _ = auth_env
+    user_id = uuid4()
+    token = _hs256(str(user_id))
+
+    user = await get_current_user(_creds(token))
+    assert user.user_id == user_id
+    assert len(cache) == 1
+
+    with patch.object(dependencies.jwt, "decode") as decode:
+        again = await get_current_user(_creds(token))
+    decode.assert_not_called()
+    assert again is user
+
+
+@pytest.mark.asyncio
+async def test_expired_cache_entry_is_reverified(auth_env):
+    cache, _ = auth_env
+    token = _hs256(str(uuid4()), exp_in=-10)
+    cache.put(token, dependencies.AuthenticatedUser(user_id=uuid4()), time.time() - 10)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await get_current_user(_creds(token))
+    assert exc_info.value.status_code == 401
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_invalid_signature_is_not_cached(auth_env):
+    cache, _ = auth_env
+    token = jwt.encode(
+        {"sub": str(uuid4()), "aud": "authenticated"},
+        "wrong-secret-0123456789abcdef012345",
+        algorithm="HS256",
+    )
+
+    with pytest.raises(HTTPException):
+        await get_current_user(_creds(token))
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_es256_uses_prefetched_jwks(auth_env):
+    _, store = auth_env
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    jwk = json.loads(jwt.algorithms.ECAlgorithm.to_jwk(private_key.public_key()))
+    store.load({"keys": [{**jwk, "kid": "k1", "alg": "ES256", "use": "sig"}]})
+
+    user_id = uuid4()
+    token = jwt.encode(
+        {"sub": str(user_id), "aud": "authenticated", "exp": int(time.time() + 60)},
+        private_key, algorithm="ES256", headers={"kid": "k1"},
+    )
+    with patch.object(store, "refresh") as refresh:
+        user = await get_current_user(_creds(token))
+    refresh.assert_not_called()
+    assert user.user_id == user_id
+
+
+@pytest.mark.asyncio
+async def test_unknown_kid_is_rejected_after_refresh(auth_env):
+    _, store = auth_env
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    token = jwt.encode(
+        {"sub": str(uuid4()), "aud": "authenticated"},
+        private_key, algorithm="ES256", headers={"kid": "rotated"},
+    )
+
+    with patch.object(store, "refresh") as mock_refresh:
+        with pytest.raises(HTTPException) as exc_info:
+            await get_current_user(_creds(token))
+        # A second unknown kid right away does not refetch.
+        with pytest.raises(HTTPException):
+            await get_current_user(_creds(token))
+    assert exc_info.value.status_code == 401
+    assert mock_refresh.await_count == 1
+
+
+# =============================================================================
+# Unit Tests: VerifiedTokenCache
+# =============================================================================
+
+
+def test_token_cache_is_bounded():
+    cache = VerifiedTokenCache(max_entries=3)
+    user = dependencies.AuthenticatedUser(user_id=uuid4())
+    for i in range(5):
+        cache.put(f"token-{i}", user, time.time() + 60)
+    assert len(cache) == 3
+    assert cache.get("token-0") is None
+    assert cache.get("token-4") is user
+
+
+def test_token_cache_skips_tokens_without_exp():
+    cache = VerifiedTokenCache()
+    cache.put("token", dependencies.AuthenticatedUser(user_id=uuid4()), None)
+    assert len(cache) == 0
@@ -1,15 +1,23 @@
 """Tests for chat service and endpoints."""
 from __future__ import annotations
 
+import asyncio
 from datetime import datetime, timezone
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock, patch
 from uuid import uuid4
 
 import pytest
 from fastapi import HTTPException
 from httpx import AsyncClient
+from postgrest.exceptions import APIError
 
-from app.chat.service import ChatService
+from app.chat.history import _GONE, HistoryManager, _ConversationWindow
+from app.chat.schemas import ChatRequest
+from app.chat.service import ChatService, _background_tasks
+from app.chat.tools import TextToolCallScanner, accumulate_tool_call_deltas
+from app.core.sse import HEARTBEAT_FRAME, encode_sse, format_sse
+from app.inference.gateway import LLMOverloaded
 
 TEST_CONV_ID = "aaaaaaaa-0000-0000-0000-000000000001"
 _NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
@@ -53,6 +61,7 @@ def _make_supabase_mock(conv_data: list | None = None, msg_data: list | None = N
         tbl.eq.return_value = tbl
         tbl.order.return_value = tbl
         tbl.limit.return_value = tbl
+        tbl.gt.return_value = tbl
         if table_name == "conversations":
             tbl.execute.return_value = conv_res
         else:
@@ -175,6 +184,30 @@ async def test_chat_post_existing_conversation(client: AsyncClient):
     assert response.json()["conversation_id"] == existing_id
 
 
+@pytest.mark.asyncio
+async def test_chat_stream_sheds_with_503_when_llm_queue_full(client: AsyncClient):
+    """A full LLM gateway queue rejects the stream before it starts."""
+    with patch(
+        "app.chat.router.llm_gateway.ensure_capacity",
+        side_effect=LLMOverloaded(),
+    ):
+        response = await client.post("/api/chat/stream", json={"message": "Hi"})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+
+@pytest.mark.asyncio
+async def test_chat_returns_503_when_llm_call_is_shed(client: AsyncClient):
+    with patch(
+        "app.chat.router.chat_service.process_chat",
+        new=AsyncMock(side_effect=LLMOverloaded()),
+    ):
+        response = await client.post("/api/chat/", json={"message": "Hi"})
+
+    assert response.status_code == 503
+
+
 @pytest.mark.asyncio
 async def test_list_conversations(client: AsyncClient):
     """GET /api/chat/conversations returns the user's conversation list."""
@@ -269,3 +302,618 @@ async def test_delete_conversation_not_found(client: AsyncClient):
         response = await client.delete(f"/api/chat/conversations/{TEST_CONV_ID}")
 
     assert response.status_code == 404
+
+
+# =============================================================================
+# Unit Tests: incremental tool-call detection
+# =============================================================================
+
+
+def test_scanner_forwards_plain_text_immediately():
+    """Plain content deltas are emitted as soon as they arrive."""
+    scanner = TextToolCallScanner()
+    assert scanner.feed("Photosynthesis ") == "Photosynthesis "
+    assert scanner.feed("converts light.") == "converts light."
+    assert scanner.finish() == ("", None)
+
+
+def test_scanner_holds_back_partial_marker_then_releases():
+    """A possible marker prefix is held until it turns out to be ordinary text."""
+    scanner = TextToolCallScanner()
+    assert scanner.feed("a <tool") == "a "
+    assert scanner.feed("kit is handy") == "<toolkit is handy"
+    assert not scanner.capturing
+
+
+def test_scanner_captures_xml_tool_call_split_across_deltas():
+    """A <tool_call> split over several deltas is captured and parsed at the end."""
+    scanner = TextToolCallScanner()
+    emitted = "".join(
+        scanner.feed(d)
+        for d in [
+            "<tool_",
+            "call>search_my_documents<arg_key>query</arg_key>",
+            "<arg_value>cell division</arg_value></tool_call>",
+        ]
+    )
+    assert emitted == ""
+    remaining, tool_call = scanner.finish()
+    assert remaining == ""
+    assert tool_call == {
+        "name": "search_my_documents",
+        "arguments": {"query": "cell division"},
+    }
+
+
+def test_scanner_returns_unparseable_capture_as_text():
+    """Captured text that is not a valid tool call is flushed as content."""
+    scanner = TextToolCallScanner()
+    assert scanner.feed("see [TOOL_CALL] docs") == "see "
+    assert scanner.finish() == ("[TOOL_CALL] docs", None)
+
+
+def test_accumulate_tool_call_deltas_merges_argument_pieces():
+    """Streamed tool_calls deltas are merged by index into full calls."""
+    acc: dict[int, dict] = {}
+    accumulate_tool_call_deltas(
+        acc,
+        [
+            SimpleNamespace(
+                index=0,
+                id="call_1",
+                function=SimpleNamespace(name="search_my_documents", arguments='{"que'),
+            )
+        ],
+    )
+    accumulate_tool_call_deltas(
+        acc,
+        [
+            SimpleNamespace(
+                index=0,
+                id=None,
+                function=SimpleNamespace(name=None, arguments='ry": "DNA"}'),
+            )
+        ],
+    )
+    assert acc[0]["id"] == "call_1"
+    assert acc[0]["function"]["name"] == "search_my_documents"
+    assert acc[0]["function"]["arguments"] == '{"query": "DNA"}'
+
+
+# =============================================================================
+# Unit Tests: ChatService.process_chat_stream
+# =============================================================================
+
+
+def _chunk(
+    content: str | None = None, tool_calls: list | None = None
+) -> SimpleNamespace:
+    delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+async def _astream(chunks: list):
+    for c in chunks:
+        yield c
+
+
+def _mock_together(*streams: list) -> MagicMock:
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(
+        side_effect=[_astream(s) for s in streams]
+    )
+    return client
+
+
+async def _collect(gen) -> list[tuple[str, str]]:
+    return [event async for event in gen]
+
+
+@pytest.mark.asyncio
+async def test_process_chat_stream_direct_answer_streams_tokens():
+    """A direct answer is forwarded delta by delta from the first call."""
+    service = ChatService()
+    together = _mock_together([_chunk("Hello"), _chunk(" there"), _chunk("!")])
+    request = ChatRequest(message="Hi", ephemeral=True)
+
+    with patch("app.chat.service.AsyncTogether", return_value=together):
+        events = await _collect(service.process_chat_stream("user-1", request))
+
+    tokens = [data for event, data in events if event == "token"]
+    assert tokens == ["Hello", " there", "!"]
+    assert together.chat.completions.create.await_count == 1
+    assert together.chat.completions.create.await_args.kwargs["stream"] is True
+    assert events[-1][0] == "done"
+    assert '"content": "Hello there!"' in events[-1][1]
+
+
+@pytest.mark.asyncio
+async def test_process_chat_stream_structured_tool_call_runs_search():
+    """Streamed tool_calls deltas trigger the RAG search and a second call."""
+    service = ChatService()
+    tc = SimpleNamespace(
+        index=0,
+        id="call_1",
+        function=SimpleNamespace(
+            name="search_my_documents", arguments='{"query": "mitosis"}'
+        ),
+    )
+    together = _mock_together([_chunk(tool_calls=[tc])], [_chunk("From your notes")])
+    request = ChatRequest(message="What did I write about mitosis?", ephemeral=True)
+    search = AsyncMock(return_value=("context", [{"document_id": "d1"}]))
+
+    with (
+        patch("app.chat.service.AsyncTogether", return_value=together),
+        patch("app.chat.service.execute_search", new=search),
+    ):
+        events = await _collect(
+            service.process_chat_stream(str(uuid4()), request)
+        )
+
+    assert search.await_args.kwargs["query"] == "mitosis"
+    assert ("token", "From your notes") in events
+    second_call = together.chat.completions.create.await_args_list[1]
+    second_messages = second_call.kwargs["messages"]
+    assert second_messages[-1]["role"] == "tool"
+    assert second_messages[-2]["tool_calls"][0]["id"] == "call_1"
+
+
+@pytest.mark.asyncio
+async def test_process_chat_stream_text_tool_call_is_not_leaked():
+    """A text-based tool call is buffered, executed, and never sent as tokens."""
+    service = ChatService()
+    together = _mock_together(
+        [
+            _chunk("<tool_call>"),
+            _chunk('{"name": "search_my_documents", "arguments": {"query": "DNA"}}'),
+            _chunk("</tool_call>"),
+        ],
+        [_chunk("DNA is genetic material.")],
+    )
+    request = ChatRequest(message="DNA?", ephemeral=True)
+    search = AsyncMock(return_value=("context", []))
+
+    with (
+        patch("app.chat.service.AsyncTogether", return_value=together),
+        patch("app.chat.service.execute_search", new=search),
+    ):
+        events = await _collect(
+            service.process_chat_stream(str(uuid4()), request)
+        )
+
+    tokens = [data for event, data in events if event == "token"]
+    assert tokens == ["DNA is genetic material."]
+    assert search.await_args.kwargs["query"] == "DNA"
+
+
+# =============================================================================
+# Unit Tests: HistoryManager
+# =============================================================================
+
+
+def _history_rows(n: int, size: int = 40) -> list[dict]:
+    return [
+        {
+            "id": f"m{i}",
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"{i:03d}" + "x" * (size - 3),
+            "created_at": f"2024-01-01T00:00:{i:02d}+00:00",
+        }
+        for i in range(n)
+    ]
+
+
+def _budget(tokens: int) -> MagicMock:
+    return MagicMock(chat_history_token_budget=tokens)
+
+
+@pytest.mark.asyncio
+async def test_history_window_keeps_most_recent_within_budget():
+    """The window is the newest messages that fit the token budget, oldest first."""
+    manager = HistoryManager()
+    entry = _ConversationWindow()
+    HistoryManager._append(entry, _history_rows(10))  # each ≈ 14 estimated tokens
+
+    with (
+        patch("app.chat.history.get_settings", return_value=_budget(45)),
+        patch.object(manager, "_load", new=AsyncMock(return_value=entry)),
+    ):
+        window = await manager.get_window(TEST_CONV_ID)
+
+    assert [m["content"][:3] for m in window] == ["007", "008", "009"]
+
+
+@pytest.mark.asyncio
+async def test_history_load_fetches_latest_messages_not_oldest():
+    """Initial load queries newest-first and restores chronological order."""
+    manager = HistoryManager()
+    newest_first = list(reversed(_history_rows(3)))
+    supabase = _make_supabase_mock(
+        conv_data=[{"summary": None, "summary_through": None}], msg_data=newest_first
+    )
+
+    with (
+        patch("app.chat.history.get_supabase_client", return_value=supabase),
+        patch("app.chat.history.get_settings", return_value=_budget(1000)),
+    ):
+        window = await manager.get_window(TEST_CONV_ID)
+
+    assert [m["content"][:3] for m in window] == ["000", "001", "002"]
+
+
+@pytest.mark.asyncio
+async def test_history_cached_conversation_only_fetches_new_messages():
+    """A cached conversation reads only messages newer than the last one seen."""
+    manager = HistoryManager()
+    entry = _ConversationWindow()
+    HistoryManager._append(entry, _history_rows(4))
+    load = AsyncMock(return_value=entry)
+    fetch_since = AsyncMock(return_value=_history_rows(6)[4:])
+
+    with (
+        patch("app.chat.history.get_settings", return_value=_budget(1000)),
+        patch.object(manager, "_load", new=load),
+        patch.object(manager, "_fetch_since", new=fetch_since),
+        patch.object(manager, "_current_summary", new=AsyncMock(return_value=None)),
+    ):
+        await manager.get_window(TEST_CONV_ID)
+        window = await manager.get_window(TEST_CONV_ID)
+
+    load.assert_awaited_once()
+    assert fetch_since.await_args.args[1] == "2024-01-01T00:00:03+00:00"
+    assert len(window) == 6
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "stored",
+    [_GONE, "2024-01-01T00:00:02+00:00"],
+    ids=["deleted-elsewhere", "resummarised-elsewhere"],
+)
+async def test_history_cache_reloads_when_another_worker_changed_it(stored):
+    """A cached window is dropped once the conversation changed in another worker."""
+    manager = HistoryManager()
+    cached = _ConversationWindow()
+    HistoryManager._append(cached, _history_rows(4))
+    reloaded = _ConversationWindow()
+    load = AsyncMock(side_effect=[cached, reloaded])
+
+    with (
+        patch("app.chat.history.get_settings", return_value=_budget(1000)),
+        patch.object(manager, "_load", new=load),
+        patch.object(manager, "_fetch_since", new=AsyncMock(return_value=[])),
+        patch.object(manager, "_current_summary", new=AsyncMock(return_value=stored)),
+    ):
+        await manager.get_window(TEST_CONV_ID)
+        window = await manager.get_window(TEST_CONV_ID)
+
+    assert load.await_count == 2
+    assert window == []
+    assert manager._windows[TEST_CONV_ID] is reloaded
+
+
+@pytest.mark.asyncio
+async def test_history_record_turn_refreshes_summary_in_background():
+    """Overflowing turns are folded into a persisted rolling summary."""
+    manager = HistoryManager()
+    entry = _ConversationWindow()
+    HistoryManager._append(entry, _history_rows(8))
+    manager._store(TEST_CONV_ID, entry)
+    llm = MagicMock()
+    llm.complete = AsyncMock(return_value="Student asked about cells.")
+    conversation = {"summary": None, "summary_through": None}
+    supabase = _make_supabase_mock(conv_data=[conversation])
+
+    with (
+        patch("app.chat.history.get_settings", return_value=_budget(60)),
+        patch("app.chat.history.get_supabase_client", return_value=supabase),
+        patch("app.inference.client.get_llm_client", return_value=llm),
+    ):
+        manager.record_turn(TEST_CONV_ID, _history_rows(10)[8:])
+        await asyncio.gather(*manager._tasks)
+        # The row now holds what the refresh wrote, so the cache stays valid.
+        conversation["summary_through"] = entry.summary_through
+        window = await manager.get_window(TEST_CONV_ID)
+
+    llm.complete.assert_awaited_once()
+    assert entry.summary == "Student asked about cells."
+    assert window[0]["role"] == "system"
+    assert "Student asked about cells." in window[0]["content"]
+
+
+# =============================================================================
+# Unit Tests: client disconnect handling
+# =============================================================================
+
+
+class _FakeStream:
+    """Async-iterable provider stream that records whether it was closed."""
+
+    def __init__(self, chunks: list) -> None:
+        self._chunks = chunks
+        self.close = AsyncMock()
+
+    async def __aiter__(self):
+        for c in self._chunks:
+            yield c
+
+
+def _persisting_supabase() -> tuple[MagicMock, list[dict]]:
+    """Supabase mock that records message inserts and echoes them back as rows."""
+    inserted: list[dict] = []
+    supabase = _make_supabase_mock(
+        conv_data=[{"summary": None, "summary_through": None}]
+    )
+    tables = supabase.table.side_effect
+
+    def _table(name: str):
+        tbl = tables(name)
+        if name == "messages":
+            def _insert(row):
+                inserted.append(row)
+                res = MagicMock()
+                res.data = [{"id": str(uuid4()), "created_at": _NOW.isoformat(), **row}]
+                tbl.execute.return_value = res
+                return tbl
+            tbl.insert.side_effect = _insert
+        return tbl
+
+    supabase.table.side_effect = _table
+    return supabase, inserted
+
+
+@pytest.mark.asyncio
+async def test_process_chat_stream_disconnect_cancels_upstream_and_stores_partial():
+    """A polled disconnect stops the provider stream and stores a partial reply."""
+    service = ChatService()
+    stream = _FakeStream(
+        [_chunk("Part one"), _chunk(" part two"), _chunk(" never sent")]
+    )
+    together = MagicMock()
+    together.chat.completions.create = AsyncMock(return_value=stream)
+    supabase, inserted = _persisting_supabase()
+    disconnected = AsyncMock(side_effect=[False, True])
+    request = ChatRequest(message="Explain", conversation_id=TEST_CONV_ID)
+
+    with (
+        patch("app.chat.service.AsyncTogether", return_value=together),
+        patch("app.chat.service.get_supabase_client", return_value=supabase),
+        patch(
+            "app.chat.service.history_manager.get_window",
+            new=AsyncMock(return_value=[]),
+        ),
+        patch("app.chat.service.DISCONNECT_POLL_INTERVAL", 0),
+        patch("app.inference.usage.token_budget") as budget,
+    ):
+        events = await _collect(
+            service.process_chat_stream(
+                "user-1", request, is_disconnected=disconnected
+            )
+        )
+
+    stream.close.assert_awaited_once()
+    assert events == [("token", "Part one")]
+    assistant_rows = [r for r in inserted if r["role"] == "assistant"]
+    assert assistant_rows == [
+        {
+            "conversation_id": TEST_CONV_ID,
+            "role": "assistant",
+            "content": "Part one",
+            "sources": [],
+            "interrupted": True,
+        }
+    ]
+    budget.record.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_process_chat_stream_closed_by_server_finishes_in_background():
+    """If the server closes the generator mid-stream, cleanup still runs."""
+    service = ChatService()
+    stream = _FakeStream([_chunk("Partial"), _chunk(" rest")])
+    together = MagicMock()
+    together.chat.completions.create = AsyncMock(return_value=stream)
+    supabase, inserted = _persisting_supabase()
+    request = ChatRequest(message="Explain", conversation_id=TEST_CONV_ID)
+
+    with (
+        patch("app.chat.service.AsyncTogether", return_value=together),
+        patch("app.chat.service.get_supabase_client", return_value=supabase),
+        patch(
+            "app.chat.service.history_manager.get_window",
+            new=AsyncMock(return_value=[]),
+        ),
+    ):
+        gen = service.process_chat_stream("user-1", request)
+        first = await gen.__anext__()
+        await gen.aclose()
+        await asyncio.gather(*_background_tasks)
+
+    assert first == ("token", "Partial")
+    stream.close.assert_awaited_once()
+    assert inserted[-1]["interrupted"] is True
+    assert inserted[-1]["content"] == "Partial"
+
+
+@pytest.mark.asyncio
+async def test_interrupted_message_is_kept_before_the_column_exists():
+    """Without messages.interrupted, the partial answer is stored unflagged."""
+    supabase, inserted = _persisting_supabase()
+    tables = supabase.table.side_effect
+
+    def _table(name: str):
+        tbl = tables(name)
+        insert = tbl.insert.side_effect
+
+        def _insert(row):
+            if "interrupted" in row:
+                raise APIError({"code": "PGRST204", "message": "unknown column"})
+            return insert(row)
+
+        tbl.insert.side_effect = _insert
+        return tbl
+
+    supabase.table.side_effect = _table
+    watch = MagicMock(close_upstream=AsyncMock())
+
+    await ChatService()._finish_interrupted(
+        watch, TEST_CONV_ID, [], "Part one", [], None, supabase
+    )
+
+    assert inserted == [
+        {
+            "conversation_id": TEST_CONV_ID,
+            "role": "assistant",
+            "content": "Part one",
+            "sources": [],
+        }
+    ]
+
+
+# =============================================================================
+# DB session lifetime during streaming
+# =============================================================================
+
+
+def test_chat_stream_route_does_not_inject_db_session():
+    """POST /chat/stream must not hold a request-scoped DB session."""
+    from app.chat.router import router
+    from app.core import database, dependencies
+
+    route = next(r for r in router.routes if getattr(r, "path", "") == "/chat/stream")
+
+    def _calls(dependant):
+        for dep in dependant.dependencies:
+            yield dep.call
+            yield from _calls(dep)
+
+    calls = set(_calls(route.dependant))
+    assert dependencies.get_db not in calls
+    assert database.get_db not in calls
+
+
+@pytest.mark.asyncio
+async def test_execute_search_without_db_uses_short_lived_session():
+    """execute_search(db=None) opens its own session only for the retrieval."""
+    from app.chat import tools
+    from app.processing.schemas import RetrieveResult
+
+    session = AsyncMock()
+    scope = MagicMock()
+    scope.return_value.__aenter__ = AsyncMock(return_value=session)
+    scope.return_value.__aexit__ = AsyncMock(return_value=False)
+    retrieve = AsyncMock(
+        return_value=RetrieveResult(context_text="", context_chunks=[])
+    )
+
+    with (
+        patch("app.chat.tools.session_scope", new=scope),
+        patch("app.chat.tools.ProcessingService.rag_retrieve_multi", new=retrieve),
+    ):
+        await tools.execute_search(None, uuid4(), "query")
+
+    scope.return_value.__aexit__.assert_awaited_once()
+    assert retrieve.await_args.kwargs["db"] is session
+
+
+# =============================================================================
+# Unit Tests: SSE encoding
+# =============================================================================
+
+
+async def _timed_events(items):
+    """Yield ``(event, data)`` items, sleeping for any float entries."""
+    for item in items:
+        if isinstance(item, float):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+def test_format_sse_splits_multiline_data():
+    """Every line of a multi-line payload gets its own data: field."""
+    expected = "event: token\ndata: a\ndata: b\ndata: c\n\n"
+    assert format_sse("token", "a\nb\r\nc") == expected
+    assert format_sse("token", "") == "event: token\ndata: \n\n"
+
+
+@pytest.mark.asyncio
+async def test_encode_sse_coalesces_burst_of_tokens():
+    """A burst of deltas is merged; done is flushed after pending tokens."""
+    events = [("token", "Hel"), ("token", "lo"), ("token", " world"), ("done", "{}")]
+    frames = [f async for f in encode_sse(_timed_events(events), flush_interval=0.05)]
+
+    # The first delta after an idle start is sent alone; the rest coalesce.
+    assert frames == [
+        format_sse("token", "Hel"),
+        format_sse("token", "lo world"),
+        format_sse("done", "{}"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_encode_sse_flushes_on_byte_threshold():
+    events = [("token", "x" * 6)] * 5
+    frames = [
+        f async for f in encode_sse(
+            _timed_events(events), flush_interval=10.0, max_frame_bytes=10
+        )
+    ]
+    assert frames == [
+        format_sse("token", "x" * 6),
+        format_sse("token", "x" * 12),
+        format_sse("token", "x" * 12),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_encode_sse_flushes_after_interval_and_sends_idle_tokens_immediately():
+    events = [("token", "a"), ("token", "b"), 0.05, ("token", "c")]
+    frames = [f async for f in encode_sse(_timed_events(events), flush_interval=0.01)]
+    assert frames == [
+        format_sse("token", "a"),
+        format_sse("token", "b"),
+        format_sse("token", "c"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_encode_sse_sends_heartbeat_while_source_is_quiet():
+    events = [0.08, ("done", "{}")]
+    frames = [
+        f async for f in encode_sse(_timed_events(events), heartbeat_interval=0.03)
+    ]
+    assert HEARTBEAT_FRAME in frames
+    assert frames[-1] == format_sse("done", "{}")
+
+
+@pytest.mark.asyncio
+async def test_encode_sse_propagates_source_errors_after_flushing():
+    async def failing():
+        yield ("token", "partial")
+        raise RuntimeError("boom")
+
+    frames = []
+    with pytest.raises(RuntimeError, match="boom"):
+        async for frame in encode_sse(failing()):
+            frames.append(frame)
+    assert frames == [format_sse("token", "partial")]
+
+
+@pytest.mark.asyncio
+async def test_encode_sse_close_cancels_source():
+    """Closing the encoder (client gone) runs the source's cleanup."""
+    cleaned_up = asyncio.Event()
+
+    async def source():
+        try:
+            yield ("token", "first")
+            await asyncio.sleep(10)
+            yield ("token", "never")
+        finally:
+            cleaned_up.set()
+
+    gen = encode_sse(source())
+    assert await gen.__anext__() == format_sse("token", "first")
+    await gen.aclose()
+    await asyncio.wait_for(cleaned_up.wait(), 1)
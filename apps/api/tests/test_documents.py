@@ -104,8 +104,8 @@ async def test_upload_text_file_triggers_rag(client: AsyncClient):
             new=AsyncMock(return_value=mock_result),
         ),
         patch(
-            "app.documents.router.extract_text_from_document",
-            return_value="sample text",
+            "app.documents.router.iter_document_pages",
+            return_value=iter(["sample text"]),
         ),
     ):
         response = await client.post(
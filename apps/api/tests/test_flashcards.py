@@ -2,12 +2,17 @@
 
 from __future__ import annotations
 
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock, patch
 from uuid import uuid4
 
 import pytest
 from fastapi import HTTPException
 
+from app.core.pagination import decode_cursor
 from app.flashcards.service import FlashcardService
 from app.processing.schemas import ChunkResponse, RetrieveResult
 from tests.conftest import TEST_DOC_ID, TEST_FOLDER_ID, TEST_USER_ID
@@ -59,7 +64,7 @@ async def test_generate_happy_path():
     mock_set.created_at = "2026-01-01T00:00:00"
     mock_set.updated_at = "2026-01-01T00:00:00"
 
-    async def fake_refresh(obj):
+    async def fake_refresh(obj, attribute_names=None):
         for attr, val in vars(mock_set).items():
             if not attr.startswith("_"):
                 setattr(obj, attr, val)
@@ -142,27 +147,70 @@ async def test_generate_empty_llm_response_raises_502():
     assert exc_info.value.status_code == 502
 
 
+def _summary_row(
+    title: str = "Bio Quiz", card_count: int = 5, created_at: datetime | None = None
+):
+    return SimpleNamespace(
+        id=uuid4(),
+        title=title,
+        description=None,
+        folder_id=None,
+        card_count=card_count,
+        created_at=created_at or datetime(2026, 1, 1),
+    )
+
+
 @pytest.mark.asyncio
 async def test_list_sets():
-    """list_sets() returns summaries with card counts."""
+    """list_sets() returns summaries with the maintained card counts."""
     db = _mock_db()
+    mock_result = MagicMock()
+    mock_result.all.return_value = [_summary_row()]
+    db.execute.return_value = mock_result
 
-    mock_set = MagicMock()
-    mock_set.id = uuid4()
-    mock_set.title = "Bio Quiz"
-    mock_set.description = None
-    mock_set.folder_id = None
-    mock_set.created_at = "2026-01-01T00:00:00"
+    page = await FlashcardService.list_sets(db, TEST_USER_ID)
 
+    assert len(page.items) == 1
+    assert page.items[0].card_count == 5
+    assert page.items[0].title == "Bio Quiz"
+    assert page.next_cursor is None
+    # Summary columns only: no join to (or eager load of) the cards table.
+    sql = str(db.execute.await_args.args[0])
+    assert "flashcards." not in sql
+    assert "count(" not in sql.lower()
+
+
+@pytest.mark.asyncio
+async def test_list_sets_paginates_with_keyset_cursor():
+    """A full page returns a cursor; passing it filters on (created_at, id)."""
+    db = _mock_db()
+    rows = [
+        _summary_row(f"Set {i}", created_at=datetime(2026, 1, 3 - i)) for i in range(3)
+    ]
     mock_result = MagicMock()
-    mock_result.all.return_value = [(mock_set, 5)]
+    mock_result.all.return_value = rows
     db.execute.return_value = mock_result
 
-    result = await FlashcardService.list_sets(db, TEST_USER_ID)
+    page = await FlashcardService.list_sets(db, TEST_USER_ID, limit=2)
+
+    assert [s.title for s in page.items] == ["Set 0", "Set 1"]
+    assert decode_cursor(page.next_cursor) == (rows[1].created_at, rows[1].id)
 
-    assert len(result) == 1
-    assert result[0].card_count == 5
-    assert result[0].title == "Bio Quiz"
+    await FlashcardService.list_sets(db, TEST_USER_ID, cursor=page.next_cursor, limit=2)
+    stmt = db.execute.await_args.args[0]
+    assert "(flashcard_sets.created_at, flashcard_sets.id) <" in str(stmt)
+    params = stmt.compile().params
+    assert rows[1].created_at in params.values()
+    assert 3 in params.values()  # limit + 1
+
+
+@pytest.mark.asyncio
+async def test_list_sets_rejects_malformed_cursor():
+    with pytest.raises(HTTPException) as exc_info:
+        await FlashcardService.list_sets(
+            _mock_db(), TEST_USER_ID, cursor="not-a-cursor"
+        )
+    assert exc_info.value.status_code == 400
 
 
 @pytest.mark.asyncio
@@ -187,3 +235,105 @@ async def test_delete_set_not_found_raises_404():
         await FlashcardService.delete_set(db, TEST_USER_ID, uuid4())
 
     assert exc_info.value.status_code == 404
+
+
+# =============================================================================
+# Streamed generation
+# =============================================================================
+
+
+def _session_scope_for(db: AsyncMock):
+    @asynccontextmanager
+    async def scope():
+        yield db
+
+    return scope
+
+
+async def _stream_cards(*args, **kwargs):
+    for card in FAKE_LLM_RESPONSE["flashcards"]:
+        yield card
+
+
+@pytest.mark.asyncio
+async def test_generate_stream_emits_cards_and_inserts_them():
+    """generate_stream() creates the set up front, then relays and saves each card."""
+    db = _mock_db()
+    db.add.side_effect = lambda obj: setattr(obj, "id", uuid4())
+    mock_llm = MagicMock()
+    mock_llm.stream_json = _stream_cards
+    scope = _session_scope_for(db)
+
+    with (
+        patch("app.flashcards.service.session_scope", scope),
+        patch("app.core.database.session_scope", scope),
+        patch(
+            "app.flashcards.service.ProcessingService.rag_retrieve_multi",
+            new=AsyncMock(return_value=FAKE_RETRIEVE),
+        ),
+        patch("app.flashcards.service.get_llm_client", return_value=mock_llm),
+    ):
+        events = await FlashcardService.generate_stream(
+            TEST_USER_ID, topic="Biology", num_cards=3
+        )
+        received = [(name, json.loads(data)) async for name, data in events]
+
+    names = [name for name, _ in received]
+    assert names == ["set", "card", "card", "card", "done"]
+    assert received[0][1]["title"] == "Biology"
+    assert [data["position"] for _, data in received[1:4]] == [0, 1, 2]
+    assert received[1][1]["front"] == "What is mitosis?"
+    assert received[-1][1]["card_count"] == 3
+    inserted = [
+        row
+        for call in db.execute.await_args_list
+        if len(call.args) > 1
+        for row in call.args[1]
+    ]
+    expected = [c["front"] for c in FAKE_LLM_RESPONSE["flashcards"]]
+    assert [row["front"] for row in inserted] == expected
+    # The set's card_count is bumped alongside each batch.
+    assert any("card_count" in str(call.args[0]) for call in db.execute.await_args_list)
+
+
+@pytest.mark.asyncio
+async def test_generate_stream_no_documents_raises_400_before_streaming():
+    """A request without context fails with a plain 400, not an error event."""
+    db = _mock_db()
+    empty_retrieve = RetrieveResult(context_text="", context_chunks=[])
+
+    with (
+        patch("app.flashcards.service.session_scope", _session_scope_for(db)),
+        patch(
+            "app.flashcards.service.ProcessingService.rag_retrieve_multi",
+            new=AsyncMock(return_value=empty_retrieve),
+        ),
+    ):
+        with pytest.raises(HTTPException) as exc_info:
+            await FlashcardService.generate_stream(TEST_USER_ID, topic="Nothing")
+
+    assert exc_info.value.status_code == 400
+    db.add.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_generate_stream_endpoint_returns_sse(client):
+    """POST /flashcards/generate/stream relays service events as SSE frames."""
+
+    async def fake_events():
+        yield ("set", json.dumps({"id": "s1", "title": "Bio"}))
+        yield ("card", json.dumps({"front": "Q", "back": "A", "position": 0}))
+        yield ("done", json.dumps({"set_id": "s1", "card_count": 1}))
+
+    with patch(
+        "app.flashcards.router.FlashcardService.generate_stream",
+        new=AsyncMock(return_value=fake_events()),
+    ):
+        response = await client.post(
+            "/api/flashcards/generate/stream", json={"num_cards": 3}
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert "event: card\n" in response.text
+    assert "event: done\n" in response.text
@@ -0,0 +1,1054 @@
+"""Tests for the inference layer.
+
+Covers the LLM gateway, deadlines, hedging, breakers, usage, budget, quotas,
+generation, JSON streaming and continuation.
+"""
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+from uuid import uuid4
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.core.deadline import (
+    DeadlineExceeded,
+    deadline_scope,
+    timeout_for,
+    within_deadline,
+)
+from app.core.quotas import QuotaExceeded, TokenQuotas
+from app.core.token_budget import TokenBudget
+from app.flashcards.models import Flashcard
+from app.inference.client import LLMClient
+from app.inference.gateway import LLMGateway, LLMOverloaded, Priority
+from app.inference.generation import (
+    ItemWriter,
+    context_top_k,
+    dedupe,
+    generate_items,
+    max_tokens_for,
+    partition,
+    relay_generation,
+    stream_items,
+)
+from app.inference.json_stream import JSONItemParser, parse_prefix
+from app.inference.resilience import (
+    CircuitBreaker,
+    LatencyTracker,
+    ProviderUnavailable,
+    hedged,
+)
+from app.inference.usage import (
+    StreamUsage,
+    UsageLedger,
+    count_message_tokens,
+    record_call,
+    usage_counts,
+    usage_scope,
+)
+from app.processing.schemas import ChunkResponse
+
+# =============================================================================
+# Unit Tests: LLMGateway
+# =============================================================================
+
+
+async def _hold(
+    gateway: LLMGateway, model: str, release: asyncio.Event, **kwargs
+) -> None:
+    async with gateway.slot(model, **kwargs):
+        await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_gateway_admits_up_to_global_limit():
+    gateway = LLMGateway(max_concurrency=2, per_model_concurrency=2)
+    release = asyncio.Event()
+    holders = [asyncio.create_task(_hold(gateway, "m", release)) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    assert gateway.in_flight == 2
+    assert gateway.queue_depth == 1
+
+    release.set()
+    await asyncio.gather(*holders)
+    stats = gateway.stats()
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
+    assert stats["admitted"] == 3
+
+
+@pytest.mark.asyncio
+async def test_gateway_per_model_limit_does_not_block_other_models():
+    gateway = LLMGateway(max_concurrency=4, per_model_concurrency=1)
+    release = asyncio.Event()
+    first = asyncio.create_task(_hold(gateway, "a", release))
+    queued = asyncio.create_task(_hold(gateway, "a", release))
+    await asyncio.sleep(0)
+
+    # Model "a" is saturated; a call for model "b" is still admitted.
+    async with gateway.slot("b"):
+        assert gateway.stats()["in_flight_by_model"] == {"a": 1, "b": 1}
+
+    release.set()
+    await asyncio.gather(first, queued)
+
+
+@pytest.mark.asyncio
+async def test_gateway_admits_interactive_before_batch():
+    gateway = LLMGateway(max_concurrency=1)
+    order: list[str] = []
+    release = asyncio.Event()
+    blocker = asyncio.create_task(_hold(gateway, "m", release))
+    await asyncio.sleep(0)
+
+    async def call(name: str, priority: Priority) -> None:
+        async with gateway.slot("m", priority):
+            order.append(name)
+
+    batch = asyncio.create_task(call("batch", Priority.BATCH))
+    await asyncio.sleep(0)
+    chat = asyncio.create_task(call("chat", Priority.INTERACTIVE))
+    await asyncio.sleep(0)
+
+    release.set()
+    await asyncio.gather(blocker, batch, chat)
+    assert order == ["chat", "batch"]
+
+
+@pytest.mark.asyncio
+async def test_gateway_sheds_after_queue_deadline():
+    gateway = LLMGateway(max_concurrency=1)
+    release = asyncio.Event()
+    blocker = asyncio.create_task(_hold(gateway, "m", release))
+    await asyncio.sleep(0)
+
+    with pytest.raises(LLMOverloaded) as exc_info:
+        async with gateway.slot("m", timeout=0.01):
+            pass
+
+    assert exc_info.value.status_code == 503
+    assert gateway.queue_depth == 0
+    assert gateway.stats()["shed"] == 1
+    release.set()
+    await blocker
+    assert gateway.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_gateway_sheds_when_queue_is_full():
+    gateway = LLMGateway(max_concurrency=1, max_queue=1)
+    release = asyncio.Event()
+    blocker = asyncio.create_task(_hold(gateway, "m", release))
+    queued = asyncio.create_task(_hold(gateway, "m", release))
+    await asyncio.sleep(0)
+
+    with pytest.raises(LLMOverloaded):
+        gateway.ensure_capacity()
+    with pytest.raises(LLMOverloaded):
+        async with gateway.slot("m"):
+            pass
+
+    release.set()
+    await asyncio.gather(blocker, queued)
+
+
+@pytest.mark.asyncio
+async def test_gateway_cancelled_waiter_leaves_queue():
+    gateway = LLMGateway(max_concurrency=1)
+    release = asyncio.Event()
+    blocker = asyncio.create_task(_hold(gateway, "m", release))
+    waiter = asyncio.create_task(_hold(gateway, "m", release))
+    await asyncio.sleep(0)
+    assert gateway.queue_depth == 1
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert gateway.queue_depth == 0
+
+    release.set()
+    await blocker
+    assert gateway.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_gateway_breaker_fast_fails_after_provider_errors():
+    gateway = LLMGateway(
+        breaker=CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    )
+
+    for _ in range(2):
+        with pytest.raises(httpx.ConnectError):
+            async with gateway.slot("m"):
+                raise httpx.ConnectError("down")
+
+    with pytest.raises(ProviderUnavailable) as exc_info:
+        async with gateway.slot("m"):
+            pass
+    assert exc_info.value.status_code == 503
+    assert gateway.in_flight == 0
+    assert gateway.stats()["breaker"]["state"] == "open"
+
+
+# =============================================================================
+# Unit Tests: deadlines
+# =============================================================================
+
+
+def test_timeout_for_without_deadline_uses_cap():
+    assert timeout_for(30.0) == 30.0
+
+
+def test_timeout_for_is_shortened_by_deadline():
+    with deadline_scope(5.0):
+        assert 4.0 < timeout_for(30.0) <= 5.0
+        # A nested scope can only tighten the budget.
+        with deadline_scope(100.0):
+            assert timeout_for(30.0) <= 5.0
+
+
+def test_timeout_for_raises_when_budget_spent():
+    with deadline_scope(-1.0):
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            timeout_for(30.0)
+    assert exc_info.value.status_code == 504
+
+
+@pytest.mark.asyncio
+async def test_within_deadline_cancels_slow_block():
+    with deadline_scope(0.02):
+        with pytest.raises(DeadlineExceeded):
+            async with within_deadline(10.0):
+                await asyncio.sleep(1)
+
+
+@pytest.mark.asyncio
+async def test_deadline_propagates_into_spawned_tasks():
+    async def child() -> float:
+        return timeout_for(30.0)
+
+    with deadline_scope(5.0):
+        task = asyncio.create_task(child())
+    assert await task <= 5.0
+
+
+# =============================================================================
+# Unit Tests: hedged requests
+# =============================================================================
+
+
+@pytest.mark.asyncio
+async def test_hedged_fast_call_is_not_duplicated():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        return "ok"
+
+    assert await hedged(call, tracker=LatencyTracker(default_delay=0.05)) == "ok"
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_slow_call_is_raced_and_loser_cancelled():
+    delays = [1.0, 0.0]
+    cancelled = asyncio.Event()
+
+    async def call():
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return delay
+
+    tracker = LatencyTracker(default_delay=0.01, min_delay=0.01)
+    assert await hedged(call, tracker=tracker) == 0.0
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_hedged_respects_allow_hedge():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    tracker = LatencyTracker(default_delay=0.01, min_delay=0.01)
+    assert await hedged(call, tracker=tracker, allow_hedge=lambda: False) == 1
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_hedged_fast_failure_is_raised():
+    async def call():
+        raise HTTPException(status_code=502, detail="bad gateway")
+
+    with pytest.raises(HTTPException):
+        await hedged(call, tracker=LatencyTracker(default_delay=1.0))
+
+
+def test_latency_tracker_uses_p95_after_enough_samples():
+    tracker = LatencyTracker(default_delay=1.0, min_samples=20)
+    assert tracker.hedge_delay() == 1.0
+    for i in range(100):
+        tracker.observe(i / 100)
+    assert tracker.hedge_delay() == pytest.approx(0.95)
+
+
+# =============================================================================
+# Unit Tests: CircuitBreaker
+# =============================================================================
+
+
+def test_breaker_half_open_trial_closes_on_success():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+
+    breaker.before_call()  # the single trial call
+    with pytest.raises(ProviderUnavailable):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_breaker_ignores_caller_errors():
+    breaker = CircuitBreaker("test", failure_threshold=1)
+    with pytest.raises(HTTPException):
+        async with breaker.guard():
+            raise HTTPException(status_code=400, detail="bad request")
+    assert breaker.state == "closed"
+
+
+# =============================================================================
+# Unit Tests: usage accounting
+# =============================================================================
+
+
+def _chunk(content: str | None = None, usage=None) -> SimpleNamespace:
+    choices = [] if content is None else [
+        SimpleNamespace(delta=SimpleNamespace(content=content, tool_calls=None))
+    ]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def test_usage_counts_reads_objects_and_dicts():
+    usage = SimpleNamespace(prompt_tokens=12, completion_tokens=3)
+    assert usage_counts(usage) == (12, 3)
+    assert usage_counts({"prompt_tokens": 12, "total_tokens": 20}) == (12, 8)
+    assert usage_counts(None) is None
+    assert usage_counts({}) is None
+
+
+def test_count_message_tokens_includes_per_message_overhead():
+    messages = [{"role": "system", "content": ""}, {"role": "user", "content": ""}]
+    assert count_message_tokens(messages) == 8
+
+
+def test_stream_usage_prefers_provider_usage():
+    usage = StreamUsage(
+        kind="chat", model="m", messages=[{"role": "user", "content": "hi"}]
+    )
+    usage.observe(_chunk("Hello"))
+    usage.observe(_chunk(usage=SimpleNamespace(prompt_tokens=40, completion_tokens=2)))
+
+    with patch("app.inference.usage.record_call", return_value=42) as record:
+        assert usage.finish() == 42
+        assert usage.finish() == 0  # idempotent
+
+    kwargs = record.call_args.kwargs
+    assert kwargs["prompt_tokens"] == 40
+    assert kwargs["completion_tokens"] == 2
+    assert kwargs["usage_source"] == "provider"
+    assert kwargs["ttft_ms"] is not None
+
+
+def test_stream_usage_estimates_when_stream_is_cut_short():
+    usage = StreamUsage(
+        kind="chat", model="m", messages=[{"role": "user", "content": "hi"}]
+    )
+    usage.observe(_chunk("Hello there"))
+
+    with patch("app.inference.usage.record_call", return_value=0) as record:
+        usage.finish("interrupted")
+
+    kwargs = record.call_args.kwargs
+    assert kwargs["usage_source"] == "estimate"
+    assert kwargs["status"] == "interrupted"
+    assert kwargs["prompt_tokens"] > 0
+    assert kwargs["completion_tokens"] > 0
+
+
+def test_record_call_charges_budget_and_attributes_scope():
+    budget = MagicMock()
+    ledger = MagicMock()
+    with (
+        patch("app.inference.usage.token_budget", budget),
+        patch("app.inference.usage.usage_ledger", ledger),
+        usage_scope(user_id="00000000-0000-0000-0000-000000000001", feature="quizzes"),
+    ):
+        total = record_call(
+            kind="json", model="m", prompt_tokens=10, completion_tokens=5,
+            usage_source="provider", latency_ms=12.5,
+        )
+
+    assert total == 15
+    budget.record.assert_called_once_with(15)
+    row = ledger.add.call_args.args[0]
+    assert row["feature"] == "quizzes"
+    assert str(row["user_id"]) == "00000000-0000-0000-0000-000000000001"
+    assert row["latency_ms"] == 12
+
+
+def test_record_call_can_skip_budget():
+    budget = MagicMock()
+    with (
+        patch("app.inference.usage.token_budget", budget),
+        patch("app.inference.usage.usage_ledger", MagicMock()),
+    ):
+        record_call(
+            kind="embedding", model="e", prompt_tokens=10, completion_tokens=0,
+            usage_source="provider", latency_ms=1, charge_budget=False,
+        )
+    budget.record.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_usage_ledger_requeues_rows_when_flush_fails():
+    ledger = UsageLedger()
+    ledger._pending.extend([{"kind": "chat"}, {"kind": "json"}])
+
+    session = AsyncMock()
+    session.execute.side_effect = RuntimeError("db down")
+    scope = MagicMock()
+    scope.return_value.__aenter__ = AsyncMock(return_value=session)
+    scope.return_value.__aexit__ = AsyncMock(return_value=False)
+
+    with patch("app.core.database.session_scope", scope):
+        await ledger.flush()
+
+    assert [r["kind"] for r in ledger._pending] == ["chat", "json"]
+
+
+# =============================================================================
+# Unit Tests: shared TokenBudget
+# =============================================================================
+
+
+class _FakeBudgetStore:
+    """In-memory stand-in for the ``token_budget_days`` row."""
+
+    def __init__(self) -> None:
+        self.reserved = 0
+        self.calls = 0
+
+    async def reserve(self, day, spent, want, limit):
+        self.calls += 1
+        self.reserved += spent
+        granted = min(want, max(limit - self.reserved, 0))
+        self.reserved += granted
+        return granted, self.reserved
+
+    async def release(self, day, tokens):
+        self.reserved -= tokens
+
+
+@pytest.mark.asyncio
+async def test_token_budget_spends_lease_without_store_round_trips():
+    store = _FakeBudgetStore()
+    budget = TokenBudget(daily_limit=10_000, store=store, lease_size=1_000)
+    await budget.sync()
+    assert budget.lease == 1_000
+
+    for _ in range(4):
+        assert budget.check()
+        budget.record(100)
+    await asyncio.sleep(0)
+    assert store.calls == 1  # still above half the lease
+    assert budget.used == 400
+
+
+@pytest.mark.asyncio
+async def test_token_budget_is_shared_between_workers():
+    store = _FakeBudgetStore()
+    a = TokenBudget(daily_limit=1_500, store=store, lease_size=1_000)
+    b = TokenBudget(daily_limit=1_500, store=store, lease_size=1_000)
+    await a.sync()
+    await b.sync()
+    assert (a.lease, b.lease) == (1_000, 500)
+
+    a.record(1_000)
+    b.record(600)  # overshoots the lease: 100 tokens of debt
+    await a.sync()
+    await b.sync()
+    assert store.reserved == 1_600
+    assert not a.check()
+    assert not b.check()
+
+
+@pytest.mark.asyncio
+async def test_token_budget_release_returns_unused_lease():
+    store = _FakeBudgetStore()
+    budget = TokenBudget(daily_limit=10_000, store=store, lease_size=1_000)
+    await budget.sync()
+    budget.record(300)
+    await budget.release()
+    assert store.reserved == 300
+    assert budget.lease == 0
+
+
+@pytest.mark.asyncio
+async def test_token_budget_keeps_counting_when_store_fails():
+    store = _FakeBudgetStore()
+    store.reserve = AsyncMock(side_effect=RuntimeError("db down"))
+    budget = TokenBudget(daily_limit=1_000, store=store)
+    budget.record(400)
+    await budget.sync()
+    assert budget.used == 400
+    assert budget.check()
+    budget.record(700)
+    assert not budget.check()
+
+
+# =============================================================================
+# Unit Tests: TokenQuotas
+# =============================================================================
+
+
+def test_quota_reservations_count_against_concurrent_calls():
+    quotas = TokenQuotas(user_daily_limit=1_000)
+    first = quotas.reserve("u1", "chat", 600)
+
+    with pytest.raises(QuotaExceeded) as exc_info:
+        quotas.reserve("u1", "chat", 600)
+    assert exc_info.value.status_code == 429
+    assert int(exc_info.value.headers["Retry-After"]) > 0
+
+    # Settling to the real cost frees the over-estimate.
+    first.settle(150)
+    quotas.reserve("u1", "chat", 600)
+    assert quotas.usage("u1") == {"used": 150, "reserved": 600}
+
+
+def test_quota_feature_limit_is_separate_from_user_limit():
+    quotas = TokenQuotas(
+        user_daily_limit=10_000, feature_daily_limits={"flashcards": 500}
+    )
+    quotas.charge("u1", "flashcards", 400)
+
+    with pytest.raises(QuotaExceeded):
+        quotas.reserve("u1", "flashcards", 200)
+    quotas.reserve("u1", "chat", 200).release()
+    # Unattributed calls are exempt.
+    quotas.reserve(None, "flashcards", 10_000).release()
+
+
+@pytest.mark.asyncio
+async def test_quota_admit_loads_persisted_usage():
+    persisted = {"u1": {"chat": 700, "quizzes": 400}, "u2": {"chat": 100}}
+    loader = AsyncMock(side_effect=lambda user_id, since: persisted[user_id])
+    quotas = TokenQuotas(user_daily_limit=1_000, loader=loader)
+
+    with pytest.raises(QuotaExceeded):
+        await quotas.admit("u1", "chat")
+    await asyncio.gather(*(quotas.admit("u2") for _ in range(3)))
+    # Loaded once per user until the refresh interval passes.
+    assert loader.await_count == 2
+    assert quotas.usage("u2")["used"] == 100
+
+
+def test_stream_usage_abandon_releases_reservation():
+    quotas = TokenQuotas(user_daily_limit=1_000)
+    with patch("app.inference.usage.token_quotas", quotas):
+        usage = StreamUsage(
+            kind="chat", model="m", messages=[{"role": "user", "content": "hi"}],
+            user_id="u1", max_tokens=500,
+        )
+        assert quotas.usage("u1")["reserved"] > 500
+        usage.abandon()
+    assert quotas.usage("u1") == {"used": 0, "reserved": 0}
+
+
+# =============================================================================
+# Unit Tests: map-reduce generation
+# =============================================================================
+
+
+def _chunks(n: int) -> list[ChunkResponse]:
+    doc_id = uuid4()
+    return [
+        ChunkResponse(
+            id=uuid4(),
+            document_id=doc_id,
+            chunk_index=i,
+            content=f"chunk {i}",
+            metadata={},
+        )
+        for i in range(n)
+    ]
+
+
+def test_partition_spreads_ranks_round_robin():
+    groups = partition(_chunks(7), 3)
+    assert [[c.chunk_index for c in g] for g in groups] == [[0, 3, 6], [1, 4], [2, 5]]
+    # Fewer chunks than groups: chunks are reused so no group is empty.
+    assert all(len(g) == 1 for g in partition(_chunks(2), 4))
+
+
+def test_context_top_k_scales_with_set_size():
+    assert context_top_k(10) == 6
+    assert context_top_k(30) == 15
+
+
+@pytest.mark.asyncio
+async def test_dedupe_drops_exact_and_similar_items():
+    items = [
+        {"front": "What is mitosis?"},
+        {"front": "what is MITOSIS"},
+        {"front": "Describe mitosis."},
+        {"front": "Define osmosis."},
+    ]
+    vectors = [[1.0, 0.0], [0.99, 0.05], [0.0, 1.0]]
+    with patch("app.processing.service.embed", AsyncMock(return_value=vectors)):
+        result = await dedupe(items, lambda i: i["front"])
+    assert [i["front"] for i in result] == ["What is mitosis?", "Define osmosis."]
+
+
+@pytest.mark.asyncio
+async def test_dedupe_stops_at_limit_and_ignores_zero_vectors():
+    items = [{"front": f"card {i}"} for i in range(4)]
+    vectors = [[0.0, 0.0], [0.0, 0.0], [1.0, 0.0], [0.0, 1.0]]
+    with patch("app.processing.service.embed", AsyncMock(return_value=vectors)):
+        result = await dedupe(items, lambda i: i["front"], limit=3)
+    assert [i["front"] for i in result] == ["card 0", "card 1", "card 2"]
+
+
+@pytest.mark.asyncio
+async def test_generate_items_fans_out_and_merges():
+    llm = MagicMock()
+    calls = 0
+    limits = []
+
+    async def generate_json(*, system_prompt, user_prompt, max_tokens, temperature):
+        nonlocal calls
+        calls += 1
+        limits.append(max_tokens)
+        base = calls * 100
+        return {"flashcards": [{"front": f"card {base + i}"} for i in range(8)]}
+
+    llm.generate_json = generate_json
+    with patch(
+        "app.processing.service.embed",
+        AsyncMock(side_effect=RuntimeError("no embeddings")),
+    ):
+        cards = await generate_items(
+            llm,
+            system_prompt="sys",
+            key="flashcards",
+            chunks=_chunks(12),
+            num_items=24,
+            build_prompt=lambda n, ctx: f"{n}:{ctx}",
+            text_of=lambda c: c["front"],
+        )
+    assert calls == 4
+    assert len(cards) == 24
+    assert len({c["front"] for c in cards}) == 24
+    # Each call reserves a budget for its share of the set, not a full default.
+    assert limits == [max_tokens_for(8)] * 4
+
+
+@pytest.mark.asyncio
+async def test_generate_items_survives_partial_failure():
+    llm = MagicMock()
+    llm.generate_json = AsyncMock(
+        side_effect=[
+            ValueError("bad json"),
+            {"questions": [{"question": "q1"}, {"question": "q2"}]},
+        ]
+    )
+    with patch(
+        "app.processing.service.embed", AsyncMock(return_value=[[1.0, 0.0], [0.0, 1.0]])
+    ):
+        items = await generate_items(
+            llm,
+            system_prompt="sys",
+            key="questions",
+            chunks=_chunks(6),
+            num_items=13,
+            build_prompt=lambda n, ctx: ctx,
+            text_of=lambda q: q["question"],
+        )
+    assert [q["question"] for q in items] == ["q1", "q2"]
+
+
+@pytest.mark.asyncio
+async def test_generate_items_raises_quota_when_set_comes_out_short():
+    llm = MagicMock()
+    llm.generate_json = AsyncMock(
+        side_effect=[
+            QuotaExceeded("flashcards"),
+            {"questions": [{"question": "q1"}, {"question": "q2"}]},
+        ]
+    )
+    with patch(
+        "app.processing.service.embed", AsyncMock(return_value=[[1.0, 0.0], [0.0, 1.0]])
+    ):
+        with pytest.raises(QuotaExceeded) as exc_info:
+            await generate_items(
+                llm,
+                system_prompt="sys",
+                key="questions",
+                chunks=_chunks(6),
+                num_items=13,
+                build_prompt=lambda n, ctx: ctx,
+                text_of=lambda q: q["question"],
+            )
+    assert exc_info.value.status_code == 429
+
+
+# =============================================================================
+# Unit Tests: streamed generation
+# =============================================================================
+
+
+def test_json_item_parser_emits_items_as_they_close():
+    text = (
+        '{"title": "Set", "flashcards": [{"front": "a } [ \\" x", "back": {"n": [1]}},'
+        ' {"front": "b", "back": "c"}, {"front": "trunc'
+    )
+    parser = JSONItemParser("flashcards")
+    completed = []
+    for i in range(0, len(text), 4):
+        completed.append(parser.feed(text[i : i + 4]))
+
+    assert parser.items == [
+        {"front": 'a } [ " x', "back": {"n": [1]}},
+        {"front": "b", "back": "c"},
+    ]
+    # Each item is returned by the feed that closed it, not at the end.
+    assert sum(1 for batch in completed if batch) == 2
+    assert not parser.done
+
+
+def test_json_item_parser_ignores_other_arrays():
+    parser = JSONItemParser("questions")
+    items = parser.feed('{"tags": [{"x": 1}], "questions": [{"question": "q"}]}')
+    assert items == [{"question": "q"}]
+    assert parser.done
+
+
+def _streaming_llm(*responses: list[dict]) -> MagicMock:
+    llm = MagicMock()
+    pending = list(responses)
+
+    async def stream_json(**kwargs):
+        for item in pending.pop(0):
+            yield item
+
+    llm.stream_json = stream_json
+    return llm
+
+
+@pytest.mark.asyncio
+async def test_stream_items_drops_exact_duplicates_and_caps():
+    llm = _streaming_llm(
+        [{"front": f"card {i}"} for i in range(8)] + [{"front": "Card 0!"}],
+        [{"front": "card 1"}] + [{"front": f"other {i}"} for i in range(8)],
+        [{"front": f"third {i}"} for i in range(8)],
+    )
+    items = [
+        item
+        async for item in stream_items(
+            llm,
+            system_prompt="sys",
+            key="flashcards",
+            chunks=_chunks(9),
+            num_items=18,
+            build_prompt=lambda n, ctx: ctx,
+            text_of=lambda c: c["front"],
+        )
+    ]
+    fronts = [i["front"] for i in items]
+    assert len(fronts) == 18
+    assert len({f.lower().rstrip("!") for f in fronts}) == 18
+
+
+@pytest.mark.asyncio
+async def test_stream_items_raises_quota_after_short_stream():
+    llm = MagicMock()
+    limits = []
+
+    async def stream_json(*, user_prompt, max_tokens, **kwargs):
+        limits.append(max_tokens)
+        if user_prompt == "0":
+            raise QuotaExceeded("flashcards")
+        for i in range(7):
+            yield {"front": f"{user_prompt} card {i}"}
+
+    llm.stream_json = stream_json
+    calls = iter(range(3))
+    sent = []
+    with pytest.raises(QuotaExceeded):
+        async for item in stream_items(
+            llm,
+            system_prompt="sys",
+            key="flashcards",
+            chunks=_chunks(9),
+            num_items=18,
+            build_prompt=lambda n, ctx: f"{next(calls)}",
+            text_of=lambda c: c["front"],
+        ):
+            sent.append(item)
+    # Items from the calls that ran were still streamed before the error.
+    assert len(sent) == 14
+    assert limits == [max_tokens_for(8)] * 3
+
+
+def _recording_scope(batches: list):
+    session = AsyncMock()
+
+    async def execute(stmt, rows):
+        batches.append([row["position"] for row in rows])
+
+    session.execute = execute
+
+    @asynccontextmanager
+    async def scope():
+        yield session
+
+    return scope
+
+
+@pytest.mark.asyncio
+async def test_item_writer_inserts_in_batches():
+    batches: list = []
+    writer = ItemWriter(
+        Flashcard,
+        uuid4(),
+        lambda pos, item: {"position": pos},
+        batch_size=3,
+        interval=10.0,
+        session_factory=_recording_scope(batches),
+    )
+    for i in range(7):
+        writer.add({"i": i})
+    await asyncio.sleep(0)
+    assert await writer.close() == 7
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+@pytest.mark.asyncio
+async def test_item_writer_flushes_partial_batch_after_interval():
+    batches: list = []
+    writer = ItemWriter(
+        Flashcard,
+        uuid4(),
+        lambda pos, item: {"position": pos},
+        batch_size=10,
+        interval=0.01,
+        session_factory=_recording_scope(batches),
+    )
+    writer.add({})
+    await asyncio.sleep(0.05)
+    assert batches == [[0]]
+    await writer.close()
+
+
+def _failing_scope(failures: int, batches: list):
+    """Session scope whose first *failures* inserts raise."""
+    session = AsyncMock()
+    calls = 0
+
+    async def execute(stmt, rows):
+        nonlocal calls
+        calls += 1
+        if calls <= failures:
+            raise ConnectionError("connection reset")
+        batches.append([row["position"] for row in rows])
+
+    session.execute = execute
+
+    @asynccontextmanager
+    async def scope():
+        yield session
+
+    return scope
+
+
+@pytest.mark.asyncio
+async def test_item_writer_retries_failed_batch_once():
+    batches: list = []
+    writer = ItemWriter(
+        Flashcard,
+        uuid4(),
+        lambda pos, item: {"position": pos},
+        session_factory=_failing_scope(1, batches),
+    )
+    writer.add({})
+    with patch("app.inference.generation.WRITE_RETRY_DELAY", 0):
+        assert await writer.close() == 1
+    assert batches == [[0]]
+
+
+@pytest.mark.asyncio
+async def test_relay_generation_reports_unsaved_items_as_error():
+    async def items():
+        yield {"v": 1}
+        yield {"v": 2}
+
+    async def finish(count):  # pragma: no cover
+        return {"count": count}
+
+    batches: list = []
+    writer = ItemWriter(
+        Flashcard, uuid4(), lambda pos, item: {"position": pos},
+        session_factory=_failing_scope(2, batches),
+    )
+    with patch("app.inference.generation.WRITE_RETRY_DELAY", 0):
+        relay = relay_generation(
+            items(), writer, created={}, event="item", finish=finish
+        )
+        events = [e async for e in relay]
+    assert events[-1] == (
+        "error", '{"detail": "Generated items could not be saved. Please try again."}'
+    )
+    assert batches == []
+
+
+@pytest.mark.asyncio
+async def test_relay_generation_finishes_after_client_leaves():
+    release = asyncio.Event()
+    finished = asyncio.Event()
+
+    async def items():
+        yield {"v": 1}
+        await release.wait()
+        yield {"v": 2}
+
+    async def finish(count):
+        finished.set()
+        return {"count": count}
+
+    batches: list = []
+    writer = ItemWriter(
+        Flashcard, uuid4(), lambda pos, item: {"position": pos},
+        session_factory=_recording_scope(batches),
+    )
+    events = relay_generation(
+        items(), writer, created={"id": "s"}, event="item", finish=finish
+    )
+    assert (await anext(events))[0] == "set"
+    assert (await anext(events))[0] == "item"
+    await events.aclose()  # client disconnects
+
+    release.set()
+    await asyncio.wait_for(finished.wait(), 1)
+    assert sum(len(b) for b in batches) == 2
+
+
+@pytest.mark.asyncio
+async def test_relay_generation_reports_errors_as_events():
+    async def items():
+        raise HTTPException(
+            status_code=502, detail="LLM did not return any flashcards."
+        )
+        yield  # pragma: no cover
+
+    async def finish(count):  # pragma: no cover
+        return {}
+
+    writer = ItemWriter(
+        Flashcard, uuid4(), lambda pos, item: {}, session_factory=_recording_scope([])
+    )
+    relay = relay_generation(items(), writer, created={}, event="item", finish=finish)
+    events = [e async for e in relay]
+    assert events[-1] == ("error", '{"detail": "LLM did not return any flashcards."}')
+
+
+# =============================================================================
+# Unit Tests: continuation of truncated JSON
+# =============================================================================
+
+
+def test_parse_prefix_closes_after_last_complete_item():
+    prefix, parser = parse_prefix(
+        '{"title": "t", "flashcards": [{"front": "a"}, {"front": "b"}, {"fro'
+    )
+    assert prefix == {"title": "t", "flashcards": [{"front": "a"}, {"front": "b"}]}
+    assert parser.key == "flashcards"
+    assert parse_prefix('{"flashcards": [{"fro')[0] is None
+
+
+def _json_response(content: str, finish_reason: str = "stop") -> SimpleNamespace:
+    return SimpleNamespace(
+        choices=[
+            SimpleNamespace(
+                message=SimpleNamespace(content=content), finish_reason=finish_reason
+            )
+        ],
+        usage=None,
+    )
+
+
+def _json_client(*responses: SimpleNamespace) -> LLMClient:
+    llm = LLMClient.__new__(LLMClient)
+    llm.model = "test-model"
+    llm.max_tokens = 100
+    llm.temperature = 0.1
+    llm.client = MagicMock()
+    llm.client.chat.completions.create = AsyncMock(side_effect=list(responses))
+    return llm
+
+
+@pytest.mark.asyncio
+async def test_generate_json_continues_after_truncation():
+    llm = _json_client(
+        _json_response(
+            '{"flashcards": [{"front": "a"}, {"front": "b"}, {"fr', "length"
+        ),
+        _json_response('{"flashcards": [{"front": "c"}]}'),
+    )
+    result = await llm.generate_json("sys", "user")
+
+    assert result == {"flashcards": [{"front": "a"}, {"front": "b"}, {"front": "c"}]}
+    calls = llm.client.chat.completions.create.await_args_list
+    assert len(calls) == 2
+    # Same token limit: the continuation only generates the missing items.
+    assert calls[0].kwargs["max_tokens"] == calls[1].kwargs["max_tokens"]
+    follow_up = calls[1].kwargs["messages"]
+    assert follow_up[2] == {
+        "role": "assistant",
+        "content": '{"flashcards": [{"front": "a"}, {"front": "b"}]}',
+    }
+    assert '"flashcards"' in follow_up[3]["content"]
+
+
+@pytest.mark.asyncio
+async def test_generate_json_keeps_items_when_continuations_run_out():
+    llm = _json_client(
+        _json_response('{"questions": [{"question": "1"}, {"q', "length"),
+        _json_response('{"questions": [{"question": "2"}, {"q', "length"),
+    )
+    result = await llm.generate_json("sys", "user", max_retries=1)
+    assert result == {"questions": [{"question": "1"}, {"question": "2"}]}
+
+
+@pytest.mark.asyncio
+async def test_generate_json_raises_without_a_complete_item():
+    llm = _json_client(_json_response('{"flashcards": [{"fro', "length"))
+    with pytest.raises(ValueError):
+        await llm.generate_json("sys", "user")
+    assert llm.client.chat.completions.create.await_count == 1
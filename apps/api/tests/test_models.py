@@ -0,0 +1,219 @@
+"""Tests for ORM loading strategies and per-endpoint query budgets.
+
+The budgets run against a real database (``TEST_DATABASE_URL``) and count
+what the engine actually sent: statements, lazy loads included, and the
+rows each one returned.
+"""
+
+from __future__ import annotations
+
+from uuid import uuid4
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.orm import RelationshipDirection
+
+from app.core.models import Base
+from app.documents.models import Document
+from app.flashcards.models import Flashcard, FlashcardSet
+from app.processing.models import DocumentChunk, ProcessingDocument
+from app.quizzes.models import QuizQuestion, QuizSet
+from tests.conftest import TEST_DOC_ID, TEST_USER_ID, QueryLog, seed
+
+
+def _relationships():
+    for mapper in Base.registry.mappers:
+        for rel in mapper.relationships:
+            yield mapper.class_.__name__, rel
+
+
+def test_relationships_raise_on_lazy_load():
+    """Every relationship must be loaded explicitly; a lazy load is a bug."""
+    lazy = [
+        f"{name}.{rel.key}={rel.lazy}"
+        for name, rel in _relationships()
+        if rel.lazy != "raise"
+    ]
+    assert lazy == []
+
+
+def test_collections_leave_deletes_to_the_database():
+    """Deleting a parent must not load its children to cascade in Python."""
+    loading = [
+        f"{name}.{rel.key}"
+        for name, rel in _relationships()
+        if rel.direction is RelationshipDirection.ONETOMANY and not rel.passive_deletes
+    ]
+    assert loading == []
+
+
+def _document(doc_id=TEST_DOC_ID) -> Document:
+    return Document(
+        id=doc_id,
+        user_id=TEST_USER_ID,
+        filename="abc123.pdf",
+        original_filename="notes.pdf",
+        file_type="pdf",
+        mime_type="application/pdf",
+        file_size=1024,
+        storage_path=f"user/{TEST_USER_ID}/abc123.pdf",
+    )
+
+
+def _processed(doc_id=TEST_DOC_ID, chunks: int = 3) -> list:
+    pdoc = ProcessingDocument(
+        id=doc_id, status="ready", chunks_count=chunks, active_version=1
+    )
+    return [pdoc] + [
+        DocumentChunk(
+            document_id=doc_id,
+            index_version=1,
+            chunk_index=i,
+            content=f"chunk {i}",
+            chunk_metadata={},
+            embedding=[0.0] * 1024,
+        )
+        for i in range(chunks)
+    ]
+
+
+def _flashcard_set(items: int, **fields) -> list:
+    fset = FlashcardSet(
+        id=uuid4(), user_id=TEST_USER_ID, title="Cells", card_count=items, **fields
+    )
+    return [fset] + [
+        Flashcard(set_id=fset.id, front=f"Q{i}", back=f"A{i}", position=i)
+        for i in range(items)
+    ]
+
+
+def _quiz_set(items: int, **fields) -> list:
+    qset = QuizSet(
+        id=uuid4(), user_id=TEST_USER_ID, title="Cells", question_count=items, **fields
+    )
+    return [qset] + [
+        QuizQuestion(
+            set_id=qset.id,
+            question=f"Q{i}",
+            options=[{"label": "A", "text": "yes"}, {"label": "B", "text": "no"}],
+            correct_option="A",
+            position=i,
+        )
+        for i in range(items)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_processing_status_query_budget(
+    pg_client: AsyncClient, pg_engine, query_log: QueryLog
+):
+    """Status polling is one row from one join — the chunks are never read."""
+    await seed(pg_engine, _document(), *_processed(chunks=3))
+    query_log.clear()
+
+    resp = await pg_client.get(f"/api/processing/{TEST_DOC_ID}/status")
+
+    assert resp.status_code == 200
+    assert resp.json()["chunks_count"] == 3
+    assert len(query_log) == 1
+    assert query_log.rows == 1
+    assert "document_chunks" not in query_log.statements[0]
+
+
+@pytest.mark.asyncio
+async def test_processing_status_unowned_document_404(
+    pg_client: AsyncClient, query_log: QueryLog
+):
+    resp = await pg_client.get(f"/api/processing/{TEST_DOC_ID}/status")
+
+    assert resp.status_code == 404
+    assert len(query_log) == 1
+
+
+@pytest.mark.asyncio
+async def test_processing_status_batch(
+    pg_client: AsyncClient, pg_engine, query_log: QueryLog
+):
+    """Many ids, one query; never-processed documents report pending."""
+    other = uuid4()
+    await seed(pg_engine, _document(), _document(other), *_processed(chunks=5))
+    query_log.clear()
+
+    resp = await pg_client.post(
+        "/api/processing/status",
+        json={"document_ids": [str(TEST_DOC_ID), str(other), str(uuid4())]},
+    )
+
+    assert resp.status_code == 200
+    statuses = {s["document_id"]: s for s in resp.json()["statuses"]}
+    assert statuses[str(TEST_DOC_ID)]["status"] == "ready"
+    assert statuses[str(other)]["status"] == "pending"
+    assert statuses[str(other)]["chunks_count"] == 0
+    assert len(query_log) == 1
+    assert query_log.rows == 2
+
+
+@pytest.mark.asyncio
+async def test_processing_status_batch_limits_ids(client: AsyncClient):
+    resp = await client.post(
+        "/api/processing/status",
+        json={"document_ids": [str(uuid4()) for _ in range(101)]},
+    )
+    assert resp.status_code == 422
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("path", "make_set", "item_table", "statements"),
+    [
+        # Flashcard sets also resolve their source documents.
+        ("/api/flashcards/sets", _flashcard_set, "flashcards", 3),
+        ("/api/quizzes/sets", _quiz_set, "quiz_questions", 2),
+    ],
+)
+async def test_get_set_query_budget(
+    pg_client: AsyncClient,
+    pg_engine,
+    query_log: QueryLog,
+    path,
+    make_set,
+    item_table,
+    statements,
+):
+    """The set, then one selectin query for all of its items."""
+    rows = make_set(10, document_ids=[str(TEST_DOC_ID)])
+    set_id = rows[0].id
+    await seed(pg_engine, _document(), *rows)
+    query_log.clear()
+
+    resp = await pg_client.get(f"{path}/{set_id}")
+
+    assert resp.status_code == 200
+    assert len(query_log) == statements
+    # The set, its 10 items and (for flashcards) the one source document.
+    assert query_log.rows == 1 + 10 + (statements - 2)
+    assert f"FROM {item_table}" in query_log.statements[1]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("path", "make_set", "item_table"),
+    [
+        ("/api/flashcards/sets", _flashcard_set, "flashcards"),
+        ("/api/quizzes/sets", _quiz_set, "quiz_questions"),
+    ],
+)
+async def test_list_sets_query_budget(
+    pg_client: AsyncClient, pg_engine, query_log: QueryLog, path, make_set, item_table
+):
+    """A page is one query for limit + 1 rows; the item tables are not read."""
+    await seed(pg_engine, *make_set(5), *make_set(5), *make_set(5))
+    query_log.clear()
+
+    resp = await pg_client.get(path, params={"limit": 2})
+
+    assert resp.status_code == 200
+    assert len(resp.json()["items"]) == 2
+    assert len(query_log) == 1
+    assert query_log.rows == 3
+    assert item_table not in query_log.statements[0]
@@ -1,20 +1,57 @@
 """Tests for document processing service (chunking, embeddings, RAG)."""
 from __future__ import annotations
 
+import asyncio
 import json
+from contextlib import asynccontextmanager
+from datetime import UTC, datetime
+from functools import partial
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock, patch
 from uuid import UUID, uuid4
 
 import pytest
 from fastapi import HTTPException
-
+from httpx import AsyncClient
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import (
+    BinaryExpression,
+    BindParameter,
+    BooleanClauseList,
+    Grouping,
+    Label,
+    Null,
+)
+from sqlalchemy.sql.functions import FunctionElement
+
+from app.core.config import get_settings
+from app.core.deadline import deadline_scope, time_remaining, timeout_for
+from app.documents.text_extraction import iter_document_pages
+from app.processing.models import DocumentChunk, ProcessingDocument
+from app.processing.pipeline import (
+    EMBED_BATCH_SIZE,
+    Page,
+    StageTimings,
+    TextChunker,
+    run_ingestion,
+)
+from app.processing.progress import (
+    SUBSCRIBER_QUEUE_SIZE,
+    ProgressEvent,
+    ProgressHub,
+    ProgressReporter,
+)
+from app.processing.recovery import IngestionRecovery
+from app.processing.reembed import Pacer, Reembedder, ReembedJobs
 from app.processing.service import (
     EMBEDDING_DIM,
+    PARTIAL_NOTE,
     ProcessingService,
     chunk_text,
     embed,
 )
-from tests.conftest import TEST_DOC_ID, TEST_USER_ID
+from tests.conftest import TEST_DOC_ID, TEST_USER_ID, make_mock_document
 
 # =============================================================================
 # Unit Tests: chunk_text
@@ -251,22 +288,25 @@ def _make_db_for_processing(doc_status: str = "ready") -> AsyncMock:
     # scalar() returns None (no existing processing_document)
     db.scalar.return_value = None
 
-    # execute() for update/delete statements
+    # execute() for update/delete statements; no processing run yet
     db.execute.return_value = MagicMock()
+    db.execute.return_value.one_or_none.return_value = None
 
     return db
 
 
+def _embed_each() -> AsyncMock:
+    """An ``embed`` stand-in that returns one vector per text."""
+    return AsyncMock(
+        side_effect=lambda texts, **kw: [[0.1] * EMBEDDING_DIM] * len(texts)
+    )
+
+
 @pytest.mark.asyncio
 async def test_process_document_happy_path():
     """process_document() chunks, embeds, stores chunks, and returns ready status."""
     db = _make_db_for_processing()
-    fake_vectors = [[0.1] * EMBEDDING_DIM] * 3  # 3 chunks
-
-    with patch(
-        "app.processing.service.embed",
-        new=AsyncMock(return_value=fake_vectors),
-    ):
+    with patch("app.processing.service.embed", new=_embed_each()):
         result = await ProcessingService.process_document(
             db=db,
             document_id=TEST_DOC_ID,
@@ -280,6 +320,30 @@ async def test_process_document_happy_path():
     db.commit.assert_awaited()
 
 
+@pytest.mark.asyncio
+async def test_process_document_records_status_columns():
+    """The final update stores the chunk count, embed model and stage timings."""
+    db = _make_db_for_processing()
+
+    with (
+        patch("app.processing.service.embed", new=_embed_each()),
+        patch("app.processing.service.embed_model_name", return_value="e5-test"),
+    ):
+        result = await ProcessingService.process_document(
+            db=db,
+            document_id=TEST_DOC_ID,
+            title="Test Doc",
+            text="word " * 300,
+        )
+
+    final = db.execute.await_args_list[-1].args[0].compile().params
+    assert final["status"] == "ready"
+    assert final["chunks_count"] == result.chunks_count
+    assert final["embed_model"] == "e5-test"
+    assert final["processed_at"] == result.processed_at
+    assert result.embed_ms is not None and result.store_ms is not None
+
+
 @pytest.mark.asyncio
 async def test_process_document_empty_text_returns_error():
     """process_document() with empty text sets status='error' and returns error schema."""
@@ -366,7 +430,7 @@ async def test_rag_retrieve_multi_with_results():
 
     # First call: resolve doc IDs
     doc_id_result = MagicMock()
-    doc_id_result.all.return_value = [(TEST_DOC_ID,)]
+    doc_id_result.all.return_value = [(TEST_DOC_ID, False, None)]
 
     # Second call: chunk similarity search
     row = _make_row(TEST_DOC_ID, chunk_idx=0)
@@ -399,7 +463,7 @@ async def test_rag_retrieve_multi_with_folder_ids():
     folder_id = UUID("00000000-0000-0000-0000-000000000003")
 
     doc_id_result = MagicMock()
-    doc_id_result.all.return_value = [(TEST_DOC_ID,)]
+    doc_id_result.all.return_value = [(TEST_DOC_ID, False, None)]
 
     row = _make_row(TEST_DOC_ID)
     chunk_result = MagicMock()
@@ -430,7 +494,7 @@ async def test_rag_retrieve_multi_with_document_ids():
     fake_vec = [0.1] * EMBEDDING_DIM
 
     doc_id_result = MagicMock()
-    doc_id_result.all.return_value = [(TEST_DOC_ID,)]
+    doc_id_result.all.return_value = [(TEST_DOC_ID, False, None)]
 
     row = _make_row(TEST_DOC_ID)
     chunk_result = MagicMock()
@@ -451,3 +515,1184 @@ async def test_rag_retrieve_multi_with_document_ids():
 
     assert db.execute.call_count == 2
     assert len(result.context_chunks) == 1
+
+
+@pytest.mark.asyncio
+async def test_rag_retrieve_multi_includes_partial_documents():
+    """Documents still being indexed are searched, and their chunks are flagged."""
+    db = AsyncMock()
+    indexing_doc = uuid4()
+
+    doc_id_result = MagicMock()
+    # (id, reading a version that is still being built, active model)
+    doc_id_result.all.return_value = [
+        (TEST_DOC_ID, False, None),
+        (indexing_doc, True, None),
+    ]
+    chunk_result = MagicMock()
+    chunk_result.mappings.return_value.all.return_value = [
+        _make_row(TEST_DOC_ID),
+        _make_row(indexing_doc, chunk_idx=1),
+    ]
+    db.execute.side_effect = [doc_id_result, chunk_result]
+
+    with (
+        patch(
+            "app.processing.service.embed",
+            new=AsyncMock(return_value=[[0.1] * EMBEDDING_DIM]),
+        ),
+        patch(
+            "app.processing.service._resolve_vec_schema",
+            new=AsyncMock(return_value="extensions"),
+        ),
+    ):
+        result = await ProcessingService.rag_retrieve_multi(
+            db=db,
+            user_id=TEST_USER_ID,
+            question="Photosynthesis",
+        )
+
+    resolve_sql = str(db.execute.await_args_list[0].args[0].compile())
+    assert "processing_documents.active_version IS NOT NULL" in resolve_sql
+    chunk_sql = str(db.execute.await_args_list[1].args[0])
+    assert "d.active_version = c.index_version" in chunk_sql
+    assert [(c.document_id, c.partial) for c in result.context_chunks] == [
+        (TEST_DOC_ID, False),
+        (indexing_doc, True),
+    ]
+    assert f"[Doc {indexing_doc}{PARTIAL_NOTE} | Chunk 1]" in result.context_text
+
+
+@pytest.mark.asyncio
+async def test_rag_retrieve_multi_embeds_query_per_active_model():
+    """During a switch-over each model's documents get their own query vector."""
+    db = AsyncMock()
+    migrated_doc = uuid4()
+
+    doc_id_result = MagicMock()
+    doc_id_result.all.return_value = [
+        (TEST_DOC_ID, False, "old-model"),
+        (migrated_doc, False, "new-model"),
+    ]
+    old_result = MagicMock()
+    old_result.mappings.return_value.all.return_value = [
+        {**_make_row(TEST_DOC_ID), "distance": 0.4},
+        {**_make_row(TEST_DOC_ID, chunk_idx=1), "distance": 0.9},
+    ]
+    new_result = MagicMock()
+    new_result.mappings.return_value.all.return_value = [
+        {**_make_row(migrated_doc, chunk_idx=2), "distance": 0.2},
+    ]
+    db.execute.side_effect = [doc_id_result, old_result, new_result]
+    embed = AsyncMock(return_value=[[0.1] * EMBEDDING_DIM])
+
+    with (
+        patch("app.processing.service.embed", new=embed),
+        patch(
+            "app.processing.service._resolve_vec_schema",
+            new=AsyncMock(return_value="extensions"),
+        ),
+    ):
+        result = await ProcessingService.rag_retrieve_multi(
+            db=db,
+            user_id=TEST_USER_ID,
+            question="Enzymes",
+            top_k=2,
+        )
+
+    assert sorted(call.kwargs["model"] for call in embed.await_args_list) == [
+        "new-model",
+        "old-model",
+    ]
+    assert [
+        params["doc_ids"]
+        for _, params in (c.args for c in db.execute.await_args_list[1:])
+    ] == [
+        [TEST_DOC_ID],
+        [migrated_doc],
+    ]
+    assert [(c.document_id, c.chunk_index) for c in result.context_chunks] == [
+        (migrated_doc, 2),
+        (TEST_DOC_ID, 0),
+    ]
+
+
+# =============================================================================
+# Unit Tests: ingestion progress
+# =============================================================================
+
+
+def _status_row(doc_id: UUID, status: str, chunks_count: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=doc_id, status=status, chunks_count=chunks_count, error=None, coverage=None,
+        active_version=1 if status == "ready" else None, embed_model=None,
+        processed_at=None, extract_ms=None, chunk_ms=None, embed_ms=None, store_ms=None,
+        total_ms=None,
+    )
+
+
+def _session_scope_for(db: AsyncMock):
+    @asynccontextmanager
+    async def scope():
+        yield db
+
+    return scope
+
+
+def test_progress_hub_delivers_to_matching_subscribers():
+    hub = ProgressHub()
+    other_doc = uuid4()
+    everything = hub.subscribe(TEST_USER_ID)
+    one_doc = hub.subscribe(TEST_USER_ID, {TEST_DOC_ID})
+    other_user = hub.subscribe(uuid4())
+
+    hub.publish(ProgressEvent(TEST_USER_ID, TEST_DOC_ID, "chunked", total=4))
+    hub.publish(ProgressEvent(TEST_USER_ID, other_doc, "chunked", total=2))
+
+    assert everything.queue.qsize() == 2
+    assert one_doc.queue.get_nowait().document_id == TEST_DOC_ID
+    assert one_doc.queue.empty()
+    assert other_user.queue.empty()
+
+    everything.close()
+    one_doc.close()
+    other_user.close()
+    assert hub._subscriptions == {}
+
+
+def test_progress_subscription_drops_oldest_when_full():
+    hub = ProgressHub()
+    sub = hub.subscribe(TEST_USER_ID)
+    for i in range(SUBSCRIBER_QUEUE_SIZE + 5):
+        hub.publish(
+            ProgressEvent(TEST_USER_ID, TEST_DOC_ID, "embedding", done=i, total=100)
+        )
+
+    assert sub.queue.qsize() == SUBSCRIBER_QUEUE_SIZE
+    assert sub.queue.get_nowait().done == 5
+
+
+def test_progress_hub_bridges_workers_and_skips_own_notifications():
+    """Events go out through the backend; only other workers' come back in."""
+    sent: list[str] = []
+    backend = MagicMock(send=sent.append)
+    worker_a, worker_b = ProgressHub(backend), ProgressHub(backend)
+    sub_a = worker_a.subscribe(TEST_USER_ID)
+    sub_b = worker_b.subscribe(TEST_USER_ID)
+
+    worker_a.publish(ProgressEvent(TEST_USER_ID, TEST_DOC_ID, "ready", done=3, total=3))
+    for payload in sent:
+        worker_a._on_notification(payload)
+        worker_b._on_notification(payload)
+
+    assert sub_a.queue.qsize() == 1
+    event = sub_b.queue.get_nowait()
+    assert (event.document_id, event.stage, event.done) == (TEST_DOC_ID, "ready", 3)
+
+
+@pytest.mark.asyncio
+async def test_process_document_reports_progress():
+    db = _make_db_for_processing()
+    hub = ProgressHub()
+    sub = hub.subscribe(TEST_USER_ID)
+
+    with patch("app.processing.service.embed", new=_embed_each()):
+        result = await ProcessingService.process_document(
+            db=db,
+            document_id=TEST_DOC_ID,
+            title="Test Doc",
+            text="word " * 300,
+            progress=ProgressReporter(TEST_USER_ID, TEST_DOC_ID, hub),
+        )
+
+    stages = []
+    while not sub.queue.empty():
+        event = sub.queue.get_nowait()
+        stages.append((event.stage, event.done, event.total))
+    n = result.chunks_count
+    assert stages == [
+        ("chunked", None, n),
+        ("embedding", n, n),
+        ("partial", n, None),
+        ("ready", n, n),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_watch_progress_streams_until_documents_finish():
+    """Stored state first, then live events; ends once every document is done."""
+    ready_doc, running_doc = uuid4(), uuid4()
+    db = AsyncMock()
+    db.execute.return_value = MagicMock(
+        all=MagicMock(
+            return_value=[
+                _status_row(ready_doc, "ready", 4),
+                _status_row(running_doc, "processing", 0),
+            ]
+        )
+    )
+    hub = ProgressHub()
+
+    with (
+        patch("app.processing.service.session_scope", _session_scope_for(db)),
+        patch("app.processing.service.progress_hub", hub),
+    ):
+        events = await ProcessingService.watch_progress(
+            TEST_USER_ID, [ready_doc, running_doc]
+        )
+        report = ProgressReporter(TEST_USER_ID, running_doc, hub)
+        report("embedding", 2, 5)
+        report("ready", 5, 5)
+        received = [(name, json.loads(data)) async for name, data in events]
+
+    assert [(name, data.get("stage")) for name, data in received] == [
+        ("progress", "ready"),
+        ("progress", "processing"),
+        ("progress", "embedding"),
+        ("progress", "ready"),
+        ("done", None),
+    ]
+    assert received[2][1]["document_id"] == str(running_doc)
+    assert hub._subscriptions == {}
+
+
+@pytest.mark.asyncio
+async def test_watch_progress_unowned_documents_404():
+    db = AsyncMock()
+    db.execute.return_value = MagicMock(all=MagicMock(return_value=[]))
+    hub = ProgressHub()
+
+    with (
+        patch("app.processing.service.session_scope", _session_scope_for(db)),
+        patch("app.processing.service.progress_hub", hub),
+        pytest.raises(HTTPException) as exc_info,
+    ):
+        await ProcessingService.watch_progress(TEST_USER_ID, [uuid4()])
+
+    assert exc_info.value.status_code == 404
+    assert hub._subscriptions == {}
+
+
+@pytest.mark.asyncio
+async def test_progress_endpoint_returns_sse(client):
+    async def fake_events():
+        payload = {"document_id": str(TEST_DOC_ID), "stage": "ready"}
+        yield ("progress", json.dumps(payload))
+        yield ("done", "{}")
+
+    with patch(
+        "app.processing.router.ProcessingService.watch_progress",
+        new=AsyncMock(return_value=fake_events()),
+    ) as watch:
+        response = await client.get(
+            f"/api/processing/progress?document_ids={TEST_DOC_ID}"
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert "event: progress\n" in response.text
+    assert "event: done\n" in response.text
+    watch.assert_awaited_once_with(TEST_USER_ID, [TEST_DOC_ID])
+
+
+# =============================================================================
+# Integration Tests: request deadlines
+# =============================================================================
+
+
+@pytest.mark.asyncio
+async def test_process_endpoint_outlives_request_deadline(client, mock_db):
+    """Ingestion runs outside the request deadline, however long it takes."""
+    result = MagicMock()
+    result.scalar_one_or_none.return_value = make_mock_document(file_type="text")
+    mock_db.execute = AsyncMock(return_value=result)
+
+    async def slow_process(**kwargs):
+        await asyncio.sleep(0.05)
+        # What every embedding call does before hitting the provider.
+        assert time_remaining() is None
+        timeout_for(30.0)
+        return {"document_id": TEST_DOC_ID, "status": "ready", "chunks_count": 3}
+
+    with (
+        patch.object(get_settings(), "request_deadline_seconds", 0.01),
+        patch(
+            "app.processing.router.ProcessingService.process_document", new=slow_process
+        ),
+    ):
+        response = await client.post(f"/api/processing/{TEST_DOC_ID}/process")
+
+    assert response.status_code == 200
+    assert response.json()["chunks_count"] == 3
+
+
+@pytest.mark.asyncio
+async def test_rag_query_is_held_to_request_deadline(client, mock_db):
+    result = MagicMock()
+    result.scalar_one_or_none.return_value = make_mock_document(file_type="text")
+    mock_db.execute = AsyncMock(return_value=result)
+
+    async def slow_query(**kwargs):
+        await asyncio.sleep(0.05)
+        timeout_for(30.0)
+
+    with (
+        patch.object(get_settings(), "request_deadline_seconds", 0.01),
+        patch("app.processing.router.ProcessingService.rag_query", new=slow_query),
+    ):
+        response = await client.post(
+            "/api/processing/rag/query",
+            json={"document_id": str(TEST_DOC_ID), "question": "What is it?"},
+        )
+
+    assert response.status_code == 504
+
+
+# =============================================================================
+# Unit Tests: ingestion pipeline
+# =============================================================================
+
+
+def _page(n: int) -> str:
+    return " ".join(f"p{n}w{i}" for i in range(200))
+
+
+def test_text_chunker_matches_chunk_text_page_by_page():
+    pages = [_page(n) for n in range(7)] + ["  ", "short tail\n\twith  spaces"]
+    chunker = TextChunker()
+    streamed = [c for page in pages for c in chunker.feed(page)] + chunker.finish()
+
+    assert streamed == chunk_text("\n\n".join(pages))
+
+
+@pytest.mark.asyncio
+async def test_run_ingestion_overlaps_embedding_and_storing():
+    """Batch 2 is embedded while batch 1 is still being inserted."""
+    second_embed_started = asyncio.Event()
+    calls = 0
+    stored: list[tuple[int, int]] = []
+
+    async def fake_embed(texts):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            second_embed_started.set()
+        return [[0.0]] * len(texts)
+
+    async def fake_store(batch):
+        if batch.first_index == 0:
+            await asyncio.wait_for(second_embed_started.wait(), timeout=1)
+        stored.append((batch.first_index, len(batch.texts)))
+
+    timings = StageTimings()
+    count = await run_ingestion(
+        [_page(n) for n in range(6)],
+        embed=fake_embed,
+        store=fake_store,
+        timings=timings,
+        batch_size=2,
+    )
+
+    assert count == sum(size for _, size in stored)
+    assert [first for first, _ in stored] == list(range(0, count, 2))
+    assert timings.total > 0
+
+
+@pytest.mark.asyncio
+async def test_run_ingestion_estimates_coverage_from_pages():
+    coverages: list[float | None] = []
+
+    async def fake_store(batch):
+        coverages.append(batch.coverage)
+
+    await run_ingestion(
+        (Page(_page(n), n + 1, 10) for n in range(10)),
+        embed=AsyncMock(side_effect=lambda texts: [[0.0]] * len(texts)),
+        store=fake_store,
+        timings=StageTimings(),
+        batch_size=2,
+    )
+
+    assert all(c is not None and 0 < c <= 1 for c in coverages)
+    assert coverages == sorted(coverages)
+    assert coverages[0] < 0.5
+    assert coverages[-1] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_run_ingestion_bounds_pages_in_flight():
+    """A stalled embedder stops extraction after a few pages, not the whole document."""
+    pulled = 0
+    release = asyncio.Event()
+
+    def pages():
+        nonlocal pulled
+        for n in range(1000):
+            pulled += 1
+            yield _page(n)
+
+    async def stalled_embed(texts):
+        await release.wait()
+        return [[0.0]] * len(texts)
+
+    task = asyncio.create_task(
+        run_ingestion(
+            pages(),
+            embed=stalled_embed,
+            store=AsyncMock(),
+            timings=StageTimings(),
+            batch_size=1,
+        )
+    )
+    await asyncio.sleep(0.2)
+    assert pulled < 20
+
+    release.set()
+    assert await asyncio.wait_for(task, timeout=5) > 1000
+    assert pulled == 1000
+
+
+@pytest.mark.asyncio
+async def test_run_ingestion_failure_cancels_stages():
+    store = AsyncMock()
+    calls = 0
+
+    async def failing_embed(texts):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise HTTPException(status_code=502, detail="Embedding provider error")
+        return [[0.0]] * len(texts)
+
+    timings = StageTimings()
+    with pytest.raises(HTTPException):
+        await run_ingestion(
+            [_page(n) for n in range(6)],
+            embed=failing_embed,
+            store=store,
+            timings=timings,
+            batch_size=2,
+        )
+
+    assert store.await_count <= 1
+    assert timings.embed > 0
+
+
+@pytest.mark.asyncio
+async def test_process_document_bulk_inserts_batches():
+    db = _make_db_for_processing()
+
+    async def fake_embed(texts, prefix=None, model=None):
+        return [[0.1] * EMBEDDING_DIM for _ in texts]
+
+    with patch("app.processing.service.embed", new=fake_embed):
+        result = await ProcessingService.process_document(
+            db=db,
+            document_id=TEST_DOC_ID,
+            title="Textbook",
+            text=iter([_page(n) for n in range(30)]),
+        )
+
+    inserts = [
+        call.args[1]
+        for call in db.execute.await_args_list
+        if len(call.args) > 1
+    ]
+    assert len(inserts) == -(-result.chunks_count // EMBED_BATCH_SIZE)
+    indices = [row["chunk_index"] for rows in inserts for row in rows]
+    assert indices == list(range(result.chunks_count))
+    assert result.extract_ms is not None and result.total_ms is not None
+
+
+@pytest.mark.asyncio
+async def test_process_document_commits_partial_batches():
+    """Each batch is committed with status partial before the document is ready."""
+    db = _make_db_for_processing()
+    searchable_at: list[tuple[int, int | None]] = []
+
+    async def fake_embed(texts, prefix=None, model=None):
+        return [[0.1] * EMBEDDING_DIM for _ in texts]
+
+    async def record_commit():
+        last = db.execute.await_args_list[-1].args
+        params = last[0].compile().params if len(last) == 1 else {}
+        if params.get("status") == "partial":
+            searchable_at.append((params["chunks_count"], params["coverage"]))
+
+    db.commit.side_effect = record_commit
+
+    with patch("app.processing.service.embed", new=fake_embed):
+        result = await ProcessingService.process_document(
+            db=db,
+            document_id=TEST_DOC_ID,
+            title="Textbook",
+            text=iter([Page(_page(n), n + 1, 30) for n in range(30)]),
+        )
+
+    batches = -(-result.chunks_count // EMBED_BATCH_SIZE)
+    assert len(searchable_at) == batches > 1
+    counts = [count for count, _ in searchable_at]
+    assert counts == sorted(counts) and counts[-1] == result.chunks_count
+    coverages = [coverage for _, coverage in searchable_at]
+    assert coverages == sorted(coverages) and coverages[0] < 100
+    final = db.execute.await_args_list[-1].args[0].compile().params
+    assert (final["status"], final["coverage"]) == ("ready", 100)
+    assert result.coverage == 100
+
+
+# =============================================================================
+# Unit Tests: resumable ingestion
+# =============================================================================
+
+
+class _CheckpointDB:
+    """Just enough of an AsyncSession for process_document.
+
+    Writes only reach *state* on commit, so cancelling a run drops
+    whatever it had not committed, as a real session would.
+    """
+
+    def __init__(self, state: dict):
+        self.state = state
+        self.statements: list = []
+        self._pending: list = []
+
+    def add(self, obj):
+        self._pending.append(
+            lambda: self.state.update(
+                doc={"status": obj.status, "index_version": obj.index_version}
+            )
+        )
+
+    async def flush(self):
+        pass
+
+    async def commit(self):
+        for apply in self._pending:
+            apply()
+        self._pending = []
+
+    async def execute(self, stmt, params=None):
+        self.statements.append(stmt)
+        result = MagicMock()
+        kind = stmt.__visit_name__
+        if kind == "select":
+            columns = [c.key for c in stmt.selected_columns]
+            if "page_number" in columns:
+                pages = sorted(self.state["pages"].items())
+                result.all.return_value = [
+                    SimpleNamespace(page_number=n, content=text) for n, text in pages
+                ]
+            else:
+                doc = self.state.get("doc")
+                result.one_or_none.return_value = (
+                    None
+                    if doc is None
+                    else SimpleNamespace(**{c: doc.get(c) for c in columns})
+                )
+        elif kind == "insert" and stmt.table.name == "processing_pages":
+            self._pending.append(
+                lambda: self.state["pages"].update(
+                    (r["page_number"], r["content"]) for r in params
+                )
+            )
+        elif kind == "insert":
+            self._pending.append(
+                lambda: self.state["chunks"].update(
+                    ((r["index_version"], r["chunk_index"]), r["content"])
+                    for r in params
+                )
+            )
+        elif kind == "update":
+            values = {
+                k: v for k, v in stmt.compile().params.items()
+                if k in ProcessingDocument.__table__.c and k != "id"
+            }
+            self._pending.append(lambda: self.state["doc"].update(values))
+        elif kind == "delete":
+            where = stmt.compile().params
+            version, first = where["index_version_1"], where["chunk_index_1"]
+            self._pending.append(
+                lambda: [
+                    self.state["chunks"].pop(key)
+                    for key in list(self.state["chunks"])
+                    if key[0] == version and key[1] >= first
+                ]
+            )
+        return result
+
+
+@pytest.mark.asyncio
+async def test_killed_ingestion_resumes_without_repeating_work():
+    """A run killed mid-document resumes at its checkpoint; no work is redone."""
+    document = [_page(n) for n in range(40)]
+    state: dict = {"doc": None, "pages": {}, "chunks": {}}
+    extracted: list[int] = []
+    embedded: list[str] = []
+    stall = asyncio.Event()
+    release = asyncio.Event()
+
+    def source(start_page):
+        for number in range(start_page, len(document) + 1):
+            extracted.append(number)
+            yield Page(document[number - 1], number, len(document))
+
+    async def fake_embed(texts, prefix=None, model=None):
+        if len(embedded) >= 2 * EMBED_BATCH_SIZE and not release.is_set():
+            stall.set()
+            await release.wait()
+        embedded.extend(texts)
+        return [[0.1] * EMBEDDING_DIM for _ in texts]
+
+    with patch("app.processing.service.embed", new=fake_embed):
+        run = asyncio.create_task(
+            ProcessingService.process_document(
+                db=_CheckpointDB(state),
+                document_id=TEST_DOC_ID,
+                title="Textbook",
+                text=source,
+            )
+        )
+        await asyncio.wait_for(stall.wait(), timeout=5)
+        await asyncio.sleep(0.05)
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+
+        assert state["doc"]["status"] == "partial"
+        stored_chunks = {i: text for (_, i), text in state["chunks"].items()}
+        checkpoint_page = state["doc"]["pages_extracted"]
+        assert (
+            len(stored_chunks) == state["doc"]["chunks_count"] == 2 * EMBED_BATCH_SIZE
+        )
+        assert sorted(state["pages"]) == list(range(1, checkpoint_page + 1))
+
+        extracted.clear()
+        embedded.clear()
+        release.set()
+        result = await ProcessingService.process_document(
+            db=_CheckpointDB(state),
+            document_id=TEST_DOC_ID,
+            title="Textbook",
+            text=source,
+        )
+
+    expected = chunk_text("\n\n".join(document))
+    assert result.status == "ready"
+    assert [state["chunks"][1, i] for i in range(len(expected))] == expected
+    # Nothing stored by the killed run was extracted or embedded again.
+    assert extracted[0] == checkpoint_page + 1
+    assert embedded == expected[len(stored_chunks):]
+    assert state["doc"]["pages_extracted"] == len(document)
+
+
+@pytest.mark.asyncio
+async def test_finished_extraction_is_not_repeated():
+    """Re-processing a document reuses its saved pages instead of re-extracting."""
+    document = [_page(n) for n in range(3)]
+    state = {
+        "doc": {
+            "status": "ready", "chunks_count": 2, "embed_model": "old-model",
+            "pages_extracted": 3, "page_count": 3, "index_version": 1,
+        },
+        "pages": dict(enumerate(document, start=1)),
+        "chunks": {(1, 0): "old", (1, 1): "old"},
+    }
+    source = MagicMock()
+
+    async def fake_embed(texts, prefix=None, model=None):
+        return [[0.1] * EMBEDDING_DIM for _ in texts]
+
+    with patch("app.processing.service.embed", new=fake_embed):
+        result = await ProcessingService.process_document(
+            db=_CheckpointDB(state), document_id=TEST_DOC_ID, title="Notes", text=source
+        )
+
+    source.assert_not_called()
+    new_chunks = [
+        text for (version, _), text in state["chunks"].items() if version == 2
+    ]
+    assert new_chunks == chunk_text("\n\n".join(document))
+    assert result.chunks_count == len(new_chunks)
+
+
+@pytest.mark.asyncio
+async def test_recovery_resumes_stale_runs_from_their_page_source():
+    db = AsyncMock()
+    document = SimpleNamespace(
+        id=TEST_DOC_ID,
+        user_id=TEST_USER_ID,
+        original_filename="book.pdf",
+        file_type="pdf",
+    )
+    # Claim one stale run, load its document, then find no more.
+    db.scalar.side_effect = [TEST_DOC_ID, document, None]
+    recovery = IngestionRecovery(session_factory=_session_scope_for(db))
+
+    with patch(
+        "app.processing.recovery.ProcessingService.process_document", new=AsyncMock()
+    ) as process:
+        assert await recovery.sweep() == 1
+
+    claim_sql = str(
+        db.scalar.await_args_list[0].args[0].compile(dialect=postgresql.dialect())
+    )
+    assert "FOR UPDATE SKIP LOCKED" in claim_sql
+    kwargs = process.await_args.kwargs
+    assert kwargs["document_id"] == TEST_DOC_ID
+    assert kwargs["text"].func is iter_document_pages
+
+
+@pytest.mark.asyncio
+async def test_reindex_keeps_active_version_until_atomic_swap():
+    """Re-indexing builds version 2 beside version 1 and swaps in one UPDATE."""
+    document = [_page(n) for n in range(40)]
+    state = {
+        "doc": {
+            "status": "ready",
+            "chunks_count": 2,
+            "embed_model": "old-model",
+            "pages_extracted": 40,
+            "page_count": 40,
+            "index_version": 1,
+            "active_version": 1,
+        },
+        "pages": dict(enumerate(document, start=1)),
+        "chunks": {(1, 0): "old", (1, 1): "old"},
+    }
+    db = _CheckpointDB(state)
+    stall, release = asyncio.Event(), asyncio.Event()
+    calls = 0
+
+    async def fake_embed(texts, prefix=None, model=None):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            stall.set()
+            await release.wait()
+        return [[0.1] * EMBEDDING_DIM for _ in texts]
+
+    with patch("app.processing.service.embed", new=fake_embed):
+        run = asyncio.create_task(
+            ProcessingService.process_document(
+                db=db, document_id=TEST_DOC_ID, title="Book", text=MagicMock()
+            )
+        )
+        await asyncio.wait_for(stall.wait(), timeout=5)
+        await asyncio.sleep(0.05)
+
+        # Mid-build: the old version is untouched and still the one read.
+        assert state["doc"]["active_version"] == 1
+        assert state["doc"]["index_version"] == 2
+        assert state["chunks"][1, 0] == state["chunks"][1, 1] == "old"
+        assert any(version == 2 for version, _ in state["chunks"])
+
+        release.set()
+        result = await run
+
+    assert result.status == "ready"
+    assert state["doc"]["active_version"] == 2
+    # One statement moves the pointer and marks version 1 for cleanup.
+    swap = str(db.statements[-1].compile(dialect=postgresql.dialect()))
+    assert "active_version=" in swap and "retired_version=CASE" in swap
+
+
+@pytest.mark.asyncio
+async def test_delete_retired_chunks_removes_versions_below_active():
+    db = AsyncMock()
+    db.scalar.return_value = 3
+
+    assert await ProcessingService.delete_retired_chunks(db, TEST_DOC_ID) is True
+
+    claim = str(db.scalar.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "SET retired_version" in claim and "retired_version IS NOT NULL" in claim
+    (delete_call,) = db.execute.await_args_list
+    where = delete_call.args[0].compile().params
+    assert where["index_version_1"] == 3
+    db.commit.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_delete_retired_chunks_without_retired_version_is_a_no_op():
+    db = AsyncMock()
+    db.scalar.return_value = None
+
+    assert await ProcessingService.delete_retired_chunks(db, TEST_DOC_ID) is False
+    db.execute.assert_not_awaited()
+
+
+# =============================================================================
+# Unit Tests: embedding migrations
+# =============================================================================
+
+
+_SQL_OPERATORS = {
+    operators.eq: lambda a, b: a == b,
+    operators.ne: lambda a, b: a != b,
+    operators.lt: lambda a, b: a < b,
+    operators.le: lambda a, b: a <= b,
+    operators.gt: lambda a, b: a > b,
+    operators.ge: lambda a, b: a >= b,
+    operators.add: lambda a, b: a + b,
+    operators.sub: lambda a, b: a - b,
+    operators.is_distinct_from: lambda a, b: a != b,
+    operators.is_: lambda a, b: a is b,
+    operators.is_not: lambda a, b: a is not b,
+    operators.in_op: lambda a, b: a in b,
+    operators.not_in_op: lambda a, b: a not in b,
+}
+
+
+def _sql_value(expr, row: dict):
+    """Evaluate the SQL expressions the migration job uses against *row*."""
+    if isinstance(expr, BooleanClauseList):
+        values = [_sql_value(c, row) for c in expr.clauses]
+        return all(values) if expr.operator is operators.and_ else any(values)
+    if isinstance(expr, BinaryExpression):
+        left, right = _sql_value(expr.left, row), _sql_value(expr.right, row)
+        ordering = (operators.lt, operators.le, operators.gt, operators.ge)
+        if expr.operator in ordering and None in (left, right):
+            return False
+        return _SQL_OPERATORS[expr.operator](left, right)
+    if isinstance(expr, Grouping):
+        return _sql_value(expr.element, row)
+    if isinstance(expr, BindParameter):
+        return expr.effective_value
+    if isinstance(expr, Null):
+        return None
+    if isinstance(expr, FunctionElement) and expr.name == "now":
+        return datetime.now(UTC)
+    return row[expr.key]
+
+
+class _MigrationDB:
+    """An in-memory stand-in for the tables an embedding migration touches.
+
+    Sessions evaluate the job's statements against the rows; writes reach
+    the tables on commit and are dropped on rollback or cancellation.
+    """
+
+    def __init__(self) -> None:
+        self.tables: dict[str, list[dict]] = {
+            "processing_documents": [],
+            "document_chunks": [],
+            "embedding_migrations": [],
+        }
+
+    def rows(self, table: str, **match) -> list[dict]:
+        return [
+            r for r in self.tables[table] if all(r[k] == v for k, v in match.items())
+        ]
+
+    @asynccontextmanager
+    async def session(self):
+        yield _MigrationSession(self)
+
+
+class _MigrationSession:
+    def __init__(self, store: _MigrationDB) -> None:
+        self.store = store
+        self._pending: list = []
+
+    async def commit(self) -> None:
+        for apply in self._pending:
+            apply()
+        self._pending = []
+
+    async def rollback(self) -> None:
+        self._pending = []
+
+    async def scalar(self, stmt):
+        row = (await self.execute(stmt)).first()
+        return None if row is None else row[0]
+
+    async def execute(self, stmt, params=None):
+        table = self.store.tables[stmt.table.name] if hasattr(stmt, "table") else None
+        kind = stmt.__visit_name__
+        if kind == "select":
+            (source,) = stmt.get_final_froms()
+            rows = [
+                r
+                for r in self.store.tables[source.name]
+                if _sql_value(stmt.whereclause, r)
+            ]
+            for order in reversed(stmt._order_by_clauses):
+                rows.sort(key=lambda r: r[order.key])
+            columns = list(stmt.selected_columns)
+            if isinstance(columns[0], FunctionElement):
+                return _Result([(len(rows),)])
+            rows = rows[: stmt._limit] if stmt._limit is not None else rows
+            keys = [
+                (c.key, c.element.key if isinstance(c, Label) else c.key)
+                for c in columns
+            ]
+            return _Result(
+                [SimpleNamespace(**{k: r[source] for k, source in keys}) for r in rows]
+            )
+        if kind == "insert":
+            mapper = DocumentChunk.__mapper__
+            new = [
+                {mapper.attrs[k].columns[0].key: v for k, v in p.items()}
+                for p in params
+            ]
+            self._pending.append(lambda: table.extend(new))
+            return _Result([])
+        matched = [r for r in table if _sql_value(stmt.whereclause, r)]
+        if kind == "delete":
+            self._pending.append(lambda: [table.remove(r) for r in matched])
+            return _Result([])
+        changes = [
+            (
+                r,
+                {
+                    (k if isinstance(k, str) else k.key): _sql_value(v, r)
+                    for k, v in stmt._values.items()
+                },
+            )
+            for r in matched
+        ]
+        self._pending.append(lambda: [r.update(c) for r, c in changes])
+        returned = []
+        for r, c in changes:
+            after = {**r, **c}
+            returned.append(
+                [
+                    SimpleNamespace(**after) if hasattr(col, "c") else after[col.key]
+                    for col in stmt._returning
+                ]
+            )
+        return _Result(returned, rowcount=len(matched))
+
+
+class _Result:
+    def __init__(self, rows: list, rowcount: int = 0) -> None:
+        self._rows = rows
+        self.rowcount = rowcount
+
+    def all(self) -> list:
+        return self._rows
+
+    def first(self):
+        return self._rows[0] if self._rows else None
+
+
+def _library(store: _MigrationDB, sizes: list[int]) -> list[UUID]:
+    """Ready documents of *sizes* chunks, embedded with "old-model"."""
+    ids = sorted(uuid4() for _ in sizes)
+    for doc_id, size in zip(ids, sizes, strict=True):
+        store.tables["processing_documents"].append(
+            {
+                "id": doc_id, "status": "ready", "chunks_count": size,
+                "active_version": 1, "index_version": 1, "retired_version": None,
+                "active_model": "old-model", "embed_model": "old-model",
+                "staged_version": None, "staged_model": None, "staged_chunks": 0,
+            }
+        )
+        store.tables["document_chunks"].extend(
+            {
+                "id": uuid4(),
+                "document_id": doc_id,
+                "index_version": 1,
+                "chunk_index": i,
+                "content": f"{doc_id} chunk {i}",
+                "metadata": {"chunk_index": i},
+                "embedding": [0.0],
+                "embed_model": "old-model",
+            }
+            for i in range(size)
+        )
+    return ids
+
+
+def _migration(store: _MigrationDB) -> UUID:
+    migration_id = uuid4()
+    store.tables["embedding_migrations"].append(
+        {
+            "id": migration_id,
+            "target_model": "new-model",
+            "status": "pending",
+            "error": None,
+            "rate_limit": 1_000_000.0,
+            "concurrency": 2,
+            "cursor": None,
+            "chunks_done": 0,
+            "switched_at": None,
+            "completed_at": None,
+            "updated_at": datetime.now(UTC),
+        }
+    )
+    return migration_id
+
+
+def test_pacer_spaces_batches_to_rate():
+    clock = SimpleNamespace(now=100.0)
+    pacer = Pacer(rate=10.0, clock=lambda: clock.now)
+
+    assert pacer.delay(32) == 0.0
+    assert pacer.delay(32) == pytest.approx(3.2)
+    clock.now += 10.0
+    # Idle time is not banked as a burst beyond one batch.
+    assert pacer.delay(32) == 0.0
+    assert pacer.delay(8) == pytest.approx(3.2)
+
+
+@pytest.mark.asyncio
+async def test_interrupted_migration_resumes_and_switches_at_full_coverage():
+    """The old index is served until every document is staged.
+
+    Nothing is embedded twice.
+    """
+    store = _MigrationDB()
+    docs = _library(store, [40, 5, 70])
+    migration_id = _migration(store)
+    embedded: list[str] = []
+
+    async def embed_fn(texts, prefix=None, model=None):
+        assert model == "new-model" and prefix == "passage: "
+        if len(embedded) >= 64 and not killed:
+            raise RuntimeError("worker killed")
+        # Nothing switches while the new index is incomplete.
+        served = {d["active_model"] for d in store.tables["processing_documents"]}
+        assert served == {"old-model"}
+        embedded.extend(texts)
+        return [[0.2] for _ in texts]
+
+    killed = False
+    with pytest.raises(RuntimeError):
+        await Reembedder(migration_id, store.session, embed_fn, pass_delay=0).run()
+    killed = True
+    checkpointed = len(embedded)
+    (migration,) = store.tables["embedding_migrations"]
+    assert migration["status"] == "running" and migration["chunks_done"] == checkpointed
+    assert len(store.rows("document_chunks", index_version=2)) == checkpointed
+
+    status = await Reembedder(
+        migration_id, store.session, embed_fn, lease_timeout=-1, pass_delay=0
+    ).run()
+
+    assert status == "completed"
+    assert len(embedded) == len(set(embedded)) == 115
+    assert migration["chunks_done"] == 115 and migration["switched_at"] is not None
+    for doc_id, doc in zip(docs, store.tables["processing_documents"], strict=True):
+        assert doc["active_version"] == 2 and doc["retired_version"] == 1
+        assert doc["active_model"] == doc["embed_model"] == "new-model"
+        assert doc["staged_version"] is None
+        old = store.rows("document_chunks", document_id=doc_id, index_version=1)
+        new = store.rows("document_chunks", document_id=doc_id, index_version=2)
+        assert [c["content"] for c in sorted(new, key=lambda c: c["chunk_index"])] == [
+            c["content"] for c in old
+        ]
+        assert {c["embed_model"] for c in new} == {"new-model"}
+
+
+@pytest.mark.asyncio
+async def test_launched_migration_outlives_request_deadline():
+    """A migration started from an admin request does not inherit its deadline."""
+    store = _MigrationDB()
+    _library(store, [10])
+    migration_id = _migration(store)
+
+    async def embed_fn(texts, prefix=None, model=None):
+        await asyncio.sleep(0.02)
+        # What embed() does first: fails once a request deadline has run out.
+        timeout_for(30.0)
+        return [[0.2] for _ in texts]
+
+    jobs = ReembedJobs()
+    reembedder = partial(
+        Reembedder, session_factory=store.session, embed_fn=embed_fn, pass_delay=0
+    )
+    with patch("app.processing.reembed.Reembedder", reembedder):
+        with deadline_scope(0.01):
+            jobs.launch(migration_id)
+        (task,) = jobs._tasks.values()
+        await asyncio.wait_for(task, 5)
+
+    (migration,) = store.tables["embedding_migrations"]
+    assert migration["status"] == "completed" and migration["error"] is None
+
+
+@pytest.mark.asyncio
+async def test_paused_migration_keeps_only_committed_batches():
+    store = _MigrationDB()
+    _library(store, [100])
+    migration_id = _migration(store)
+    embedded: list[str] = []
+
+    async def embed_fn(texts, prefix=None, model=None):
+        embedded.extend(texts)
+        if len(embedded) > EMBED_BATCH_SIZE:
+            store.tables["embedding_migrations"][0]["status"] = "paused"
+        return [[0.2] for _ in texts]
+
+    status = await Reembedder(migration_id, store.session, embed_fn, pass_delay=0).run()
+
+    assert status == "paused"
+    (doc,) = store.tables["processing_documents"]
+    assert doc["staged_chunks"] == EMBED_BATCH_SIZE
+    assert doc["active_version"] == 1 and doc["active_model"] == "old-model"
+    assert len(store.rows("document_chunks", index_version=2)) == EMBED_BATCH_SIZE
+
+
+@pytest.mark.asyncio
+async def test_reprocessed_document_is_migrated_after_the_switch():
+    """A document re-indexed mid-migration loses its staging.
+
+    It is switched on its own later.
+    """
+    store = _MigrationDB()
+    first, second = _library(store, [10, 10])
+    migration_id = _migration(store)
+    reprocessed = False
+
+    async def embed_fn(texts, prefix=None, model=None):
+        nonlocal reprocessed
+        if not reprocessed:
+            # process_document restarting the first document, as its UPDATE does.
+            doc = store.rows("processing_documents", id=first)[0]
+            doc.update(
+                status="processing",
+                index_version=3,
+                staged_version=None,
+                staged_model=None,
+            )
+            reprocessed = True
+        return [[0.2] for _ in texts]
+
+    runner = Reembedder(migration_id, store.session, embed_fn, pass_delay=0)
+    run = asyncio.create_task(runner.run())
+    while not store.rows("embedding_migrations", id=migration_id)[0]["switched_at"]:
+        await asyncio.sleep(0)
+    # The re-index finishes with the old model only after the switch.
+    store.rows("processing_documents", id=first)[0].update(
+        status="ready", active_version=3, retired_version=1, chunks_count=10
+    )
+    store.tables["document_chunks"].extend(
+        {
+            "id": uuid4(),
+            "document_id": first,
+            "index_version": 3,
+            "chunk_index": i,
+            "content": f"reprocessed {i}",
+            "metadata": {},
+            "embedding": [0.0],
+            "embed_model": "old-model",
+        }
+        for i in range(10)
+    )
+
+    assert await asyncio.wait_for(run, timeout=5) == "completed"
+    docs = {d["id"]: d for d in store.tables["processing_documents"]}
+    assert docs[second]["active_version"] == 2
+    assert docs[first]["active_version"] == 4
+    assert docs[first]["active_model"] == "new-model"
+    assert len(store.rows("document_chunks", document_id=first, index_version=4)) == 10
+
+
+@pytest.mark.asyncio
+async def test_embedding_migration_endpoints_require_admin(client: AsyncClient):
+    resp = await client.post(
+        "/api/processing/embedding-migrations", json={"target_model": "new-model"}
+    )
+
+    assert resp.status_code == 403
@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+from datetime import datetime
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock, patch
 from uuid import uuid4
 
@@ -88,7 +90,7 @@ async def test_generate_happy_path():
     mock_set.created_at = "2026-01-01T00:00:00"
     mock_set.updated_at = "2026-01-01T00:00:00"
 
-    async def fake_refresh(obj):
+    async def fake_refresh(obj, attribute_names=None):
         for attr, val in vars(mock_set).items():
             if not attr.startswith("_"):
                 setattr(obj, attr, val)
@@ -177,24 +179,27 @@ async def test_generate_empty_llm_response_raises_502():
 
 @pytest.mark.asyncio
 async def test_list_sets():
-    """list_sets() returns summaries with question counts."""
+    """list_sets() returns summaries with the maintained question counts."""
     db = _mock_db()
 
-    mock_set = MagicMock()
-    mock_set.id = uuid4()
-    mock_set.title = "Bio Quiz"
-    mock_set.description = None
-    mock_set.folder_id = None
-    mock_set.created_at = "2026-01-01T00:00:00"
-
+    row = SimpleNamespace(
+        id=uuid4(),
+        title="Bio Quiz",
+        description=None,
+        folder_id=None,
+        question_count=10,
+        created_at=datetime(2026, 1, 1),
+    )
     mock_result = MagicMock()
-    mock_result.all.return_value = [(mock_set, 10)]
+    mock_result.all.return_value = [row]
     db.execute.return_value = mock_result
 
-    result = await QuizService.list_sets(db, TEST_USER_ID)
+    page = await QuizService.list_sets(db, TEST_USER_ID)
 
-    assert len(result) == 1
-    assert result[0].question_count == 10
+    assert len(page.items) == 1
+    assert page.items[0].question_count == 10
+    assert page.next_cursor is None
+    assert "quiz_questions" not in str(db.execute.await_args.args[0])
 
 
 @pytest.mark.asyncio
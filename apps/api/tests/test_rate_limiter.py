@@ -0,0 +1,259 @@
+"""Tests for the GCRA rate limiter and its backends."""
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.core.rate_limiter import (
+    MemoryRateLimitBackend,
+    PostgresRateLimitBackend,
+    RateLimitDecision,
+    RateLimiter,
+)
+
+# A Postgres URL (postgresql+asyncpg://...) to run the cross-process test against.
+_PG_URL = os.environ.get("RATE_LIMIT_TEST_DATABASE_URL")
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    c = _Clock()
+    with patch("app.core.rate_limiter.time.monotonic", c):
+        yield c
+
+
+def _session_factory(granted: int | None):
+    """A session factory whose lease upsert grants *granted* cells."""
+    session = AsyncMock()
+    session.execute.return_value = MagicMock(
+        scalar_one_or_none=MagicMock(return_value=granted)
+    )
+
+    @asynccontextmanager
+    async def factory():
+        yield session
+
+    return factory, session
+
+
+# =============================================================================
+# Unit Tests: MemoryRateLimitBackend
+# =============================================================================
+
+
+def test_allows_burst_then_spaces_requests(clock):
+    backend = MemoryRateLimitBackend()
+    for _ in range(3):
+        assert backend.hit_now("generate:u1", 3, 60).allowed
+
+    denied = backend.hit_now("generate:u1", 3, 60)
+    assert not denied.allowed
+    assert denied.retry_after == pytest.approx(20.0)
+    assert denied.retry_after_header == "20"
+
+    clock.now += 20
+    assert backend.hit_now("generate:u1", 3, 60).allowed
+    assert not backend.hit_now("generate:u1", 3, 60).allowed
+
+
+def test_idle_keys_are_swept(clock):
+    backend = MemoryRateLimitBackend()
+    for i in range(10):
+        backend.hit_now(f"chat:u{i}", 10, 10)
+    assert len(backend) == 10
+
+    clock.now += 60
+    for _ in range(5):
+        backend.hit_now("chat:active", 10, 10)
+    assert len(backend) == 1
+
+
+def test_max_keys_bounds_memory(clock):
+    backend = MemoryRateLimitBackend(max_keys=100)
+    for i in range(1_000):
+        backend.hit_now(f"generate:u{i}", 3, 3600)
+    assert len(backend) == 100
+
+
+# =============================================================================
+# Unit Tests: PostgresRateLimitBackend leases
+# =============================================================================
+
+
+@pytest.mark.asyncio
+async def test_postgres_backend_spends_leased_cells_locally(clock):
+    factory, session = _session_factory(5)
+    backend = PostgresRateLimitBackend(factory, lease_cells=5)
+
+    for _ in range(5):
+        assert (await backend.hit("chat:u1", 20, 3600)).allowed
+    assert session.execute.await_count == 1
+    assert session.execute.await_args.args[1]["cells"] == 5
+
+    assert (await backend.hit("chat:u1", 20, 3600)).allowed
+    assert session.execute.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_postgres_backend_leases_a_quarter_of_the_burst(clock):
+    factory, session = _session_factory(1)
+    backend = PostgresRateLimitBackend(factory, lease_cells=5)
+
+    await backend.hit("generate:u1", 3, 3600)
+    assert session.execute.await_args.args[1]["cells"] == 1
+    await backend.hit("chat:u1", 10, 60)
+    assert session.execute.await_args.args[1]["cells"] == 2
+
+
+@pytest.mark.asyncio
+async def test_postgres_backend_hands_back_expired_leases(clock):
+    factory, session = _session_factory(5)
+    backend = PostgresRateLimitBackend(factory, lease_cells=5, lease_ttl=10)
+    await backend.hit("chat:u1", 20, 3600)
+
+    clock.now += 11
+    await backend.hit("chat:u2", 20, 3600)
+    await backend.close()
+
+    calls = session.execute.await_args_list
+    released = [c.args[1] for c in calls if "span" in c.args[1]]
+    # u1's four unspent cells, 180 s apart; u2's lease goes back on close.
+    assert {"key": "chat:u1", "span": pytest.approx(720.0)} in released
+    assert {"key": "chat:u2", "span": pytest.approx(720.0)} in released
+
+
+@pytest.mark.asyncio
+async def test_postgres_backend_denial_reads_retry_after(clock):
+    factory, session = _session_factory(None)
+    backend = PostgresRateLimitBackend(factory)
+
+    decision = await backend.hit("chat:u1", 10, 60)
+    assert not decision.allowed
+    assert session.execute.await_count == 2
+
+
+# =============================================================================
+# Unit Tests: RateLimiter
+# =============================================================================
+
+
+@pytest.mark.asyncio
+async def test_keys_are_independent_per_user_and_action(clock):
+    limiter = RateLimiter()
+    assert (await limiter.check("u1", "chat", 1, 60)).allowed
+    assert not (await limiter.check("u1", "chat", 1, 60)).allowed
+    assert (await limiter.check("u2", "chat", 1, 60)).allowed
+    assert (await limiter.check("u1", "generate", 1, 60)).allowed
+
+
+@pytest.mark.asyncio
+async def test_denials_are_cached_locally(clock):
+    backend = AsyncMock()
+    backend.hit.return_value = RateLimitDecision(False, 30.0)
+    limiter = RateLimiter(backend)
+
+    for _ in range(5):
+        decision = await limiter.check("u1", "chat", 10, 60)
+        assert not decision.allowed
+    assert backend.hit.await_count == 1
+    assert decision.retry_after == pytest.approx(30.0)
+
+    clock.now += 31
+    backend.hit.return_value = RateLimitDecision(True, 0.0)
+    assert (await limiter.check("u1", "chat", 10, 60)).allowed
+    assert backend.hit.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_backend_failure_falls_back_to_local_limits(clock):
+    backend = AsyncMock()
+    backend.hit.side_effect = ConnectionRefusedError()
+    limiter = RateLimiter(backend)
+
+    assert (await limiter.check("u1", "chat", 1, 60)).allowed
+    assert not (await limiter.check("u1", "chat", 1, 60)).allowed
+
+
+@pytest.mark.asyncio
+async def test_failing_backend_is_skipped_while_the_breaker_is_open(clock):
+    backend = AsyncMock()
+    backend.hit.side_effect = ConnectionRefusedError()
+    limiter = RateLimiter(backend)
+
+    for i in range(10):
+        assert (await limiter.check(f"u{i}", "chat", 10, 60)).allowed
+    assert backend.hit.await_count == limiter.breaker.failure_threshold
+
+    clock.now += limiter.breaker.reset_timeout
+    backend.hit.side_effect = None
+    backend.hit.return_value = RateLimitDecision(True, 0.0)
+    assert (await limiter.check("u1", "chat", 10, 60)).allowed
+    assert (await limiter.check("u2", "chat", 10, 60)).allowed
+    assert backend.hit.await_count == limiter.breaker.failure_threshold + 2
+
+
+# =============================================================================
+# Integration Tests: PostgresRateLimitBackend across processes
+# =============================================================================
+
+
+def _hammer(url: str, key: str, attempts: int, lease_cells: int) -> int:
+    """Run in a child process: hit *key* and return how many were allowed."""
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async def run() -> int:
+        engine = create_async_engine(url)
+        backend = PostgresRateLimitBackend(async_sessionmaker(engine), lease_cells)
+        allowed = 0
+        for _ in range(attempts):
+            allowed += (await backend.hit(key, 20, 3600)).allowed
+        # Unspent cells go back to the shared row.
+        await backend.close()
+        await engine.dispose()
+        return allowed
+
+    return asyncio.run(run())
+
+
+@pytest.mark.skipif(not _PG_URL, reason="RATE_LIMIT_TEST_DATABASE_URL not set")
+@pytest.mark.parametrize("lease_cells", [1, 5])
+@pytest.mark.asyncio
+async def test_postgres_backend_limit_holds_across_processes(lease_cells):
+    from uuid import uuid4
+
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    from app.core.models import RateLimitState
+
+    engine = create_async_engine(_PG_URL)
+    async with engine.begin() as conn:
+        await conn.run_sync(RateLimitState.__table__.create, checkfirst=True)
+
+    key = f"test:{uuid4()}"
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(4) as pool:
+        results = pool.starmap(_hammer, [(_PG_URL, key, 15, lease_cells)] * 4)
+
+    # Whatever was leased but not spent has been handed back, so what the
+    # processes let through plus what is left is exactly the burst of 20.
+    backend = PostgresRateLimitBackend(async_sessionmaker(engine), lease_cells=1)
+    left = 0
+    while (await backend.hit(key, 20, 3600)).allowed:
+        left += 1
+    await engine.dispose()
+
+    assert sum(results) <= 20
+    assert sum(results) + left == 20
@@ -3,6 +3,7 @@
 import { useCallback, useState } from "react";
 import { useDropzone } from "react-dropzone";
 import { createSupabaseBrowser } from "../../lib/supabase/client";
+import { readSSE } from "../../lib/sse";
 
 const ACCEPTED_FILE_TYPES = {
   "application/pdf": [".pdf"],
@@ -17,26 +18,71 @@ const MAX_FILE_SIZE = 50 * 1024 * 1024; // 10MB
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
 
+async function getUploadToken() {
+  const supabase = createSupabaseBrowser();
+  const {
+    data: { session },
+  } = await supabase.auth.getSession();
+
+  // In development, allow using a dev token if no session exists
+  const isDev = process.env.NODE_ENV === "development";
+  const devToken = process.env.NEXT_PUBLIC_DEV_ACCESS_TOKEN || "dev-token";
+  const accessToken = session?.access_token || (isDev ? devToken : null);
+
+  if (!accessToken) {
+    throw new Error("You must be logged in to upload documents");
+  }
+  return accessToken;
+}
+
+/**
+ * Follow ingestion progress of all the user's documents until `signal`
+ * aborts. Progress is best-effort: failures are ignored.
+ */
+async function watchIndexing(accessToken, onProgress, signal) {
+  try {
+    const res = await fetch(`${API_URL}/api/processing/progress`, {
+      headers: { Authorization: `Bearer ${accessToken}` },
+      signal,
+    });
+    if (!res.ok) return;
+    await readSSE(res, (event, data) => {
+      if (event === "progress") onProgress(JSON.parse(data));
+    });
+  } catch {
+    // Aborted when the uploads finish, or the stream dropped.
+  }
+}
+
+function describeIndexing(p) {
+  if (!p) return null;
+  switch (p.stage) {
+    case "downloaded":
+      return "Reading file...";
+    case "extracted":
+      return `Extracting page ${p.done} of ${p.total}`;
+    case "chunked":
+      return `Split into ${p.total} passages`;
+    case "embedding":
+      return `Indexing ${p.done} of ${p.total} passages`;
+    case "partial":
+      return `Searchable now \u2014 ${p.done} passages indexed so far`;
+    case "ready":
+      return "Indexed";
+    case "error":
+      return p.error || "Indexing failed";
+    default:
+      return null;
+  }
+}
+
 export default function DocumentUpload({ onUploadSuccess }) {
   const [uploading, setUploading] = useState(false);
   const [error, setError] = useState(null);
   const [uploadProgress, setUploadProgress] = useState(0);
+  const [indexing, setIndexing] = useState(null);
 
-  const uploadFile = async (file) => {
-    const supabase = createSupabaseBrowser();
-    const {
-      data: { session },
-    } = await supabase.auth.getSession();
-
-    // In development, allow using a dev token if no session exists
-    const isDev = process.env.NODE_ENV === "development";
-    const devToken = process.env.NEXT_PUBLIC_DEV_ACCESS_TOKEN || "dev-token";
-    const accessToken = session?.access_token || (isDev ? devToken : null);
-
-    if (!accessToken) {
-      throw new Error("You must be logged in to upload documents");
-    }
-
+  const uploadFile = async (file, accessToken) => {
     const formData = new FormData();
     formData.append("file", file);
 
@@ -72,14 +118,18 @@ export default function DocumentUpload({ onUploadSuccess }) {
 
       setUploading(true);
       setUploadProgress(0);
+      setIndexing(null);
+      const watcher = new AbortController();
 
       try {
+        const accessToken = await getUploadToken();
+        watchIndexing(accessToken, setIndexing, watcher.signal);
         const results = [];
         for (let i = 0; i < acceptedFiles.length; i++) {
           const file = acceptedFiles[i];
           setUploadProgress(Math.round(((i + 0.5) / acceptedFiles.length) * 100));
 
-          const result = await uploadFile(file);
+          const result = await uploadFile(file, accessToken);
           results.push(result);
 
           setUploadProgress(Math.round(((i + 1) / acceptedFiles.length) * 100));
@@ -91,8 +141,10 @@ export default function DocumentUpload({ onUploadSuccess }) {
       } catch (err) {
         setError(err.message || "Upload failed");
       } finally {
+        watcher.abort();
         setUploading(false);
         setUploadProgress(0);
+        setIndexing(null);
       }
     },
     [onUploadSuccess]
@@ -168,6 +220,9 @@ export default function DocumentUpload({ onUploadSuccess }) {
                 />
               </div>
               <p className="text-sm text-slate-500">{uploadProgress}%</p>
+              {describeIndexing(indexing) && (
+                <p className="text-xs text-slate-400">{describeIndexing(indexing)}</p>
+              )}
             </div>
           ) : (
             <>
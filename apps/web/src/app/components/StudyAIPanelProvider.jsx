@@ -2,6 +2,7 @@
 
 import { useRouter } from "next/navigation";
 import { createContext, useCallback, useContext, useEffect, useRef, useState } from "react";
+import { createSSEParser } from "../../lib/sse";
 import { createSupabaseBrowser } from "../../lib/supabase/client";
 
 const API_BASE = (process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000") + "/api";
@@ -105,55 +106,40 @@ export function StudyAIPanelProvider({ children }) {
 
       const reader = res.body.getReader();
       const decoder = new TextDecoder();
-      let buffer = "";
+      const parser = createSSEParser((event, data) => {
+        if (event === "token") {
+          setMessages((prev) => {
+            const copy = [...prev];
+            const last = copy[copy.length - 1];
+            if (last?.role === "assistant") {
+              copy[copy.length - 1] = { ...last, content: last.content + data };
+            }
+            return copy;
+          });
+        } else if (event === "done") {
+          try {
+            const payload = JSON.parse(data);
+            const { conversation_id, message: finalMsg } = payload;
+            setMessages((prev) => {
+              const copy = [...prev];
+              copy[copy.length - 1] = {
+                role: "assistant",
+                content: finalMsg.content,
+                _id: finalMsg.id,
+              };
+              return copy;
+            });
+            setConversationId((prev) => prev ?? conversation_id);
+          } catch {
+            // ignore parse errors
+          }
+        }
+      });
 
       while (true) {
         const { done, value } = await reader.read();
         if (done) break;
-
-        buffer += decoder.decode(value, { stream: true });
-        const lines = buffer.split("\n");
-        buffer = lines.pop() || "";
-
-        let currentEvent = null;
-        for (const line of lines) {
-          if (line.startsWith("event: ")) {
-            currentEvent = line.slice(7).trim();
-          } else if (line.startsWith("data: ") && currentEvent) {
-            const data = line.slice(6);
-
-            if (currentEvent === "token") {
-              setMessages((prev) => {
-                const copy = [...prev];
-                const last = copy[copy.length - 1];
-                if (last?.role === "assistant") {
-                  copy[copy.length - 1] = { ...last, content: last.content + data };
-                }
-                return copy;
-              });
-            } else if (currentEvent === "done") {
-              try {
-                const payload = JSON.parse(data);
-                const { conversation_id, message: finalMsg } = payload;
-                setMessages((prev) => {
-                  const copy = [...prev];
-                  copy[copy.length - 1] = {
-                    role: "assistant",
-                    content: finalMsg.content,
-                    _id: finalMsg.id,
-                  };
-                  return copy;
-                });
-                setConversationId((prev) => prev ?? conversation_id);
-              } catch {
-                // ignore parse errors
-              }
-            }
-            currentEvent = null;
-          } else if (line === "") {
-            currentEvent = null;
-          }
-        }
+        parser.push(decoder.decode(value, { stream: true }));
       }
     } catch (err) {
       console.error("StudyAIPanel error:", err);
@@ -55,6 +55,11 @@ export default function MessageBubble({ message }) {
                   {[...new Set(message.sources.map((s) => s.document_id))].length} source
                   {[...new Set(message.sources.map((s) => s.document_id))].length !== 1 ? "s" : ""}
                 </span>
+                {message.sources.some((s) => s.partial) && (
+                  <span className="text-xs text-amber-500 dark:text-amber-400">
+                    (still indexing; answer may be incomplete)
+                  </span>
+                )}
               </div>
             )}
           </>
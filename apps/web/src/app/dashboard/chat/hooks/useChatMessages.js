@@ -1,5 +1,6 @@
 import { useCallback, useEffect, useRef, useState } from "react";
 import axios from "axios";
+import { createSSEParser } from "../../../../lib/sse";
 
 const API_BASE = (process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000") + "/api";
 
@@ -108,66 +109,50 @@ export default function useChatMessages(accessToken, activeId, setActiveId, fetc
 
         const reader = res.body.getReader();
         const decoder = new TextDecoder();
-        let buffer = "";
+        const parser = createSSEParser((event, data) => {
+          if (event === "token") {
+            setMessages((prev) => {
+              const updated = [...prev];
+              const last = updated[updated.length - 1];
+              if (last && last.role === "assistant") {
+                updated[updated.length - 1] = {
+                  ...last,
+                  content: last.content + data,
+                };
+              }
+              return updated;
+            });
+          } else if (event === "done") {
+            try {
+              const payload = JSON.parse(data);
+              const { conversation_id, message: finalMsg } = payload;
+
+              setMessages((prev) => {
+                const updated = [...prev];
+                updated[updated.length - 1] = {
+                  id: finalMsg.id,
+                  role: "assistant",
+                  content: finalMsg.content,
+                  created_at: finalMsg.created_at,
+                  sources: finalMsg.sources || [],
+                };
+                return updated;
+              });
+
+              if (!activeId) {
+                setActiveId(conversation_id);
+              }
+              fetchThreads();
+            } catch (parseErr) {
+              console.error("Failed to parse done event:", parseErr);
+            }
+          }
+        });
 
         while (true) {
           const { done, value } = await reader.read();
           if (done) break;
-
-          buffer += decoder.decode(value, { stream: true });
-
-          const lines = buffer.split("\n");
-          buffer = lines.pop() || "";
-
-          let currentEvent = null;
-          for (const line of lines) {
-            if (line.startsWith("event: ")) {
-              currentEvent = line.slice(7).trim();
-            } else if (line.startsWith("data: ") && currentEvent) {
-              const data = line.slice(6);
-
-              if (currentEvent === "token") {
-                setMessages((prev) => {
-                  const updated = [...prev];
-                  const last = updated[updated.length - 1];
-                  if (last && last.role === "assistant") {
-                    updated[updated.length - 1] = {
-                      ...last,
-                      content: last.content + data,
-                    };
-                  }
-                  return updated;
-                });
-              } else if (currentEvent === "done") {
-                try {
-                  const payload = JSON.parse(data);
-                  const { conversation_id, message: finalMsg } = payload;
-
-                  setMessages((prev) => {
-                    const updated = [...prev];
-                    updated[updated.length - 1] = {
-                      id: finalMsg.id,
-                      role: "assistant",
-                      content: finalMsg.content,
-                      created_at: finalMsg.created_at,
-                      sources: finalMsg.sources || [],
-                    };
-                    return updated;
-                  });
-
-                  if (!activeId) {
-                    setActiveId(conversation_id);
-                  }
-                  fetchThreads();
-                } catch (parseErr) {
-                  console.error("Failed to parse done event:", parseErr);
-                }
-              }
-              currentEvent = null;
-            } else if (line === "") {
-              currentEvent = null;
-            }
-          }
+          parser.push(decoder.decode(value, { stream: true }));
         }
       } catch (err) {
         console.error("Chat Error:", err);
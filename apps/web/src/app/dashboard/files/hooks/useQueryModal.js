@@ -12,7 +12,8 @@ export default function useQueryModal() {
   const open = useCallback(async (doc) => {
     try {
       const data = await api.get(`/api/processing/${doc.id}/status`);
-      if (data.status !== "ready") {
+      // Partially indexed and re-indexing documents can already be asked about.
+      if (!data.searchable) {
         return "This document is not indexed for RAG. Upload TXT or CSV files to enable questions.";
       }
       setAskDocumentId(doc.id);
@@ -1,6 +1,8 @@
 import { PALETTE } from "../constants/flashcards";
 
-export default function DeckSwitcher({ decks, activeDeckId, setActiveDeckId, onDelete }) {
+export default function DeckSwitcher({
+  decks, activeDeckId, setActiveDeckId, onDelete, hasMore, onLoadMore, loadingMore,
+}) {
   return (
     <div className="flex flex-wrap gap-2">
       {decks.map((d, idx) => {
@@ -32,6 +34,15 @@ export default function DeckSwitcher({ decks, activeDeckId, setActiveDeckId, onD
           </div>
         );
       })}
+      {hasMore && onLoadMore && (
+        <button
+          onClick={onLoadMore}
+          disabled={loadingMore}
+          className="px-3.5 py-1.5 rounded-full text-sm font-semibold border border-dashed text-slate-500 hover:text-slate-700 disabled:opacity-50"
+        >
+          {loadingMore ? "Loading..." : "Load more"}
+        </button>
+      )}
     </div>
   );
 }
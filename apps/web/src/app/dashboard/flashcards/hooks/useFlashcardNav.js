@@ -1,4 +1,6 @@
-import { useCallback, useEffect, useMemo, useState } from "react";
+import { useCallback, useEffect, useMemo, useRef, useState } from "react";
+import { fetchPage } from "../../../../lib/pagination";
+import { readSSE } from "../../../../lib/sse";
 import { createSupabaseBrowser } from "../../../../lib/supabase/client";
 import { PALETTE } from "../constants/flashcards";
 
@@ -13,7 +15,11 @@ async function getAccessToken() {
 
 export function useFlashcardNav() {
   const [decks, setDecks] = useState([]);
+  const [decksCursor, setDecksCursor] = useState(null);
+  const [loadingMoreDecks, setLoadingMoreDecks] = useState(false);
   const [activeDeckId, setActiveDeckId] = useState(null);
+  // The open deck as loaded on its own, for decks past the loaded pages.
+  const [openedDeck, setOpenedDeck] = useState(null);
   const [cards, setCards] = useState([]);
   const [loading, setLoading] = useState(true);
   const [tab, setTab] = useState("flashcards");
@@ -29,7 +35,14 @@ export function useFlashcardNav() {
   const [sources, setSources] = useState({ source_documents: [], source_chunks: [] });
   const [showCardSources, setShowCardSources] = useState(false);
 
-  const deck = useMemo(() => decks.find((d) => d.id === activeDeckId), [decks, activeDeckId]);
+  // Deck whose cards are still arriving from a streamed generation.
+  const streamingDeckRef = useRef(null);
+
+  const deck = useMemo(
+    () => decks.find((d) => d.id === activeDeckId)
+      ?? (openedDeck?.id === activeDeckId ? openedDeck : undefined),
+    [decks, activeDeckId, openedDeck],
+  );
   const current = useMemo(() => {
     if (!cards.length) return null;
     return cards[Math.min(index, cards.length - 1)];
@@ -37,7 +50,7 @@ export function useFlashcardNav() {
 
   const accentColor = useMemo(() => {
     if (!deck) return PALETTE[0];
-    const idx = decks.indexOf(deck);
+    const idx = Math.max(0, decks.indexOf(deck));
     return PALETTE[idx % PALETTE.length];
   }, [deck, decks]);
 
@@ -45,13 +58,10 @@ export function useFlashcardNav() {
     try {
       const token = await getAccessToken();
       if (!token) return;
-      const res = await fetch(`${API_URL}/api/flashcards/sets`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      if (!res.ok) throw new Error("Failed to fetch flashcard sets");
-      const data = await res.json();
-      setDecks(data);
-      if (data.length && !activeDeckId) setActiveDeckId(data[0].id);
+      const page = await fetchPage("/api/flashcards/sets", token);
+      setDecks(page.items);
+      setDecksCursor(page.next_cursor);
+      if (page.items.length && !activeDeckId) setActiveDeckId(page.items[0].id);
     } catch (err) {
       console.error("Error fetching decks:", err);
     } finally {
@@ -59,6 +69,22 @@ export function useFlashcardNav() {
     }
   }, [activeDeckId]);
 
+  const loadMoreDecks = useCallback(async () => {
+    if (!decksCursor || loadingMoreDecks) return;
+    setLoadingMoreDecks(true);
+    try {
+      const token = await getAccessToken();
+      if (!token) return;
+      const page = await fetchPage("/api/flashcards/sets", token, { cursor: decksCursor });
+      setDecks((prev) => [...prev, ...page.items]);
+      setDecksCursor(page.next_cursor);
+    } catch (err) {
+      console.error("Error fetching more decks:", err);
+    } finally {
+      setLoadingMoreDecks(false);
+    }
+  }, [decksCursor, loadingMoreDecks]);
+
   const fetchCards = useCallback(async (deckId) => {
     if (!deckId) return;
     try {
@@ -69,6 +95,7 @@ export function useFlashcardNav() {
       if (!res.ok) throw new Error("Failed to fetch cards");
       const data = await res.json();
       setCards(data.cards || []);
+      setOpenedDeck({ id: data.id, title: data.title, card_count: data.cards?.length ?? 0 });
       setSources({
         source_documents: data.source_documents ?? [],
         source_chunks: data.source_chunks ?? [],
@@ -99,7 +126,8 @@ export function useFlashcardNav() {
       setIndex(0);
       setIsFlipped(false);
       setShowCardSources(false);
-      fetchCards(activeDeckId);
+      // A deck being generated is filled from the stream instead.
+      if (streamingDeckRef.current !== activeDeckId) fetchCards(activeDeckId);
     }
   }, [activeDeckId, fetchCards]);
 
@@ -147,6 +175,7 @@ export function useFlashcardNav() {
     }
   }
 
+  // Resolves once the first card arrives; the rest stream into the deck.
   async function handleGenerate({ title, folderId, topic, numCards }) {
     const token = await getAccessToken();
     const body = { num_cards: numCards };
@@ -154,7 +183,7 @@ export function useFlashcardNav() {
     if (folderId) body.folder_id = folderId;
     if (topic?.trim()) body.topic = topic.trim();
 
-    const res = await fetch(`${API_URL}/api/flashcards/generate`, {
+    const res = await fetch(`${API_URL}/api/flashcards/generate/stream`, {
       method: "POST",
       headers: { "Content-Type": "application/json", Authorization: `Bearer ${token}` },
       body: JSON.stringify(body),
@@ -165,10 +194,56 @@ export function useFlashcardNav() {
       const err = await res.json().catch(() => ({}));
       throw new Error(err.detail || "Generation failed");
     }
-    const newSet = await res.json();
-    await fetchDecks();
-    setActiveDeckId(newSet.id);
-    return newSet;
+
+    return new Promise((resolve, reject) => {
+      let newSet = null;
+      let received = 0;
+      let settled = false;
+      const settle = (err) => {
+        if (settled) return;
+        settled = true;
+        if (err) reject(err);
+        else resolve(newSet);
+      };
+      const finish = async () => {
+        streamingDeckRef.current = null;
+        if (newSet && received) await fetchCards(newSet.id);
+        await fetchDecks();
+      };
+
+      readSSE(res, (event, data) => {
+        const payload = JSON.parse(data);
+        if (event === "set") {
+          newSet = payload;
+          streamingDeckRef.current = payload.id;
+          setCards([]);
+          setOpenedDeck({ id: payload.id, title: payload.title, card_count: 0 });
+          setActiveDeckId(payload.id);
+        } else if (event === "card") {
+          received += 1;
+          setCards((prev) => [...prev, payload]);
+          settle();
+        } else if (event === "done") {
+          settle();
+          finish();
+        } else if (event === "error") {
+          // A set that got no cards is deleted by the server.
+          if (!received) setActiveDeckId(null);
+          settle(new Error(payload.detail || "Generation failed"));
+          finish();
+        }
+      })
+        .then(() => {
+          if (!settled) {
+            settle(new Error("Generation was interrupted"));
+            finish();
+          }
+        })
+        .catch((err) => {
+          settle(err);
+          finish();
+        });
+    });
   }
 
   useEffect(() => {
@@ -189,6 +264,7 @@ export function useFlashcardNav() {
 
   return {
     decks, activeDeckId, setActiveDeckId, tab, setTab,
+    hasMoreDecks: Boolean(decksCursor), loadMoreDecks, loadingMoreDecks,
     index, isFlipped, setIsFlipped, loading,
     deck, cards, current, accentColor, progressPct,
     flip, prev, next, goToCard,
@@ -15,6 +15,7 @@ export default function FlashcardsPage() {
   const nav = useFlashcardNav();
   const {
     decks, activeDeckId, setActiveDeckId, tab, setTab,
+    hasMoreDecks, loadMoreDecks, loadingMoreDecks,
     index, isFlipped, setIsFlipped, loading,
     deck, cards, current, accentColor, progressPct,
     flip, prev, next, goToCard,
@@ -67,6 +68,9 @@ export default function FlashcardsPage() {
               activeDeckId={activeDeckId}
               setActiveDeckId={setActiveDeckId}
               onDelete={deleteDeck}
+              hasMore={hasMoreDecks}
+              onLoadMore={loadMoreDecks}
+              loadingMore={loadingMoreDecks}
             />
           )}
 
@@ -3,6 +3,7 @@
 import Link from "next/link";
 import { useEffect, useMemo, useState } from "react";
 import { Timer, FolderOpen, MessageSquare, Brain, Layers } from "lucide-react";
+import { fetchPage } from "../../lib/pagination";
 import { PROFILE_UPDATED_EVENT } from "../../lib/profile";
 import { createSupabaseBrowser } from "../../lib/supabase/client";
 
@@ -51,6 +52,9 @@ export default function DashboardHome() {
     fileCount: 0,
     flashcardCount: 0,
     quizCount: 0,
+    // Only the first page of sets is loaded; these mark that there are more.
+    moreFlashcards: false,
+    moreQuizzes: false,
   });
   const [continueCards, setContinueCards] = useState([]);
 
@@ -91,21 +95,23 @@ export default function DashboardHome() {
       const [chats, docs, flashcardSets, quizSets] = await Promise.all([
         apiFetch("/api/chat/conversations", token),
         apiFetch("/api/documents", token),
-        apiFetch("/api/flashcards/sets", token),
-        apiFetch("/api/quizzes/sets", token),
+        fetchPage("/api/flashcards/sets", token).catch(() => null),
+        fetchPage("/api/quizzes/sets", token).catch(() => null),
       ]);
       if (!active) return;
 
       const chatList = Array.isArray(chats) ? chats : [];
       const docList = Array.isArray(docs) ? docs : [];
-      const fcList = Array.isArray(flashcardSets) ? flashcardSets : [];
-      const qzList = Array.isArray(quizSets) ? quizSets : [];
+      const fcList = flashcardSets?.items ?? [];
+      const qzList = quizSets?.items ?? [];
 
       setStats({
         chatCount: chatList.length,
         fileCount: docList.length,
         flashcardCount: fcList.length,
         quizCount: qzList.length,
+        moreFlashcards: Boolean(flashcardSets?.next_cursor),
+        moreQuizzes: Boolean(quizSets?.next_cursor),
       });
 
       const cards = [];
@@ -295,14 +301,14 @@ export default function DashboardHome() {
             title="Quizzes"
             desc="Generate & practice"
             href="/dashboard/quizzes"
-            pill={loading ? "..." : stats.quizCount > 0 ? `${stats.quizCount} set${stats.quizCount !== 1 ? "s" : ""}` : "New"}
+            pill={loading ? "..." : stats.quizCount > 0 ? `${stats.quizCount}${stats.moreQuizzes ? "+" : ""} set${stats.quizCount !== 1 ? "s" : ""}` : "New"}
             icon={Brain}
           />
           <ToolCard
             title="Flashcards"
             desc="Create and review flashcards"
             href="/dashboard/flashcards"
-            pill={loading ? "..." : stats.flashcardCount > 0 ? `${stats.flashcardCount} set${stats.flashcardCount !== 1 ? "s" : ""}` : "New"}
+            pill={loading ? "..." : stats.flashcardCount > 0 ? `${stats.flashcardCount}${stats.moreFlashcards ? "+" : ""} set${stats.flashcardCount !== 1 ? "s" : ""}` : "New"}
             icon={Layers}
           />
         </div>
@@ -17,6 +17,7 @@ export default function QuizPage() {
   const state = useQuizState();
   const {
     quizSets, activeSetId, setActiveSetId, quizTitle, pageLoading,
+    hasMoreSets, loadMoreSets, loadingMoreSets,
     questions, view, q, currentIndex, cardKey, pickedForCurrent, hasAnswered,
     isFirst, isLast, score, progressPct, breakdown, shakeRef,
     mm, ss, isRunning, mode, modeLabel,
@@ -67,6 +68,9 @@ export default function QuizPage() {
               activeSetId={activeSetId}
               setActiveSetId={setActiveSetId}
               onDelete={handleDeleteSet}
+              hasMore={hasMoreSets}
+              onLoadMore={loadMoreSets}
+              loadingMore={loadingMoreSets}
             />
           )}
 
@@ -1,4 +1,6 @@
-export default function QuizSetSwitcher({ quizSets, activeSetId, setActiveSetId, onDelete }) {
+export default function QuizSetSwitcher({
+  quizSets, activeSetId, setActiveSetId, onDelete, hasMore, onLoadMore, loadingMore,
+}) {
   if (!quizSets.length) return null;
   return (
     <div className="flex flex-wrap gap-2">
@@ -29,6 +31,15 @@ export default function QuizSetSwitcher({ quizSets, activeSetId, setActiveSetId,
           </div>
         );
       })}
+      {hasMore && onLoadMore && (
+        <button
+          onClick={onLoadMore}
+          disabled={loadingMore}
+          className="px-3.5 py-1.5 rounded-full text-sm font-semibold border border-dashed border-slate-300 dark:border-slate-600 text-slate-500 dark:text-slate-400 hover:text-slate-700 dark:hover:text-slate-200 disabled:opacity-50"
+        >
+          {loadingMore ? "Loading..." : "Load more"}
+        </button>
+      )}
     </div>
   );
 }
@@ -1,4 +1,6 @@
-import { useCallback, useEffect, useMemo, useState } from "react";
+import { useCallback, useEffect, useMemo, useRef, useState } from "react";
+import { fetchPage } from "../../../lib/pagination";
+import { readSSE } from "../../../lib/sse";
 import { createSupabaseBrowser } from "../../../lib/supabase/client";
 import { usePomodoro } from "../../../app/components/PomodoroProvider";
 import { useShake } from "./useShake";
@@ -15,6 +17,8 @@ async function getAccessToken() {
 export function useQuizState() {
   // Quiz set management
   const [quizSets, setQuizSets] = useState([]);
+  const [quizSetsCursor, setQuizSetsCursor] = useState(null);
+  const [loadingMoreSets, setLoadingMoreSets] = useState(false);
   const [activeSetId, setActiveSetId] = useState(null);
   const [questions, setQuestions] = useState([]);
   const [quizTitle, setQuizTitle] = useState("Quiz");
@@ -23,6 +27,8 @@ export function useQuizState() {
   // Generate modal
   const [showGenerate, setShowGenerate] = useState(false);
   const [folders, setFolders] = useState([]);
+  // Set whose questions are still arriving from a streamed generation.
+  const streamingSetRef = useRef(null);
 
   // Quiz state
   const [view, setView] = useState("quiz");
@@ -55,13 +61,10 @@ export function useQuizState() {
     try {
       const token = await getAccessToken();
       if (!token) return;
-      const res = await fetch(`${API_URL}/api/quizzes/sets`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      if (!res.ok) throw new Error("Failed to fetch quiz sets");
-      const data = await res.json();
-      setQuizSets(data);
-      if (data.length && !activeSetId) setActiveSetId(data[0].id);
+      const page = await fetchPage("/api/quizzes/sets", token);
+      setQuizSets(page.items);
+      setQuizSetsCursor(page.next_cursor);
+      if (page.items.length && !activeSetId) setActiveSetId(page.items[0].id);
     } catch (err) {
       console.error("Error fetching quiz sets:", err);
     } finally {
@@ -69,6 +72,22 @@ export function useQuizState() {
     }
   }, [activeSetId]);
 
+  const loadMoreSets = useCallback(async () => {
+    if (!quizSetsCursor || loadingMoreSets) return;
+    setLoadingMoreSets(true);
+    try {
+      const token = await getAccessToken();
+      if (!token) return;
+      const page = await fetchPage("/api/quizzes/sets", token, { cursor: quizSetsCursor });
+      setQuizSets((prev) => [...prev, ...page.items]);
+      setQuizSetsCursor(page.next_cursor);
+    } catch (err) {
+      console.error("Error fetching more quiz sets:", err);
+    } finally {
+      setLoadingMoreSets(false);
+    }
+  }, [quizSetsCursor, loadingMoreSets]);
+
   const fetchQuiz = useCallback(async (setId) => {
     if (!setId) return;
     try {
@@ -104,11 +123,13 @@ export function useQuizState() {
   useEffect(() => {
     if (activeSetId) {
       resetQuizState();
-      fetchQuiz(activeSetId);
+      // A set being generated is filled from the stream instead.
+      if (streamingSetRef.current !== activeSetId) fetchQuiz(activeSetId);
     }
   // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [activeSetId, fetchQuiz]);
 
+  // Resolves once the first question arrives; the rest stream into the set.
   async function handleGenerate({ title, folderId, topic, numQuestions }) {
     const token = await getAccessToken();
     const body = { num_questions: numQuestions };
@@ -116,7 +137,7 @@ export function useQuizState() {
     if (folderId) body.folder_id = folderId;
     if (topic?.trim()) body.topic = topic.trim();
 
-    const res = await fetch(`${API_URL}/api/quizzes/generate`, {
+    const res = await fetch(`${API_URL}/api/quizzes/generate/stream`, {
       method: "POST",
       headers: { "Content-Type": "application/json", Authorization: `Bearer ${token}` },
       body: JSON.stringify(body),
@@ -127,10 +148,56 @@ export function useQuizState() {
       const err = await res.json().catch(() => ({}));
       throw new Error(err.detail || "Generation failed");
     }
-    const newSet = await res.json();
-    await fetchQuizSets();
-    setActiveSetId(newSet.id);
-    return newSet;
+
+    return new Promise((resolve, reject) => {
+      let newSet = null;
+      let received = 0;
+      let settled = false;
+      const settle = (err) => {
+        if (settled) return;
+        settled = true;
+        if (err) reject(err);
+        else resolve(newSet);
+      };
+      const finish = async () => {
+        streamingSetRef.current = null;
+        if (newSet && received) await fetchQuiz(newSet.id);
+        await fetchQuizSets();
+      };
+
+      readSSE(res, (event, data) => {
+        const payload = JSON.parse(data);
+        if (event === "set") {
+          newSet = payload;
+          streamingSetRef.current = payload.id;
+          setQuestions([]);
+          setQuizTitle(payload.title || "Quiz");
+          setActiveSetId(payload.id);
+        } else if (event === "question") {
+          received += 1;
+          setQuestions((prev) => [...prev, payload]);
+          settle();
+        } else if (event === "done") {
+          settle();
+          finish();
+        } else if (event === "error") {
+          // A set that got no questions is deleted by the server.
+          if (!received) setActiveSetId(null);
+          settle(new Error(payload.detail || "Generation failed"));
+          finish();
+        }
+      })
+        .then(() => {
+          if (!settled) {
+            settle(new Error("Generation was interrupted"));
+            finish();
+          }
+        })
+        .catch((err) => {
+          settle(err);
+          finish();
+        });
+    });
   }
 
   async function handleDeleteSet(setId) {
@@ -193,6 +260,7 @@ export function useQuizState() {
   return {
     // Quiz sets
     quizSets, activeSetId, setActiveSetId, quizTitle, pageLoading,
+    hasMoreSets: Boolean(quizSetsCursor), loadMoreSets, loadingMoreSets,
     // Questions
     questions, view, q, currentIndex, cardKey, pickedForCurrent, hasAnswered,
     isFirst, isLast, score, progressPct, breakdown, shakeRef,
@@ -0,0 +1,17 @@
+const API_URL = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
+
+/**
+ * Fetch one page of a cursor-paginated list endpoint. Resolves to
+ * `{ items, next_cursor }`; pass `next_cursor` back as `cursor` for the
+ * next page (it is null on the last one).
+ */
+export async function fetchPage(path, token, { cursor = null, pageSize = 20 } = {}) {
+  const params = new URLSearchParams({ limit: String(pageSize) });
+  if (cursor) params.set("cursor", cursor);
+  const res = await fetch(`${API_URL}${path}?${params}`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  if (!res.ok) throw new Error(`Failed to fetch ${path}`);
+  const page = await res.json();
+  return { items: page.items ?? [], next_cursor: page.next_cursor ?? null };
+}
@@ -0,0 +1,63 @@
+/**
+ * Incremental Server-Sent Events parser for fetch() response streams.
+ *
+ * Feed decoded text with `push()`; `onEvent(event, data)` is called once per
+ * complete frame. Multiple `data:` lines in a frame are joined with "\n"
+ * (the server splits multi-line payloads that way), comment lines such as
+ * heartbeats (": ping") are ignored, and partial frames are kept across
+ * reads.
+ */
+export function createSSEParser(onEvent) {
+  let buffer = "";
+  let eventName = null;
+  let dataLines = [];
+
+  function dispatch() {
+    if (dataLines.length > 0) {
+      onEvent(eventName || "message", dataLines.join("\n"));
+    }
+    eventName = null;
+    dataLines = [];
+  }
+
+  function handleLine(line) {
+    if (line === "") {
+      dispatch();
+      return;
+    }
+    if (line.startsWith(":")) return;
+
+    const colon = line.indexOf(":");
+    const field = colon === -1 ? line : line.slice(0, colon);
+    let value = colon === -1 ? "" : line.slice(colon + 1);
+    if (value.startsWith(" ")) value = value.slice(1);
+
+    if (field === "event") eventName = value;
+    else if (field === "data") dataLines.push(value);
+  }
+
+  return {
+    push(text) {
+      buffer += text;
+      // A trailing "\r" may be the first half of "\r\n"; keep it buffered.
+      const lines = buffer.split(/\r\n|\n|\r(?!$)/);
+      buffer = lines.pop() || "";
+      for (const line of lines) handleLine(line);
+    },
+  };
+}
+
+/**
+ * Read a fetch() response body as SSE until it ends, calling
+ * `onEvent(event, data)` once per frame.
+ */
+export async function readSSE(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  const parser = createSSEParser(onEvent);
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    parser.push(decoder.decode(value, { stream: true }));
+  }
+}